@@ -0,0 +1,263 @@
+"""Per-part readers for the built-in scan_2025 / perf_2025 CSV corpus.
+
+These live outside dashboard.py so process-pool workers can import them
+without re-running the Streamlit script.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# The old row-wise parser took the first two _COORD_NUM_PAT.findall() tokens of
+# a "lat,lon" / "lon lat" / "GPS: x / y" cell. _COORD_HEAD_PAT splits off the
+# leftmost token and the text after it; applied twice it yields exactly those
+# two tokens, where a single pair pattern could backtrack into or skip one.
+# RE2 spells Python's str \d as \p{Nd} so pyarrow matches the same digits.
+_COORD_NUM_PAT = r"[-+]?\d+(?:\.\d+)?"
+_COORD_HEAD_PAT = r"(?s)^.*?(?P<num>[-+]?\p{Nd}+(?:\.\p{Nd}+)?)(?P<rest>.*)$"
+
+def _coord_pair_arrays(s: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        arr = pa.array(s.astype(str), type=pa.string(), from_pandas=True)
+        first = pc.extract_regex(arr, _COORD_HEAD_PAT)
+        second = pc.extract_regex(pc.struct_field(first, 1), _COORD_HEAD_PAT)
+        return (
+            pc.cast(pc.struct_field(first, 0), pa.float64()).to_numpy(zero_copy_only=False),
+            pc.cast(pc.struct_field(second, 0), pa.float64()).to_numpy(zero_copy_only=False),
+        )
+    except Exception:
+        # Object strings keep Python's re semantics; float() takes any Nd digits.
+        text = pd.Series(s.astype(str).to_numpy(dtype=object))
+        nums = text.str.extractall(f"({_COORD_NUM_PAT})")[0]
+        nums = nums[nums.index.get_level_values("match") < 2].unstack("match")
+        nums = nums.reindex(index=range(len(text)), columns=[0, 1])
+        return nums[0].map(float, na_action="ignore").to_numpy(dtype=float), nums[1].map(float, na_action="ignore").to_numpy(dtype=float)
+
+def parse_lon_lat_series(s: pd.Series) -> tuple[pd.Series, pd.Series]:
+    a, b = _coord_pair_arrays(s)
+
+    def _is_lon(x): return (x >= 70) & (x <= 140)
+    def _is_lat(x): return (x >= 0) & (x <= 60)
+
+    # Same precedence as the old row-wise parser: (lon, lat), then (lat, lon), then larger |x| as lon.
+    a_first = (_is_lon(a) & _is_lat(b)) | (~(_is_lon(b) & _is_lat(a)) & (np.abs(a) >= np.abs(b)))
+    lon = np.where(a_first, a, b)
+    lat = np.where(a_first, b, a)
+    ok = _is_lon(lon) & _is_lat(lat)
+    return (
+        pd.Series(np.where(ok, lon, np.nan), index=s.index),
+        pd.Series(np.where(ok, lat, np.nan), index=s.index),
+    )
+
+# Raw export position -> (normalized name, dtype at read time). Only these
+# columns of the 25-wide scan export are ever read from the csv.gz parts.
+SCAN_PART_SCHEMA = {
+    1: ("门店名称", None),
+    7: ("听码", "str"),
+    8: ("箱码", "str"),
+    11: ("IP地址", "str"),
+    12: ("经纬度", None),
+    13: ("年份", "int16"),
+    14: ("月份", "int8"),
+    15: ("日", "int8"),
+    17: ("省区", "category"),
+    18: ("经销商名称", "category"),
+    19: ("产品大类", "category"),
+    20: ("产品小类", "category"),
+}
+_SCAN_OUT_COLS = ["门店名称", "经销商名称", "省区", "产品大类", "产品小类", "经纬度", "年份", "月份", "日", "听码", "箱码", "IP地址"]
+
+_PERF_TEXT_COLS = ["省区", "经销商名称", "发货仓", "中类", "归类", "大分类", "大类", "小类"]
+
+def _text(s: pd.Series) -> pd.Series:
+    # Same as fillna("").astype(str).str.strip(), but categoricals only touch their categories.
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        labels = np.append(s.cat.categories.astype(str).str.strip().to_numpy(dtype=object), "")
+        return pd.Series(labels[s.cat.codes.to_numpy()], index=s.index).astype(str)
+    return s.fillna("").astype(str).str.strip()
+
+def _leading_int(s: pd.Series) -> pd.Series:
+    # Same as astype(str).str.extract(r"(\d+)") -> int with 0 for missing.
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        vals = s.cat.categories.astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int).to_numpy()
+        return pd.Series(np.append(vals, 0)[s.cat.codes.to_numpy()], index=s.index)
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+        return pd.to_numeric(s, errors="coerce").fillna(0).astype(float).abs().astype(int)
+    return s.astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
+
+def _schema_int(s: pd.Series, name: str) -> pd.Series:
+    # Back to the SCAN_PART_SCHEMA dtype of `name`; values that do not fit it
+    # count as missing (0) instead of wrapping around.
+    dtype = next(t for n, t in SCAN_PART_SCHEMA.values() if n == name)
+    info = np.iinfo(dtype)
+    return s.where(s.between(info.min, info.max), 0).astype(dtype)
+
+def scan_code_text(s: pd.Series) -> pd.Series:
+    # Tin/box codes as plain digit strings ("" if missing). Numeric cells lose
+    # their ".0"; codes that went through scientific notation ("7.49e+16") no
+    # longer identify one box and are treated as missing.
+    t = _text(s).str.replace(r"\.0+$", "", regex=True)
+    return t.where(~t.str.fullmatch(r"[-+]?\d+(?:\.\d+)?[eE][-+]?\d+"), "")
+
+def _full_year(y: pd.Series) -> pd.Series:
+    return y.where(~((y > 0) & (y < 100)), y + 2000)
+
+def select_scan_columns(df0: pd.DataFrame) -> pd.DataFrame:
+    def _col(idx: int):
+        if idx < df0.shape[1]:
+            return df0.iloc[:, idx]
+        return pd.Series([None] * len(df0))
+
+    df = pd.DataFrame({name: _col(idx) for idx, (name, _) in SCAN_PART_SCHEMA.items()})
+    return df[_SCAN_OUT_COLS]
+
+def normalize_scan_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df = df[_SCAN_OUT_COLS].copy()
+    df["年份"] = _schema_int(_full_year(_leading_int(df["年份"])), "年份")
+    df["月份"] = _schema_int(_leading_int(df["月份"]), "月份")
+    df["日"] = _schema_int(_leading_int(df["日"]), "日")
+
+    for c in ["门店名称", "省区", "经销商名称", "产品大类", "产品小类", "IP地址"]:
+        df[c] = _text(df[c])
+    df["听码"] = scan_code_text(df["听码"])
+    df["箱码"] = scan_code_text(df["箱码"])
+
+    df["经度"], df["纬度"] = parse_lon_lat_series(df["经纬度"])
+
+    return df[df["年份"] == 2025]
+
+def normalize_scan_part(df0: pd.DataFrame) -> pd.DataFrame:
+    if df0 is None or df0.empty:
+        return pd.DataFrame()
+    return normalize_scan_frame(select_scan_columns(df0))
+
+def _perf_source_columns(columns) -> dict:
+    cols = [str(c).strip() for c in columns]
+    col_year = next((c for c in cols if c == "年份" or "年" in c), None)
+    col_month = next((c for c in cols if c == "月份" or "月" in c), None)
+    col_prov = next((c for c in cols if "省区" in c), None)
+    col_dist = next((c for c in cols if "客户简称" in c), None) or next((c for c in cols if "购货单位" in c), None)
+    col_qty = next((c for c in cols if "基本数量" in c), None) or next((c for c in cols if "箱" in c or "数量" in c), None)
+    col_amt = next((c for c in cols if "原价金额" in c), None) or next((c for c in cols if "金额" in c), None)
+    col_wh = next((c for c in cols if "发货仓" in c), None)
+    col_grp = next((c for c in cols if "归类" in c), None)
+    col_bigcat = next((c for c in cols if c == "大分类"), None) or next((c for c in cols if "月分析" in c), None)
+    col_big = next((c for c in cols if c == "大类"), None)
+    col_mid = next((c for c in cols if c == "中类"), None)
+    col_small = next((c for c in cols if c == "小类"), None)
+
+    pairs = [
+        ("年份", col_year), ("月份", col_month), ("省区", col_prov), ("经销商名称", col_dist),
+        ("发货箱数", col_qty), ("发货金额", col_amt), ("发货仓", col_wh), ("中类", col_mid),
+        ("归类", col_grp), ("大分类", col_bigcat), ("大类", col_big), ("小类", col_small),
+    ]
+    return {name: src for name, src in pairs if src is not None}
+
+def normalize_perf_frame(df: pd.DataFrame) -> pd.DataFrame:
+    for c in _PERF_TEXT_COLS:
+        if c in df.columns:
+            df[c] = _text(df[c])
+    if "年份" in df.columns:
+        df["年份"] = _full_year(_leading_int(df["年份"]))
+    if "月份" in df.columns:
+        df["月份"] = _leading_int(df["月份"])
+    if "发货箱数" in df.columns:
+        df["发货箱数"] = pd.to_numeric(df["发货箱数"], errors="coerce").fillna(0)
+    if "发货金额" in df.columns:
+        df["发货金额"] = pd.to_numeric(df["发货金额"], errors="coerce").fillna(0)
+    if "年份" in df.columns and "月份" in df.columns:
+        df = df[(df["年份"] == 2025) & (df["月份"].between(1, 12))]
+        df["年月"] = pd.to_datetime(df["年份"].astype(str) + "-" + df["月份"].astype(str).str.zfill(2) + "-01", errors="coerce")
+    else:
+        return pd.DataFrame()
+    return df
+
+def normalize_perf_part(df0: pd.DataFrame) -> pd.DataFrame:
+    if df0 is None or df0.empty:
+        return pd.DataFrame()
+    df0.columns = [str(c).strip() for c in df0.columns]
+    src = _perf_source_columns(df0.columns)
+    df = pd.DataFrame({name: df0[c] for name, c in src.items()})
+    return normalize_perf_frame(df)
+
+def read_scan_part(path: str) -> pd.DataFrame:
+    idxs = sorted(SCAN_PART_SCHEMA)
+    dtypes = {i: t for i, (_, t) in SCAN_PART_SCHEMA.items() if t}
+    try:
+        raw = pd.read_csv(path, usecols=idxs, dtype=dtypes)
+    except (ValueError, TypeError):
+        # Narrower/odd exports: read everything and select by position as before.
+        return normalize_scan_part(pd.read_csv(path))
+    if raw.empty:
+        return pd.DataFrame()
+    raw.columns = [SCAN_PART_SCHEMA[i][0] for i in idxs]
+    return normalize_scan_frame(raw)
+
+def read_perf_part(path: str) -> pd.DataFrame:
+    raw_cols = list(pd.read_csv(path, nrows=0).columns)
+    src = _perf_source_columns(raw_cols)
+    num_src = {src.get("发货箱数"), src.get("发货金额")}
+    usecols = [c for c in raw_cols if str(c).strip() in set(src.values())]
+    dtypes = {c: "category" for c in usecols if str(c).strip() not in num_src}
+    try:
+        raw = pd.read_csv(path, usecols=usecols, dtype=dtypes)
+    except (ValueError, TypeError):
+        return normalize_perf_part(pd.read_csv(path))
+    if raw.empty:
+        return pd.DataFrame()
+    raw.columns = [str(c).strip() for c in raw.columns]
+    return normalize_perf_frame(pd.DataFrame({name: raw[c] for name, c in src.items()}))
+
+# detached_main swaps a process-global entry while other request threads run,
+# so every swap is serialised (re-entrant for nested use in one thread).
+_DETACHED_MAIN_LOCK = threading.RLock()
+
+@contextmanager
+def detached_main():
+    # Under Streamlit, __main__ carries the dashboard script's __file__; spawn
+    # would re-execute the whole app in every worker unless it is hidden.
+    # sys.modules["__main__"] is shared by the whole process: keep the block to
+    # the submits that start workers. A rerun that installs its own __main__
+    # meanwhile is left in place rather than overwritten on exit.
+    with _DETACHED_MAIN_LOCK:
+        main_mod = sys.modules.get("__main__")
+        stub = types.ModuleType("__main__")
+        sys.modules["__main__"] = stub
+        try:
+            yield
+        finally:
+            if sys.modules.get("__main__") is stub:
+                if main_mod is not None:
+                    sys.modules["__main__"] = main_mod
+                else:
+                    del sys.modules["__main__"]
+
+def read_parts(paths: list[str], reader, max_workers: int | None = None) -> pd.DataFrame | None:
+    if not paths:
+        return None
+    workers = min(len(paths), int(max_workers or os.cpu_count() or 1))
+    dfs = None
+    if workers > 1:
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+                with detached_main():
+                    futures = [ex.submit(reader, p) for p in paths]
+                dfs = [f.result() for f in futures]
+        except Exception:
+            dfs = None
+    if dfs is None:
+        dfs = [reader(p) for p in paths]
+    dfs = [d for d in dfs if d is not None and not d.empty]
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs, ignore_index=True)
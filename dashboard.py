@@ -11,14 +11,21 @@ import hashlib
 import re
 import json
 import zipfile
-from copy import copy
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
 import html as _html
 from PIL import Image, ImageDraw, ImageFont
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, JsCode
-from openpyxl import load_workbook, Workbook
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+from builtin_parts import normalize_perf_part, normalize_scan_part, parse_lon_lat_series, read_parts, read_perf_part, read_scan_part, scan_code_text
+from excel_export import build_xlsx_zip, df_to_excel_bytes, sheets_to_excel_bytes
+from frame_index import filter_rows, filter_values
+from scan_views import SCAN_IP_BURST, build_scan_code_index, build_scan_grids, scan_code_rows, scan_lod_grid
 def _is_nan(x):
     try:
         return x != x
@@ -51,385 +58,15 @@ def sanitize_filename(name: str, default: str = "export"):
     s = re.sub(r"\s+", " ", s).strip()
     return s[:120] if len(s) > 120 else s
 
-def _df_to_excel_bytes(
-    df: pd.DataFrame,
-    sheet_name: str,
-    title_lines: list[str] | None = None,
-    number_headers: set[str] | None = None,
-    number_formats: dict[str, str] | None = None,
-    trend_type_header: str | None = None,
-    percent_headers: set[str] | None = None,
-    percent_formats: dict[str, str] | None = None,
-    store_type_header: str | None = None,
-    group_headers: bool = False,
-):
+def _png_zip_bytes(members: list, progress=None) -> bytes:
+    # members: (file name, renderer, args, kwargs); renderer returns PNG bytes.
     buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
-    buf.seek(0)
-    wb = load_workbook(buf)
-    ws = wb[sheet_name]
-
-    title_lines = title_lines or []
-    insert_n = len(title_lines) + (1 if title_lines else 0)
-    if insert_n:
-        ws.insert_rows(1, amount=insert_n)
-        end_col = get_column_letter(ws.max_column)
-        for i, line in enumerate(title_lines, start=1):
-            ws.merge_cells(f"A{i}:{end_col}{i}")
-            c = ws[f"A{i}"]
-            c.value = str(line)
-            c.font = Font(bold=True, size=12, color="111827")
-            c.alignment = Alignment(horizontal="left", vertical="center")
-
-    header_row = (len(title_lines) + 2) if title_lines else 1
-
-    header_fill = PatternFill("solid", fgColor="111827")
-    header_font = Font(bold=True, color="FFFFFF")
-    thin = Side(style="thin", color="D1D5DB")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    def _get_headers(row_idx: int):
-        hs = []
-        for col in range(1, ws.max_column + 1):
-            v = ws.cell(row=row_idx, column=col).value
-            hs.append(str(v) if v is not None else "")
-        return hs
-
-    group_row = None
-    subheader_row = header_row
-    if group_headers:
-        group_row = header_row
-        ws.insert_rows(group_row, amount=1)
-        subheader_row = group_row + 1
-
-    ws.freeze_panes = f"A{subheader_row + 1}"
-
-    headers = _get_headers(subheader_row)
-
-    if group_headers:
-        seg_specs = [
-            ("段粉", "段粉-", "DCFCE7", "166534"),
-            ("雅系列", "雅系列-", "DBEAFE", "1D4ED8"),
-            ("中老年（提）", "中老年-", "FEF9C3", "A16207"),
-        ]
-        grouped_cols: set[int] = set()
-        for label, prefix, bg, fg in seg_specs:
-            idxs = [i + 1 for i, h in enumerate(headers) if str(h).startswith(prefix)]
-            if not idxs:
-                continue
-            idxs = sorted(set(idxs))
-            blocks = []
-            start = idxs[0]
-            prev = idxs[0]
-            for x in idxs[1:]:
-                if x == prev + 1:
-                    prev = x
-                else:
-                    blocks.append((start, prev))
-                    start = x
-                    prev = x
-            blocks.append((start, prev))
-
-            for c1, c2 in blocks:
-                grouped_cols.update(range(c1, c2 + 1))
-                top_cell = ws.cell(row=group_row, column=c1)
-                top_cell.value = label
-                top_cell.fill = PatternFill("solid", fgColor=bg)
-                top_cell.font = Font(bold=True, color=fg)
-                top_cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                top_cell.border = border
-                if c2 > c1:
-                    ws.merge_cells(start_row=group_row, start_column=c1, end_row=group_row, end_column=c2)
-
-                for col in range(c1, c2 + 1):
-                    sh = ws.cell(row=subheader_row, column=col)
-                    full = headers[col - 1]
-                    sub = full.split("-", 1)[1] if "-" in full else full
-                    sub = sub.replace("(提)", "").strip()
-                    sh.value = sub
-                    sh.fill = PatternFill("solid", fgColor=bg)
-                    sh.font = Font(bold=True, color=fg)
-                    sh.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                    sh.border = border
-
-        if not grouped_cols:
-            def _sub_style(s: str):
-                k = str(s or "").strip()
-                if k in ("A", "A数量"):
-                    return "DCFCE7", "166534"
-                if k in ("B", "B数量"):
-                    return "DBEAFE", "1D4ED8"
-                if k in ("C", "C数量"):
-                    return "FEF9C3", "A16207"
-                if k in ("D", "D数量"):
-                    return "FEE2E2", "991B1B"
-                if k == "持续升级":
-                    return "DCFCE7", "166534"
-                if k == "持续降级":
-                    return "FEE2E2", "991B1B"
-                if k == "先降级后升级":
-                    return "DBEAFE", "1D4ED8"
-                if k == "先升级后降级":
-                    return "FEF9C3", "A16207"
-                if k == "持续持平":
-                    return "E5E7EB", "374151"
-                if k in ("持平升级", "升级持平"):
-                    return "DCFCE7", "166534"
-                if k in ("持平降级", "降级持平"):
-                    return "FEE2E2", "991B1B"
-                return None, None
-
-            group_map: dict[str, list[int]] = {}
-            for i, h in enumerate(headers, start=1):
-                hs = str(h or "")
-                if "-" not in hs:
-                    continue
-                prefix, _ = hs.split("-", 1)
-                prefix = str(prefix).strip()
-                if not prefix:
-                    continue
-                group_map.setdefault(prefix, []).append(i)
-
-            for label, idxs in group_map.items():
-                idxs = sorted(set(idxs))
-                blocks = []
-                start = idxs[0]
-                prev = idxs[0]
-                for x in idxs[1:]:
-                    if x == prev + 1:
-                        prev = x
-                    else:
-                        blocks.append((start, prev))
-                        start = x
-                        prev = x
-                blocks.append((start, prev))
-
-                for c1, c2 in blocks:
-                    grouped_cols.update(range(c1, c2 + 1))
-                    top_cell = ws.cell(row=group_row, column=c1)
-                    top_cell.value = label
-                    top_cell.fill = header_fill
-                    top_cell.font = header_font
-                    top_cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                    top_cell.border = border
-                    if c2 > c1:
-                        ws.merge_cells(start_row=group_row, start_column=c1, end_row=group_row, end_column=c2)
-
-                    for col in range(c1, c2 + 1):
-                        sh = ws.cell(row=subheader_row, column=col)
-                        full = headers[col - 1]
-                        sub = full.split("-", 1)[1] if "-" in full else full
-                        sub = str(sub).strip()
-                        if sub in ("A", "B", "C", "D"):
-                            sub = f"{sub}数量"
-                        sh.value = sub
-                        bg, fg = _sub_style(sub)
-                        if bg and fg:
-                            sh.fill = PatternFill("solid", fgColor=bg)
-                            sh.font = Font(bold=True, color=fg)
-                        else:
-                            sh.fill = header_fill
-                            sh.font = header_font
-                        sh.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                        sh.border = border
-
-        for col in range(1, ws.max_column + 1):
-            if col in grouped_cols:
-                continue
-            v = ws.cell(row=subheader_row, column=col).value
-            c = ws.cell(row=group_row, column=col)
-            c.value = v
-            c.fill = header_fill
-            c.font = header_font
-            c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            c.border = border
-            ws.merge_cells(start_row=group_row, start_column=col, end_row=subheader_row, end_column=col)
-
-        for col in range(1, ws.max_column + 1):
-            c = ws.cell(row=group_row, column=col)
-            if c.value is None:
-                continue
-            c.border = border
-        for col in range(1, ws.max_column + 1):
-            c = ws.cell(row=subheader_row, column=col)
-            if c.value is None:
-                continue
-            c.border = border
-    else:
-        for col in range(1, ws.max_column + 1):
-            c = ws.cell(row=subheader_row, column=col)
-            c.fill = header_fill
-            c.font = header_font
-            c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            c.border = border
-
-    trend_col_idx = None
-    if trend_type_header:
-        try:
-            trend_col_idx = headers.index(trend_type_header) + 1
-        except ValueError:
-            trend_col_idx = None
-    trend_col_idxs = set()
-    if trend_col_idx:
-        trend_col_idxs.add(trend_col_idx)
-    for i, h in enumerate(headers, start=1):
-        hs = str(h or "").strip()
-        if hs in ("趋势类型", "近三周期变化") or hs.endswith("趋势类型") or hs.endswith("变化类型"):
-            trend_col_idxs.add(i)
-
-    store_type_col_idx = None
-    if store_type_header:
-        try:
-            store_type_col_idx = headers.index(store_type_header) + 1
-        except ValueError:
-            store_type_col_idx = None
-    store_type_col_idxs = set()
-    if store_type_col_idx:
-        store_type_col_idxs.add(store_type_col_idx)
-    for i, h in enumerate(headers, start=1):
-        hs = str(h or "").strip()
-        if "门店类型" in hs or hs in ("等级",):
-            store_type_col_idxs.add(i)
-
-    max_rows_for_full_style = 12000
-    apply_full = ws.max_row <= max_rows_for_full_style
-    num_fmt = "0.#"
-    pct_fmt = "0.#%"
-    number_headers = number_headers or set()
-    percent_headers = percent_headers or set()
-    number_formats = number_formats or {}
-    percent_formats = percent_formats or {}
-
-    even_fill = PatternFill("solid", fgColor="F8FAFC")
-    total_fill = None
-
-    for r in range(subheader_row + 1, ws.max_row + 1):
-        is_total_row = False
-        for c0 in range(1, min(4, ws.max_column) + 1):
-            if str(ws.cell(row=r, column=c0).value or "").strip() == "合计":
-                is_total_row = True
-                break
-        for col in range(1, ws.max_column + 1):
-            cell = ws.cell(row=r, column=col)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            if apply_full:
-                cell.border = border
-                if (r - subheader_row) % 2 == 0:
-                    cell.fill = even_fill
-                if is_total_row:
-                    cell.font = Font(bold=True, color="A16207")
-            fmt_override = number_formats.get(headers[col - 1])
-            if fmt_override:
-                cell.number_format = fmt_override
-            elif headers[col - 1] in number_headers:
-                cell.number_format = num_fmt
-            pct_override = percent_formats.get(headers[col - 1])
-            if pct_override:
-                cell.number_format = pct_override
-            elif headers[col - 1] in percent_headers:
-                cell.number_format = pct_fmt
-            if trend_col_idxs and col in trend_col_idxs:
-                v = str(cell.value or "").strip()
-                if v == "持续增长":
-                    cell.fill = PatternFill("solid", fgColor="DCFCE7")
-                    cell.font = Font(bold=True, color="166534")
-                elif v == "持续下滑":
-                    cell.fill = PatternFill("solid", fgColor="FEE2E2")
-                    cell.font = Font(bold=True, color="991B1B")
-                elif v == "先下滑后增长":
-                    cell.fill = PatternFill("solid", fgColor="DBEAFE")
-                    cell.font = Font(bold=True, color="1D4ED8")
-                elif v == "先增长后下滑":
-                    cell.fill = PatternFill("solid", fgColor="FEF9C3")
-                    cell.font = Font(bold=True, color="A16207")
-                elif v == "持续升级":
-                    cell.fill = PatternFill("solid", fgColor="DCFCE7")
-                    cell.font = Font(bold=True, color="166534")
-                elif v == "持续降级":
-                    cell.fill = PatternFill("solid", fgColor="FEE2E2")
-                    cell.font = Font(bold=True, color="991B1B")
-                elif v == "先降级后升级":
-                    cell.fill = PatternFill("solid", fgColor="DBEAFE")
-                    cell.font = Font(bold=True, color="1D4ED8")
-                elif v == "先升级后降级":
-                    cell.fill = PatternFill("solid", fgColor="FEF9C3")
-                    cell.font = Font(bold=True, color="A16207")
-                elif v == "持续持平":
-                    cell.fill = PatternFill("solid", fgColor="E5E7EB")
-                    cell.font = Font(bold=True, color="374151")
-                elif v in ("持平升级", "升级持平"):
-                    cell.fill = PatternFill("solid", fgColor="DCFCE7")
-                    cell.font = Font(bold=True, color="166534")
-                elif v in ("持平降级", "降级持平"):
-                    cell.fill = PatternFill("solid", fgColor="FEE2E2")
-                    cell.font = Font(bold=True, color="991B1B")
-            if store_type_col_idxs and col in store_type_col_idxs:
-                v = str(cell.value or "").strip().upper()
-                if "A" in v:
-                    cell.fill = PatternFill("solid", fgColor="DCFCE7")
-                    cell.font = Font(bold=True, color="166534")
-                elif "B" in v:
-                    cell.fill = PatternFill("solid", fgColor="DBEAFE")
-                    cell.font = Font(bold=True, color="1D4ED8")
-                elif "C" in v:
-                    cell.fill = PatternFill("solid", fgColor="FEF9C3")
-                    cell.font = Font(bold=True, color="A16207")
-                elif "D" in v:
-                    cell.fill = PatternFill("solid", fgColor="FEE2E2")
-                    cell.font = Font(bold=True, color="991B1B")
-
-    for col in range(1, ws.max_column + 1):
-        col_letter = get_column_letter(col)
-        max_len = 0
-        for r in range(1, min(ws.max_row, header_row + 2000) + 1):
-            v = ws.cell(row=r, column=col).value
-            if v is None:
-                continue
-            max_len = max(max_len, len(str(v)))
-        ws.column_dimensions[col_letter].width = max(10, min(36, max_len + 2))
-
-    out = io.BytesIO()
-    wb.save(out)
-    return out.getvalue()
-
-def _merge_single_sheet_workbooks(items: list[tuple[bytes, str]]):
-    wb_out = Workbook()
-    if wb_out.worksheets:
-        wb_out.remove(wb_out.worksheets[0])
-
-    for xlsx_bytes, sheet_name in items:
-        src_wb = load_workbook(io.BytesIO(xlsx_bytes))
-        src_ws = src_wb.active
-
-        tgt_ws = wb_out.create_sheet(title=str(sheet_name))
-        tgt_ws.sheet_view.showGridLines = src_ws.sheet_view.showGridLines
-        tgt_ws.freeze_panes = src_ws.freeze_panes
-
-        for k, dim in src_ws.column_dimensions.items():
-            tgt_ws.column_dimensions[k].width = dim.width
-            tgt_ws.column_dimensions[k].hidden = dim.hidden
-
-        for k, dim in src_ws.row_dimensions.items():
-            tgt_ws.row_dimensions[k].height = dim.height
-            tgt_ws.row_dimensions[k].hidden = dim.hidden
-
-        for rng in list(src_ws.merged_cells.ranges):
-            tgt_ws.merge_cells(str(rng))
-
-        for row in src_ws.iter_rows(values_only=False):
-            for cell in row:
-                tgt = tgt_ws.cell(row=cell.row, column=cell.column, value=cell.value)
-                tgt.number_format = cell.number_format
-                tgt.font = copy(cell.font)
-                tgt.fill = copy(cell.fill)
-                tgt.border = copy(cell.border)
-                tgt.alignment = copy(cell.alignment)
-                tgt.protection = copy(cell.protection)
-
-    out = io.BytesIO()
-    wb_out.save(out)
-    return out.getvalue()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for i, (fname, render, args, kwargs) in enumerate(members, start=1):
+            zf.writestr(fname, render(*args, **kwargs))
+            if progress is not None:
+                progress(i, len(members))
+    return buf.getvalue()
 
 def fmt_pct_ratio(r, na="—", decimals=1):
     if r is None or _is_nan(r):
@@ -852,33 +489,6 @@ def _pil_line_png(x_labels: list[str], y_vals: list[float], title_lines: list[st
     img.save(buf, format="PNG")
     return buf.getvalue()
 
-_COORD_NUM_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
-
-def _parse_lon_lat(v):
-    if v is None:
-        return None, None
-    s = str(v).strip()
-    if not s or s.lower() in {"nan", "none"}:
-        return None, None
-    nums = _COORD_NUM_RE.findall(s)
-    if len(nums) < 2:
-        return None, None
-    a = float(nums[0])
-    b = float(nums[1])
-
-    def _is_lon(x): return 70 <= x <= 140
-    def _is_lat(x): return 0 <= x <= 60
-
-    if _is_lon(a) and _is_lat(b):
-        lon, lat = a, b
-    elif _is_lon(b) and _is_lat(a):
-        lon, lat = b, a
-    else:
-        lon, lat = (a, b) if abs(a) >= abs(b) else (b, a)
-    if not _is_lon(lon) or not _is_lat(lat):
-        return None, None
-    return lon, lat
-
 def get_host_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -2672,12 +2282,133 @@ def load_data_v2(file_bytes: bytes, file_name: str):
         st.error(f"数据加载失败: {str(e)}")
         return None, None, None, None, None, None, [str(e)]
 
-@st.cache_data(ttl=3600)
-def load_data_v3(file_bytes: bytes, file_name: str):
+# Rows per chunk when streaming a sheet; each chunk becomes typed columns
+# before the next one is read, so the whole sheet never sits in Python lists.
+_EXCEL_STREAM_CHUNK = 50_000
+_EXCEL_ERROR_VALUES = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A", "#GETTING_DATA"}
+
+def _excel_engine() -> str | None:
+    # python-calamine (pandas >= 2.2) parses xlsx far faster than openpyxl; use it when installed.
+    try:
+        import importlib.util
+        if importlib.util.find_spec("python_calamine") is not None:
+            return "calamine"
+    except Exception:
+        pass
+    return None
+
+def _open_excel(bio) -> pd.ExcelFile:
+    engine = _excel_engine()
+    if engine:
+        try:
+            return pd.ExcelFile(bio, engine=engine)
+        except Exception:
+            bio.seek(0)
+    return pd.ExcelFile(bio)
+
+def _excel_cell(v):
+    # Same conversions as pandas' openpyxl reader, on values_only rows.
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and v in _EXCEL_ERROR_VALUES:
+        return np.nan
+    return v
+
+def _parse_sheet_rows(rows: list, header: int) -> pd.DataFrame:
+    from pandas.io.parsers import TextParser
+
+    width = max((len(r) for r in rows), default=0)
+    rows = [r + [""] * (width - len(r)) for r in rows]
+    return TextParser(rows, header=header, skip_blank_lines=False).read()
+
+def _read_excel_sheet(xl: pd.ExcelFile, sheet, header: int = 0) -> pd.DataFrame:
+    """xl.parse(sheet, header=header), streamed in row chunks for openpyxl workbooks."""
+    book = getattr(xl, "book", None)
+    if xl.engine != "openpyxl" or not getattr(book, "read_only", False):
+        return xl.parse(sheet, header=header)
+    ws = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+    ws.reset_dimensions()
+
+    head_rows = []
+    chunks = []
+    buf = []
+    blank_run = []
+    for raw in ws.iter_rows(values_only=True):
+        row = [_excel_cell(v) for v in raw]
+        while row and row[-1] == "":
+            row.pop()
+        if len(head_rows) <= header:
+            head_rows.append(row)
+            continue
+        # Blank rows only count once data follows them (pandas trims trailing blanks).
+        if not row:
+            blank_run.append(row)
+            continue
+        buf.extend(blank_run)
+        blank_run = []
+        buf.append(row)
+        if len(buf) >= _EXCEL_STREAM_CHUNK:
+            chunks.append(_parse_sheet_rows(head_rows + buf, header))
+            buf = []
+    if not chunks:
+        # Small sheet: one pass over all rows, exactly like xl.parse.
+        rows = head_rows + buf
+        while rows and not rows[-1]:
+            rows.pop()
+        return _parse_sheet_rows(rows, header) if rows else pd.DataFrame()
+    if buf:
+        chunks.append(_parse_sheet_rows(head_rows + buf, header))
+
+    # A column that is empty in one chunk parses as all-NaN float; give it the
+    # dtype the other chunks agree on so dates and text don't degrade to object.
+    for c in chunks[0].columns:
+        ref = next((ch[c].dtype for ch in chunks if c in ch.columns and ch[c].notna().any()), None)
+        if ref is None or not (pd.api.types.is_datetime64_any_dtype(ref) or pd.api.types.is_string_dtype(ref)):
+            continue
+        for ch in chunks:
+            if c in ch.columns and ch[c].dtype != ref and not ch[c].notna().any():
+                ch[c] = ch[c].astype(ref)
+    return pd.concat(chunks, ignore_index=True)
+
+# Header / leading-rows probes used for sheet detection, memoized per
+# (workbook md5, sheet, rows, header). load_data_v3 and the project loader
+# ask the same questions of the same sheets, so each is read once per upload.
+_SHEET_PROBE_CACHE: OrderedDict = OrderedDict()
+_SHEET_PROBE_MAX = 512
+_SHEET_PROBE_LOCK = threading.Lock()
+
+def _probe_sheet(xl: pd.ExcelFile, wb_sig: str, sheet, nrows: int, header=None) -> pd.DataFrame:
+    """First `nrows` rows of a sheet (header=None) or just its header row (nrows=0, header=0)."""
+    sname = xl.sheet_names[sheet] if isinstance(sheet, int) else str(sheet)
+    key = (wb_sig, sname, int(nrows), header)
+    with _SHEET_PROBE_LOCK:
+        hit = _SHEET_PROBE_CACHE.get(key)
+        if hit is not None:
+            _SHEET_PROBE_CACHE.move_to_end(key)
+            return hit
+    df = xl.parse(sheet, header=header, nrows=int(nrows))
+    with _SHEET_PROBE_LOCK:
+        _SHEET_PROBE_CACHE[key] = df
+        while len(_SHEET_PROBE_CACHE) > _SHEET_PROBE_MAX:
+            _SHEET_PROBE_CACHE.popitem(last=False)
+    return df
+
+def _probe_header(xl: pd.ExcelFile, wb_sig: str, sheet) -> list[str]:
+    return [str(c).strip() for c in _probe_sheet(xl, wb_sig, sheet, 0, header=0).columns]
+
+# Sheet kinds load_data_v3 can parse; pass a subset as `sheets` to skip the rest.
+_WORKBOOK_SHEETS = ("sales", "stock", "outbound", "perf", "target", "scan", "newcust")
+
+def load_data_v3(file_bytes: bytes, file_name: str, sheets=None):
     debug_logs = []
+    def _want(kind: str) -> bool:
+        return sheets is None or kind in sheets
     try:
         file_name_lower = (file_name or "").lower()
         bio = io.BytesIO(file_bytes)
+        wb_sig = hashlib.md5(file_bytes).hexdigest()
         
         # Init Returns
         df = None
@@ -2690,9 +2421,10 @@ def load_data_v3(file_bytes: bytes, file_name: str):
         df_newcust_raw = None
 
         if file_name_lower.endswith('.csv'):
-            df = pd.read_csv(bio, encoding='gb18030')
+            if _want("sales"):
+                df = pd.read_csv(bio, encoding='gb18030')
         else:
-            xl = pd.ExcelFile(bio)
+            xl = _open_excel(bio)
             debug_logs.append(f"Sheet Names: {xl.sheet_names}")
 
             def _pick_sheet_by_name(names, keywords, default_index=None):
@@ -2716,16 +2448,16 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 return candidates[0]
             
             # Sheet 1: Sales
-            if len(xl.sheet_names) > 0: df = xl.parse(0)
+            if _want("sales") and len(xl.sheet_names) > 0: df = _read_excel_sheet(xl, 0)
             
             # Sheet 2: Stock
-            if len(xl.sheet_names) > 1: df_stock = xl.parse(1)
+            if _want("stock") and len(xl.sheet_names) > 1: df_stock = _read_excel_sheet(xl, 1)
             
             # Sheet 3: Outbound (Q4)
-            if len(xl.sheet_names) > 2: df_q4_raw = xl.parse(2)
+            if _want("outbound") and len(xl.sheet_names) > 2: df_q4_raw = _read_excel_sheet(xl, 2)
             
             # Sheet 4: Performance
-            if len(xl.sheet_names) > 3:
+            if _want("perf") and len(xl.sheet_names) > 3:
                 preferred = next((s for s in xl.sheet_names if any(k in str(s) for k in ["发货", "业绩", "Performance", "perf", "Perf"])), None)
                 if preferred is None:
                     preferred = next((s for s in xl.sheet_names if 'sheet4' in str(s).strip().lower()), None)
@@ -2733,42 +2465,40 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 candidate_names += [s for s in xl.sheet_names if s not in candidate_names]
                 for sname in candidate_names:
                     try:
-                        tmp_header = xl.parse(sname, nrows=0)
-                        cols = [str(c).strip() for c in tmp_header.columns]
+                        cols = _probe_header(xl, wb_sig, sname)
                         key_hits = sum(1 for k in ['年份', '月份', '省区'] if any(k in c for c in cols))
                         signal_hits = sum(1 for k in ['发货仓', '原价金额', '基本数量', '大分类', '月分析', '客户简称'] if any(k in c for c in cols))
                         if key_hits >= 2 and signal_hits >= 1:
-                            df_perf_raw = xl.parse(sname)
+                            df_perf_raw = _read_excel_sheet(xl, sname)
                             debug_logs.append(f"-> MATCHED Sheet4: {sname}")
                             break
                     except: continue
                 if df_perf_raw is None:
                     try:
-                        tmp_header = xl.parse(3, nrows=0)
-                        cols = [str(c).strip() for c in tmp_header.columns]
+                        cols = _probe_header(xl, wb_sig, 3)
                         signal_hits = sum(1 for k in ['日期', '业务部', '原价金额', '基本数量', '客户简称', '客户名称', '大类'] if any(k in c for c in cols))
                         if signal_hits >= 3:
-                            df_perf_raw = xl.parse(3)
+                            df_perf_raw = _read_excel_sheet(xl, 3)
                             debug_logs.append(f"-> FALLBACK Sheet4(idx3): {xl.sheet_names[3]}")
                     except Exception:
                         pass
             
             # Sheet 5: Target
-            if len(xl.sheet_names) > 4: df_target_raw = xl.parse(4)
+            if _want("target") and len(xl.sheet_names) > 4: df_target_raw = _read_excel_sheet(xl, 4)
 
             # Sheet 6: Scan Data (用于扫码相关分析)
-            scan_sheet_name = _pick_sheet_by_name(xl.sheet_names, ["扫码", "扫描"], default_index=5)
+            scan_sheet_name = _pick_sheet_by_name(xl.sheet_names, ["扫码", "扫描"], default_index=5) if _want("scan") else None
             if scan_sheet_name is not None:
                 try:
-                    df_scan_raw = xl.parse(scan_sheet_name)
+                    df_scan_raw = _read_excel_sheet(xl, scan_sheet_name)
                     debug_logs.append(f"-> Scan Data: {scan_sheet_name}")
                 except Exception:
                     df_scan_raw = None
 
-            if len(xl.sheet_names) > 7:
+            if _want("newcust") and len(xl.sheet_names) > 7:
                 try:
                     _sname_nc = xl.sheet_names[7]
-                    _raw_nc = xl.parse(7, header=None)
+                    _raw_nc = _probe_sheet(xl, wb_sig, 7, 20)
                     _best_i = None
                     _best_score = -1
                     _kw = ["省区", "门店", "新客", "经销", "客户", "时间", "日期", "月份", "年月"]
@@ -2783,22 +2513,21 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                         except Exception:
                             continue
                     if _best_i is not None and _best_score >= 2:
-                        df_newcust_raw = xl.parse(7, header=int(_best_i))
+                        df_newcust_raw = _read_excel_sheet(xl, 7, header=int(_best_i))
                         debug_logs.append(f"-> New Customers from Sheet8: {_sname_nc} (header row={int(_best_i)+1})")
                     else:
-                        df_newcust_raw = xl.parse(7)
+                        df_newcust_raw = _read_excel_sheet(xl, 7)
                         debug_logs.append(f"-> New Customers from Sheet8: {_sname_nc}")
                 except Exception:
                     df_newcust_raw = None
 
-            if df_newcust_raw is None and len(xl.sheet_names) > 0:
+            if _want("newcust") and df_newcust_raw is None and len(xl.sheet_names) > 0:
                 def _pick_newcust_sheet(_xl):
                     best = None
                     best_score = -1
                     for sname in _xl.sheet_names:
                         try:
-                            h = _xl.parse(sname, nrows=0)
-                            cols = [str(c).strip() for c in h.columns]
+                            cols = _probe_header(_xl, wb_sig, sname)
                             score = 0
                             score += 2 if any("新客" in c for c in cols) else 0
                             score += 1 if any("门店" in c for c in cols) else 0
@@ -2815,7 +2544,7 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 chosen_newcust = _pick_newcust_sheet(xl)
                 if chosen_newcust:
                     try:
-                        _raw_nc = xl.parse(chosen_newcust, header=None)
+                        _raw_nc = _probe_sheet(xl, wb_sig, chosen_newcust, 20)
                         _best_i = None
                         _best_score = -1
                         _kw = ["省区", "门店", "新客", "经销", "客户", "时间", "日期", "月份", "年月"]
@@ -2830,10 +2559,10 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                             except Exception:
                                 continue
                         if _best_i is not None and _best_score >= 2:
-                            df_newcust_raw = xl.parse(chosen_newcust, header=int(_best_i))
+                            df_newcust_raw = _read_excel_sheet(xl, chosen_newcust, header=int(_best_i))
                             debug_logs.append(f"-> New Customers matched: {chosen_newcust} (header row={int(_best_i)+1})")
                         else:
-                            df_newcust_raw = xl.parse(chosen_newcust)
+                            df_newcust_raw = _read_excel_sheet(xl, chosen_newcust)
                             debug_logs.append(f"-> New Customers matched: {chosen_newcust}")
                     except Exception:
                         df_newcust_raw = None
@@ -2964,7 +2693,7 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 df_stock[_c] = df_stock[_c].fillna("").astype(str).str.strip()
             if "批次号" in df_stock.columns:
                 df_stock["批次号"] = df_stock["批次号"].astype(str).str.extract(r"(\d{8})")[0].fillna("").astype(str).str.strip()
-            df_stock["经销商名称"] = df_stock["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+            df_stock["经销商名称"] = _norm_key(df_stock["经销商名称"])
             df_stock["经销商全称"] = df_stock["经销商全称"].fillna("").astype(str).str.strip()
             df_stock["产品名称"] = df_stock["产品名称"].fillna("").astype(str).str.strip()
 
@@ -3218,13 +2947,15 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 best_key = -1
                 for sname in candidates:
                     try:
-                        tmp = xl_obj.parse(sname)
-                        cols = [str(c).strip() for c in tmp.columns]
+                        cols = _probe_header(xl_obj, wb_sig, sname)
                         y_col = next((c for c in cols if c in ["年", "年份"]), None)
                         m_col = next((c for c in cols if c in ["月", "月份"]), None)
                         d_col = next((c for c in cols if c in ["日", "天"]), None)
                         if y_col is None or m_col is None or d_col is None:
                             continue
+                        # Only the three date columns are needed for the max date.
+                        tmp = xl_obj.parse(sname, usecols=lambda c: str(c).strip() in (y_col, m_col, d_col))
+                        tmp.columns = [str(c).strip() for c in tmp.columns]
                         yy = pd.to_numeric(tmp[y_col].astype(str).str.extract(r"(\d+)")[0], errors="coerce").fillna(0).astype(int)
                         yy = yy.apply(lambda v: v + 2000 if 0 < v < 100 else v)
                         mm = pd.to_numeric(tmp[m_col].astype(str).str.extract(r"(\d+)")[0], errors="coerce").fillna(0).astype(int)
@@ -3257,6 +2988,9 @@ def load_data_v3(file_bytes: bytes, file_name: str):
             cat_col = _col_by_name(["产品大类", "大类"])
             small_col = _col_by_name(["产品小类", "产品名称", "重量"])
             coord_col = _col_by_name(["经纬度", "GPS位置"])
+            tin_col = _col_by_name(["听码"])
+            box_col = _col_by_name(["箱码"])
+            ip_col = _col_by_name(["IP地址"])
             y_col = _col_by_name(["年份", "年"])
             m_col = _col_by_name(["月份", "月"])
             d_col = _col_by_name(["日"])
@@ -3271,6 +3005,15 @@ def load_data_v3(file_bytes: bytes, file_name: str):
             prov_src = df0[prov_col] if prov_col is not None else _col(17)
             cat_src = df0[cat_col] if cat_col is not None else _col(19)
             small_src = df0[small_col] if small_col is not None else _col(20)
+            # Codes only fall back to position on the raw 25-column export.
+            def _code_col(name, idx: int):
+                if name is not None:
+                    return df0[name]
+                return _col(idx) if df0.shape[1] >= 25 else pd.Series([None] * len(df0))
+
+            tin_src = _code_col(tin_col, 7)
+            box_src = _code_col(box_col, 8)
+            ip_src = _code_col(ip_col, 11)
             y_src = df0[y_col] if y_col is not None else _col(13)
             m_src = df0[m_col] if m_col is not None else _col(14)
             d_src = df0[d_col] if d_col is not None else _col(15)
@@ -3294,6 +3037,9 @@ def load_data_v3(file_bytes: bytes, file_name: str):
                 "年份": y_src,
                 "月份": m_src,
                 "日": d_src,
+                "听码": tin_src,
+                "箱码": box_src,
+                "IP地址": ip_src,
             })
 
             df_scan_raw["年份"] = df_scan_raw["年份"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
@@ -3306,10 +3052,11 @@ def load_data_v3(file_bytes: bytes, file_name: str):
             df_scan_raw["门店名称"] = df_scan_raw["门店名称"].astype(str).str.replace(r"\s+", "", regex=True)
             df_scan_raw["经销商名称"] = df_scan_raw["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True)
             df_scan_raw["客户简称"] = df_scan_raw["客户简称"].astype(str).str.replace(r"\s+", "", regex=True)
+            df_scan_raw["听码"] = scan_code_text(df_scan_raw["听码"])
+            df_scan_raw["箱码"] = scan_code_text(df_scan_raw["箱码"])
+            df_scan_raw["IP地址"] = df_scan_raw["IP地址"].fillna("").astype(str).str.strip()
 
-            coords = df_scan_raw["经纬度"].apply(_parse_lon_lat)
-            df_scan_raw["经度"] = coords.apply(lambda x: x[0])
-            df_scan_raw["纬度"] = coords.apply(lambda x: x[1])
+            df_scan_raw["经度"], df_scan_raw["纬度"] = parse_lon_lat_series(df_scan_raw["经纬度"])
 
         if df_newcust_raw is not None and not getattr(df_newcust_raw, "empty", True):
             try:
@@ -3417,35 +3164,102 @@ def load_data_v3(file_bytes: bytes, file_name: str):
         import traceback
         return None, None, None, None, None, None, None, None, [f"Error: {str(e)}", traceback.format_exc()]
 
-@st.cache_data(ttl=3600)
-def load_builtin_perf_2025():
+_builtin_cache_ver = 5
+
+def _builtin_cache_dir() -> str:
+    base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+    return os.path.join(base_dir, ".builtin_cache")
+
+def _builtin_parts_signature(paths: list[str]) -> str | None:
+    # Keyed by name/size/mtime of every part, so replacing any csv.gz invalidates the cache.
+    items = [str(_builtin_cache_ver)]
+    try:
+        for p in paths:
+            stat = os.stat(p)
+            items.append(f"{os.path.basename(p)}|{int(stat.st_size)}|{int(stat.st_mtime_ns)}")
+    except OSError:
+        return None
+    return hashlib.md5("\n".join(items).encode("utf-8")).hexdigest()
+
+def _read_builtin_cache(kind: str, sig: str | None):
+    if not sig:
+        return None
+    path = os.path.join(_builtin_cache_dir(), f"{kind}_{sig}.parquet")
+    if not os.path.exists(path):
+        return None
+    # pyarrow is a declared requirement: a missing engine is an install error
+    # and is raised, only unreadable cache files fall back to the parts.
+    try:
+        return pd.read_parquet(path)
+    except ImportError:
+        raise
+    except Exception:
+        return None
+
+def _write_builtin_cache(kind: str, sig: str | None, df: pd.DataFrame):
+    if not sig or df is None:
+        return
+    cache_dir = _builtin_cache_dir()
+    path = os.path.join(cache_dir, f"{kind}_{sig}.parquet")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        for f in os.listdir(cache_dir):
+            if f.startswith(f"{kind}_") and f.endswith(".parquet") and f != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(cache_dir, f))
+                except OSError:
+                    pass
+    except ImportError:
+        raise
+    except Exception:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _builtin_split_paths(prefix: str) -> list[str]:
     base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
     candidate_dirs = [base_dir, os.path.join(base_dir, "builtin_data")]
     split_paths_by_dir = {}
     for d in candidate_dirs:
         if os.path.isdir(d):
             for f in os.listdir(d):
-                if f.startswith("perf_2025_part") and (f.endswith(".csv") or f.endswith(".csv.gz")):
+                if f.startswith(prefix) and (f.endswith(".csv") or f.endswith(".csv.gz")):
                     split_paths_by_dir.setdefault(d, []).append(os.path.join(d, f))
-    split_paths = []
     preferred_dir = os.path.join(base_dir, "builtin_data")
     if split_paths_by_dir.get(preferred_dir):
-        split_paths = sorted(split_paths_by_dir[preferred_dir])
-    elif split_paths_by_dir.get(base_dir):
-        split_paths = sorted(split_paths_by_dir[base_dir])
+        return sorted(split_paths_by_dir[preferred_dir])
+    if split_paths_by_dir.get(base_dir):
+        return sorted(split_paths_by_dir[base_dir])
+    return []
+
+def _builtin_data_signature() -> str:
+    # Signature of every built-in input (the scan/perf parts and the fallback
+    # workbook), for artifacts outside this process that embed built-in rows.
+    base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+    paths = _builtin_split_paths("scan_2025_part") + _builtin_split_paths("perf_2025_part")
+    fallback = os.path.join(base_dir, "分析底表0115.xlsx")
+    if os.path.exists(fallback):
+        paths.append(fallback)
+    return _builtin_parts_signature(paths) or ""
+
+@st.cache_data(ttl=3600)
+def load_builtin_perf_2025():
+    base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+    split_paths = _builtin_split_paths("perf_2025_part")
 
-    df0 = None
+    df = None
     if split_paths:
         try:
-            dfs = []
-            for p in split_paths:
-                dfs.append(pd.read_csv(p))
-            if dfs:
-                df0 = pd.concat(dfs, ignore_index=True)
+            df = read_parts(split_paths, read_perf_part)
         except Exception:
-            df0 = None
+            df = None
 
-    if df0 is None:
+    if df is None:
         path = os.path.join(base_dir, "分析底表0115.xlsx")
         if not os.path.exists(path):
             return pd.DataFrame()
@@ -3456,86 +3270,30 @@ def load_builtin_perf_2025():
                 sheet_name = xl.sheet_names[3]
             if sheet_name is None:
                 return pd.DataFrame()
-            df0 = xl.parse(sheet_name)
+            df = normalize_perf_part(xl.parse(sheet_name))
         except Exception:
             return pd.DataFrame()
-
-    df0.columns = [str(c).strip() for c in df0.columns]
-    col_year = next((c for c in df0.columns if str(c).strip() == "年份" or "年" in str(c)), None)
-    col_month = next((c for c in df0.columns if str(c).strip() == "月份" or "月" in str(c)), None)
-    col_prov = next((c for c in df0.columns if "省区" in str(c)), None)
-    col_dist = next((c for c in df0.columns if "客户简称" in str(c)), None) or next((c for c in df0.columns if "购货单位" in str(c)), None)
-    col_qty = next((c for c in df0.columns if "基本数量" in str(c)), None) or next((c for c in df0.columns if "箱" in str(c) or "数量" in str(c)), None)
-    col_amt = next((c for c in df0.columns if "原价金额" in str(c)), None) or next((c for c in df0.columns if "金额" in str(c)), None)
-    col_wh = next((c for c in df0.columns if "发货仓" in str(c)), None)
-    col_grp = next((c for c in df0.columns if "归类" in str(c)), None)
-    col_bigcat = next((c for c in df0.columns if str(c).strip() == "大分类"), None) or next((c for c in df0.columns if "月分析" in str(c)), None)
-    col_big = next((c for c in df0.columns if str(c).strip() == "大类"), None)
-    col_mid = next((c for c in df0.columns if str(c).strip() == "中类"), None)
-    col_small = next((c for c in df0.columns if str(c).strip() == "小类"), None)
-
-    df = pd.DataFrame()
-    if col_year is not None: df["年份"] = df0[col_year]
-    if col_month is not None: df["月份"] = df0[col_month]
-    if col_prov is not None: df["省区"] = df0[col_prov]
-    if col_dist is not None: df["经销商名称"] = df0[col_dist]
-    if col_qty is not None: df["发货箱数"] = df0[col_qty]
-    if col_amt is not None: df["发货金额"] = df0[col_amt]
-    if col_wh is not None: df["发货仓"] = df0[col_wh]
-    if col_mid is not None: df["中类"] = df0[col_mid]
-    if col_grp is not None: df["归类"] = df0[col_grp]
-    if col_bigcat is not None: df["大分类"] = df0[col_bigcat]
-    if col_big is not None: df["大类"] = df0[col_big]
-    if col_small is not None: df["小类"] = df0[col_small]
-
-    for c in ["省区", "经销商名称", "发货仓", "中类", "归类", "大分类", "大类", "小类"]:
-        if c in df.columns:
-            df[c] = df[c].fillna("").astype(str).str.strip()
-    if "年份" in df.columns:
-        df["年份"] = df["年份"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
-        df["年份"] = df["年份"].apply(lambda y: y + 2000 if 0 < y < 100 else y)
-    if "月份" in df.columns:
-        df["月份"] = df["月份"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
-    if "发货箱数" in df.columns:
-        df["发货箱数"] = pd.to_numeric(df["发货箱数"], errors="coerce").fillna(0)
-    if "发货金额" in df.columns:
-        df["发货金额"] = pd.to_numeric(df["发货金额"], errors="coerce").fillna(0)
-    if "年份" in df.columns and "月份" in df.columns:
-        df = df[(df["年份"] == 2025) & (df["月份"].between(1, 12))]
-        df["年月"] = pd.to_datetime(df["年份"].astype(str) + "-" + df["月份"].astype(str).str.zfill(2) + "-01", errors="coerce")
-    else:
-        return pd.DataFrame()
-    return df
+    return _encode_dims(df, _build_dim_dictionary([df]))
 
 @st.cache_data(ttl=3600)
 def load_builtin_scan_2025():
     base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
-    candidate_dirs = [base_dir, os.path.join(base_dir, "builtin_data")]
-    split_paths_by_dir = {}
-    for d in candidate_dirs:
-        if os.path.isdir(d):
-            for f in os.listdir(d):
-                if f.startswith("scan_2025_part") and (f.endswith(".csv") or f.endswith(".csv.gz")):
-                    split_paths_by_dir.setdefault(d, []).append(os.path.join(d, f))
-    split_paths = []
-    preferred_dir = os.path.join(base_dir, "builtin_data")
-    if split_paths_by_dir.get(preferred_dir):
-        split_paths = sorted(split_paths_by_dir[preferred_dir])
-    elif split_paths_by_dir.get(base_dir):
-        split_paths = sorted(split_paths_by_dir[base_dir])
+    split_paths = _builtin_split_paths("scan_2025_part")
 
-    df0 = None
+    cache_sig = _builtin_parts_signature(split_paths) if split_paths else None
+    df_cached = _read_builtin_cache("scan_2025", cache_sig)
+    if df_cached is not None:
+        return df_cached
+
+    df = None
     if split_paths:
         try:
-            dfs = []
-            for p in split_paths:
-                dfs.append(pd.read_csv(p))
-            if dfs:
-                df0 = pd.concat(dfs, ignore_index=True)
+            df = read_parts(split_paths, read_scan_part)
         except Exception:
-            df0 = None
+            df = None
+            cache_sig = None
 
-    if df0 is None:
+    if df is None:
         path = os.path.join(base_dir, "分析底表0115.xlsx")
         if not os.path.exists(path):
             return pd.DataFrame()
@@ -3543,50 +3301,647 @@ def load_builtin_scan_2025():
             xl = pd.ExcelFile(path)
             if len(xl.sheet_names) <= 5:
                 return pd.DataFrame()
-            df0 = xl.parse(5)
+            df = normalize_scan_part(xl.parse(5))
         except Exception:
             return pd.DataFrame()
 
-    if df0 is None or df0.empty:
+    if df is None or df.empty:
         return pd.DataFrame()
 
-    def _col(idx: int):
-        if idx < df0.shape[1]:
-            return df0.iloc[:, idx]
-        return pd.Series([None] * len(df0))
-
-    df = pd.DataFrame({
-        "门店名称": _col(1),
-        "经销商名称": _col(18),
-        "省区": _col(17),
-        "产品大类": _col(19),
-        "产品小类": _col(20),
-        "经纬度": _col(12),
-        "年份": _col(13),
-        "月份": _col(14),
-        "日": _col(15),
-    })
-
-    df["年份"] = df["年份"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
-    df["年份"] = df["年份"].apply(lambda y: y + 2000 if 0 < y < 100 else y)
-    df["月份"] = df["月份"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
-    df["日"] = df["日"].astype(str).str.extract(r"(\d+)")[0].astype(float).fillna(0).astype(int)
-
-    for c in ["门店名称", "省区", "经销商名称", "产品大类", "产品小类"]:
-        df[c] = df[c].fillna("").astype(str).str.strip()
-
-    coords = df["经纬度"].apply(_parse_lon_lat)
-    df["经度"] = coords.apply(lambda x: x[0])
-    df["纬度"] = coords.apply(lambda x: x[1])
-
-    df = df[df["年份"] == 2025]
+    df = _encode_dims(df.reset_index(drop=True), _build_dim_dictionary([df]))
+    _write_builtin_cache("scan_2025", cache_sig, df)
+    return df
+
+# Dimension columns shared by the scan / outbound / stock / perf / newcust frames.
+# They are held as categoricals over one category set per dimension, so the
+# resident frames keep int codes and the same label has the same code everywhere.
+_DIM_COLS = ["省区", "经销商名称", "门店名称", "产品大类", "产品小类"]
+
+def _dim_values(s) -> pd.Index | None:
+    # Distinct labels of a text dimension column, or None if it is not plain text.
+    if not isinstance(s, pd.Series):
+        return None
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        vals = s.cat.categories
+    elif pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype):
+        vals = pd.Index(s.dropna().unique())
+    else:
+        return None
+    if len(vals) and pd.api.types.infer_dtype(vals, skipna=True) != "string":
+        return None
+    return vals
+
+def _build_dim_dictionary(frames) -> dict[str, pd.Index]:
+    dims = {}
+    for c in _DIM_COLS:
+        # "" is always a category: the tabs fillna("") these columns everywhere.
+        vals = pd.Index([""])
+        for _df in frames:
+            if _df is None or getattr(_df, "empty", True) or c not in _df.columns:
+                continue
+            v = _dim_values(_df[c])
+            if v is not None:
+                vals = vals.append(pd.Index(v.astype(str)))
+        dims[c] = vals.unique().sort_values()
+    return dims
+
+def _extend_dims(dims: dict[str, pd.Index] | None, frames) -> dict[str, pd.Index]:
+    # dims plus any labels of `frames` it lacks; the same object when nothing is new.
+    if dims is None:
+        return _build_dim_dictionary(frames)
+    out, grown = {}, False
+    for c, cats in dims.items():
+        vals = cats
+        for _df in frames:
+            if _df is None or getattr(_df, "empty", True) or c not in _df.columns:
+                continue
+            s = _df[c]
+            if isinstance(s.dtype, pd.CategoricalDtype) and s.cat.categories.equals(cats):
+                continue
+            v = _dim_values(s)
+            if v is not None:
+                vals = vals.append(pd.Index(v.astype(str)).difference(vals))
+        if len(vals) != len(cats):
+            grown = True
+            vals = vals.sort_values()
+        out[c] = vals
+    return out if grown else dims
+
+def _encode_dims(df: pd.DataFrame, dims: dict[str, pd.Index]) -> pd.DataFrame:
+    if df is None or getattr(df, "empty", True):
+        return df
+    for c, cats in dims.items():
+        if c not in df.columns:
+            continue
+        s = df[c]
+        if isinstance(s, pd.Series) and isinstance(s.dtype, pd.CategoricalDtype) and s.cat.categories.equals(cats):
+            continue
+        if _dim_values(s) is None:
+            continue
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            df[c] = s.cat.set_categories(cats)
+        else:
+            df[c] = pd.Categorical(s, categories=cats)
     return df
 
+# Interning table for join keys: raw label -> label with all whitespace removed.
+# Process-wide, so each distinct store/distributor name is normalized once.
+# Session threads share it; reads and writes go through _NORM_KEY_LOCK.
+_NORM_KEY_TABLE: dict[str, str] = {}
+_NORM_KEY_TABLE_MAX = 500_000
+_NORM_KEY_LOCK = threading.Lock()
+# Key array per category Index. Frames of one upload share one dictionary per
+# dimension (_parsed_dims), so a categorical column is keyed by a code lookup
+# into the array built the first time that dictionary is seen.
+_NORM_KEY_CATS: OrderedDict = OrderedDict()
+_NORM_KEY_CATS_MAX = 64
+
+def _norm_key_labels(labels: list) -> np.ndarray:
+    # Interned keys of `labels`, plus "" for the missing-value code -1.
+    with _NORM_KEY_LOCK:
+        hit = [_NORM_KEY_TABLE.get(x) for x in labels]
+    todo = list(dict.fromkeys(x for x, k in zip(labels, hit) if k is None))
+    if todo:
+        new = dict(zip(todo, pd.Series(todo).astype(str).str.replace(r"\s+", "", regex=True).tolist()))
+        hit = [new[x] if k is None else k for x, k in zip(labels, hit)]
+        with _NORM_KEY_LOCK:
+            if len(_NORM_KEY_TABLE) + len(new) > _NORM_KEY_TABLE_MAX:
+                _NORM_KEY_TABLE.clear()
+            _NORM_KEY_TABLE.update(new)
+    return np.array(hit + [""], dtype=object)
+
+def _norm_key(s: pd.Series) -> pd.Series:
+    # Same as s.fillna("").astype(str).str.replace(r"\s+", "", regex=True), but the
+    # regex only runs on labels not seen before, and categoricals map their categories.
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = s.cat.categories
+        with _NORM_KEY_LOCK:
+            hit = _NORM_KEY_CATS.get(id(cats))
+        if hit is not None and hit[0]() is cats:
+            keys = hit[1]
+        else:
+            keys = _norm_key_labels(cats.astype(str).tolist())
+            with _NORM_KEY_LOCK:
+                _NORM_KEY_CATS[id(cats)] = (weakref.ref(cats), keys)
+                while len(_NORM_KEY_CATS) > _NORM_KEY_CATS_MAX:
+                    _NORM_KEY_CATS.popitem(last=False)
+        return pd.Series(keys[s.cat.codes.to_numpy()], index=s.index).astype(str)
+    if pd.api.types.infer_dtype(s, skipna=True) not in ("string", "empty"):
+        # Mixed objects: factorize would fold 1 / 1.0 / True into one label.
+        return s.fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+    codes, labels = pd.factorize(s, use_na_sentinel=True)
+    keys = _norm_key_labels(pd.Index(labels).astype(str).tolist())
+    return pd.Series(keys[codes], index=s.index).astype(str)
+
+def _dim_options(s: pd.Series) -> list[str]:
+    # Sorted non-empty stripped labels actually present in s.
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.cat.remove_unused_categories().cat.categories.to_series()
+    vals = s.dropna().astype(str).str.strip().unique().tolist()
+    return sorted(x for x in vals if x)
+
+# Daily scan fact table: one row per (day, store, product) with the tin count
+# ("听数") and boxes at 6 tins per box ("箱数"), built once per upload signature.
+# Key values keep their raw dtype, so the scan filters apply to it unchanged.
+_SCAN_DAILY_KEYS = ["年份", "月份", "日", "省区", "经销商名称", "门店名称", "产品大类", "产品小类"]
+_SCAN_DAILY_CACHE: OrderedDict = OrderedDict()
+_SCAN_DAILY_MAX = 4
+_SCAN_DAILY_LOCK = threading.Lock()
+
+def _build_scan_daily(df: pd.DataFrame) -> pd.DataFrame:
+    keys = [c for c in _SCAN_DAILY_KEYS if c in df.columns]
+    daily = df.groupby(keys, dropna=False, observed=True, sort=True).size().rename("听数").reset_index()
+    daily["箱数"] = daily["听数"] / 6.0
+    return daily
+
+def _scan_daily(df: pd.DataFrame | None, sig: str | None) -> pd.DataFrame | None:
+    if df is None or getattr(df, "empty", True):
+        return df
+    if not sig:
+        return _build_scan_daily(df)
+    key = (sig, len(df))
+    with _SCAN_DAILY_LOCK:
+        hit = _SCAN_DAILY_CACHE.get(key)
+        if hit is not None:
+            _SCAN_DAILY_CACHE.move_to_end(key)
+            return hit
+    daily = _build_scan_daily(df)
+    with _SCAN_DAILY_LOCK:
+        _SCAN_DAILY_CACHE[key] = daily
+        while len(_SCAN_DAILY_CACHE) > _SCAN_DAILY_MAX:
+            _SCAN_DAILY_CACHE.popitem(last=False)
+    return daily
+
+# Store geography per upload: 市 / 区/县 / 门店状态 of each store in the sales
+# sheet, keyed by "_k_store_geo" (the _norm_key of 门店名称). Built once per
+# upload signature; the tabs merge their store tables onto it by that key.
+_STORE_GEO_CACHE: OrderedDict = OrderedDict()
+_STORE_GEO_MAX = 4
+_STORE_GEO_LOCK = threading.Lock()
+
+def _build_store_geo(df_raw: pd.DataFrame | None) -> pd.DataFrame | None:
+    store_geo_df = None
+    try:
+        if df_raw is not None and not getattr(df_raw, "empty", True) and int(df_raw.shape[1]) >= 9:
+            _store = df_raw.iloc[:, 8].fillna("").astype(str).str.strip()
+            _city = df_raw.iloc[:, 2].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 3 else pd.Series([""] * len(df_raw))
+            _dist = df_raw.iloc[:, 3].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 4 else pd.Series([""] * len(df_raw))
+            _status = df_raw.iloc[:, 17].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 18 else pd.Series([""] * len(df_raw))
+            _m0 = pd.DataFrame({"门店名称": _store, "市": _city, "区/县": _dist, "门店状态": _status})
+            _m0 = _m0[_m0["门店名称"].fillna("").astype(str).str.strip() != ""].copy()
+            if not _m0.empty:
+                _m0["_k_store_geo"] = _norm_key(_m0["门店名称"])
+
+                def _first_non_empty(vs):
+                    for x in vs.tolist():
+                        s = str(x or "").strip()
+                        if s and s.lower() not in ("nan", "none", "null"):
+                            return s
+                    return ""
+
+                store_geo_df = (
+                    _m0.groupby(["_k_store_geo"], as_index=False)
+                    .agg({"市": _first_non_empty, "区/县": _first_non_empty, "门店状态": _first_non_empty})
+                )
+    except Exception:
+        store_geo_df = None
+    return store_geo_df
+
+def _store_geo(df_raw: pd.DataFrame | None, sig: str | None) -> pd.DataFrame | None:
+    if not sig or df_raw is None:
+        return _build_store_geo(df_raw)
+    key = (sig, len(df_raw))
+    with _STORE_GEO_LOCK:
+        if key in _STORE_GEO_CACHE:
+            _STORE_GEO_CACHE.move_to_end(key)
+            return _STORE_GEO_CACHE[key]
+    store_geo_df = _build_store_geo(df_raw)
+    with _STORE_GEO_LOCK:
+        _STORE_GEO_CACHE[key] = store_geo_df
+        while len(_STORE_GEO_CACHE) > _STORE_GEO_MAX:
+            _STORE_GEO_CACHE.popitem(last=False)
+    return store_geo_df
+
+# Hashed scan-code index (scan_views.build_scan_code_index) per upload.
+_SCAN_CODE_CACHE: OrderedDict = OrderedDict()
+_SCAN_CODE_MAX = 4
+_SCAN_CODE_LOCK = threading.Lock()
+
+def _scan_code_index(df: pd.DataFrame | None, sig: str | None) -> dict | None:
+    if df is None or getattr(df, "empty", True) or "听码" not in df.columns:
+        return None
+    if not sig:
+        return build_scan_code_index(df)
+    key = (sig, len(df))
+    with _SCAN_CODE_LOCK:
+        hit = _SCAN_CODE_CACHE.get(key)
+        if hit is not None:
+            _SCAN_CODE_CACHE.move_to_end(key)
+            return hit
+    idx = build_scan_code_index(df)
+    with _SCAN_CODE_LOCK:
+        _SCAN_CODE_CACHE[key] = idx
+        while len(_SCAN_CODE_CACHE) > _SCAN_CODE_MAX:
+            _SCAN_CODE_CACHE.popitem(last=False)
+    return idx
+
+def _period_rollup(df: pd.DataFrame, by=(), value: str | None = None) -> pd.DataFrame:
+    # One grouped pass over (年份, 月份, 日, *by): row count in "_n", or the sum of
+    # `value`. Missing keys are kept, so totals over any slice match len()/sum().
+    keys = ["年份", "月份", "日"] + [c for c in by if c in df.columns]
+    g = df.groupby(keys, dropna=False, observed=True, sort=True)
+    out = g.size() if value is None else g[value].sum()
+    return out.rename("_n").reset_index()
+
+def _period_rows(roll: pd.DataFrame, year, month=None, day=None) -> pd.DataFrame:
+    m = roll["年份"] == year
+    if month is not None:
+        m &= roll["月份"] == month
+    if day is not None:
+        m &= roll["日"] == day
+    return roll[m]
+
+def _scan_map_points(df: pd.DataFrame, year, month=None, day=None, prov=None) -> pd.DataFrame:
+    # Scan rows of one period (and province) with usable coordinates.
+    d = _period_rows(df, year, month, day)
+    if prov is not None:
+        d = d[d["省区"] == prov]
+    return _with_coords(d)
+
+def _with_coords(d: pd.DataFrame) -> pd.DataFrame:
+    d = d.dropna(subset=["经度", "纬度"])
+    return d[d["经度"].between(70, 140) & d["纬度"].between(0, 60)]
+
+# Province centroids (mean scan coordinate) per upload, used to place the
+# rate-map markers; keyed like the daily rollup.
+_SCAN_CENT_CACHE: OrderedDict = OrderedDict()
+_SCAN_CENT_MAX = 4
+_SCAN_CENT_LOCK = threading.Lock()
+
+def _scan_centroids(df: pd.DataFrame, sig: str | None) -> pd.DataFrame:
+    key = (sig, len(df))
+    if sig:
+        with _SCAN_CENT_LOCK:
+            hit = _SCAN_CENT_CACHE.get(key)
+            if hit is not None:
+                _SCAN_CENT_CACHE.move_to_end(key)
+                return hit
+    cent = _with_coords(df[["省区", "经度", "纬度"]]).groupby("省区", observed=True)[["经度", "纬度"]].mean().reset_index()
+    if sig:
+        with _SCAN_CENT_LOCK:
+            _SCAN_CENT_CACHE[key] = cent
+            while len(_SCAN_CENT_CACHE) > _SCAN_CENT_MAX:
+                _SCAN_CENT_CACHE.popitem(last=False)
+    return cent
+
+# Heat-map layers per (upload sig, scan filters, period, focus province): point
+# count, center, tins per province and the tin counts per coordinate cell at
+# every selectable precision (0-3 decimals), so zoom / precision / render-mode
+# changes only re-render.
+_SCAN_GRID_CACHE: OrderedDict = OrderedDict()
+_SCAN_GRID_MAX = 16
+_SCAN_GRID_LOCK = threading.Lock()
+
+def _scan_grids(df: pd.DataFrame, key: tuple | None, year, month=None, day=None, prov=None) -> dict:
+    if key is None or not key[0]:
+        return build_scan_grids(_scan_map_points(df, year, month, day, prov))
+    with _SCAN_GRID_LOCK:
+        hit = _SCAN_GRID_CACHE.get(key)
+        if hit is not None:
+            _SCAN_GRID_CACHE.move_to_end(key)
+            return hit
+    layers = build_scan_grids(_scan_map_points(df, year, month, day, prov))
+    with _SCAN_GRID_LOCK:
+        _SCAN_GRID_CACHE[key] = layers
+        while len(_SCAN_GRID_CACHE) > _SCAN_GRID_MAX:
+            _SCAN_GRID_CACHE.popitem(last=False)
+    return layers
+
+def _period_by(roll: pd.DataFrame, col: str, name: str) -> pd.DataFrame:
+    # Same as rows.groupby(col).size()/sum().reset_index(name=name) on the sliced rows.
+    if col not in roll.columns:
+        return pd.DataFrame(columns=[col, name])
+    return roll.groupby(col, observed=True)["_n"].sum().reset_index(name=name)
+
+# Store tiers by rolling monthly outbound (箱): A >= 4, B >= 2, C >= 1, else D.
+# Tiers are int8 codes 0..3 (D..A) so period-to-period moves are just sign arrays.
+_STORE_TIER_LABELS = np.array(["D", "C", "B", "A"], dtype=object)
+# Indexed by sign(cur - prev) + 1.
+_STORE_TIER_CHANGE = np.array(["降级 ⬇️", "持平", "升级 ⬆️"], dtype=object)
+# Indexed by [sign(p2 - p1) + 1, sign(p3 - p2) + 1].
+_STORE_TIER_TREND3 = np.array(
+    [
+        ["持续降级", "降级持平", "先降级后升级"],
+        ["持平降级", "持续持平", "持平升级"],
+        ["先升级后降级", "升级持平", "持续升级"],
+    ],
+    dtype=object,
+)
+
+def _store_tier_codes(avg) -> np.ndarray:
+    # Non-numeric / missing averages fall through to D, like float() failing did.
+    v = pd.to_numeric(pd.Series(avg), errors="coerce").to_numpy(dtype=float)
+    return np.select([v >= 4, v >= 2, v >= 1], [3, 2, 1], 0).astype(np.int8)
+
+def _store_tier_labels(codes: np.ndarray) -> np.ndarray:
+    return _STORE_TIER_LABELS[codes]
+
+def _store_tier_change(prev: np.ndarray, cur: np.ndarray) -> np.ndarray:
+    return _STORE_TIER_CHANGE[np.sign(cur.astype(np.int8) - prev) + 1]
+
+def _store_tier_trend3(c1: np.ndarray, c2: np.ndarray, c3: np.ndarray) -> np.ndarray:
+    return _STORE_TIER_TREND3[np.sign(c2.astype(np.int8) - c1) + 1, np.sign(c3.astype(np.int8) - c2) + 1]
+
+# Outbound rows prepared for the 出库分析 tab (trimmed keys, _模块* columns,
+# _门店名, _年 / _月 / _日), built once per upload signature. The frame is shared
+# by every rerun and session on that upload, so callers slice it and never
+# assign into it.
+_OUT_ROWS_CACHE: OrderedDict = OrderedDict()
+_OUT_ROWS_MAX = 4
+_OUT_ROWS_LOCK = threading.Lock()
+
+def _build_outbound_rows(df: pd.DataFrame) -> pd.DataFrame:
+    o_raw = df.copy()
+
+    if '产品大类' not in o_raw.columns:
+        o_raw['产品大类'] = '全部'
+    if '产品小类' not in o_raw.columns:
+        o_raw['产品小类'] = '全部'
+    for _c in ['省区', '经销商名称', '产品大类', '产品小类']:
+        if _c in o_raw.columns:
+            o_raw[_c] = o_raw[_c].fillna('').astype(str).str.strip()
+    if '经销商名称' in o_raw.columns:
+        o_raw['经销商名称'] = o_raw['经销商名称'].str.replace(r'\s+', '', regex=True)
+
+    big_cat_src = '透视' if '透视' in o_raw.columns else (o_raw.columns[19] if len(o_raw.columns) > 19 else None)
+    small_cat_src = '重量' if '重量' in o_raw.columns else (o_raw.columns[20] if len(o_raw.columns) > 20 else None)
+    out_prod_src = '出库产品' if '出库产品' in o_raw.columns else (o_raw.columns[8] if len(o_raw.columns) > 8 else None)
+    o_raw['_模块大类'] = o_raw[big_cat_src] if big_cat_src is not None else '全部'
+    o_raw['_模块小类'] = o_raw[small_cat_src] if small_cat_src is not None else '全部'
+    o_raw['_模块出库产品'] = o_raw[out_prod_src] if out_prod_src is not None else '全部'
+    for _c in ['_模块大类', '_模块小类', '_模块出库产品']:
+        if _c in o_raw.columns:
+            o_raw[_c] = o_raw[_c].fillna('').astype(str).str.strip()
+
+    day_col = next((c for c in o_raw.columns if str(c).strip() == '日'), None)
+    if day_col is None:
+        day_col = next((c for c in o_raw.columns if ('日期' in str(c)) or (str(c).strip().endswith('日') and '月' not in str(c))), None)
+    if day_col is None and len(o_raw.columns) > 14:
+        day_col = o_raw.columns[14]
+
+    store_name_col = o_raw.columns[5] if len(o_raw.columns) > 5 else None
+
+    if '数量(箱)' in o_raw.columns:
+        o_raw['数量(箱)'] = pd.to_numeric(o_raw['数量(箱)'], errors='coerce').fillna(0.0)
+    else:
+        o_raw['数量(箱)'] = 0.0
+
+    if store_name_col is not None and store_name_col in o_raw.columns:
+        o_raw['_门店名'] = (
+            o_raw[store_name_col]
+            .fillna('')
+            .astype(str)
+            .str.replace(r'\s+', '', regex=True)
+        )
+        o_raw.loc[o_raw['_门店名'].isin(['', 'nan', 'None', 'NULL', 'NaN']), '_门店名'] = pd.NA
+    else:
+        o_raw['_门店名'] = pd.NA
+
+    def _to_month(v):
+        if pd.isna(v):
+            return None
+        if isinstance(v, (int, float)) and not pd.isna(v):
+            m = int(v)
+            return m if 1 <= m <= 12 else None
+        s = str(v).strip()
+        if s.isdigit():
+            m = int(s)
+            return m if 1 <= m <= 12 else None
+        if '月' in s:
+            digits = ''.join([ch for ch in s if ch.isdigit()])
+            if digits:
+                for k in (2, 1):
+                    if len(digits) >= k:
+                        m = int(digits[-k:])
+                        if 1 <= m <= 12:
+                            return m
+            return None
+        dt = pd.to_datetime(s, errors='coerce')
+        if pd.isna(dt):
+            return None
+        m = int(dt.month)
+        return m if 1 <= m <= 12 else None
+
+    def _to_day(v):
+        if pd.isna(v):
+            return None
+        if isinstance(v, (int, float)) and not pd.isna(v):
+            d = int(v)
+            return d if 1 <= d <= 31 else None
+        s = str(v).strip()
+        digits = ''.join([ch for ch in s if ch.isdigit()])
+        if not digits:
+            return None
+        d = int(digits[-2:]) if len(digits) >= 2 else int(digits)
+        return d if 1 <= d <= 31 else None
+
+    if '年份' in o_raw.columns:
+        o_raw['_年'] = pd.to_numeric(o_raw['年份'], errors='coerce').fillna(0).astype(int)
+    else:
+        o_raw['_年'] = 0
+    if '月份' in o_raw.columns:
+        o_raw['_月'] = o_raw['月份'].apply(_to_month)
+    else:
+        o_raw['_月'] = None
+
+    if day_col is not None and day_col in o_raw.columns:
+        if '日期' in str(day_col):
+            dt_series = pd.to_datetime(o_raw[day_col], errors='coerce')
+            o_raw['_年'] = np.where(dt_series.notna(), dt_series.dt.year, o_raw['_年']).astype(int)
+            o_raw['_月'] = np.where(dt_series.notna(), dt_series.dt.month, o_raw['_月'])
+            o_raw['_日'] = np.where(dt_series.notna(), dt_series.dt.day, None)
+        else:
+            o_raw['_日'] = o_raw[day_col].apply(_to_day)
+    else:
+        o_raw['_日'] = None
+
+    if '月份' in o_raw.columns:
+        _ms = o_raw['月份'].fillna('').astype(str).str.strip()
+        _ym4 = _ms.str.extract(r'(20\d{2})\D{0,3}(0?[1-9]|1[0-2])')
+        _mask_y = pd.to_numeric(o_raw.get('_年', 0), errors='coerce').fillna(0).astype(int) <= 0
+        if _mask_y.any():
+            _y4 = pd.to_numeric(_ym4[0], errors='coerce')
+            o_raw.loc[_mask_y & _y4.notna(), '_年'] = _y4[_mask_y & _y4.notna()].astype(int)
+        _mask_m = o_raw.get('_月', pd.Series([None] * len(o_raw))).isna()
+        if _mask_m.any():
+            _m4 = pd.to_numeric(_ym4[1], errors='coerce')
+            o_raw.loc[_mask_m & _m4.notna(), '_月'] = _m4[_mask_m & _m4.notna()]
+
+        _ym2 = _ms.str.extract(r'(?<!\d)(\d{2})\D{0,3}(0?[1-9]|1[0-2])')
+        _mask_y2 = pd.to_numeric(o_raw.get('_年', 0), errors='coerce').fillna(0).astype(int) <= 0
+        if _mask_y2.any():
+            _y2 = pd.to_numeric(_ym2[0], errors='coerce')
+            o_raw.loc[_mask_y2 & _y2.notna(), '_年'] = (2000 + _y2[_mask_y2 & _y2.notna()]).astype(int)
+        _mask_m2 = o_raw.get('_月', pd.Series([None] * len(o_raw))).isna()
+        if _mask_m2.any():
+            _m2 = pd.to_numeric(_ym2[1], errors='coerce')
+            o_raw.loc[_mask_m2 & _m2.notna(), '_月'] = _m2[_mask_m2 & _m2.notna()]
+
+    o_raw = o_raw[o_raw['_年'] > 0].copy()
+    o_raw = o_raw[o_raw['_月'].notna()].copy()
+    o_raw['_月'] = o_raw['_月'].astype(int)
+    o_raw['_日'] = pd.to_numeric(o_raw['_日'], errors='coerce')
+    return o_raw
+
+def _build_outbound_trend_rows(o_raw: pd.DataFrame) -> pd.DataFrame:
+    # The trend views read 客户简称 as 经销商名称 and key months by _ym.
+    d = o_raw
+    if "客户简称" in d.columns:
+        d = d.assign(经销商名称=d["客户简称"].fillna(d["经销商名称"]))
+    y = pd.to_numeric(d["_年"], errors="coerce").fillna(0).astype(int)
+    m = pd.to_numeric(d["_月"], errors="coerce").fillna(0).astype(int)
+    ok = (d["_年"].notna() & d["_月"].notna() & (y > 0) & m.between(1, 12)).to_numpy()
+    if not ok.all():
+        d, y, m = d[ok], y[ok], m[ok]
+    return d.assign(_年=y, _月=m, _ym=(y * 100 + m).astype(int))
+
+def _outbound_rows_cached(key, build):
+    if key[0] is None:
+        return build()
+    with _OUT_ROWS_LOCK:
+        hit = _OUT_ROWS_CACHE.get(key)
+        if hit is not None:
+            _OUT_ROWS_CACHE.move_to_end(key)
+            return hit
+    out = build()
+    with _OUT_ROWS_LOCK:
+        _OUT_ROWS_CACHE[key] = out
+        while len(_OUT_ROWS_CACHE) > _OUT_ROWS_MAX:
+            _OUT_ROWS_CACHE.popitem(last=False)
+    return out
+
+def _outbound_rows(df: pd.DataFrame, sig: str | None) -> pd.DataFrame:
+    return _outbound_rows_cached((sig or None, "rows", len(df)), lambda: _build_outbound_rows(df))
+
+def _outbound_trend_rows(o_raw: pd.DataFrame, sig: str | None) -> pd.DataFrame:
+    return _outbound_rows_cached((sig or None, "trend", len(o_raw)), lambda: _build_outbound_trend_rows(o_raw))
+
+# Outbound 数量(箱) summed per store x product module x month, built once per
+# upload signature. Stores keep their raw key values (客户简称 included, so the
+# trend views can still substitute it for 经销商名称); callers filter the small
+# store / module tables and re-group with their own key normalization.
+_OUT_CUBE_STORE_COLS = ["省区", "经销商名称", "客户简称", "_门店名"]
+_OUT_CUBE_MODULE_COLS = ["_模块大类", "_模块小类", "_模块出库产品"]
+_OUT_CUBE_CACHE: OrderedDict = OrderedDict()
+_OUT_CUBE_MAX = 8
+_OUT_CUBE_LOCK = threading.Lock()
+
+def _build_outbound_cube(df: pd.DataFrame) -> dict:
+    y = pd.to_numeric(df["_年"], errors="coerce").fillna(0).astype(int)
+    m = pd.to_numeric(df["_月"], errors="coerce").fillna(0).astype(int)
+    ok = (df["_年"].notna() & df["_月"].notna() & (y > 0) & m.between(1, 12)).to_numpy()
+    store_cols = [c for c in _OUT_CUBE_STORE_COLS if c in df.columns]
+    module_cols = [c for c in _OUT_CUBE_MODULE_COLS if c in df.columns]
+    d = df.loc[ok, store_cols + module_cols].copy()
+    d["_ym"] = (y[ok] * 100 + m[ok]).astype(int)
+    d["数量(箱)"] = pd.to_numeric(df.loc[ok, "数量(箱)"], errors="coerce").fillna(0.0) if "数量(箱)" in df.columns else 0.0
+    g = d.groupby(store_cols + module_cols + ["_ym"], dropna=False, sort=True)["数量(箱)"].sum().reset_index()
+
+    # g is sorted by store key first, so first-appearance ids are in key order.
+    store_id = g.groupby(store_cols, dropna=False, sort=False).ngroup().to_numpy()
+    stores = g.iloc[np.unique(store_id, return_index=True)[1]][store_cols].reset_index(drop=True)
+    if module_cols:
+        module_id = g.groupby(module_cols, dropna=False, sort=False).ngroup().to_numpy()
+        modules = g.iloc[np.unique(module_id, return_index=True)[1]][module_cols].reset_index(drop=True)
+    else:
+        module_id = np.zeros(len(g), dtype=int)
+        modules = pd.DataFrame(index=range(1 if len(g) else 0))
+    yms = np.sort(g["_ym"].unique())
+    return {
+        "stores": stores,
+        "modules": modules,
+        "yms": yms,
+        "store": store_id,
+        "module": module_id,
+        "ym": np.searchsorted(yms, g["_ym"].to_numpy()),
+        "qty": g["数量(箱)"].to_numpy(dtype=float),
+    }
+
+def _outbound_cube(df: pd.DataFrame, sig: str | None) -> dict:
+    if not sig:
+        return _build_outbound_cube(df)
+    with _OUT_CUBE_LOCK:
+        hit = _OUT_CUBE_CACHE.get(sig)
+        if hit is not None:
+            _OUT_CUBE_CACHE.move_to_end(sig)
+            return hit
+    cube = _build_outbound_cube(df)
+    with _OUT_CUBE_LOCK:
+        _OUT_CUBE_CACHE[sig] = cube
+        while len(_OUT_CUBE_CACHE) > _OUT_CUBE_MAX:
+            _OUT_CUBE_CACHE.popitem(last=False)
+    return cube
+
+def _cube_module_mask(cube: dict, big="全部", small="全部", prods=None) -> np.ndarray:
+    # Same selection as filtering the outbound rows on _模块大类 / _模块小类 / _模块出库产品.
+    mods = cube["modules"]
+    mask = np.ones(len(mods), dtype=bool)
+    if big != "全部" and "_模块大类" in mods.columns:
+        mask &= (mods["_模块大类"].astype(str).str.strip() == str(big).strip()).to_numpy()
+    if small != "全部" and "_模块小类" in mods.columns:
+        mask &= (mods["_模块小类"].astype(str).str.strip() == str(small).strip()).to_numpy()
+    if prods and "_模块出库产品" in mods.columns:
+        _p = [str(x).strip() for x in prods if str(x).strip()]
+        if _p:
+            mask &= mods["_模块出库产品"].astype(str).str.strip().isin(_p).to_numpy()
+    return mask
+
+def _cube_module_opts(cube: dict, col: str, big="全部", small="全部") -> list:
+    # Sorted non-empty values of one module column under the 大类 / 小类 picks,
+    # the option list the row-level pickers used to build from the whole frame.
+    mods = cube["modules"]
+    if col not in mods.columns:
+        return []
+    s = mods.loc[_cube_module_mask(cube, big, small), col].dropna().astype(str).str.strip()
+    return sorted([x for x in s.unique().tolist() if x and x.lower() not in ("nan", "none", "null")])
+
+def _cube_store_months(cube: dict, yms, store_mask=None, module_mask=None, any_month: bool = False, stores=None):
+    """Dense store x month slice of the cube.
+
+    Returns one row per store with data in `yms` (in any month if `any_month`),
+    its key columns plus one float column per ym, and the set of months that
+    have any cell under the masks. `stores` replaces cube["stores"] (same rows)
+    when the caller has re-derived key columns.
+    """
+    keep = np.ones(len(cube["qty"]), dtype=bool)
+    if store_mask is not None:
+        keep &= np.asarray(store_mask, dtype=bool)[cube["store"]]
+    if module_mask is not None:
+        keep &= np.asarray(module_mask, dtype=bool)[cube["module"]]
+    sid = cube["store"][keep]
+    ym = cube["yms"][cube["ym"][keep]]
+    qty = cube["qty"][keep]
+    avail = set(int(x) for x in np.unique(ym))
+
+    yms = list(dict.fromkeys(int(x) for x in yms))
+    pos = pd.Index(yms, dtype=int).get_indexer(ym)
+    req = pos >= 0
+    rows = np.unique(sid if any_month else sid[req])
+    row_of = np.full(len(cube["stores"]), -1)
+    row_of[rows] = np.arange(len(rows))
+    n = len(yms)
+    mat = np.bincount(row_of[sid[req]] * n + pos[req], weights=qty[req], minlength=len(rows) * n).reshape(len(rows), n)
+    out = (cube["stores"] if stores is None else stores).iloc[rows].reset_index(drop=True)
+    for j, ym_i in enumerate(yms):
+        out[ym_i] = mat[:, j]
+    return out, avail
+
 @st.cache_data(show_spinner=False, ttl=3600)
 def load_project_targets_sheet(file_bytes: bytes, file_name: str) -> pd.DataFrame:
     try:
         bio = io.BytesIO(file_bytes)
         xl = pd.ExcelFile(bio)
+        wb_sig = hashlib.md5(file_bytes).hexdigest()
         names = [str(s) for s in xl.sheet_names]
         preferred = [s for s in names if any(k in s for k in ["专案", "项目", "专案数据"])]
         candidates = preferred + [s for s in names if s not in preferred]
@@ -3596,8 +3951,7 @@ def load_project_targets_sheet(file_bytes: bytes, file_name: str) -> pd.DataFram
 
         for sname in candidates:
             try:
-                tmp = xl.parse(sname, nrows=0)
-                cols = [str(c).strip() for c in tmp.columns]
+                cols = _probe_header(xl, wb_sig, sname)
                 if _has_store_type(cols):
                     df = xl.parse(sname)
                     df.columns = [str(c).strip() for c in df.columns]
@@ -3608,17 +3962,19 @@ def load_project_targets_sheet(file_bytes: bytes, file_name: str) -> pd.DataFram
 
         for sname in candidates:
             try:
-                raw = xl.parse(sname, header=None)
-                if raw is None or raw.empty:
+                # Look for the header in the first 80 rows before parsing the whole sheet.
+                head = _probe_sheet(xl, wb_sig, sname, 80)
+                if head is None or head.empty:
                     continue
                 header_row = None
-                for r in range(min(80, len(raw))):
-                    row = raw.iloc[r].tolist()
+                for r in range(min(80, len(head))):
+                    row = head.iloc[r].tolist()
                     if any("门店类型" in str(x) for x in row if x is not None):
                         header_row = r
                         break
                 if header_row is None:
                     continue
+                raw = xl.parse(sname, header=None)
                 cols = [str(c).strip() if c is not None else "" for c in raw.iloc[header_row].tolist()]
                 df = raw.iloc[header_row + 1 :].copy()
                 df.columns = cols
@@ -3712,7 +4068,7 @@ def _build_project_tracking_store_df(
     for c in ["省区", "经销商名称", "门店名称", "门店类型"]:
         df_tgt[c] = df_tgt[c].fillna("").astype(str).str.strip()
         if c in ("经销商名称", "门店名称"):
-            df_tgt[c] = df_tgt[c].str.replace(r"\s+", "", regex=True)
+            df_tgt[c] = _norm_key(df_tgt[c])
     for c in ["段粉_目标", "雅系列_目标", "中老年_目标"]:
         df_tgt[c] = pd.to_numeric(df_tgt[c], errors="coerce").fillna(0.0)
     if not mid_target_is_ti:
@@ -3741,17 +4097,18 @@ def _build_project_tracking_store_df(
                 store_name_col = c
                 break
         if store_name_col:
-            df_out_all["_门店名"] = df_out_all[store_name_col].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+            df_out_all["_门店名"] = _norm_key(df_out_all[store_name_col])
         else:
             df_out_all["_门店名"] = pd.NA
 
-    for c in ["省区", "经销商名称", "_门店名", cat_col]:
+    # 经销商名称 / _门店名 lose all whitespace below; _norm_key keys their categories once.
+    for c in ["省区", cat_col]:
         if c in df_out_all.columns:
             df_out_all[c] = df_out_all[c].fillna("").astype(str).str.strip()
     if "经销商名称" in df_out_all.columns:
-        df_out_all["经销商名称"] = df_out_all["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True)
+        df_out_all["经销商名称"] = _norm_key(df_out_all["经销商名称"])
     if "_门店名" in df_out_all.columns:
-        df_out_all["_门店名"] = df_out_all["_门店名"].astype(str).str.replace(r"\s+", "", regex=True)
+        df_out_all["_门店名"] = _norm_key(df_out_all["_门店名"])
     if weight_col is not None and weight_col in df_out_all.columns:
         df_out_all[weight_col] = df_out_all[weight_col].fillna("").astype(str).str.strip()
 
@@ -3891,7 +4248,7 @@ def _build_project_tracking_store_df(
 
     if anchor_ym is None:
         try:
-            _scan = globals().get("df_scan_raw")
+            _scan = globals().get("df_scan_daily")
             if _scan is not None and not getattr(_scan, "empty", True):
                 _s0 = _scan.copy()
                 _s0["_ym"] = (pd.to_numeric(_s0.get("年份", 0), errors="coerce").fillna(0).astype(int) * 100 + pd.to_numeric(_s0.get("月份", 0), errors="coerce").fillna(0).astype(int)).astype(int)
@@ -3920,9 +4277,9 @@ def _build_project_tracking_store_df(
             if "省区" in nc.columns:
                 nc["省区"] = nc["省区"].fillna("").astype(str).str.strip()
             if "经销商名称" in nc.columns:
-                nc["经销商名称"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                nc["经销商名称"] = _norm_key(nc["经销商名称"])
             if "门店名称" in nc.columns:
-                nc["门店名称"] = nc["门店名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                nc["门店名称"] = _norm_key(nc["门店名称"])
             if "新客数" in nc.columns:
                 nc["新客数"] = pd.to_numeric(nc["新客数"], errors="coerce").fillna(0.0)
             nc["_ym"] = pd.to_numeric(nc["_ym"], errors="coerce").fillna(0).astype(int)
@@ -3933,8 +4290,8 @@ def _build_project_tracking_store_df(
             cum = nc[(nc["_ym"] >= 202501) & (nc["_ym"] <= anchor_ym)].groupby(["省区", "经销商名称", "门店名称"], as_index=False)["新客数"].sum().rename(columns={"新客数": "累计新客"})
             for _df in (cur, p3, cum):
                 _df["省区"] = _df["省区"].fillna("").astype(str).str.strip()
-                _df["经销商名称"] = _df["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                _df["门店名称"] = _df["门店名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                _df["经销商名称"] = _norm_key(_df["经销商名称"])
+                _df["门店名称"] = _norm_key(_df["门店名称"])
             store_df = store_df.merge(cur, on=["省区", "经销商名称", "门店名称"], how="left")
             store_df = store_df.merge(p3, on=["省区", "经销商名称", "门店名称"], how="left")
             store_df = store_df.merge(cum, on=["省区", "经销商名称", "门店名称"], how="left")
@@ -3952,7 +4309,7 @@ def _build_project_tracking_store_df(
             for _c in ["省区", "经销商名称", "产品大类", "产品名称", "重量"]:
                 if _c in _s.columns:
                     if _c == "经销商名称":
-                        _s[_c] = _s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                        _s[_c] = _norm_key(_s[_c])
                     else:
                         _s[_c] = _s[_c].fillna("").astype(str).str.strip()
             if "箱数" in _s.columns:
@@ -3972,20 +4329,20 @@ def _build_project_tracking_store_df(
                 _s = _s[~((_s["产品大类"].astype(str).str.strip() == "美思雅段粉") & (w_digits.astype(str) != "800"))].copy()
             inv = _s.groupby(["省区", "经销商名称"], as_index=False)["箱数"].sum().rename(columns={"箱数": "库存"})
             for _c in ["省区", "经销商名称"]:
-                inv[_c] = inv[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True) if _c == "经销商名称" else inv[_c].fillna("").astype(str).str.strip()
+                inv[_c] = _norm_key(inv[_c]) if _c == "经销商名称" else inv[_c].fillna("").astype(str).str.strip()
             store_df = store_df.merge(inv, on=["省区", "经销商名称"], how="left", suffixes=("", "_y"))
             if "库存_y" in store_df.columns:
                 store_df.drop(columns=["库存"], inplace=True, errors="ignore")
                 store_df.rename(columns={"库存_y": "库存"}, inplace=True)
             store_df["库存"] = pd.to_numeric(store_df.get("库存", 0), errors="coerce").fillna(0.0)
 
-        sc0 = globals().get("df_scan_raw")
+        sc0 = globals().get("df_scan_daily")
         if sc0 is not None and not getattr(sc0, "empty", True):
             s = sc0.copy()
             for _c in ["省区", "经销商名称", "门店名称", "产品大类", "产品小类"]:
                 if _c in s.columns:
                     if _c in ("经销商名称", "门店名称"):
-                        s[_c] = s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                        s[_c] = _norm_key(s[_c])
                     else:
                         s[_c] = s[_c].fillna("").astype(str).str.strip()
             s["年份"] = pd.to_numeric(s.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -4006,9 +4363,9 @@ def _build_project_tracking_store_df(
                     s = s[~((s["产品大类"].astype(str).str.strip() == "美思雅段粉") & (w_digits.astype(str) != "800"))].copy()
                 if not s.empty:
                     scan_agg = (
-                        s.groupby(["省区", "经销商名称", "门店名称"], as_index=False)
-                        .size()
-                        .rename(columns={"size": "_扫码听数"})
+                        s.groupby(["省区", "经销商名称", "门店名称"], as_index=False)["听数"]
+                        .sum()
+                        .rename(columns={"听数": "_扫码听数"})
                     )
                     scan_agg["本月扫码"] = pd.to_numeric(scan_agg["_扫码听数"], errors="coerce").fillna(0.0) / 6.0
                     scan_agg.drop(columns=["_扫码听数"], inplace=True, errors="ignore")
@@ -4054,6 +4411,500 @@ def _build_project_tracking_store_df(
     store_df = store_df[keep].copy()
     return store_df, logs
 
+# Parsed uploads, shared by every session in the process and keyed by the
+# upload MD5, so N users opening the same 底表 parse and hold it once.
+_parsed_store_ver = 4
+_parsed_store_max_bytes = 1536 * 1024 * 1024
+# Optional second tier on disk (pickles under .parsed_cache/); off by default
+# because it persists uploaded sales data.
+_parsed_store_disk = False
+_parsed_store_disk_max_bytes = 4096 * 1024 * 1024
+
+@st.cache_resource
+def _parsed_store() -> dict:
+    # "inflight" maps a store key to the Event of the session parsing it, so
+    # sessions opening the same upload together wait for one parse. "dims" holds
+    # each upload's category dictionary (see _parsed_dims).
+    return {"lock": threading.Lock(), "items": OrderedDict(), "bytes": 0, "inflight": {}, "dims": {}}
+
+def _parsed_nbytes(parsed) -> int:
+    n = 0
+    for x in parsed:
+        if isinstance(x, pd.DataFrame):
+            try:
+                n += int(x.memory_usage(index=True, deep=True).sum())
+            except Exception:
+                n += int(x.size) * 8
+    return n
+
+def _parsed_disk_path(key: str) -> str:
+    base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+    return os.path.join(base_dir, ".parsed_cache", f"v{_parsed_store_ver}_{key}.pkl")
+
+def _parsed_disk_read(key: str):
+    path = _parsed_disk_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        parsed = pd.read_pickle(path)
+        os.utime(path)
+        return parsed if isinstance(parsed, tuple) else None
+    except Exception:
+        return None
+
+def _parsed_disk_write(key: str, parsed):
+    path = _parsed_disk_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.to_pickle(parsed, tmp_path)
+        os.replace(tmp_path, path)
+        # Least recently used files go first once the directory is over budget.
+        cache_dir = os.path.dirname(path)
+        files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith(".pkl")]
+        files.sort(key=lambda f: os.stat(f).st_mtime)
+        total = sum(os.stat(f).st_size for f in files)
+        for f in files[:-1]:
+            if total <= _parsed_store_disk_max_bytes:
+                break
+            total -= os.stat(f).st_size
+            os.remove(f)
+    except Exception:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _parsed_store_put(key: str, parsed, write_disk: bool = True):
+    store = _parsed_store()
+    nbytes = _parsed_nbytes(parsed)
+    with store["lock"]:
+        old = store["items"].pop(key, None)
+        if old is not None:
+            store["bytes"] -= old[0]
+        store["items"][key] = (nbytes, parsed)
+        store["bytes"] += nbytes
+        # Evict least recently used workbooks, but always keep the newest one.
+        while store["bytes"] > _parsed_store_max_bytes and len(store["items"]) > 1:
+            old_key, (n_old, _) = store["items"].popitem(last=False)
+            store["bytes"] -= n_old
+            old_sig = old_key.rsplit("_", 1)[0]
+            if not any(k.startswith(f"{old_sig}_") for k in store["items"]):
+                store["dims"].pop(old_sig, None)
+    if _parsed_store_disk and write_disk:
+        _parsed_disk_write(key, parsed)
+
+def _parsed_store_get(key: str):
+    store = _parsed_store()
+    with store["lock"]:
+        hit = store["items"].get(key)
+        if hit is not None:
+            store["items"].move_to_end(key)
+            return hit[1]
+    if _parsed_store_disk:
+        parsed = _parsed_disk_read(key)
+        if parsed is not None:
+            _parsed_store_put(key, parsed, write_disk=False)
+            return parsed
+    return None
+
+def _parsed_store_discard(sig: str | None):
+    if not sig:
+        return
+    store = _parsed_store()
+    with store["lock"]:
+        store["dims"].pop(sig, None)
+    for key in [f"{sig}_{k}" for k in _WORKBOOK_SHEETS]:
+        with store["lock"]:
+            old = store["items"].pop(key, None)
+            if old is not None:
+                store["bytes"] -= old[0]
+        try:
+            path = _parsed_disk_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+def _parsed_dims(sig: str, frames) -> dict[str, pd.Index]:
+    # The upload's one category dictionary: every label of the built-ins and of
+    # each sheet parsed for `sig` so far. It only grows. When `frames` bring new
+    # labels the stored sheets are re-encoded against the grown dictionary, so
+    # sheets parsed later share one category set per column with the others.
+    store = _parsed_store()
+    while True:
+        with store["lock"]:
+            dims = store["dims"].get(sig)
+        grown = _extend_dims(dims, frames)
+        if grown is dims:
+            return dims
+        with store["lock"]:
+            if store["dims"].get(sig) is not dims:
+                continue
+            store["dims"][sig] = grown
+            # The sales sheet is never encoded (see _load_parsed_workbook).
+            stale = [(k, v) for k, v in store["items"].items() if k.startswith(f"{sig}_") and k != f"{sig}_sales"]
+        for key, entry in stale:
+            nbytes, (value, month_cols, logs) = entry
+            if not isinstance(value, pd.DataFrame):
+                continue
+            # A re-encoded shallow copy replaces the entry; readers keep the old frame.
+            fresh = (nbytes, (_encode_dims(value.copy(deep=False), grown), month_cols, logs))
+            with store["lock"]:
+                if store["items"].get(key) is entry:
+                    store["items"][key] = fresh
+        return grown
+
+# Slot of each sheet kind in the load_data_v3 result tuple.
+_SHEET_SLOTS = {"sales": 0, "stock": 2, "outbound": 3, "perf": 4, "target": 5, "scan": 6, "newcust": 7}
+
+def _load_parsed_workbook(file_bytes: bytes, file_name: str, sig: str, sheets=_WORKBOOK_SHEETS):
+    # Returns the load_data_v3 tuple with only `sheets` filled in. Each sheet is
+    # parsed on first request and then served from the store per file signature.
+    store = _parsed_store()
+    entries = {k: _parsed_store_get(f"{sig}_{k}") for k in sheets}
+    while True:
+        missing = tuple(k for k, v in entries.items() if v is None)
+        if not missing:
+            break
+        # Claim the sheets nobody is parsing yet; wait for the others.
+        with store["lock"]:
+            waits = {store["inflight"].get(f"{sig}_{k}") for k in missing} - {None}
+            mine = tuple(k for k in missing if f"{sig}_{k}" not in store["inflight"])
+            done = threading.Event()
+            for k in mine:
+                store["inflight"][f"{sig}_{k}"] = done
+        if mine:
+            try:
+                # Another session may have stored a sheet between our miss and the claim.
+                for k in mine:
+                    entries[k] = _parsed_store_get(f"{sig}_{k}")
+                todo = tuple(k for k in mine if entries[k] is None)
+                if todo:
+                    parsed = load_data_v3(file_bytes, file_name, sheets=todo)
+                    if parsed[1] is None:
+                        # Failed parses are not shared; waiters and the next rerun retry.
+                        return parsed
+                    # Encode before sharing, so sessions only ever read the stored frames.
+                    frames = [parsed[_SHEET_SLOTS[k]] for k in todo if k != "sales"]
+                    dims = _parsed_dims(sig, frames + [load_builtin_perf_2025(), load_builtin_scan_2025()])
+                    for _df in frames:
+                        _encode_dims(_df, dims)
+                    for k in todo:
+                        entries[k] = (parsed[_SHEET_SLOTS[k]], parsed[1] if k == "sales" else None, list(parsed[8] or []))
+                        _parsed_store_put(f"{sig}_{k}", entries[k])
+            finally:
+                with store["lock"]:
+                    for k in mine:
+                        store["inflight"].pop(f"{sig}_{k}", None)
+                done.set()
+        for ev in waits:
+            ev.wait()
+        for k in missing:
+            if entries[k] is None:
+                entries[k] = _parsed_store_get(f"{sig}_{k}")
+
+    out = [None, [], None, None, None, None, None, None, []]
+    for k, (value, month_cols, logs) in entries.items():
+        out[_SHEET_SLOTS[k]] = value
+        if k == "sales":
+            out[1] = month_cols
+        out[8] += [x for x in logs if x not in out[8]]
+    # Per-session shallow copies: the tabs add and replace columns on these frames.
+    return tuple(x.copy(deep=False) if isinstance(x, pd.DataFrame) else (list(x) if isinstance(x, list) else x) for x in out)
+
+# Export jobs. The "生成…" buttons hand their frames to a small worker pool
+# shared by every session; finished artifacts are written under .export_cache/,
+# addressed by a stable hash of the export key, so they survive reruns, are
+# never held in session memory, and every session asking for the same export
+# gets the one artifact. The directory is an LRU bounded by
+# _export_store_max_bytes; _export_ttl_sec drops artifacts nobody has used.
+_export_job_ver = 2
+_export_workers = 2
+_export_ttl_sec = 24 * 3600
+_export_store_max_bytes = 2048 * 1024 * 1024
+# Artifacts used this recently are never evicted: every render of a download
+# button touches its artifact, so the file is still there when it is clicked.
+_export_pin_sec = 600
+_export_sweep_sec = 60
+_export_poll_sec = 1.0
+
+@st.cache_resource
+def _export_jobs() -> dict:
+    pool = ThreadPoolExecutor(max_workers=_export_workers, thread_name_prefix="export")
+    return {"lock": threading.Lock(), "jobs": {}, "pool": pool, "swept": 0.0}
+
+def _export_dir() -> str:
+    base_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+    return os.path.join(base_dir, ".export_cache")
+
+def _export_paths(job_id: str) -> tuple[str, str]:
+    d = _export_dir()
+    return os.path.join(d, f"{job_id}.bin"), os.path.join(d, f"{job_id}.json")
+
+def _export_key_plain(x):
+    # JSON-able, order-stable form of an export key; repr() is not stable for
+    # sets or across numpy scalar types.
+    if isinstance(x, dict):
+        return [[str(k), _export_key_plain(v)] for k, v in sorted(x.items(), key=lambda kv: str(kv[0]))]
+    if isinstance(x, (set, frozenset)):
+        return sorted((_export_key_plain(v) for v in x), key=lambda v: json.dumps(v, ensure_ascii=False))
+    if isinstance(x, (list, tuple)):
+        return [_export_key_plain(v) for v in x]
+    if isinstance(x, np.generic):
+        return _export_key_plain(x.item())
+    if x is None or isinstance(x, (bool, int, float, str)):
+        return x
+    return str(x)
+
+def _export_job_id(key) -> str:
+    # Keys describe the export inside one workbook; the upload signature keeps
+    # sessions on different files apart, and the built-in signature retires
+    # artifacts built from replaced scan/perf parts.
+    sig = st.session_state.get("_active_file_sig") or ""
+    payload = json.dumps([_export_job_ver, sig, _builtin_data_signature(), _export_key_plain(key)], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:40]
+
+def _export_remove(job_id: str):
+    for path in _export_paths(job_id):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+def _export_forget(job_ids):
+    # Removes finished artifacts and their job records.
+    job_ids = list(job_ids)
+    for job_id in job_ids:
+        _export_remove(job_id)
+    if job_ids:
+        store = _export_jobs()
+        with store["lock"]:
+            for job_id in job_ids:
+                job = store["jobs"].get(job_id)
+                if job is not None and job["status"] == "done":
+                    store["jobs"].pop(job_id, None)
+
+def _export_touch(job_id: str):
+    try:
+        os.utime(_export_paths(job_id)[0])
+    except OSError:
+        pass
+
+def _export_evict(keep: str):
+    # Least recently used artifacts go first once the store is over budget;
+    # pinned ones stay even if that leaves it over budget for a while.
+    try:
+        d = _export_dir()
+        files = [(os.stat(os.path.join(d, f)), f[: -len(".bin")]) for f in os.listdir(d) if f.endswith(".bin")]
+    except OSError:
+        return
+    files.sort(key=lambda x: x[0].st_mtime)
+    total = sum(x[0].st_size for x in files)
+    pinned_since = time.time() - _export_pin_sec
+    evicted = []
+    for st_f, job_id in files:
+        if total <= _export_store_max_bytes or st_f.st_mtime >= pinned_since:
+            break
+        if job_id == keep:
+            continue
+        total -= st_f.st_size
+        evicted.append(job_id)
+    _export_forget(evicted)
+
+def _export_sweep():
+    # Drops failed jobs and artifacts unused for _export_ttl_sec; every hit
+    # touches the artifact, so its mtime is the last use.
+    store = _export_jobs()
+    now = time.time()
+    with store["lock"]:
+        if now - store["swept"] < _export_sweep_sec:
+            return
+        store["swept"] = now
+        failed = [
+            job_id for job_id, job in store["jobs"].items()
+            if job["status"] == "error" and now - job["finished"] > _export_ttl_sec
+        ]
+        for job_id in failed:
+            store["jobs"].pop(job_id, None)
+        busy = {job_id for job_id, job in store["jobs"].items() if job["status"] in ("queued", "running")}
+    stale = set()
+    try:
+        d = _export_dir()
+        for f in os.listdir(d):
+            path = os.path.join(d, f)
+            job_id = f.split(".", 1)[0]
+            if job_id in busy:
+                continue
+            if f.endswith(".json") and os.path.exists(os.path.join(d, f"{job_id}.bin")):
+                continue
+            if now - os.stat(path).st_mtime <= _export_ttl_sec:
+                continue
+            if f.endswith(".bin"):
+                stale.add(job_id)
+            else:
+                os.remove(path)
+    except OSError:
+        pass
+    _export_forget(stale)
+
+def _export_run(job_id: str, build, args: tuple, kwargs: dict, progress: bool):
+    store = _export_jobs()
+
+    def _tick(done: int, total: int):
+        with store["lock"]:
+            store["jobs"][job_id].update(done=int(done), total=int(total))
+
+    with store["lock"]:
+        job = store["jobs"][job_id]
+        job["status"] = "running"
+    bin_path, meta_path = _export_paths(job_id)
+    tmp_path = f"{bin_path}.{os.getpid()}.tmp"
+    try:
+        data = build(*args, progress=_tick, **kwargs) if progress else build(*args, **kwargs)
+        os.makedirs(_export_dir(), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, bin_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"name": job["name"], "mime": job["mime"], "size": len(data)}, f, ensure_ascii=False)
+        with store["lock"]:
+            job.update(status="done", size=len(data), finished=time.time())
+        _export_evict(keep=job_id)
+    except Exception as e:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+        with store["lock"]:
+            job.update(status="error", error=f"{type(e).__name__}: {e}", finished=time.time())
+
+def _export_submit(key, name: str, mime: str, build, args: tuple = (), kwargs: dict | None = None, progress: bool = False) -> str:
+    """Queue build(*args, **kwargs) -> bytes as the artifact for `key`.
+
+    A queued, running or finished job for the same key is reused; a failed one
+    is retried. `progress=True` passes a progress(done, total) callback.
+    """
+    _export_sweep()
+    store = _export_jobs()
+    job_id = _export_job_id(key)
+    with store["lock"]:
+        job = store["jobs"].get(job_id)
+        if job is not None and job["status"] in ("queued", "running"):
+            return job_id
+        if job is not None and job["status"] == "done" and os.path.exists(_export_paths(job_id)[0]):
+            return job_id
+        store["jobs"][job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "name": name,
+            "mime": mime,
+            "done": 0,
+            "total": 0,
+            "size": 0,
+            "error": "",
+            "created": time.time(),
+            "finished": 0.0,
+        }
+    store["pool"].submit(_export_run, job_id, build, tuple(args), dict(kwargs or {}), progress)
+    return job_id
+
+def _export_job(key) -> dict | None:
+    # Snapshot of the job for `key`, picking up artifacts a previous server
+    # process left on disk.
+    _export_sweep()
+    store = _export_jobs()
+    job_id = _export_job_id(key)
+    with store["lock"]:
+        job = store["jobs"].get(job_id)
+        if job is not None:
+            if job["status"] != "done":
+                return dict(job)
+            if os.path.exists(_export_paths(job_id)[0]):
+                job = dict(job)
+            else:
+                store["jobs"].pop(job_id, None)
+                job = None
+    if job is not None:
+        _export_touch(job_id)
+        return job
+    bin_path, meta_path = _export_paths(job_id)
+    try:
+        st_bin = os.stat(bin_path)
+        if time.time() - st_bin.st_mtime > _export_ttl_sec:
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    job = {
+        "id": job_id,
+        "status": "done",
+        "name": str(meta.get("name") or "export"),
+        "mime": str(meta.get("mime") or "application/octet-stream"),
+        "done": 0,
+        "total": 0,
+        "size": int(st_bin.st_size),
+        "error": "",
+        "created": st_bin.st_mtime,
+        "finished": st_bin.st_mtime,
+    }
+    with store["lock"]:
+        store["jobs"].setdefault(job_id, job)
+    return dict(job)
+
+def _export_read(job_id: str) -> bytes:
+    # Runs when the download is clicked. If the artifact is gone anyway (removed
+    # by hand or by another server process), forget the job so the next rerun
+    # offers "生成…" again, and fail with a message the user can act on.
+    _export_touch(job_id)
+    try:
+        with open(_export_paths(job_id)[0], "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        _export_forget([job_id])
+        raise FileNotFoundError("导出文件已失效，请重新生成") from None
+
+def _export_needed(key) -> bool:
+    # False when the export is already queued, running or on disk, so a
+    # "生成…" click skips preparing its frames again.
+    job = _export_job(key)
+    return job is None or job["status"] == "error"
+
+@st.fragment(run_every=_export_poll_sec)
+def _export_poll(key, text: str):
+    job = _export_job(key)
+    if job is None or job["status"] not in ("queued", "running"):
+        # Finished: redraw the page so the download button replaces the bar.
+        st.rerun()
+    if job["status"] == "queued":
+        st.progress(0.0, text=f"{text}（排队中）")
+    elif job["total"] > 0:
+        st.progress(job["done"] / job["total"], text=f"{text}（{job['done']}/{job['total']}）")
+    else:
+        st.progress(0.0, text=f"{text}…")
+
+def _export_download(key, label: str, dl_key: str, text: str = "正在生成"):
+    """Status of the export job for `key`: progress while it runs, the download once it is done."""
+    job = _export_job(key)
+    if job is None:
+        return
+    if job["status"] in ("queued", "running"):
+        _export_poll(key, text)
+    elif job["status"] == "error":
+        st.error(f"导出失败：{job['error']}")
+    else:
+        st.download_button(
+            label,
+            data=partial(_export_read, job["id"]),
+            file_name=job["name"],
+            mime=job["mime"],
+            key=dl_key,
+        )
+
 # -----------------------------------------------------------------------------
 # 4. Layout
 # -----------------------------------------------------------------------------
@@ -4089,16 +4940,14 @@ with st.expander("📥 数据导入", expanded=st.session_state.exp_upload):
     c_u1, c_u2 = st.columns([1, 3])
     with c_u1:
         if st.button("🔄 清缓存重解析", key="clear_cache_reparse_btn"):
+            _parsed_store_discard(st.session_state.get("_uploaded_sig"))
             for k in [
                 "main_uploader",
                 "_uploaded_bytes",
                 "_uploaded_sig",
                 "_uploaded_name",
                 "_active_file_sig",
-                "_parsed_cache",
                 "out_subtab_cache",
-                "out_m_excel_cache",
-                "out_m_zip_cache",
                 "out_m_month_cols",
                 "out_m_drill_level",
                 "out_m_selected_prov",
@@ -4143,32 +4992,31 @@ if uploaded_file:
         st.session_state["_active_file_sig"] = cached_sig
         st.session_state["run_analysis"] = False
         st.session_state.pop("out_subtab_cache", None)
-        st.session_state.pop("out_m_excel_cache", None)
-        st.session_state.pop("out_m_zip_cache", None)
-
-    parsed_cache = st.session_state.get("_parsed_cache", {})
-    if cached_sig in parsed_cache:
-        # Check cache format
-        cache_val = parsed_cache[cached_sig]
-        if len(cache_val) == 9:
-            df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs = cache_val
-        elif len(cache_val) == 8:
-            df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs = load_data_v3(cached_bytes, uploaded_name)
-            parsed_cache[cached_sig] = (df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs)
-            st.session_state["_parsed_cache"] = parsed_cache
-        else:
-            df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs = load_data_v3(cached_bytes, uploaded_name)
-            parsed_cache[cached_sig] = (df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs)
-            st.session_state["_parsed_cache"] = parsed_cache
-    else:
-        df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs = load_data_v3(cached_bytes, uploaded_name)
-        parsed_cache[cached_sig] = (df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs)
-        if len(parsed_cache) > 2:
-            for k in list(parsed_cache.keys())[:-2]:
-                parsed_cache.pop(k, None)
-        st.session_state["_parsed_cache"] = parsed_cache
+
+    # The shell (filters, store geo, category options) needs these sheets; the
+    # target and newcust sheets are parsed when a tab first asks for them.
+    df_raw, month_cols, df_stock_raw, df_q4_raw, df_perf_raw, df_target_raw, df_scan_raw, df_newcust_raw, debug_logs = _load_parsed_workbook(
+        cached_bytes, uploaded_name, cached_sig, ("sales", "stock", "outbound", "perf", "scan")
+    )
 
     df_perf_2025 = load_builtin_perf_2025()
+    df_scan_2025 = load_builtin_scan_2025()
+
+    # One category set per dimension across every frame, so the built-in
+    # concat below stays categorical and filters compare codes.
+    _dim_frames = [df_q4_raw, df_stock_raw, df_perf_raw, df_scan_raw, df_perf_2025, df_scan_2025]
+    _dims = _parsed_dims(cached_sig, _dim_frames)
+    for _df in _dim_frames:
+        _encode_dims(_df, _dims)
+
+    def _lazy_sheet(kind: str):
+        df = _load_parsed_workbook(cached_bytes, uploaded_name, cached_sig, (kind,))[_SHEET_SLOTS[kind]]
+        # A sheet with labels no other frame has grows the dictionary; rerun so
+        # every frame of this run is encoded against the grown one.
+        if _parsed_dims(cached_sig, [df]) is not _dims:
+            st.rerun()
+        return _encode_dims(df, _dims)
+
     if df_perf_2025 is not None and not df_perf_2025.empty:
         if df_perf_raw is None or getattr(df_perf_raw, "empty", True):
             df_perf_raw = df_perf_2025.copy()
@@ -4184,7 +5032,6 @@ if uploaded_file:
             if not bool((years == 2025).any()):
                 df_perf_raw = pd.concat([df_perf_2025, df_perf_raw], ignore_index=True, sort=False)
                 
-    df_scan_2025 = load_builtin_scan_2025()
     if df_scan_2025 is not None and not df_scan_2025.empty:
         if df_scan_raw is None or getattr(df_scan_raw, "empty", True):
             df_scan_raw = df_scan_2025.copy()
@@ -4200,6 +5047,11 @@ if uploaded_file:
             if not bool((years_s == 2025).any()):
                 df_scan_raw = pd.concat([df_scan_2025, df_scan_raw], ignore_index=True, sort=False)
 
+    # Tin scans rolled up per day/store/product once per upload; counts read this.
+    df_scan_daily = _scan_daily(df_scan_raw, cached_sig)
+    # Duplicate / cross-province / IP-burst index over 听码, 箱码 and IP地址.
+    scan_code_idx = _scan_code_index(df_scan_raw, cached_sig)
+
     if df_raw is None and debug_logs:
         st.error("数据加载失败。详细日志如下：")
         st.text("\n".join(debug_logs))
@@ -4216,15 +5068,6 @@ if uploaded_file:
         st.error("未找到包含「省区」「经销商名称」字段的数据表（第1个sheet已删除也可用其它sheet，但需包含这两列）。")
         st.stop()
     else:
-        nc_ok = df_newcust_raw is not None and not getattr(df_newcust_raw, "empty", True) and ("_ym" in df_newcust_raw.columns)
-        if nc_ok:
-            try:
-                _yms = sorted([int(x) for x in pd.to_numeric(df_newcust_raw["_ym"], errors="coerce").dropna().astype(int).unique().tolist() if 200001 <= int(x) <= 209912])
-            except Exception:
-                _yms = []
-            st.caption(f"新客表：已读取（行数={int(len(df_newcust_raw))}，月份={('、'.join([str(x) for x in _yms[:12]]) + ('…' if len(_yms) > 12 else '')) if _yms else '未识别到月份'}）")
-        else:
-            st.caption("新客表：未读取（请确认底表第8个sheet包含新客数据，并点「清缓存重解析」后重新上传）")
         def _col_series(_df: pd.DataFrame, _name: str) -> pd.Series:
             if _df is None or getattr(_df, "empty", True) or (_name not in _df.columns):
                 return pd.Series([], dtype=object)
@@ -4235,47 +5078,18 @@ if uploaded_file:
                 return pd.Series([""] * int(len(_df)), index=_df.index, dtype=object)
             return _v
 
-        store_geo_df = None
-        try:
-            if df_raw is not None and not getattr(df_raw, "empty", True) and int(df_raw.shape[1]) >= 9:
-                _store = df_raw.iloc[:, 8].fillna("").astype(str).str.strip()
-                _city = df_raw.iloc[:, 2].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 3 else pd.Series([""] * len(df_raw))
-                _dist = df_raw.iloc[:, 3].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 4 else pd.Series([""] * len(df_raw))
-                _status = df_raw.iloc[:, 17].fillna("").astype(str).str.strip() if int(df_raw.shape[1]) >= 18 else pd.Series([""] * len(df_raw))
-                _m0 = pd.DataFrame({"门店名称": _store, "市": _city, "区/县": _dist, "门店状态": _status})
-                _m0 = _m0[_m0["门店名称"].fillna("").astype(str).str.strip() != ""].copy()
-                if not _m0.empty:
-                    _m0["_k_store_geo"] = _m0["门店名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-
-                    def _first_non_empty(vs):
-                        for x in vs.tolist():
-                            s = str(x or "").strip()
-                            if s and s.lower() not in ("nan", "none", "null"):
-                                return s
-                        return ""
-
-                    store_geo_df = (
-                        _m0.groupby(["_k_store_geo"], as_index=False)
-                        .agg({"市": _first_non_empty, "区/县": _first_non_empty, "门店状态": _first_non_empty})
-                    )
-        except Exception:
-            store_geo_df = None
+        store_geo_df = _store_geo(df_raw, st.session_state.get("_active_file_sig"))
 
         # --- Filters Area ---
+        _filter_sig = st.session_state.get("_active_file_sig")
         with st.expander("🔎 筛选搜索", expanded=st.session_state.exp_filter):
             # Province Filter
-            _prov_s = _col_series(df_filter_src, "省区").dropna().astype(str).str.strip()
-            provinces = ["全部"] + sorted([x for x in _prov_s.unique().tolist() if x])
+            provinces = ["全部"] + _dim_options(filter_values(df_filter_src, _filter_sig, "main", "省区"))
             sel_prov = st.selectbox("选择省区 (Province)", provinces)
             
             # Distributor Filter
-            if sel_prov != '全部':
-                _m = _col_series(df_filter_src, "省区").fillna("").astype(str).str.strip() == str(sel_prov).strip()
-                _dist_s = _col_series(df_filter_src.loc[_m], "经销商名称").dropna().astype(str).str.strip()
-                dist_options = ["全部"] + sorted([x for x in _dist_s.unique().tolist() if x])
-            else:
-                _dist_s = _col_series(df_filter_src, "经销商名称").dropna().astype(str).str.strip()
-                dist_options = ["全部"] + sorted([x for x in _dist_s.unique().tolist() if x])
+            _prov_preds = [("省区", "dim", sel_prov)] if sel_prov != '全部' else []
+            dist_options = ["全部"] + _dim_options(filter_values(df_filter_src, _filter_sig, "main", "经销商名称", _prov_preds))
             sel_dist = st.selectbox("选择经销商 (Distributor)", dist_options)
 
             cat_set = set()
@@ -4287,18 +5101,17 @@ if uploaded_file:
                 (df_scan_raw, '产品大类'),
             ]:
                 if _df is not None and not getattr(_df, "empty", True) and _col in _df.columns:
-                    cat_set |= set(_df[_col].fillna('').astype(str).str.strip().tolist())
+                    cat_set |= set(_dim_options(_col_series(_df, _col)))
             cat_options = ['全部'] + sorted([x for x in cat_set if x])
             sel_cat = st.selectbox("选择产品大类 (Category)", cat_options, key="main_sel_cat")
         
         # Apply Filters
-        df = df_filter_src.copy()
+        _main_preds = []
         if sel_prov != '全部':
-            _m = _col_series(df, "省区").fillna("").astype(str).str.strip() == str(sel_prov).strip()
-            df = df.loc[_m].copy()
+            _main_preds.append(("省区", "dim", sel_prov))
         if sel_dist != '全部':
-            _m = _col_series(df, "经销商名称").fillna("").astype(str).str.strip() == str(sel_dist).strip()
-            df = df.loc[_m].copy()
+            _main_preds.append(("经销商名称", "dim", sel_dist))
+        df = filter_rows(df_filter_src, _filter_sig, "main", _main_preds).copy()
             
         if not st.session_state.get('run_analysis', False):
             st.markdown("### ✅ 数据已加载")
@@ -4328,6 +5141,7 @@ if uploaded_file:
             
             # === TAB 1: OVERVIEW ===
             if main_tab == "📊 核心概览":
+                df_target_raw = _lazy_sheet("target")
                 st.caption(f"筛选口径：省区={sel_prov}｜经销商={sel_dist}｜产品大类={st.session_state.get('main_sel_cat', '全部')}")
 
                 # --- Common Helpers for Tab 1 ---
@@ -4396,29 +5210,31 @@ if uploaded_file:
 
                 sel_bigcat = st.session_state.get("main_sel_cat", "全部")
 
-                def _filter_common(_df):
+                def _filter_common(_df, name: str):
                     if _df is None or getattr(_df, "empty", True):
                         return pd.DataFrame()
-                    d = _df.copy()
+                    # Narrow on dimension codes first, then normalize only the surviving rows.
+                    preds = []
+                    if sel_prov != '全部' and '省区' in _df.columns:
+                        preds.append(('省区', 'dim', sel_prov))
+                    if sel_dist != '全部' and '经销商名称' in _df.columns:
+                        preds.append(('经销商名称', 'dim', sel_dist))
+                    if sel_bigcat != '全部':
+                        if '产品大类' in _df.columns:
+                            preds.append(('产品大类', 'dim', sel_bigcat))
+                        elif '大分类' in _df.columns:
+                            preds.append(('大分类', 'dim', sel_bigcat))
+                    d = filter_rows(_df, _filter_sig, name, preds).copy()
                     for c in ['省区', '经销商名称', '产品大类', '大分类']:
                         if c in d.columns:
                             d[c] = d[c].fillna('').astype(str).str.strip()
-                    if sel_prov != '全部' and '省区' in d.columns:
-                        d = d[d['省区'] == sel_prov]
-                    if sel_dist != '全部' and '经销商名称' in d.columns:
-                        d = d[d['经销商名称'] == sel_dist]
-                    if sel_bigcat != '全部':
-                        if '产品大类' in d.columns:
-                            d = d[d['产品大类'] == sel_bigcat]
-                        elif '大分类' in d.columns:
-                            d = d[d['大分类'] == sel_bigcat]
                     return d
 
                 # ---------------------------------------------------------
                 # 1. 核心业绩指标 (From Tab 7)
                 # ---------------------------------------------------------
                 st.markdown("### 🚀 核心业绩指标")
-                df_perf = _filter_common(df_perf_raw)
+                df_perf = _filter_common(df_perf_raw, "perf")
                 if not df_perf.empty:
                     # Data Prep
                     if '年份' in df_perf.columns:
@@ -4480,7 +5296,7 @@ if uploaded_file:
                 # 2. 库存关键指标 (From Tab 6)
                 # ---------------------------------------------------------
                 st.markdown("### 📦 库存关键指标")
-                df_stock = _filter_common(df_stock_raw)
+                df_stock = _filter_common(df_stock_raw, "stock")
                 if not df_stock.empty:
                     # Prepare Data for Metrics
                     stock_box_col = '箱数' if '箱数' in df_stock.columns else next((c for c in df_stock.columns if '箱' in str(c)), None)
@@ -4530,7 +5346,7 @@ if uploaded_file:
                 # 3. 出库关键指标 (From Tab Out)
                 # ---------------------------------------------------------
                 st.markdown("### 🚚 出库关键指标")
-                df_out = _filter_common(df_q4_raw)
+                df_out = _filter_common(df_q4_raw, "outbound")
                 if not df_out.empty:
                     # Date Prep
                     tmp = df_out.copy()
@@ -4593,7 +5409,7 @@ if uploaded_file:
                 # 4. 扫码率概览 (From Tab Scan)
                 # ---------------------------------------------------------
                 st.markdown("### 📱 扫码率概览")
-                df_scan = _filter_common(df_scan_raw)
+                df_scan = _filter_common(df_scan_daily, "scan_daily")
                 # Re-use out_base from above or re-calc
                 if not df_scan.empty and not df_out.empty:
                     # Ensure Date Cols
@@ -4601,13 +5417,16 @@ if uploaded_file:
                         if c in df_scan.columns: df_scan[c] = pd.to_numeric(df_scan[c], errors='coerce').fillna(0).astype(int)
                     
                     # Use same oy, om, od from Outbound
-                    scan_today = len(df_scan[(df_scan['年份'] == oy) & (df_scan['月份'] == om) & (df_scan['日'] == od)]) / 6.0
-                    scan_month = len(df_scan[(df_scan['年份'] == oy) & (df_scan['月份'] == om)]) / 6.0
-                    scan_year = len(df_scan[df_scan['年份'] == oy]) / 6.0
+                    scan_roll = _period_rollup(df_scan, value='听数')
+                    def _scan_boxes(year, month=None, day=None):
+                        return float(_period_rows(scan_roll, year, month, day)['_n'].sum()) / 6.0
+                    scan_today = _scan_boxes(oy, om, od)
+                    scan_month = _scan_boxes(oy, om)
+                    scan_year = _scan_boxes(oy)
                     
-                    l_scan_today = len(df_scan[(df_scan['年份'] == ly) & (df_scan['月份'] == om) & (df_scan['日'] == od)]) / 6.0
-                    l_scan_month = len(df_scan[(df_scan['年份'] == ly) & (df_scan['月份'] == om)]) / 6.0
-                    l_scan_year = len(df_scan[df_scan['年份'] == ly]) / 6.0
+                    l_scan_today = _scan_boxes(ly, om, od)
+                    l_scan_month = _scan_boxes(ly, om)
+                    l_scan_year = _scan_boxes(ly)
 
                     rate_today = scan_today / today_boxes if today_boxes > 0 else 0
                     rate_month = scan_month / month_boxes if month_boxes > 0 else 0
@@ -4650,7 +5469,7 @@ if uploaded_file:
                     # 1. Date Calculation
                     # Today: Max date in max month of 2026
                     max_scan_date = None
-                    df_scan_2026 = df_scan_raw[df_scan_raw['年份'] == 2026]
+                    df_scan_2026 = df_scan_daily[df_scan_daily['年份'] == 2026]
                     if not df_scan_2026.empty:
                         max_month = df_scan_2026['月份'].max()
                         max_day = df_scan_2026[df_scan_2026['月份'] == max_month]['日'].max()
@@ -4669,28 +5488,42 @@ if uploaded_file:
                     with st.expander("🔎 扫码筛选", expanded=True):
                         c_s1, c_s2, c_s3 = st.columns(3)
                         # Province
-                        prov_opts_s = ['全部'] + sorted(df_scan_raw['省区'].unique().tolist())
+                        prov_opts_s = ['全部'] + sorted(filter_values(df_scan_raw, _filter_sig, "scan", '省区').tolist())
                         sel_prov_s = c_s1.selectbox("省区", prov_opts_s, key="scan_prov")
                         
                         # Distributor
-                        if sel_prov_s != '全部':
-                            dist_opts_s = ['全部'] + sorted(df_scan_raw[df_scan_raw['省区'] == sel_prov_s]['经销商名称'].unique().tolist())
-                        else:
-                            dist_opts_s = ['全部'] + sorted(df_scan_raw['经销商名称'].unique().tolist())
+                        _prov_preds_s = [('省区', 'eq', sel_prov_s)] if sel_prov_s != '全部' else []
+                        dist_opts_s = ['全部'] + sorted(filter_values(df_scan_raw, _filter_sig, "scan", '经销商名称', _prov_preds_s).tolist())
                         sel_dist_s = c_s2.selectbox("经销商", dist_opts_s, key="scan_dist")
                         
                         # Category
-                        cat_opts_s = ['全部'] + sorted(df_scan_raw['产品大类'].unique().tolist())
+                        cat_opts_s = ['全部'] + sorted(filter_values(df_scan_raw, _filter_sig, "scan", '产品大类').tolist())
                         sel_cat_s = c_s3.selectbox("产品大类", cat_opts_s, key="scan_cat")
 
                     # Apply Filters
-                    df_s_flt = df_scan_raw.copy()
+                    _scan_preds = []
+                    _out_preds = []
+                    _q4_cols = df_q4_raw.columns if df_q4_raw is not None else []
+                    if sel_prov_s != '全部':
+                        _scan_preds.append(('省区', 'eq', sel_prov_s))
+                        if '省区' in _q4_cols:
+                            _out_preds.append(('省区', 'strip', sel_prov_s))
+                    if sel_dist_s != '全部':
+                        _scan_preds.append(('经销商名称', 'eq', sel_dist_s))
+                        if '经销商名称' in _q4_cols:
+                            _out_preds.append(('经销商名称', 'strip', sel_dist_s))
+                    if sel_cat_s != '全部':
+                        _scan_preds.append(('产品大类', 'eq', sel_cat_s))
+                        if '产品大类' in _q4_cols:
+                            _out_preds.append(('产品大类', 'strip', sel_cat_s))
+                        elif '大分类' in _q4_cols:
+                            _out_preds.append(('大分类', 'strip', sel_cat_s))
+                    df_s_flt = filter_rows(df_scan_raw, _filter_sig, "scan", _scan_preds)
+                    df_s_daily = filter_rows(df_scan_daily, _filter_sig, "scan_daily", _scan_preds)
                     last_year = cur_year - 1
                     out_base_df = None
-                    out_day_df = None
-                    out_day_last_df = None
                     if df_q4_raw is not None and not getattr(df_q4_raw, "empty", True):
-                        tmp = df_q4_raw.copy()
+                        tmp = filter_rows(df_q4_raw, _filter_sig, "outbound", _out_preds).copy()
                         for c in ['年份', '月份']:
                             if c in tmp.columns:
                                 tmp[c] = pd.to_numeric(tmp[c], errors='coerce').fillna(0).astype(int)
@@ -4715,64 +5548,40 @@ if uploaded_file:
                                     if c in out_base_df.columns:
                                         out_base_df[c] = out_base_df[c].fillna('').astype(str).str.strip()
 
-                    if sel_prov_s != '全部':
-                        df_s_flt = df_s_flt[df_s_flt['省区'] == sel_prov_s]
-                        if out_base_df is not None and '省区' in out_base_df.columns:
-                            out_base_df = out_base_df[out_base_df['省区'] == sel_prov_s]
-                    if sel_dist_s != '全部':
-                        df_s_flt = df_s_flt[df_s_flt['经销商名称'] == sel_dist_s]
-                        if out_base_df is not None and '经销商名称' in out_base_df.columns:
-                            out_base_df = out_base_df[out_base_df['经销商名称'] == sel_dist_s]
-                    if sel_cat_s != '全部':
-                        df_s_flt = df_s_flt[df_s_flt['产品大类'] == sel_cat_s]
-                        if out_base_df is not None:
-                            if '产品大类' in out_base_df.columns:
-                                out_base_df = out_base_df[out_base_df['产品大类'] == sel_cat_s]
-                            elif '大分类' in out_base_df.columns:
-                                out_base_df = out_base_df[out_base_df['大分类'] == sel_cat_s]
-
-                    if out_base_df is not None:
-                        out_day_df = out_base_df[(out_base_df['年份'] == cur_year) & (out_base_df['月份'] == cur_month) & (out_base_df['日'] == cur_day)].copy()
-                        out_day_last_df = out_base_df[(out_base_df['年份'] == last_year) & (out_base_df['月份'] == cur_month) & (out_base_df['日'] == cur_day)].copy()
-
                     # 3. Calculate Metrics (Scan vs Outbound)
                     # Unit: Box (6 tins = 1 box)
                     # Scan Count (Rows) / 6
-                    
+                    # One pass per filter state over the daily rollup: tins per (年, 月, 日, 省区, 产品大类) and
+                    # outbound boxes per (年, 月, 日, 省区, 大类); tiles and tables slice these.
+                    scan_ymd = _period_rollup(df_s_daily, by=['省区', '产品大类'], value='听数')
+                    out_cat_col = None
+                    out_ymd = None
+                    if out_base_df is not None:
+                        out_cat_col = '产品大类' if '产品大类' in out_base_df.columns else ('大分类' if '大分类' in out_base_df.columns else None)
+                        out_ymd = _period_rollup(out_base_df, by=['省区'] + ([out_cat_col] if out_cat_col else []), value='数量(箱)')
+
+                    def _scan_boxes(year, month=None, day=None):
+                        return float(_period_rows(scan_ymd, year, month, day)['_n'].sum()) / 6.0
+
+                    def _out_boxes(year, month=None, day=None):
+                        return float(_period_rows(out_ymd, year, month, day)['_n'].sum()) if out_ymd is not None else 0.0
+
                     # --- Current Period (2026) ---
-                    # Day
-                    scan_day = len(df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month) & (df_s_flt['日'] == cur_day)]) / 6.0
-                    out_day = 0
-                    if out_day_df is not None:
-                        qty_col_out = '数量(箱)' if '数量(箱)' in out_day_df.columns else next((c for c in out_day_df.columns if '数量' in str(c) or '箱' in str(c)), None)
-                        if qty_col_out:
-                            out_day = float(pd.to_numeric(out_day_df[qty_col_out], errors='coerce').fillna(0).sum())
-                    out_day_last = 0
-                    if out_day_last_df is not None:
-                        qty_col_out = '数量(箱)' if '数量(箱)' in out_day_last_df.columns else next((c for c in out_day_last_df.columns if '数量' in str(c) or '箱' in str(c)), None)
-                        if qty_col_out:
-                            out_day_last = float(pd.to_numeric(out_day_last_df[qty_col_out], errors='coerce').fillna(0).sum())
-                    
-                    # Month
-                    scan_month = len(df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month)]) / 6.0
-                    out_month = float(pd.to_numeric(out_base_df[(out_base_df['年份'] == cur_year) & (out_base_df['月份'] == cur_month)]['数量(箱)'], errors='coerce').fillna(0).sum()) if out_base_df is not None else 0.0
-                    
-                    # Year
-                    scan_year = len(df_s_flt[df_s_flt['年份'] == cur_year]) / 6.0
-                    out_year = float(pd.to_numeric(out_base_df[out_base_df['年份'] == cur_year]['数量(箱)'], errors='coerce').fillna(0).sum()) if out_base_df is not None else 0.0
+                    scan_day = _scan_boxes(cur_year, cur_month, cur_day)
+                    out_day = _out_boxes(cur_year, cur_month, cur_day)
+                    scan_month = _scan_boxes(cur_year, cur_month)
+                    out_month = _out_boxes(cur_year, cur_month)
+                    scan_year = _scan_boxes(cur_year)
+                    out_year = _out_boxes(cur_year)
 
                     # --- Same Period Last Year (2025) ---
-                    scan_day_last = len(df_s_flt[(df_s_flt['年份'] == last_year) & (df_s_flt['月份'] == cur_month) & (df_s_flt['日'] == cur_day)]) / 6.0
-                    
-                    # Month
-                    scan_month_last = len(df_s_flt[(df_s_flt['年份'] == last_year) & (df_s_flt['月份'] == cur_month)]) / 6.0
-                    out_month_last = float(pd.to_numeric(out_base_df[(out_base_df['年份'] == last_year) & (out_base_df['月份'] == cur_month)]['数量(箱)'], errors='coerce').fillna(0).sum()) if out_base_df is not None else 0.0
-                    
-                    # Year (YTD? or Full Year? Usually YTD for comparison or Full Year 2025)
-                    # "同期" usually means same period. For Year, it means 2025 Full Year or YTD.
-                    # Let's use Full Year 2025 for now as 2026 is incomplete.
-                    scan_year_last = len(df_s_flt[df_s_flt['年份'] == last_year]) / 6.0
-                    out_year_last = float(pd.to_numeric(out_base_df[out_base_df['年份'] == last_year]['数量(箱)'], errors='coerce').fillna(0).sum()) if out_base_df is not None else 0.0
+                    # Year uses full-year 2025, as 2026 is incomplete.
+                    scan_day_last = _scan_boxes(last_year, cur_month, cur_day)
+                    out_day_last = _out_boxes(last_year, cur_month, cur_day)
+                    scan_month_last = _scan_boxes(last_year, cur_month)
+                    out_month_last = _out_boxes(last_year, cur_month)
+                    scan_year_last = _scan_boxes(last_year)
+                    out_year_last = _out_boxes(last_year)
 
                     # Rates
                     rate_month = (scan_month / out_month) if out_month > 0 else 0
@@ -4782,7 +5591,7 @@ if uploaded_file:
                     rate_day = (scan_day / out_day) if out_day > 0 else 0
                     rate_day_last = (scan_day_last / out_day_last) if out_day_last > 0 else 0
 
-                    tab_overview, tab_s_cat, tab_s_prov, tab_s_map = st.tabs(["📊 扫码率概览", "🧩 分品类扫码率", "🗺️ 省区扫码率", "🧭 地图热力"])
+                    tab_overview, tab_s_cat, tab_s_prov, tab_s_map, tab_s_anom = st.tabs(["📊 扫码率概览", "🧩 分品类扫码率", "🗺️ 省区扫码率", "🧭 地图热力", "🚨 异常扫码"])
 
                     with tab_overview:
                         st.caption(f"口径：今日 {cur_year}年{cur_month}月{cur_day}日｜本月 {cur_month}月｜本年 {cur_year}年")
@@ -4856,41 +5665,27 @@ if uploaded_file:
                         # Group by Big Category
                         
                         # --- Day Level (Sync) ---
-                        s_cat_day = df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month) & (df_s_flt['日'] == cur_day)].groupby('产品大类').size().reset_index(name='本日扫码听数')
+                        s_cat_day = _period_by(_period_rows(scan_ymd, cur_year, cur_month, cur_day), '产品大类', '本日扫码听数')
                         s_cat_day['本日扫码(箱)'] = s_cat_day['本日扫码听数'] / 6.0
                         o_cat_day = None
-                        if out_day_df is not None:
-                            if '产品大类' in out_day_df.columns:
-                                group_col = '产品大类'
-                            elif '大分类' in out_day_df.columns:
-                                group_col = '大分类'
-                            else:
-                                group_col = None
-                            qty_col_out = '数量(箱)' if '数量(箱)' in (out_day_df.columns if out_day_df is not None else []) else next((c for c in out_day_df.columns if '数量' in str(c) or '箱' in str(c)), None) if out_day_df is not None else None
-                            if group_col and qty_col_out:
-                                o_cat_day = out_day_df.groupby(group_col)[qty_col_out].sum().reset_index().rename(columns={group_col: '产品大类', qty_col_out: '今日出库(箱)'})
+                        if out_ymd is not None and out_cat_col:
+                            o_cat_day = _period_by(_period_rows(out_ymd, cur_year, cur_month, cur_day), out_cat_col, '今日出库(箱)').rename(columns={out_cat_col: '产品大类'})
                         
                         # --- Month Level (Sync) ---
-                        s_cat_month = df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month)].groupby('产品大类').size().reset_index(name='本月扫码听数')
+                        s_cat_month = _period_by(_period_rows(scan_ymd, cur_year, cur_month), '产品大类', '本月扫码听数')
                         s_cat_month['本月扫码(箱)'] = s_cat_month['本月扫码听数'] / 6.0
                         
                         o_cat_month = pd.DataFrame(columns=['产品大类', '本月出库(箱)'])
-                        if out_base_df is not None:
-                            group_col_m = '产品大类' if '产品大类' in out_base_df.columns else ('大分类' if '大分类' in out_base_df.columns else None)
-                            if group_col_m:
-                                o_cat_month = out_base_df[(out_base_df['年份'] == cur_year) & (out_base_df['月份'] == cur_month)].groupby(group_col_m)['数量(箱)'].sum().reset_index()
-                                o_cat_month = o_cat_month.rename(columns={group_col_m: '产品大类', '数量(箱)': '本月出库(箱)'})
+                        if out_ymd is not None and out_cat_col:
+                            o_cat_month = _period_by(_period_rows(out_ymd, cur_year, cur_month), out_cat_col, '本月出库(箱)').rename(columns={out_cat_col: '产品大类'})
 
                         # --- Year Level (Sync) ---
-                        s_cat_year = df_s_flt[df_s_flt['年份'] == cur_year].groupby('产品大类').size().reset_index(name='本年扫码听数')
+                        s_cat_year = _period_by(_period_rows(scan_ymd, cur_year), '产品大类', '本年扫码听数')
                         s_cat_year['本年扫码(箱)'] = s_cat_year['本年扫码听数'] / 6.0
                         
                         o_cat_year = pd.DataFrame(columns=['产品大类', '本年出库(箱)'])
-                        if out_base_df is not None:
-                            group_col_y = '产品大类' if '产品大类' in out_base_df.columns else ('大分类' if '大分类' in out_base_df.columns else None)
-                            if group_col_y:
-                                o_cat_year = out_base_df[out_base_df['年份'] == cur_year].groupby(group_col_y)['数量(箱)'].sum().reset_index()
-                                o_cat_year = o_cat_year.rename(columns={group_col_y: '产品大类', '数量(箱)': '本年出库(箱)'})
+                        if out_ymd is not None and out_cat_col:
+                            o_cat_year = _period_by(_period_rows(out_ymd, cur_year), out_cat_col, '本年出库(箱)').rename(columns={out_cat_col: '产品大类'})
                             
                         # Merge All
                         cat_final = pd.merge(s_cat_day[['产品大类', '本日扫码(箱)']], s_cat_month[['产品大类', '本月扫码(箱)']], on='产品大类', how='outer')
@@ -4945,29 +5740,29 @@ if uploaded_file:
                     # --- Sub-Tab 2: Province ---
                     with tab_s_prov:
                         # --- Day Level ---
-                        s_prov_day = df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month) & (df_s_flt['日'] == cur_day)].groupby('省区').size().reset_index(name='本日扫码听数')
+                        s_prov_day = _period_by(_period_rows(scan_ymd, cur_year, cur_month, cur_day), '省区', '本日扫码听数')
                         s_prov_day['本日扫码(箱)'] = s_prov_day['本日扫码听数'] / 6.0
                         o_prov_day = None
-                        if out_day_df is not None:
-                            o_prov_day = out_day_df.groupby('省区')['数量(箱)'].sum().reset_index().rename(columns={'数量(箱)': '今日出库(箱)'})
+                        if out_ymd is not None:
+                            o_prov_day = _period_by(_period_rows(out_ymd, cur_year, cur_month, cur_day), '省区', '今日出库(箱)')
 
                         # --- Month Level (Current) ---
-                        s_prov_cur = df_s_flt[(df_s_flt['年份'] == cur_year) & (df_s_flt['月份'] == cur_month)].groupby('省区').size().reset_index(name='扫码听数')
+                        s_prov_cur = _period_by(_period_rows(scan_ymd, cur_year, cur_month), '省区', '扫码听数')
                         s_prov_cur['扫码箱数'] = s_prov_cur['扫码听数'] / 6.0
                         o_prov_cur = pd.DataFrame(columns=['省区', '本月出库(箱)'])
-                        if out_base_df is not None:
-                            o_prov_cur = out_base_df[(out_base_df['年份'] == cur_year) & (out_base_df['月份'] == cur_month)].groupby('省区')['数量(箱)'].sum().reset_index().rename(columns={'数量(箱)': '本月出库(箱)'})
+                        if out_ymd is not None:
+                            o_prov_cur = _period_by(_period_rows(out_ymd, cur_year, cur_month), '省区', '本月出库(箱)')
                         prov_cur = pd.merge(s_prov_cur[['省区', '扫码箱数']], o_prov_cur, on='省区', how='outer').fillna(0)
                         prov_cur['本月扫码(箱)'] = prov_cur['扫码箱数']
                         prov_cur['本月扫码率'] = prov_cur.apply(lambda x: x['本月扫码(箱)'] / x['本月出库(箱)'] if x['本月出库(箱)'] > 0 else 0, axis=1)
                         prov_cur = prov_cur[['省区', '本月出库(箱)', '本月扫码(箱)', '本月扫码率']]
 
                         # --- Same Period Last Year (Month) ---
-                        s_prov_last = df_s_flt[(df_s_flt['年份'] == last_year) & (df_s_flt['月份'] == cur_month)].groupby('省区').size().reset_index(name='扫码听数')
+                        s_prov_last = _period_by(_period_rows(scan_ymd, last_year, cur_month), '省区', '扫码听数')
                         s_prov_last['扫码箱数'] = s_prov_last['扫码听数'] / 6.0
                         o_prov_last = pd.DataFrame(columns=['省区', '同期出库(箱)'])
-                        if out_base_df is not None:
-                            o_prov_last = out_base_df[(out_base_df['年份'] == last_year) & (out_base_df['月份'] == cur_month)].groupby('省区')['数量(箱)'].sum().reset_index().rename(columns={'数量(箱)': '同期出库(箱)'})
+                        if out_ymd is not None:
+                            o_prov_last = _period_by(_period_rows(out_ymd, last_year, cur_month), '省区', '同期出库(箱)')
                         prov_last = pd.merge(s_prov_last[['省区', '扫码箱数']], o_prov_last, on='省区', how='outer').fillna(0)
                         prov_last['同期扫码(箱)'] = prov_last['扫码箱数']
                         prov_last['同期扫码率'] = prov_last.apply(lambda x: x['同期扫码(箱)'] / x['同期出库(箱)'] if x['同期出库(箱)'] > 0 else 0, axis=1)
@@ -4981,11 +5776,11 @@ if uploaded_file:
                             ring_year = cur_year
                             ring_month = cur_month - 1
 
-                        s_prov_ring = df_s_flt[(df_s_flt['年份'] == ring_year) & (df_s_flt['月份'] == ring_month)].groupby('省区').size().reset_index(name='扫码听数')
+                        s_prov_ring = _period_by(_period_rows(scan_ymd, ring_year, ring_month), '省区', '扫码听数')
                         s_prov_ring['扫码箱数'] = s_prov_ring['扫码听数'] / 6.0
                         o_prov_ring = pd.DataFrame(columns=['省区', '环比出库(箱)'])
-                        if out_base_df is not None:
-                            o_prov_ring = out_base_df[(out_base_df['年份'] == ring_year) & (out_base_df['月份'] == ring_month)].groupby('省区')['数量(箱)'].sum().reset_index().rename(columns={'数量(箱)': '环比出库(箱)'})
+                        if out_ymd is not None:
+                            o_prov_ring = _period_by(_period_rows(out_ymd, ring_year, ring_month), '省区', '环比出库(箱)')
                         prov_ring = pd.merge(s_prov_ring[['省区', '扫码箱数']], o_prov_ring, on='省区', how='outer').fillna(0)
                         prov_ring['环比扫码(箱)'] = prov_ring['扫码箱数']
                         prov_ring['环比扫码率'] = prov_ring.apply(lambda x: x['环比扫码(箱)'] / x['环比出库(箱)'] if x['环比出库(箱)'] > 0 else 0, axis=1)
@@ -5060,25 +5855,22 @@ if uploaded_file:
                                 st.session_state[show_cb_key] = not bool(st.session_state[show_cb_key])
                                 st.rerun()
 
-                            df_map = df_s_flt.copy()
-                            if period_mode == "今日":
-                                df_map = df_map[(df_map["年份"] == cur_year) & (df_map["月份"] == cur_month) & (df_map["日"] == cur_day)]
-                            elif period_mode == "本月":
-                                df_map = df_map[(df_map["年份"] == cur_year) & (df_map["月份"] == cur_month)]
-                            else:
-                                df_map = df_map[df_map["年份"] == cur_year]
-
-                            if focus_prov != "全国":
-                                df_map = df_map[df_map["省区"] == focus_prov]
-
-                            df_map = df_map.dropna(subset=["经度", "纬度"])
-                            df_map = df_map[df_map["经度"].between(70, 140) & df_map["纬度"].between(0, 60)]
+                            map_period = {
+                                "今日": (cur_year, cur_month, cur_day),
+                                "本月": (cur_year, cur_month, None),
+                            }.get(period_mode, (cur_year, None, None))
+                            map_prov = focus_prov if focus_prov != "全国" else None
+                            map_layers = _scan_grids(
+                                df_s_flt,
+                                (_filter_sig, tuple(_scan_preds), map_period, map_prov),
+                                *map_period,
+                                prov=map_prov,
+                            )
 
-                            if df_map.empty:
+                            if map_layers["n"] == 0:
                                 st.info("当前筛选与口径下没有可用的经纬度数据。")
                             else:
-                                center_lat = float(df_map["纬度"].mean())
-                                center_lon = float(df_map["经度"].mean())
+                                center_lat, center_lon = map_layers["center"]
                                 default_zoom = 3.1 if focus_prov == "全国" else 4.9
                                 min_zoom, max_zoom = 2.2, 10.5
 
@@ -5131,11 +5923,7 @@ if uploaded_file:
                                     unit_mode = c_u1.radio("单位", ["听", "箱"], horizontal=True, key="scan_map_unit")
                                     render_mode = c_u2.radio("渲染方式", ["热力", "标点"], horizontal=True, key="scan_map_render_mode")
                                     precision = st.slider("坐标聚合精度(小数位)", 0, 3, 2, key="scan_map_precision")
-                                    df_grid = df_map[["经度", "纬度"]].copy()
-                                    df_grid["经度"] = df_grid["经度"].round(int(precision))
-                                    df_grid["纬度"] = df_grid["纬度"].round(int(precision))
-                                    df_grid = df_grid.groupby(["经度", "纬度"]).size().reset_index(name="扫码听数")
-                                    df_grid["扫码箱数"] = df_grid["扫码听数"] / 6.0
+                                    df_grid = map_layers["grids"][int(precision)]
                                     val_col = "扫码听数" if unit_mode == "听" else "扫码箱数"
 
                                     if render_mode == "热力":
@@ -5152,8 +5940,13 @@ if uploaded_file:
                                         )
                                         fig.update_traces(opacity=0.82)
                                     else:
+                                        df_pts = df_grid
+                                        if st.checkbox("按缩放抽稀标点", value=True, key="scan_map_lod"):
+                                            df_pts = scan_lod_grid(map_layers, int(precision), float(st.session_state[zoom_key]), val_col)
+                                            if len(df_pts) < len(df_grid):
+                                                st.caption(f"当前缩放显示 {len(df_pts):,} / {len(df_grid):,} 个点位，放大后显示更多细节。")
                                         fig = px.scatter_mapbox(
-                                            df_grid,
+                                            df_pts,
                                             lat="纬度",
                                             lon="经度",
                                             color=val_col,
@@ -5198,25 +5991,18 @@ if uploaded_file:
                                     )
                                 else:
                                     render_mode_rate = st.radio("渲染方式", ["热力", "标点"], horizontal=True, key="scan_map_render_mode_rate")
-                                    scan_by_prov = df_map.groupby("省区").size().reset_index(name="扫码听数")
+                                    scan_by_prov = map_layers["by_prov"].copy()
                                     scan_by_prov["扫码箱数"] = scan_by_prov["扫码听数"] / 6.0
-                                    cent = df_map.groupby("省区")[["经度", "纬度"]].mean().reset_index()
-                                    prov_map = pd.merge(scan_by_prov, cent, on="省区", how="left")
+                                    prov_map = pd.merge(scan_by_prov, _scan_centroids(df_scan_raw, _filter_sig), on="省区", how="left")
                                     prov_map["出库(箱)"] = 0.0
 
-                                    if out_base_df is not None and not getattr(out_base_df, "empty", True) and ("省区" in out_base_df.columns) and ("数量(箱)" in out_base_df.columns):
-                                        out_map = out_base_df.copy()
-                                        if period_mode == "今日":
-                                            out_map = out_map[(out_map["年份"] == cur_year) & (out_map["月份"] == cur_month) & (out_map["日"] == cur_day)]
-                                        elif period_mode == "本月":
-                                            out_map = out_map[(out_map["年份"] == cur_year) & (out_map["月份"] == cur_month)]
-                                        else:
-                                            out_map = out_map[out_map["年份"] == cur_year]
-                                        out_prov = out_map.groupby("省区")["数量(箱)"].sum().reset_index().rename(columns={"数量(箱)": "出库(箱)"})
-                                        prov_map = pd.merge(prov_map.drop(columns=["出库(箱)"], errors="ignore"), out_prov, on="省区", how="left")
-                                        prov_map["出库(箱)"] = pd.to_numeric(prov_map.get("出库(箱)"), errors="coerce").fillna(0.0)
+                                    if out_ymd is not None and not out_base_df.empty and ("省区" in out_base_df.columns):
+                                        out_prov = _period_by(_period_rows(out_ymd, *map_period), "省区", "出库(箱)")
+                                        prov_map = pd.merge(prov_map.drop(columns=["出库(箱)"]), out_prov, on="省区", how="left")
+                                        prov_map["出库(箱)"] = pd.to_numeric(prov_map["出库(箱)"], errors="coerce").fillna(0.0)
 
-                                    prov_map["扫码率"] = prov_map.apply(lambda x: x["扫码箱数"] / x["出库(箱)"] if x["出库(箱)"] > 0 else None, axis=1)
+                                    _out_box = prov_map["出库(箱)"]
+                                    prov_map["扫码率"] = (prov_map["扫码箱数"] / _out_box.where(_out_box > 0)).astype(float)
                                     prov_map = prov_map.dropna(subset=["经度", "纬度"])
 
                                     if render_mode_rate == "热力":
@@ -5278,6 +6064,45 @@ if uploaded_file:
                                         config={"scrollZoom": True, "displayModeBar": True, "displaylogo": False, "responsive": True}
                                     )
 
+                    with tab_s_anom:
+                        if scan_code_idx is None:
+                            st.info("扫码数据中未检测到听码/箱码列，无法进行重复与异常识别。")
+                        else:
+                            anom_sum = scan_code_idx["summary"]
+                            a1, a2, a3, a4 = st.columns(4)
+                            a1.metric("重复听码", f"{anom_sum['重复听码']:,} 个")
+                            a2.metric("跨省听码", f"{anom_sum['跨省听码']:,} 个")
+                            a3.metric("跨省箱码", f"{anom_sum['跨省箱码']:,} 个")
+                            a4.metric("IP突增(IP·日)", f"{anom_sum['IP突增']:,} 次")
+                            st.caption(f"口径：全量扫码数据；同一听码扫码多次为重复，同一听码/箱码出现在多个省区为跨省，同一IP单日扫码≥{SCAN_IP_BURST}次为突增。明细随上方筛选。")
+
+                            anom_type = st.radio("异常类型", ["全部", "重复听码", "跨省听码", "跨省箱码", "IP突增"], horizontal=True, key="scan_anom_type")
+                            anom_flags = scan_code_idx["flags"]
+                            anom_flags = anom_flags[anom_flags.index.isin(df_s_flt.index)]
+                            anom_mask = {
+                                "重复听码": anom_flags["听码次数"] > 1,
+                                "跨省听码": anom_flags["听码省区数"] > 1,
+                                "跨省箱码": anom_flags["箱码省区数"] > 1,
+                                "IP突增": anom_flags["IP当日扫码"] >= SCAN_IP_BURST,
+                            }.get(anom_type)
+                            if anom_mask is not None:
+                                anom_flags = anom_flags[anom_mask]
+
+                            anom_code = st.text_input("按听码/箱码查询", key="scan_anom_code").strip()
+                            if anom_code:
+                                anom_pos = np.union1d(scan_code_rows(scan_code_idx, "tin", anom_code), scan_code_rows(scan_code_idx, "box", anom_code))
+                                anom_rows = df_scan_raw.iloc[anom_pos]
+                                st.caption(f"查询结果：{len(anom_rows):,} 条扫码记录")
+                            else:
+                                anom_rows = df_scan_raw.loc[anom_flags.index]
+
+                            anom_cols = [c for c in ["年份", "月份", "日", "省区", "经销商名称", "门店名称", "产品小类", "听码", "箱码", "IP地址"] if c in anom_rows.columns]
+                            anom_disp = anom_rows[anom_cols].join(scan_code_idx["flags"], how="left")
+                            anom_disp = anom_disp.sort_values(["年份", "月份", "日"], ascending=False).head(2000).reset_index(drop=True)
+                            if len(anom_rows) > 2000:
+                                st.caption(f"共 {len(anom_rows):,} 条，仅显示最近 2,000 条。")
+                            show_aggrid_table(anom_disp, key="scan_anom_ag")
+
                 else:
                     st.info("请在Excel中包含第6个Sheet（扫码数据）以查看此分析。")
 
@@ -5486,10 +6311,11 @@ if uploaded_file:
                             s_spec = st.multiselect("具体分类 (支持多选)", stock_specs, default=[], placeholder="选择具体分类...", on_change=reset_inv_drill)
                         
                         # Apply Filters
-                        df_s_filtered = df_stock_raw.copy()
-                        if s_prov != '全部': df_s_filtered = df_s_filtered[df_s_filtered['省区名称'] == s_prov]
-                        if s_dist != '全部': df_s_filtered = df_s_filtered[df_s_filtered['经销商名称'] == s_dist]
-                        if s_cat != '全部': df_s_filtered = df_s_filtered[df_s_filtered['产品大类'] == s_cat]
+                        _stock_preds = []
+                        if s_prov != '全部': _stock_preds.append(('省区名称', 'eq', s_prov))
+                        if s_dist != '全部': _stock_preds.append(('经销商名称', 'eq', s_dist))
+                        if s_cat != '全部': _stock_preds.append(('产品大类', 'eq', s_cat))
+                        df_s_filtered = filter_rows(df_stock_raw, _filter_sig, "stock", _stock_preds).copy()
                         
                         # --- Subcategory Filter Logic ---
                         if s_sub_selected and ('全部' not in s_sub_selected):
@@ -5522,10 +6348,6 @@ if uploaded_file:
                     st.markdown("### 导出库存（按省区ZIP）")
                     st.caption("导出范围：全部经销商；按省区拆分，每省一个Excel；表内按经销商与产品信息排序。产品筛选沿用当前选择。")
 
-                    if "stock_zip_cache" not in st.session_state:
-                        st.session_state.stock_zip_cache = {}
-                    _stock_zip_cache = st.session_state.stock_zip_cache
-
                     _stock_sig_n = int(df_stock_raw.shape[0]) if df_stock_raw is not None else 0
                     _stock_sig_sum = 0.0
                     try:
@@ -5541,7 +6363,7 @@ if uploaded_file:
 
                     c_z1, c_z2, c_a1, c_a2, _ = st.columns([1.8, 2.2, 1.8, 2.2, 3.0])
                     with c_z1:
-                        if st.button("生成各省区库存ZIP", key="stock_zip_gen"):
+                        if st.button("生成各省区库存ZIP", key="stock_zip_gen") and _export_needed(k_stock_zip):
                             with st.spinner("正在生成各省区库存ZIP，请稍候…"):
                                 df_all = df_stock_raw.copy()
                                 if s_cat != "全部" and "产品大类" in df_all.columns:
@@ -5607,66 +6429,63 @@ if uploaded_file:
                                     filter_parts.append(f"具体分类={','.join([str(x) for x in s_spec])}")
                                 filter_line = "筛选：" + ("；".join(filter_parts) if filter_parts else "无")
 
-                                buf = io.BytesIO()
-                                with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                    provs = []
-                                    if prov_col is not None:
-                                        provs = (
-                                            df_all[prov_col]
-                                            .dropna()
-                                            .astype(str)
-                                            .str.strip()
-                                            .tolist()
-                                        )
-                                    provs = sorted([p for p in set(provs) if p and p.lower() not in ("nan", "none", "null")])
-                                    for p in provs:
-                                        if prov_col is None:
-                                            continue
-                                        df_p = df_all[df_all[prov_col].astype(str).str.strip() == str(p).strip()].copy()
-                                        if df_p.empty:
-                                            continue
-                                        sort_cols = [c for c in ["经销商名称", "产品大类", "产品小类", "产品名称", "产品编码", "批次号"] if c in df_p.columns]
-                                        if sort_cols:
-                                            df_p = df_p.sort_values(sort_cols, kind="stable").reset_index(drop=True)
-
-                                        title_lines_p = [
-                                            "库存明细 - 经销商库存",
-                                            f"省区：{p}",
-                                            filter_line,
-                                            f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                        ]
-                                        number_headers_p = set([c for c in ["库存数量(听/盒)", "箱数"] if c in df_p.columns])
-                                        number_formats_p = {}
-                                        if "库存数量(听/盒)" in df_p.columns:
-                                            number_formats_p["库存数量(听/盒)"] = "0"
-                                        if "箱数" in df_p.columns:
-                                            number_formats_p["箱数"] = "0.0"
-
-                                        xls_p = _df_to_excel_bytes(
-                                            df_p,
+                                zip_members = []
+                                provs = []
+                                if prov_col is not None:
+                                    provs = (
+                                        df_all[prov_col]
+                                        .dropna()
+                                        .astype(str)
+                                        .str.strip()
+                                        .tolist()
+                                    )
+                                provs = sorted([p for p in set(provs) if p and p.lower() not in ("nan", "none", "null")])
+                                for p in provs:
+                                    if prov_col is None:
+                                        continue
+                                    df_p = df_all[df_all[prov_col].astype(str).str.strip() == str(p).strip()].copy()
+                                    if df_p.empty:
+                                        continue
+                                    sort_cols = [c for c in ["经销商名称", "产品大类", "产品小类", "产品名称", "产品编码", "批次号"] if c in df_p.columns]
+                                    if sort_cols:
+                                        df_p = df_p.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+                                    title_lines_p = [
+                                        "库存明细 - 经销商库存",
+                                        f"省区：{p}",
+                                        filter_line,
+                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                    ]
+                                    number_headers_p = set([c for c in ["库存数量(听/盒)", "箱数"] if c in df_p.columns])
+                                    number_formats_p = {}
+                                    if "库存数量(听/盒)" in df_p.columns:
+                                        number_formats_p["库存数量(听/盒)"] = "0"
+                                    if "箱数" in df_p.columns:
+                                        number_formats_p["箱数"] = "0.0"
+
+                                    zip_members.append((
+                                        f"{sanitize_filename(p)}.xlsx",
+                                        df_p,
+                                        dict(
                                             sheet_name="库存明细",
                                             title_lines=title_lines_p,
                                             number_headers=number_headers_p,
                                             number_formats=number_formats_p,
                                             group_headers=False,
-                                        )
-                                        zf.writestr(f"{sanitize_filename(p)}.xlsx", xls_p)
-                                buf.seek(0)
-                                _stock_zip_cache[k_stock_zip] = {
-                                    "bytes": buf.getvalue(),
-                                    "name": sanitize_filename("库存明细_各省区.zip"),
-                                }
+                                        ),
+                                    ))
+                                _export_submit(
+                                    k_stock_zip,
+                                    sanitize_filename("库存明细_各省区.zip"),
+                                    "application/zip",
+                                    build_xlsx_zip,
+                                    (zip_members,),
+                                    progress=True,
+                                )
                     with c_z2:
-                        if k_stock_zip in _stock_zip_cache:
-                            st.download_button(
-                                "下载各省区库存ZIP",
-                                data=_stock_zip_cache[k_stock_zip]["bytes"],
-                                file_name=_stock_zip_cache[k_stock_zip]["name"],
-                                mime="application/zip",
-                                key="stock_zip_dl",
-                            )
+                        _export_download(k_stock_zip, "下载各省区库存ZIP", "stock_zip_dl", "正在生成各省区库存Excel")
                     with c_a1:
-                        if st.button("生成全部库存Excel", key="stock_all_gen"):
+                        if st.button("生成全部库存Excel", key="stock_all_gen") and _export_needed(k_stock_all):
                             with st.spinner("正在生成全部库存Excel，请稍候…"):
                                 df_all = df_stock_raw.copy()
                                 if s_cat != "全部" and "产品大类" in df_all.columns:
@@ -5743,27 +6562,22 @@ if uploaded_file:
                                 if "箱数" in df_all.columns:
                                     number_formats_all["箱数"] = "0.0"
 
-                                xls_all = _df_to_excel_bytes(
-                                    df_all,
-                                    sheet_name="库存明细",
-                                    title_lines=title_lines_all,
-                                    number_headers=number_headers_all,
-                                    number_formats=number_formats_all,
-                                    group_headers=False,
+                                _export_submit(
+                                    k_stock_all,
+                                    sanitize_filename("库存明细_全部省区.xlsx"),
+                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                    df_to_excel_bytes,
+                                    (df_all,),
+                                    dict(
+                                        sheet_name="库存明细",
+                                        title_lines=title_lines_all,
+                                        number_headers=number_headers_all,
+                                        number_formats=number_formats_all,
+                                        group_headers=False,
+                                    ),
                                 )
-                                _stock_zip_cache[k_stock_all] = {
-                                    "bytes": xls_all,
-                                    "name": sanitize_filename("库存明细_全部省区.xlsx"),
-                                }
                     with c_a2:
-                        if k_stock_all in _stock_zip_cache:
-                            st.download_button(
-                                "下载全部库存Excel",
-                                data=_stock_zip_cache[k_stock_all]["bytes"],
-                                file_name=_stock_zip_cache[k_stock_all]["name"],
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key="stock_all_dl",
-                            )
+                        _export_download(k_stock_all, "下载全部库存Excel", "stock_all_dl", "正在生成全部库存Excel")
                     
                     st.markdown("---")
 
@@ -6316,6 +7130,16 @@ if uploaded_file:
                         st.caption("注：因Q4出库数据仅精确到经销商层级，此处仅展示SKU库存明细，不计算单品DOS。")
 
             if main_tab == "🚚 出库分析":
+                df_newcust_raw = _lazy_sheet("newcust")
+                nc_ok = df_newcust_raw is not None and not getattr(df_newcust_raw, "empty", True) and ("_ym" in df_newcust_raw.columns)
+                if nc_ok:
+                    try:
+                        _yms = sorted([int(x) for x in pd.to_numeric(df_newcust_raw["_ym"], errors="coerce").dropna().astype(int).unique().tolist() if 200001 <= int(x) <= 209912])
+                    except Exception:
+                        _yms = []
+                    st.caption(f"新客表：已读取（行数={int(len(df_newcust_raw))}，月份={('、'.join([str(x) for x in _yms[:12]]) + ('…' if len(_yms) > 12 else '')) if _yms else '未识别到月份'}）")
+                else:
+                    st.caption("新客表：未读取（请确认底表第8个sheet包含新客数据，并点「清缓存重解析」后重新上传）")
                 if df_q4_raw is None or df_q4_raw.empty:
                     st.warning("⚠️ 未检测到出库数据 (Sheet3)。请确认Excel包含Sheet3且数据完整。")
                     with st.expander("🛠️ 调试信息", expanded=False):
@@ -6324,184 +7148,57 @@ if uploaded_file:
                 else:
                     st.caption(f"🕒 数据更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-                    o_raw = df_q4_raw.copy()
-
-                    if '产品大类' not in o_raw.columns:
-                        o_raw['产品大类'] = '全部'
-                    if '产品小类' not in o_raw.columns:
-                        o_raw['产品小类'] = '全部'
-                    for _c in ['省区', '经销商名称', '产品大类', '产品小类']:
-                        if _c in o_raw.columns:
-                            o_raw[_c] = o_raw[_c].fillna('').astype(str).str.strip()
-                    if '经销商名称' in o_raw.columns:
-                        o_raw['经销商名称'] = o_raw['经销商名称'].str.replace(r'\s+', '', regex=True)
-
-                    big_cat_src = '透视' if '透视' in o_raw.columns else (o_raw.columns[19] if len(o_raw.columns) > 19 else None)
-                    small_cat_src = '重量' if '重量' in o_raw.columns else (o_raw.columns[20] if len(o_raw.columns) > 20 else None)
-                    out_prod_src = '出库产品' if '出库产品' in o_raw.columns else (o_raw.columns[8] if len(o_raw.columns) > 8 else None)
-                    o_raw['_模块大类'] = o_raw[big_cat_src] if big_cat_src is not None else '全部'
-                    o_raw['_模块小类'] = o_raw[small_cat_src] if small_cat_src is not None else '全部'
-                    o_raw['_模块出库产品'] = o_raw[out_prod_src] if out_prod_src is not None else '全部'
-                    for _c in ['_模块大类', '_模块小类', '_模块出库产品']:
-                        if _c in o_raw.columns:
-                            o_raw[_c] = o_raw[_c].fillna('').astype(str).str.strip()
-
-                    day_col = next((c for c in o_raw.columns if str(c).strip() == '日'), None)
-                    if day_col is None:
-                        day_col = next((c for c in o_raw.columns if ('日期' in str(c)) or (str(c).strip().endswith('日') and '月' not in str(c))), None)
-                    if day_col is None and len(o_raw.columns) > 14:
-                        day_col = o_raw.columns[14]
-
-                    store_name_col = o_raw.columns[5] if len(o_raw.columns) > 5 else None
-
-                    if '数量(箱)' in o_raw.columns:
-                        o_raw['数量(箱)'] = pd.to_numeric(o_raw['数量(箱)'], errors='coerce').fillna(0.0)
-                    else:
-                        o_raw['数量(箱)'] = 0.0
-
-                    if store_name_col is not None and store_name_col in o_raw.columns:
-                        o_raw['_门店名'] = (
-                            o_raw[store_name_col]
-                            .fillna('')
-                            .astype(str)
-                            .str.replace(r'\s+', '', regex=True)
-                        )
-                        o_raw.loc[o_raw['_门店名'].isin(['', 'nan', 'None', 'NULL', 'NaN']), '_门店名'] = pd.NA
-                    else:
-                        o_raw['_门店名'] = pd.NA
-
-                    def _to_month(v):
-                        if pd.isna(v):
-                            return None
-                        if isinstance(v, (int, float)) and not pd.isna(v):
-                            m = int(v)
-                            return m if 1 <= m <= 12 else None
-                        s = str(v).strip()
-                        if s.isdigit():
-                            m = int(s)
-                            return m if 1 <= m <= 12 else None
-                        if '月' in s:
-                            digits = ''.join([ch for ch in s if ch.isdigit()])
-                            if digits:
-                                for k in (2, 1):
-                                    if len(digits) >= k:
-                                        m = int(digits[-k:])
-                                        if 1 <= m <= 12:
-                                            return m
-                            return None
-                        dt = pd.to_datetime(s, errors='coerce')
-                        if pd.isna(dt):
-                            return None
-                        m = int(dt.month)
-                        return m if 1 <= m <= 12 else None
-
-                    def _to_day(v):
-                        if pd.isna(v):
-                            return None
-                        if isinstance(v, (int, float)) and not pd.isna(v):
-                            d = int(v)
-                            return d if 1 <= d <= 31 else None
-                        s = str(v).strip()
-                        digits = ''.join([ch for ch in s if ch.isdigit()])
-                        if not digits:
-                            return None
-                        d = int(digits[-2:]) if len(digits) >= 2 else int(digits)
-                        return d if 1 <= d <= 31 else None
-
-                    if '年份' in o_raw.columns:
-                        o_raw['_年'] = pd.to_numeric(o_raw['年份'], errors='coerce').fillna(0).astype(int)
-                    else:
-                        o_raw['_年'] = 0
-                    if '月份' in o_raw.columns:
-                        o_raw['_月'] = o_raw['月份'].apply(_to_month)
-                    else:
-                        o_raw['_月'] = None
-
-                    if day_col is not None and day_col in o_raw.columns:
-                        if '日期' in str(day_col):
-                            dt_series = pd.to_datetime(o_raw[day_col], errors='coerce')
-                            o_raw['_年'] = np.where(dt_series.notna(), dt_series.dt.year, o_raw['_年']).astype(int)
-                            o_raw['_月'] = np.where(dt_series.notna(), dt_series.dt.month, o_raw['_月'])
-                            o_raw['_日'] = np.where(dt_series.notna(), dt_series.dt.day, None)
-                        else:
-                            o_raw['_日'] = o_raw[day_col].apply(_to_day)
-                    else:
-                        o_raw['_日'] = None
-
-                    if '月份' in o_raw.columns:
-                        _ms = o_raw['月份'].fillna('').astype(str).str.strip()
-                        _ym4 = _ms.str.extract(r'(20\d{2})\D{0,3}(0?[1-9]|1[0-2])')
-                        _mask_y = pd.to_numeric(o_raw.get('_年', 0), errors='coerce').fillna(0).astype(int) <= 0
-                        if _mask_y.any():
-                            _y4 = pd.to_numeric(_ym4[0], errors='coerce')
-                            o_raw.loc[_mask_y & _y4.notna(), '_年'] = _y4[_mask_y & _y4.notna()].astype(int)
-                        _mask_m = o_raw.get('_月', pd.Series([None] * len(o_raw))).isna()
-                        if _mask_m.any():
-                            _m4 = pd.to_numeric(_ym4[1], errors='coerce')
-                            o_raw.loc[_mask_m & _m4.notna(), '_月'] = _m4[_mask_m & _m4.notna()]
-
-                        _ym2 = _ms.str.extract(r'(?<!\d)(\d{2})\D{0,3}(0?[1-9]|1[0-2])')
-                        _mask_y2 = pd.to_numeric(o_raw.get('_年', 0), errors='coerce').fillna(0).astype(int) <= 0
-                        if _mask_y2.any():
-                            _y2 = pd.to_numeric(_ym2[0], errors='coerce')
-                            o_raw.loc[_mask_y2 & _y2.notna(), '_年'] = (2000 + _y2[_mask_y2 & _y2.notna()]).astype(int)
-                        _mask_m2 = o_raw.get('_月', pd.Series([None] * len(o_raw))).isna()
-                        if _mask_m2.any():
-                            _m2 = pd.to_numeric(_ym2[1], errors='coerce')
-                            o_raw.loc[_mask_m2 & _m2.notna(), '_月'] = _m2[_mask_m2 & _m2.notna()]
-
-                    o_raw = o_raw[o_raw['_年'] > 0].copy()
-                    o_raw = o_raw[o_raw['_月'].notna()].copy()
-                    o_raw['_月'] = o_raw['_月'].astype(int)
-                    o_raw['_日'] = pd.to_numeric(o_raw['_日'], errors='coerce')
+                    o_raw = _outbound_rows(df_q4_raw, _filter_sig)
 
                     with st.expander("🛠️ 出库筛选", expanded=False):
-                        out_provs = ['全部'] + sorted(o_raw['省区'].dropna().astype(str).unique().tolist()) if '省区' in o_raw.columns else ['全部']
+                        out_provs = ['全部'] + sorted(filter_values(o_raw, _filter_sig, "out2", '省区').dropna().astype(str).unique().tolist()) if '省区' in o_raw.columns else ['全部']
                         oc1, oc2, oc3, oc4, oc5 = st.columns(5)
                         with oc1:
                             o_prov = st.selectbox("省区", out_provs, key='out2_prov')
                         with oc2:
                             if '经销商名称' in o_raw.columns:
                                 if o_prov != '全部' and '省区' in o_raw.columns:
-                                    dists_in_prov = o_raw[o_raw['省区'].astype(str) == str(o_prov)]['经销商名称'].dropna().astype(str).unique().tolist()
+                                    dists_in_prov = filter_values(o_raw, _filter_sig, "out2", '经销商名称', [('省区', 'str', o_prov)]).dropna().astype(str).unique().tolist()
                                     out_dists = ['全部'] + sorted(dists_in_prov)
                                 else:
-                                    out_dists = ['全部'] + sorted(o_raw['经销商名称'].dropna().astype(str).unique().tolist())
+                                    out_dists = ['全部'] + sorted(filter_values(o_raw, _filter_sig, "out2", '经销商名称').dropna().astype(str).unique().tolist())
                             else:
                                 out_dists = ['全部']
                             o_dist = st.selectbox("经销商", out_dists, key='out2_dist')
                         with oc3:
-                            out_cats = ['全部'] + sorted(o_raw['产品大类'].dropna().astype(str).unique().tolist())
+                            out_cats = ['全部'] + sorted(filter_values(o_raw, _filter_sig, "out2", '产品大类').dropna().astype(str).unique().tolist())
                             o_cat = st.selectbox("产品大类", out_cats, key='out2_cat')
                         with oc4:
                             if o_cat != '全部':
-                                subs_in_cat = o_raw[o_raw['产品大类'].astype(str) == str(o_cat)]['产品小类'].dropna().astype(str).unique().tolist()
+                                subs_in_cat = filter_values(o_raw, _filter_sig, "out2", '产品小类', [('产品大类', 'str', o_cat)]).dropna().astype(str).unique().tolist()
                                 out_subs = ['全部'] + sorted(subs_in_cat)
                             else:
-                                out_subs = ['全部'] + sorted(o_raw['产品小类'].dropna().astype(str).unique().tolist())
+                                out_subs = ['全部'] + sorted(filter_values(o_raw, _filter_sig, "out2", '产品小类').dropna().astype(str).unique().tolist())
                             o_sub = st.selectbox("产品小类", out_subs, key='out2_sub')
                         with oc5:
-                            year_opts = sorted([int(y) for y in o_raw['_年'].dropna().unique().tolist() if int(y) > 0])
+                            year_opts = sorted([int(y) for y in filter_values(o_raw, _filter_sig, "out2", '_年').dropna().tolist() if int(y) > 0])
                             default_year = 2025 if 2025 in year_opts else (max(year_opts) if year_opts else 2025)
                             y_index = year_opts.index(default_year) if default_year in year_opts else 0
                             o_year = st.selectbox("年份", year_opts if year_opts else [2025], index=y_index, key='out2_year')
-                            month_in_year = sorted([int(m) for m in o_raw[o_raw['_年'] == int(o_year)]['_月'].dropna().unique().tolist() if 1 <= int(m) <= 12])
+                            month_in_year = sorted([int(m) for m in filter_values(o_raw, _filter_sig, "out2", '_月', [('_年', 'eq', int(o_year))]).dropna().tolist() if 1 <= int(m) <= 12])
                             month_opts = ['全部'] + month_in_year
                             o_month = st.selectbox("月份", month_opts, index=0, key='out2_month')
 
-                    df_o = o_raw.copy()
-                    if o_prov != '全部' and '省区' in df_o.columns:
-                        df_o = df_o[df_o['省区'].astype(str) == str(o_prov)]
-                    if o_dist != '全部' and '经销商名称' in df_o.columns:
-                        df_o = df_o[df_o['经销商名称'].astype(str) == str(o_dist)]
+                    _o_preds = []
+                    if o_prov != '全部' and '省区' in o_raw.columns:
+                        _o_preds.append(('省区', 'str', o_prov))
+                    if o_dist != '全部' and '经销商名称' in o_raw.columns:
+                        _o_preds.append(('经销商名称', 'str', o_dist))
                     if o_cat != '全部':
-                        df_o = df_o[df_o['产品大类'].astype(str) == str(o_cat)]
+                        _o_preds.append(('产品大类', 'str', o_cat))
                     if o_sub != '全部':
-                        df_o = df_o[df_o['产品小类'].astype(str) == str(o_sub)]
+                        _o_preds.append(('产品小类', 'str', o_sub))
+                    df_o = filter_rows(o_raw, _filter_sig, "out2", _o_preds).copy()
 
-                    df_o_prov_base = o_raw.copy()
-                    if o_dist != '全部' and '经销商名称' in df_o_prov_base.columns:
-                        df_o_prov_base = df_o_prov_base[df_o_prov_base['经销商名称'].astype(str) == str(o_dist)]
+                    _o_prov_preds = []
+                    if o_dist != '全部' and '经销商名称' in o_raw.columns:
+                        _o_prov_preds.append(('经销商名称', 'str', o_dist))
+                    df_o_prov_base = filter_rows(o_raw, _filter_sig, "out2", _o_prov_preds).copy()
 
                     def _agg_scope(df_scope: pd.DataFrame):
                         boxes = float(df_scope.get('数量(箱)', 0).sum()) if df_scope is not None and not df_scope.empty else 0.0
@@ -6974,9 +7671,6 @@ if uploaded_file:
                             if "out_d_png_cache" not in st.session_state:
                                 st.session_state.out_d_png_cache = {}
                             _out_d_png_cache = st.session_state.out_d_png_cache
-                            if "out_d_zip_cache" not in st.session_state:
-                                st.session_state.out_d_zip_cache = {}
-                            _out_d_zip_cache = st.session_state.out_d_zip_cache
 
                             def _reset_out_d():
                                 st.session_state.out_d_drill_level = 1
@@ -6984,7 +7678,6 @@ if uploaded_file:
                                 st.session_state.out_d_selected_dist = None
                                 try:
                                     st.session_state.out_d_png_cache = {}
-                                    st.session_state.out_d_zip_cache = {}
                                 except Exception:
                                     pass
 
@@ -7161,7 +7854,7 @@ if uploaded_file:
 
                                 c_z1, c_z2, _ = st.columns([1.9, 2.2, 5.9])
                                 with c_z1:
-                                    if st.button("生成各省区日趋势图ZIP", key="out_d_zip_gen"):
+                                    if st.button("生成各省区日趋势图ZIP", key="out_d_zip_gen") and _export_needed(k_zip):
                                         with st.spinner("正在生成各省区日趋势图ZIP，请稍候…"):
                                             provs = (
                                                 df_m["省区"]
@@ -7173,33 +7866,27 @@ if uploaded_file:
                                                 else []
                                             )
                                             provs = sorted([p for p in set(provs) if p and p.lower() not in ("nan", "none", "null")])
-                                            buf = io.BytesIO()
-                                            with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                                for p in provs:
-                                                    df_p = df_m[df_m["省区"].astype(str).str.strip() == str(p).strip()].copy()
-                                                    if df_p.empty:
-                                                        continue
-                                                    x_labels, y_vals, _days = _daily_xy(df_p)
-                                                    if not _days:
-                                                        continue
-                                                    title_p = f"{y0}年{int(m0)}月 {p} 按日出库趋势"
-                                                    title_lines_p = [title_p, filter_line, f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"]
-                                                    png_b = _pil_line_png(x_labels, y_vals, title_lines_p)
-                                                    zf.writestr(f"{sanitize_filename(p)}.png", png_b)
-                                            buf.seek(0)
-                                            _out_d_zip_cache[k_zip] = {
-                                                "bytes": buf.getvalue(),
-                                                "name": sanitize_filename(f"{y0}年{int(m0)}月_各省区日趋势图.zip"),
-                                            }
+                                            zip_members = []
+                                            for p in provs:
+                                                df_p = df_m[df_m["省区"].astype(str).str.strip() == str(p).strip()].copy()
+                                                if df_p.empty:
+                                                    continue
+                                                x_labels, y_vals, _days = _daily_xy(df_p)
+                                                if not _days:
+                                                    continue
+                                                title_p = f"{y0}年{int(m0)}月 {p} 按日出库趋势"
+                                                title_lines_p = [title_p, filter_line, f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"]
+                                                zip_members.append((f"{sanitize_filename(p)}.png", _pil_line_png, (x_labels, y_vals, title_lines_p), {}))
+                                            _export_submit(
+                                                k_zip,
+                                                sanitize_filename(f"{y0}年{int(m0)}月_各省区日趋势图.zip"),
+                                                "application/zip",
+                                                _png_zip_bytes,
+                                                (zip_members,),
+                                                progress=True,
+                                            )
                                 with c_z2:
-                                    if k_zip in _out_d_zip_cache:
-                                        st.download_button(
-                                            "下载各省区日趋势图ZIP",
-                                            data=_out_d_zip_cache[k_zip]["bytes"],
-                                            file_name=_out_d_zip_cache[k_zip]["name"],
-                                            mime="application/zip",
-                                            key="out_d_zip_dl",
-                                        )
+                                    _export_download(k_zip, "下载各省区日趋势图ZIP", "out_d_zip_dl", "正在生成各省区日趋势图")
 
                                 pv = (
                                     df_m.groupby(["省区"], as_index=False)["数量(箱)"]
@@ -7292,34 +7979,20 @@ if uploaded_file:
 
                             st.stop()
 
-                        df_trend_universe = o_raw.copy()
-                        if "客户简称" in df_trend_universe.columns:
-                            df_trend_universe["经销商名称"] = df_trend_universe["客户简称"].fillna(df_trend_universe["经销商名称"])
-                        df_trend_base = df_trend_universe.copy()
+                        # Row-level trend frame (day columns for the 当月/今日 figures and the detail
+                        # exports); pickers, months and monthly rollups come off the cube.
+                        df_trend_universe = _outbound_trend_rows(o_raw, st.session_state.get("_active_file_sig"))
+                        out_cube = _outbound_cube(o_raw, st.session_state.get("_active_file_sig"))
+                        trend_stores = out_cube["stores"].copy()
+                        if "客户简称" in trend_stores.columns:
+                            trend_stores["经销商名称"] = trend_stores["客户简称"].fillna(trend_stores["经销商名称"])
+                        df_trend_base = df_trend_universe
                         if df_trend_base is None or df_trend_base.empty:
                             st.info("暂无可用于月度趋势的数据")
                         else:
-                            df_trend_base = df_trend_base[df_trend_base["_年"].notna() & df_trend_base["_月"].notna()].copy()
-                            df_trend_base["_年"] = pd.to_numeric(df_trend_base["_年"], errors="coerce").fillna(0).astype(int)
-                            df_trend_base["_月"] = pd.to_numeric(df_trend_base["_月"], errors="coerce").fillna(0).astype(int)
-                            df_trend_base = df_trend_base[(df_trend_base["_年"] > 0) & df_trend_base["_月"].between(1, 12)].copy()
-                            df_trend_base["_ym"] = (df_trend_base["_年"] * 100 + df_trend_base["_月"]).astype(int)
-                            df_trend_base["_ym_label"] = (
-                                df_trend_base["_年"].astype(str).str[-2:]
-                                + "年"
-                                + df_trend_base["_月"].astype(str)
-                                + "月"
-                            )
-
-                            month_map_df = (
-                                df_trend_base[["_ym", "_ym_label"]]
-                                .drop_duplicates()
-                                .sort_values("_ym")
-                                .reset_index(drop=True)
-                            )
-                            ym_to_label = {int(r["_ym"]): str(r["_ym_label"]) for _, r in month_map_df.iterrows()}
-                            label_to_ym = {str(r["_ym_label"]): int(r["_ym"]) for _, r in month_map_df.iterrows()}
-                            month_labels = month_map_df["_ym_label"].astype(str).tolist()
+                            ym_to_label = {int(ym): f"{str(int(ym) // 100)[-2:]}年{int(ym) % 100}月" for ym in out_cube["yms"]}
+                            label_to_ym = {label: ym for ym, label in ym_to_label.items()}
+                            month_labels = list(ym_to_label.values())
 
                             month_labels_no_2512 = [x for x in month_labels if str(x).strip() != "25年12月"]
                             default_months = month_labels_no_2512[-3:] if len(month_labels_no_2512) >= 3 else month_labels_no_2512
@@ -7340,32 +8013,14 @@ if uploaded_file:
                                 st.session_state.out_m_month_cols = sel_labels
 
                             with c_m2:
-                                _s_big = df_trend_universe.get('_模块大类', pd.Series(dtype=str)).dropna().astype(str).str.strip()
-                                cat_big_opts = ['全部'] + sorted([x for x in _s_big.unique().tolist() if x and x.lower() not in ('nan', 'none', 'null')])
+                                cat_big_opts = ['全部'] + _cube_module_opts(out_cube, '_模块大类')
                                 sel_big = st.selectbox("产品大类（T列透视）", cat_big_opts, key="out_m_cat_big")
                             with c_m3:
-                                if '_模块小类' in df_trend_universe.columns:
-                                    if sel_big != '全部' and '_模块大类' in df_trend_universe.columns:
-                                        subs = df_trend_universe[df_trend_universe['_模块大类'].astype(str).str.strip() == str(sel_big).strip()]['_模块小类'].dropna().astype(str).str.strip().unique().tolist()
-                                        cat_small_opts = ['全部'] + sorted([x for x in subs if x and str(x).strip().lower() not in ('nan', 'none', 'null')])
-                                    else:
-                                        _s_small = df_trend_universe['_模块小类'].dropna().astype(str).str.strip()
-                                        cat_small_opts = ['全部'] + sorted([x for x in _s_small.unique().tolist() if x and x.lower() not in ('nan', 'none', 'null')])
-                                else:
-                                    cat_small_opts = ['全部']
+                                cat_small_opts = ['全部'] + _cube_module_opts(out_cube, '_模块小类', sel_big)
                                 sel_small = st.selectbox("产品小类（U列重量）", cat_small_opts, key="out_m_cat_small")
 
                             with c_m4:
-                                if '_模块出库产品' in df_trend_universe.columns:
-                                    df_prod = df_trend_universe.copy()
-                                    if sel_big != '全部' and '_模块大类' in df_prod.columns:
-                                        df_prod = df_prod[df_prod['_模块大类'].astype(str).str.strip() == str(sel_big).strip()]
-                                    if sel_small != '全部' and '_模块小类' in df_prod.columns:
-                                        df_prod = df_prod[df_prod['_模块小类'].astype(str).str.strip() == str(sel_small).strip()]
-                                    _s_prod = df_prod['_模块出库产品'].dropna().astype(str).str.strip()
-                                    prod_opts = sorted([x for x in _s_prod.unique().tolist() if x and x.lower() not in ('nan', 'none', 'null')])
-                                else:
-                                    prod_opts = []
+                                prod_opts = _cube_module_opts(out_cube, '_模块出库产品', sel_big, sel_small)
                                 sel_prod = st.multiselect("出库产品（I列，可多选）", prod_opts, default=[], key="out_m_out_prod")
 
                             with c_m5:
@@ -7417,8 +8072,8 @@ if uploaded_file:
                             drill_level = int(st.session_state.get("out_m_drill_level", 1) or 1)
                             view_dim = "省区"
                             group_col = "省区"
-                            df_level_base = df_trend_base.copy()
-                            df_level = df_trend_base.copy()
+                            df_level = df_trend_base
+                            level_mask = np.ones(len(trend_stores), dtype=bool)
 
                             if drill_level == 2:
                                 view_dim = "经销商"
@@ -7426,87 +8081,54 @@ if uploaded_file:
                                 prov_name = st.session_state.get("out_m_selected_prov")
                                 if prov_name:
                                     st.caption(f"当前省区：**{prov_name}**（点击经销商可下钻到门店）")
-                                    df_level_base = df_level_base[df_level_base["省区"].astype(str).str.strip() == str(prov_name).strip()].copy()
-                                    df_level = df_level[df_level["省区"].astype(str).str.strip() == str(prov_name).strip()].copy()
+                                    df_level = df_level[df_level["省区"].astype(str).str.strip() == str(prov_name).strip()]
+                                    level_mask &= (trend_stores["省区"].astype(str).str.strip() == str(prov_name).strip()).to_numpy()
                             elif drill_level == 3:
                                 view_dim = "门店"
                                 group_col = "_门店名" if "_门店名" in df_level.columns else None
                                 prov_name = st.session_state.get("out_m_selected_prov")
                                 dist_name = st.session_state.get("out_m_selected_dist")
                                 if prov_name:
-                                    df_level_base = df_level_base[df_level_base["省区"].astype(str).str.strip() == str(prov_name).strip()].copy()
-                                    df_level = df_level[df_level["省区"].astype(str).str.strip() == str(prov_name).strip()].copy()
+                                    df_level = df_level[df_level["省区"].astype(str).str.strip() == str(prov_name).strip()]
+                                    level_mask &= (trend_stores["省区"].astype(str).str.strip() == str(prov_name).strip()).to_numpy()
                                 if dist_name:
-                                    df_level_base = df_level_base[df_level_base["经销商名称"].astype(str).str.strip() == str(dist_name).strip()].copy()
-                                    df_level = df_level[df_level["经销商名称"].astype(str).str.strip() == str(dist_name).strip()].copy()
+                                    df_level = df_level[df_level["经销商名称"].astype(str).str.strip() == str(dist_name).strip()]
+                                    level_mask &= (trend_stores["经销商名称"].astype(str).str.strip() == str(dist_name).strip()).to_numpy()
                                 st.caption(f"当前省区：**{prov_name or '—'}** ｜ 当前经销商：**{dist_name or '—'}**")
                                 if group_col is None:
                                     st.info("未检测到门店字段，无法展示门店维度趋势")
-                                    df_level = df_level.iloc[0:0].copy()
+                                    df_level = df_level.iloc[0:0]
                                 else:
-                                    df_level_base = df_level_base[df_level_base[group_col].notna()].copy()
-                                    df_level = df_level[df_level[group_col].notna()].copy()
+                                    df_level = df_level[df_level[group_col].notna()]
+                            level_grp_mask = level_mask & (trend_stores[group_col].notna().to_numpy() if group_col in trend_stores.columns else False)
+                            level_mod_mask = _cube_module_mask(out_cube, sel_big, sel_small, sel_prod)
 
                             if sel_big != '全部' and '_模块大类' in df_level.columns:
-                                df_level = df_level[df_level['_模块大类'].astype(str).str.strip() == str(sel_big).strip()].copy()
+                                df_level = df_level[df_level['_模块大类'].astype(str).str.strip() == str(sel_big).strip()]
                             if sel_small != '全部' and '_模块小类' in df_level.columns:
-                                df_level = df_level[df_level['_模块小类'].astype(str).str.strip() == str(sel_small).strip()].copy()
+                                df_level = df_level[df_level['_模块小类'].astype(str).str.strip() == str(sel_small).strip()]
                             if sel_prod and '_模块出库产品' in df_level.columns:
                                 sel_prod_norm = [str(x).strip() for x in sel_prod if str(x).strip()]
                                 if sel_prod_norm:
-                                    df_level = df_level[df_level['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)].copy()
+                                    df_level = df_level[df_level['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)]
 
-                            df_level_all = df_level.copy()
+                            df_level_all = df_level
 
                             if (not sel_yms):
                                 st.info("请选择月份")
                             else:
-                                if df_level.empty:
-                                    df_level = pd.DataFrame(columns=[group_col, "_ym", "数量(箱)"])
+                                sel_yms_u = list(dict.fromkeys(int(x) for x in sel_yms))
+                                if group_col in trend_stores.columns:
+                                    s_lv, _ = _cube_store_months(out_cube, sel_yms_u, level_grp_mask, level_mod_mask, stores=trend_stores)
+                                    pv = s_lv.groupby(group_col)[sel_yms_u].sum().rename_axis(view_dim)
                                 else:
-                                    df_level = df_level[df_level["_ym"].isin(sel_yms)].copy()
-                                    df_level["数量(箱)"] = pd.to_numeric(df_level.get("数量(箱)", 0), errors="coerce").fillna(0.0)
+                                    pv = pd.DataFrame(index=pd.Index([], name=view_dim))
 
-                                agg = (
-                                    df_level
-                                    .groupby([group_col, "_ym"], as_index=False)["数量(箱)"]
-                                    .sum()
-                                    .rename(columns={group_col: view_dim})
-                                )
-                                pv = agg.pivot(index=view_dim, columns="_ym", values="数量(箱)").fillna(0.0)
-
-                                df_names = df_trend_universe.copy()
-                                if drill_level == 2:
-                                    p = st.session_state.get("out_m_selected_prov")
-                                    if p and ('省区' in df_names.columns):
-                                        df_names = df_names[df_names['省区'].astype(str).str.strip() == str(p).strip()].copy()
-                                elif drill_level == 3:
-                                    p = st.session_state.get("out_m_selected_prov")
-                                    d = st.session_state.get("out_m_selected_dist")
-                                    if p and ('省区' in df_names.columns):
-                                        df_names = df_names[df_names['省区'].astype(str).str.strip() == str(p).strip()].copy()
-                                    if d and ('经销商名称' in df_names.columns):
-                                        df_names = df_names[df_names['经销商名称'].astype(str).str.strip() == str(d).strip()].copy()
-
-                                if sel_big != '全部' and '_模块大类' in df_names.columns:
-                                    df_names = df_names[df_names['_模块大类'].astype(str).str.strip() == str(sel_big).strip()].copy()
-                                if sel_small != '全部' and '_模块小类' in df_names.columns:
-                                    df_names = df_names[df_names['_模块小类'].astype(str).str.strip() == str(sel_small).strip()].copy()
-                                if sel_prod and '_模块出库产品' in df_names.columns:
-                                    sel_prod_norm = [str(x).strip() for x in sel_prod if str(x).strip()]
-                                    if sel_prod_norm:
-                                        df_names = df_names[df_names['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)].copy()
+                                df_names, _ = _cube_store_months(out_cube, [], level_mask, level_mod_mask, any_month=True, stores=trend_stores)
 
                                 invalid_names = {'', 'nan', 'none', 'null'}
-                                if group_col == "省区":
-                                    all_provs = df_names['省区'].dropna().astype(str).str.strip().unique() if '省区' in df_names.columns else []
-                                    base_names = sorted([x for x in all_provs if x and x.lower() not in invalid_names])
-                                elif group_col == "经销商名称":
-                                    all_dists = df_names['经销商名称'].dropna().astype(str).str.strip().unique() if '经销商名称' in df_names.columns else []
-                                    base_names = sorted([x for x in all_dists if x and x.lower() not in invalid_names])
-                                else:
-                                    tmp = df_names[group_col].dropna().astype(str).str.strip().unique() if group_col in df_names.columns else []
-                                    base_names = sorted([x for x in tmp if x and x.lower() not in invalid_names])
+                                tmp = df_names[group_col].dropna().astype(str).str.strip().unique() if group_col in df_names.columns else []
+                                base_names = sorted([x for x in tmp if x and x.lower() not in invalid_names])
 
                                 if base_names:
                                     df_base_skeleton = pd.DataFrame({view_dim: base_names})
@@ -7552,8 +8174,8 @@ if uploaded_file:
                                     if not dm.empty:
                                         dm["数量(箱)"] = pd.to_numeric(dm.get("数量(箱)", 0), errors="coerce").fillna(0.0)
                                         gm = dm.groupby([group_col], as_index=False)["数量(箱)"].sum().rename(columns={group_col: view_dim, "数量(箱)": april_col})
-                                        pv["_k_april"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                        gm["_k_april"] = gm[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                        pv["_k_april"] = _norm_key(pv[view_dim])
+                                        gm["_k_april"] = _norm_key(gm[view_dim])
                                         pv = pv.merge(gm[["_k_april", april_col]], on="_k_april", how="left")
                                         pv.drop(columns=["_k_april"], inplace=True, errors="ignore")
                                         if april_col in pv.columns:
@@ -7577,8 +8199,8 @@ if uploaded_file:
                                         if not ddm.empty:
                                             ddm["数量(箱)"] = pd.to_numeric(ddm.get("数量(箱)", 0), errors="coerce").fillna(0.0)
                                             gd = ddm.groupby([group_col], as_index=False)["数量(箱)"].sum().rename(columns={group_col: view_dim, "数量(箱)": today_col})
-                                            pv["_k_today"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            gd["_k_today"] = gd[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv["_k_today"] = _norm_key(pv[view_dim])
+                                            gd["_k_today"] = _norm_key(gd[view_dim])
                                             pv = pv.merge(gd[["_k_today", today_col]], on="_k_today", how="left")
                                             pv.drop(columns=["_k_today"], inplace=True, errors="ignore")
                                             pv[today_col] = pd.to_numeric(pv.get(today_col, 0), errors="coerce").fillna(0.0)
@@ -7594,113 +8216,37 @@ if uploaded_file:
                                     ("26年2-4月", [202602, 202603, 202604]),
                                 ]
 
-                                def _classify_store_abcd(x):
-                                    try:
-                                        v = float(x)
-                                    except Exception:
-                                        v = 0.0
-                                    if v >= 4:
-                                        return "A"
-                                    if 2 <= v < 4:
-                                        return "B"
-                                    if 1 <= v < 2:
-                                        return "C"
-                                    return "D"
-
-                                _st_order = {"A": 4, "B": 3, "C": 2, "D": 1}
-
-                                def _store_change(prev_c: str | None, cur_c: str | None):
-                                    if not prev_c or not cur_c:
-                                        return ""
-                                    pv0 = _st_order.get(str(prev_c).strip(), 0)
-                                    cv0 = _st_order.get(str(cur_c).strip(), 0)
-                                    if pv0 == cv0:
-                                        return "持平"
-                                    if cv0 > pv0:
-                                        return "升级 ⬆️"
-                                    return "降级 ⬇️"
-
-                                def _cmp_sign(prev_c: str | None, cur_c: str | None):
-                                    if not prev_c or not cur_c:
-                                        return None
-                                    pv0 = _st_order.get(str(prev_c).strip(), 0)
-                                    cv0 = _st_order.get(str(cur_c).strip(), 0)
-                                    if pv0 == cv0:
-                                        return 0
-                                    return 1 if cv0 > pv0 else -1
-
-                                def _trend3_label(c1: str | None, c2: str | None, c3: str | None):
-                                    s1 = _cmp_sign(c1, c2)
-                                    s2 = _cmp_sign(c2, c3)
-                                    if s1 is None or s2 is None:
-                                        return ""
-                                    if s1 > 0 and s2 > 0:
-                                        return "持续升级"
-                                    if s1 < 0 and s2 < 0:
-                                        return "持续降级"
-                                    if s1 > 0 and s2 < 0:
-                                        return "先升级后降级"
-                                    if s1 < 0 and s2 > 0:
-                                        return "先降级后升级"
-                                    if s1 == 0 and s2 == 0:
-                                        return "持续持平"
-                                    if s1 == 0 and s2 > 0:
-                                        return "持平升级"
-                                    if s1 > 0 and s2 == 0:
-                                        return "升级持平"
-                                    if s1 == 0 and s2 < 0:
-                                        return "持平降级"
-                                    if s1 < 0 and s2 == 0:
-                                        return "降级持平"
-                                    return "其他"
-
                                 if drill_level == 3 and group_col and (df_level_all is not None) and (not df_level_all.empty) and (view_dim in pv.columns):
                                     need_yms = []
                                     for _, yms in roll_periods:
                                         need_yms += list(yms)
                                     need_yms = sorted(set([int(x) for x in need_yms]))
-                                    d_roll = df_level_all.copy()
-                                    d_roll = d_roll[d_roll["_ym"].isin(need_yms)].copy()
+                                    d_roll, _ = _cube_store_months(out_cube, need_yms, level_grp_mask, level_mod_mask, stores=trend_stores)
                                     if not d_roll.empty:
-                                        d_roll["数量(箱)"] = pd.to_numeric(d_roll.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                        d_roll[group_col] = d_roll[group_col].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                        d_roll = d_roll[d_roll[group_col] != ""].copy()
-                                        r_agg = (
-                                            d_roll.groupby([group_col, "_ym"], as_index=False)["数量(箱)"]
-                                            .sum()
-                                            .rename(columns={group_col: view_dim})
-                                        )
-                                        r_pv = r_agg.pivot(index=view_dim, columns="_ym", values="数量(箱)").fillna(0.0)
-                                        for ym in need_yms:
-                                            if ym not in r_pv.columns:
-                                                r_pv[ym] = 0.0
-                                        r_pv = r_pv[need_yms].reset_index()
+                                        d_roll[group_col] = _norm_key(d_roll[group_col])
+                                        d_roll = d_roll[d_roll[group_col] != ""]
+                                        r_pv = d_roll.groupby(group_col, as_index=False)[need_yms].sum().rename(columns={group_col: view_dim})
 
+                                        tiers = {}
                                         for p_label, yms in roll_periods:
                                             cols = [int(x) for x in yms]
                                             r_pv[f"{p_label}月均出库"] = r_pv[cols].sum(axis=1) / 3.0
-                                            r_pv[f"{p_label}门店类型"] = r_pv[f"{p_label}月均出库"].apply(_classify_store_abcd)
+                                            tiers[p_label] = _store_tier_codes(r_pv[f"{p_label}月均出库"])
+                                            r_pv[f"{p_label}门店类型"] = _store_tier_labels(tiers[p_label])
 
                                         for i in range(1, len(roll_periods)):
                                             prev_label = roll_periods[i - 1][0]
                                             cur_label = roll_periods[i][0]
-                                            r_pv[f"{cur_label}变动"] = r_pv.apply(lambda r: _store_change(r.get(f"{prev_label}门店类型"), r.get(f"{cur_label}门店类型")), axis=1)
+                                            r_pv[f"{cur_label}变动"] = _store_tier_change(tiers[prev_label], tiers[cur_label])
 
                                         if len(roll_periods) >= 3:
                                             p1, p2, p3 = roll_periods[-3][0], roll_periods[-2][0], roll_periods[-1][0]
-                                            r_pv["近三周期变化"] = r_pv.apply(
-                                                lambda r: _trend3_label(
-                                                    r.get(f"{p1}门店类型"),
-                                                    r.get(f"{p2}门店类型"),
-                                                    r.get(f"{p3}门店类型"),
-                                                ),
-                                                axis=1,
-                                            )
+                                            r_pv["近三周期变化"] = _store_tier_trend3(tiers[p1], tiers[p2], tiers[p3])
                                         else:
                                             r_pv["近三周期变化"] = ""
 
-                                        r_pv[view_dim] = r_pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                        pv["_k_store"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                        r_pv[view_dim] = _norm_key(r_pv[view_dim])
+                                        pv["_k_store"] = _norm_key(pv[view_dim])
                                         r_pv["_k_store"] = r_pv[view_dim]
                                         keep_cols = ["_k_store"]
                                         for p_label, _ in roll_periods:
@@ -7731,7 +8277,7 @@ if uploaded_file:
                                         for c in ["省区", "经销商名称", "大类", "小类", "小类码", "中类", "重量"]:
                                             if c in sp.columns:
                                                 if c == "经销商名称":
-                                                    sp[c] = sp[c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    sp[c] = _norm_key(sp[c])
                                                 else:
                                                     sp[c] = sp[c].fillna("").astype(str).str.strip()
                                         sp["年份"] = pd.to_numeric(sp.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -7765,8 +8311,8 @@ if uploaded_file:
                                         if not sp.empty:
                                             if drill_level == 1 and "省区" in sp.columns and view_dim in pv.columns:
                                                 gsp = sp.groupby(["省区", "_ym"], as_index=False).agg({"发货箱数": "sum"})
-                                                gsp["_k_prov"] = gsp["省区"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                pv["_k_prov"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                gsp["_k_prov"] = _norm_key(gsp["省区"])
+                                                pv["_k_prov"] = _norm_key(pv[view_dim])
                                                 ship_cols_qty = ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]
                                                 for i, _ym in enumerate(ship_yms):
                                                     _cq = ship_cols_qty[i]
@@ -7782,7 +8328,7 @@ if uploaded_file:
                                                 _p = str(st.session_state.get("out_m_selected_prov") or "").strip()
                                                 if _p and "省区" in sp.columns:
                                                     _p_norm = re.sub(r"\s+", "", str(_p))
-                                                    sp = sp[sp["省区"].astype(str).str.replace(r"\s+", "", regex=True) == _p_norm].copy()
+                                                    sp = sp[_norm_key(sp["省区"]) == _p_norm].copy()
                                                 dist_map2 = {}
                                                 if df_stock_raw is not None and not getattr(df_stock_raw, "empty", True):
                                                     if "经销商全称" in df_stock_raw.columns and "经销商名称" in df_stock_raw.columns:
@@ -7790,16 +8336,16 @@ if uploaded_file:
                                                             df_stock_raw[["经销商全称", "经销商名称"]]
                                                             .dropna()
                                                             .astype(str)
-                                                            .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                            .apply(_norm_key)
                                                             .drop_duplicates()
                                                         )
                                                         dist_map2 = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
 
-                                                sp["_k_dist"] = sp["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                sp["_k_dist"] = _norm_key(sp["经销商名称"])
                                                 if dist_map2:
                                                     sp["_k_dist"] = sp["_k_dist"].map(dist_map2).fillna(sp["_k_dist"])
                                                 gsp = sp.groupby(["_k_dist", "_ym"], as_index=False).agg({"发货箱数": "sum"})
-                                                pv["_k_dist"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                pv["_k_dist"] = _norm_key(pv[view_dim])
                                                 if dist_map2:
                                                     pv["_k_dist"] = pv["_k_dist"].map(dist_map2).fillna(pv["_k_dist"])
                                                 ship_cols_qty = ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]
@@ -7821,7 +8367,7 @@ if uploaded_file:
                                     for _c in ["省区", "经销商名称", "产品大类", "产品小类", "重量"]:
                                         if _c in _s.columns:
                                             if _c == "经销商名称":
-                                                _s[_c] = _s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                _s[_c] = _norm_key(_s[_c])
                                             else:
                                                 _s[_c] = _s[_c].fillna("").astype(str).str.strip()
                                     if "箱数" in _s.columns:
@@ -7860,7 +8406,7 @@ if uploaded_file:
                                     if "省区" in nc.columns:
                                         nc["省区"] = nc["省区"].fillna("").astype(str).str.strip()
                                     if "经销商名称" in nc.columns:
-                                        nc["经销商名称"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                        nc["经销商名称"] = _norm_key(nc["经销商名称"])
                                     if "门店名称" in nc.columns:
                                         nc["门店名称"] = nc["门店名称"].fillna("").astype(str).str.strip()
                                     if "新客数" in nc.columns:
@@ -7877,7 +8423,7 @@ if uploaded_file:
                                         if _p and "省区" in nc.columns:
                                             nc = nc[nc["省区"].astype(str).str.strip() == _p].copy()
                                         if _d and "经销商名称" in nc.columns:
-                                            nc = nc[nc["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == _d.replace(" ", "")].copy()
+                                            nc = nc[_norm_key(nc["经销商名称"]) == _d.replace(" ", "")].copy()
                                     if not nc.empty:
                                         _yms = sorted([int(x) for x in nc["_ym"].dropna().astype(int).tolist() if 200001 <= int(x) <= 209912])
                                         _yy = int(max(_yms) // 100)
@@ -7922,12 +8468,12 @@ if uploaded_file:
                                                     pv[_c] = 0.0
                                             pv["累计新客"] = pd.to_numeric(pv.get("整体新客", 0), errors="coerce").fillna(0.0)
 
-                                if df_scan_raw is not None and not getattr(df_scan_raw, "empty", True):
-                                    s = df_scan_raw.copy()
+                                if df_scan_daily is not None and not getattr(df_scan_daily, "empty", True):
+                                    s = df_scan_daily.copy()
                                     for _c in ["省区", "门店名称", "经销商名称", "产品大类", "产品小类"]:
                                         if _c in s.columns:
                                             if _c == "经销商名称":
-                                                s[_c] = s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                s[_c] = _norm_key(s[_c])
                                             else:
                                                 s[_c] = s[_c].fillna("").astype(str).str.strip()
                                     if "年份" in s.columns:
@@ -7945,7 +8491,7 @@ if uploaded_file:
                                         if _p and "省区" in s.columns:
                                             s = s[s["省区"].astype(str).str.strip() == _p].copy()
                                         if _d and "经销商名称" in s.columns:
-                                            s = s[s["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == re.sub(r"\s+", "", _d)].copy()
+                                            s = s[_norm_key(s["经销商名称"]) == re.sub(r"\s+", "", _d)].copy()
                                     if sel_big != "全部":
                                         _sb = str(sel_big).strip()
                                         if _sb == "雅系列":
@@ -7976,19 +8522,19 @@ if uploaded_file:
                                         else:
                                             key_col = "门店名称"
                                         if key_col in s.columns:
-                                            pv[view_dim] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv[view_dim] = _norm_key(pv[view_dim])
                                             for _ym in scan_yms:
                                                 s_m = s[pd.to_numeric(s["_ym"], errors="coerce").fillna(0).astype(int) == int(_ym)].copy()
                                                 c_scan = f"_scan_{int(_ym)}"
                                                 if not s_m.empty:
                                                     scan_m = (
-                                                        s_m.groupby(key_col, as_index=False)
-                                                        .size()
-                                                        .rename(columns={key_col: view_dim, "size": "_扫码听数"})
+                                                        s_m.groupby(key_col, as_index=False)["听数"]
+                                                        .sum()
+                                                        .rename(columns={key_col: view_dim, "听数": "_扫码听数"})
                                                     )
                                                     scan_m[c_scan] = pd.to_numeric(scan_m["_扫码听数"], errors="coerce").fillna(0.0) / 6.0
                                                     scan_m = scan_m[[view_dim, c_scan]].copy()
-                                                    scan_m[view_dim] = scan_m[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    scan_m[view_dim] = _norm_key(scan_m[view_dim])
                                                     pv = pv.merge(scan_m, on=view_dim, how="left")
                                                 else:
                                                     pv[c_scan] = 0.0
@@ -8009,7 +8555,7 @@ if uploaded_file:
 
                                 if drill_level == 3 and store_geo_df is not None and not getattr(store_geo_df, "empty", True) and (view_dim in pv.columns):
                                     try:
-                                        pv["_k_store_geo"] = pv[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                        pv["_k_store_geo"] = _norm_key(pv[view_dim])
                                         pv = pv.merge(store_geo_df, on="_k_store_geo", how="left")
                                         pv.drop(columns=["_k_store_geo"], inplace=True, errors="ignore")
                                         pv["市"] = pv.get("市", "").fillna("").astype(str).str.strip()
@@ -8198,7 +8744,7 @@ if uploaded_file:
                                             for c in ["省区", "经销商名称", "大类", "小类", "小类码", "中类", "重量"]:
                                                 if c in sp.columns:
                                                     if c == "经销商名称":
-                                                        sp[c] = sp[c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                        sp[c] = _norm_key(sp[c])
                                                     else:
                                                         sp[c] = sp[c].fillna("").astype(str).str.strip()
                                             sp["年份"] = pd.to_numeric(sp.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -8235,15 +8781,15 @@ if uploaded_file:
                                                 _p = str(st.session_state.get("out_m_selected_prov") or "").strip()
                                                 if _p and "省区" in sp.columns:
                                                     _p_norm = re.sub(r"\s+", "", str(_p))
-                                                    sp = sp[sp["省区"].astype(str).str.replace(r"\s+", "", regex=True) == _p_norm].copy()
+                                                    sp = sp[_norm_key(sp["省区"]) == _p_norm].copy()
 
                                             if not sp.empty and view_dim in df_x.columns:
                                                 if drill_level == 1 and "省区" in sp.columns:
-                                                    sp["_k"] = sp["省区"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                    df_x["_k"] = df_x[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    sp["_k"] = _norm_key(sp["省区"])
+                                                    df_x["_k"] = _norm_key(df_x[view_dim])
                                                 else:
-                                                    sp["_k"] = sp["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                    df_x["_k"] = df_x[view_dim].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    sp["_k"] = _norm_key(sp["经销商名称"])
+                                                    df_x["_k"] = _norm_key(df_x[view_dim])
 
                                                 g = sp.groupby(["_k", "_ym"], as_index=False).agg({"发货箱数": "sum"})
                                                 ship = g.pivot(index="_k", columns="_ym", values="发货箱数").fillna(0.0)
@@ -8402,7 +8948,7 @@ if uploaded_file:
                                         for c in ["省区", "经销商名称", "大类", "小类", "小类码", "中类", "重量"]:
                                             if c in sp.columns:
                                                 if c == "经销商名称":
-                                                    sp[c] = sp[c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    sp[c] = _norm_key(sp[c])
                                                 else:
                                                     sp[c] = sp[c].fillna("").astype(str).str.strip()
                                         sp["年份"] = pd.to_numeric(sp.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -8443,16 +8989,16 @@ if uploaded_file:
                                                         df_stock_raw[["经销商全称", "经销商名称"]]
                                                         .dropna()
                                                         .astype(str)
-                                                        .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                        .apply(_norm_key)
                                                         .drop_duplicates()
                                                     )
                                                     dist_map2 = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
-                                            sp["_k_dist"] = sp["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            sp["_k_dist"] = _norm_key(sp["经销商名称"])
                                             if dist_map2:
                                                 sp["_k_dist"] = sp["_k_dist"].map(dist_map2).fillna(sp["_k_dist"])
                                             # 统一匹配口径：不再依赖省区匹配（避免“广东”vs“广东省”不一致），仅使用经销商名称匹配
                                             gsp = sp.groupby(["_k_dist", "_ym"], as_index=False).agg({"发货箱数": "sum"})
-                                            pv_s["_k_dist"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_k_dist"] = _norm_key(pv_s["经销商"])
                                             if dist_map2:
                                                 pv_s["_k_dist"] = pv_s["_k_dist"].map(dist_map2).fillna(pv_s["_k_dist"])
                                             ship_cols_qty = ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]
@@ -8542,7 +9088,7 @@ if uploaded_file:
                                         for _c in ["省区", "经销商名称", "产品大类", "产品小类", "重量"]:
                                             if _c in _s.columns:
                                                 if _c == "经销商名称":
-                                                    _s[_c] = _s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    _s[_c] = _norm_key(_s[_c])
                                                 else:
                                                     _s[_c] = _s[_c].fillna("").astype(str).str.strip()
                                         if "箱数" in _s.columns:
@@ -8579,7 +9125,7 @@ if uploaded_file:
                                         if "省区" in nc.columns:
                                             nc["省区"] = nc["省区"].fillna("").astype(str).str.strip()
                                         if "经销商名称" in nc.columns:
-                                            nc["经销商名称"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            nc["经销商名称"] = _norm_key(nc["经销商名称"])
 
                                         dist_map = {}
                                         if df_stock_raw is not None and not getattr(df_stock_raw, "empty", True):
@@ -8588,7 +9134,7 @@ if uploaded_file:
                                                     df_stock_raw[["经销商全称", "经销商名称"]]
                                                     .dropna()
                                                     .astype(str)
-                                                    .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                    .apply(_norm_key)
                                                     .drop_duplicates()
                                                 )
                                                 dist_map = dict(zip(_m["经销商全称"].tolist(), _m["经销商名称"].tolist()))
@@ -8607,12 +9153,12 @@ if uploaded_file:
                                             prev3 = [int(_yy * 100 + 1), int(_yy * 100 + 2), int(_yy * 100 + 3)]
 
                                             pv_s["省区"] = pv_s["省区"].fillna("").astype(str).str.strip()
-                                            pv_s["经销商"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["经销商"] = _norm_key(pv_s["经销商"])
                                             pv_s["_经销商_key"] = pv_s["经销商"]
                                             if dist_map:
                                                 pv_s["_经销商_key"] = pv_s["_经销商_key"].map(dist_map).fillna(pv_s["_经销商_key"])
 
-                                            nc["_经销商_key"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            nc["_经销商_key"] = _norm_key(nc["经销商名称"])
                                             if dist_map:
                                                 nc["_经销商_key"] = nc["_经销商_key"].map(dist_map).fillna(nc["_经销商_key"])
 
@@ -8654,12 +9200,12 @@ if uploaded_file:
 
                                     pv_s[scan_avg_col] = 0.0
                                     pv_s[scan_rate_col] = 0.0
-                                    if df_scan_raw is not None and not getattr(df_scan_raw, "empty", True):
-                                        s = df_scan_raw.copy()
+                                    if df_scan_daily is not None and not getattr(df_scan_daily, "empty", True):
+                                        s = df_scan_daily.copy()
                                         for _c in ["省区", "经销商名称", "产品大类", "产品小类"]:
                                             if _c in s.columns:
                                                 if _c == "经销商名称":
-                                                    s[_c] = s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    s[_c] = _norm_key(s[_c])
                                                 else:
                                                     s[_c] = s[_c].fillna("").astype(str).str.strip()
                                         s["年份"] = pd.to_numeric(s.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -8693,14 +9239,14 @@ if uploaded_file:
                                                         df_stock_raw[["经销商全称", "经销商名称"]]
                                                         .dropna()
                                                         .astype(str)
-                                                        .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                        .apply(_norm_key)
                                                         .drop_duplicates()
                                                     )
                                                     dist_map2 = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
-                                            pv_s["_经销商_key_scan"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_经销商_key_scan"] = _norm_key(pv_s["经销商"])
                                             if dist_map2:
                                                 pv_s["_经销商_key_scan"] = pv_s["_经销商_key_scan"].map(dist_map2).fillna(pv_s["_经销商_key_scan"])
-                                            s["_经销商_key_scan"] = s["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            s["_经销商_key_scan"] = _norm_key(s["经销商名称"])
                                             if dist_map2:
                                                 s["_经销商_key_scan"] = s["_经销商_key_scan"].map(dist_map2).fillna(s["_经销商_key_scan"])
                                             for _ym in scan_yms:
@@ -8708,7 +9254,7 @@ if uploaded_file:
                                                 sf = s[pd.to_numeric(s["_ym"], errors="coerce").fillna(0).astype(int) == _ym_i].copy()
                                                 c_scan = f"_scan_{_ym_i}"
                                                 if not sf.empty:
-                                                    agg_f = sf.groupby(["省区", "_经销商_key_scan"], as_index=False).size().rename(columns={"size": "_扫码听数"})
+                                                    agg_f = sf.groupby(["省区", "_经销商_key_scan"], as_index=False)["听数"].sum().rename(columns={"听数": "_扫码听数"})
                                                     agg_f[c_scan] = pd.to_numeric(agg_f["_扫码听数"], errors="coerce").fillna(0.0) / 6.0
                                                     agg_f.drop(columns=["_扫码听数"], inplace=True, errors="ignore")
                                                     pv_s = pv_s.merge(agg_f[["省区", "_经销商_key_scan", c_scan]], on=["省区", "_经销商_key_scan"], how="left")
@@ -8728,7 +9274,7 @@ if uploaded_file:
 
                                     if store_geo_df is not None and not getattr(store_geo_df, "empty", True) and "门店" in pv_s.columns:
                                         try:
-                                            pv_s["_k_store_geo"] = pv_s["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_k_store_geo"] = _norm_key(pv_s["门店"])
                                             pv_s = pv_s.merge(store_geo_df, on="_k_store_geo", how="left")
                                             pv_s.drop(columns=["_k_store_geo"], inplace=True, errors="ignore")
                                             pv_s["市"] = pv_s.get("市", "").fillna("").astype(str).str.strip()
@@ -8785,7 +9331,7 @@ if uploaded_file:
                                     return pv_s
 
                                 def _build_store_detail_df(all_provinces: bool):
-                                    d = df_trend_base.copy()
+                                    d = df_trend_base
                                     store_col = "_门店名" if "_门店名" in d.columns else ("门店名称" if "门店名称" in d.columns else None)
                                     if store_col is None:
                                         cols0 = ["省区", "经销商", "门店"]
@@ -8799,23 +9345,29 @@ if uploaded_file:
 
                                     prov_sel = str(st.session_state.get("out_m_selected_prov") or "").strip()
                                     dist_sel = str(st.session_state.get("out_m_selected_dist") or "").strip()
+                                    store_mask = np.ones(len(trend_stores), dtype=bool)
                                     if not all_provinces and prov_sel:
-                                        d = d[d["省区"].astype(str).str.strip() == prov_sel].copy()
+                                        d = d[d["省区"].astype(str).str.strip() == prov_sel]
+                                        store_mask &= (trend_stores["省区"].astype(str).str.strip() == prov_sel).to_numpy()
                                     if drill_level == 3 and dist_sel:
-                                        d = d[d["经销商名称"].astype(str).str.strip() == dist_sel].copy()
+                                        d = d[d["经销商名称"].astype(str).str.strip() == dist_sel]
+                                        store_mask &= (trend_stores["经销商名称"].astype(str).str.strip() == dist_sel).to_numpy()
+                                    mod_mask = _cube_module_mask(out_cube, sel_big, sel_small, sel_prod)
 
+                                    # Row-level slice, only for 门店编号 and the day-level 当日 / 当月 columns.
                                     if sel_big != '全部' and '_模块大类' in d.columns:
-                                        d = d[d['_模块大类'].astype(str).str.strip() == str(sel_big).strip()].copy()
+                                        d = d[d['_模块大类'].astype(str).str.strip() == str(sel_big).strip()]
                                     if sel_small != '全部' and '_模块小类' in d.columns:
-                                        d = d[d['_模块小类'].astype(str).str.strip() == str(sel_small).strip()].copy()
+                                        d = d[d['_模块小类'].astype(str).str.strip() == str(sel_small).strip()]
                                     if sel_prod and '_模块出库产品' in d.columns:
                                         sel_prod_norm = [str(x).strip() for x in sel_prod if str(x).strip()]
                                         if sel_prod_norm:
-                                            d = d[d['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)].copy()
+                                            d = d[d['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)]
+                                    d_all = d
 
-                                    d_all = d.copy()
-                                    d = d[d["_ym"].isin(sel_yms)].copy()
-                                    if d.empty:
+                                    sel_yms_u = list(dict.fromkeys(int(x) for x in sel_yms))
+                                    d_sel, _ = _cube_store_months(out_cube, sel_yms_u, store_mask, mod_mask, stores=trend_stores)
+                                    if d_sel.empty:
                                         return pd.DataFrame(columns=["省区", "经销商", "门店"] + sel_month_cols + [avg_header])
 
                                     meta_cols = [c for c in ["门店编号"] if c in d_all.columns]
@@ -8841,17 +9393,12 @@ if uploaded_file:
                                             .rename(columns={"经销商名称": "经销商", store_col: "门店"})
                                         )
 
-                                    d["数量(箱)"] = pd.to_numeric(d.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                    d["省区"] = d["省区"].fillna("").astype(str).str.strip()
-                                    d["经销商名称"] = d["经销商名称"].fillna("").astype(str).str.strip()
-                                    d[store_col] = d[store_col].fillna("").astype(str).str.strip()
-                                    d = d[(d[store_col] != "") & (d["经销商名称"] != "")].copy()
+                                    d_sel["省区"] = d_sel["省区"].fillna("").astype(str).str.strip()
+                                    d_sel["经销商名称"] = d_sel["经销商名称"].fillna("").astype(str).str.strip()
+                                    d_sel[store_col] = d_sel[store_col].fillna("").astype(str).str.strip()
+                                    d_sel = d_sel[(d_sel[store_col] != "") & (d_sel["经销商名称"] != "")]
 
-                                    g = d.groupby(["省区", "经销商名称", store_col, "_ym"], as_index=False)["数量(箱)"].sum()
-                                    pv_s = g.pivot(index=["省区", "经销商名称", store_col], columns="_ym", values="数量(箱)").fillna(0.0)
-                                    for ym in sel_yms:
-                                        if ym not in pv_s.columns:
-                                            pv_s[ym] = 0.0
+                                    pv_s = d_sel.groupby(["省区", "经销商名称", store_col])[sel_yms_u].sum()
                                     pv_s = pv_s[sel_yms]
                                     pv_s.columns = sel_month_cols
                                     pv_s["_合计"] = pv_s.sum(axis=1)
@@ -8866,40 +9413,32 @@ if uploaded_file:
                                         for _, yms in roll_periods:
                                             need_yms += list(yms)
                                         need_yms = sorted(set([int(x) for x in need_yms]))
-                                        d_roll = d_all.copy()
-                                        d_roll = d_roll[d_roll["_ym"].isin(need_yms)].copy()
+                                        d_roll, _ = _cube_store_months(out_cube, need_yms, store_mask, mod_mask, stores=trend_stores)
                                         if not d_roll.empty:
-                                            d_roll["数量(箱)"] = pd.to_numeric(d_roll.get("数量(箱)", 0), errors="coerce").fillna(0.0)
                                             d_roll["省区"] = d_roll["省区"].fillna("").astype(str).str.strip()
-                                            d_roll["经销商名称"] = d_roll["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            d_roll[store_col] = d_roll[store_col].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            d_roll = d_roll[(d_roll["省区"] != "") & (d_roll["经销商名称"] != "") & (d_roll[store_col] != "")].copy()
+                                            d_roll["经销商名称"] = _norm_key(d_roll["经销商名称"])
+                                            d_roll[store_col] = _norm_key(d_roll[store_col])
+                                            d_roll = d_roll[(d_roll["省区"] != "") & (d_roll["经销商名称"] != "") & (d_roll[store_col] != "")]
 
-                                            g2 = d_roll.groupby(["省区", "经销商名称", store_col, "_ym"], as_index=False)["数量(箱)"].sum()
-                                            rp = g2.pivot(index=["省区", "经销商名称", store_col], columns="_ym", values="数量(箱)").fillna(0.0)
-                                            for ym in need_yms:
-                                                if ym not in rp.columns:
-                                                    rp[ym] = 0.0
-                                            rp = rp[need_yms].reset_index().rename(columns={"经销商名称": "经销商", store_col: "门店"})
+                                            rp = (
+                                                d_roll.groupby(["省区", "经销商名称", store_col], as_index=False)[need_yms]
+                                                .sum()
+                                                .rename(columns={"经销商名称": "经销商", store_col: "门店"})
+                                            )
 
+                                            tiers = {}
                                             for p_label, yms in roll_periods:
                                                 cols = [int(x) for x in yms]
                                                 rp[f"{p_label}月均出库"] = rp[cols].sum(axis=1) / 3.0
-                                                rp[f"{p_label}门店类型"] = rp[f"{p_label}月均出库"].apply(_classify_store_abcd)
+                                                tiers[p_label] = _store_tier_codes(rp[f"{p_label}月均出库"])
+                                                rp[f"{p_label}门店类型"] = _store_tier_labels(tiers[p_label])
                                             for i in range(1, len(roll_periods)):
                                                 prev_label = roll_periods[i - 1][0]
                                                 cur_label = roll_periods[i][0]
-                                                rp[f"{cur_label}变动"] = rp.apply(lambda r: _store_change(r.get(f"{prev_label}门店类型"), r.get(f"{cur_label}门店类型")), axis=1)
+                                                rp[f"{cur_label}变动"] = _store_tier_change(tiers[prev_label], tiers[cur_label])
                                             if len(roll_periods) >= 3:
                                                 p1, p2, p3 = roll_periods[-3][0], roll_periods[-2][0], roll_periods[-1][0]
-                                                rp["近三周期变化"] = rp.apply(
-                                                    lambda r: _trend3_label(
-                                                        r.get(f"{p1}门店类型"),
-                                                        r.get(f"{p2}门店类型"),
-                                                        r.get(f"{p3}门店类型"),
-                                                    ),
-                                                    axis=1,
-                                                )
+                                                rp["近三周期变化"] = _store_tier_trend3(tiers[p1], tiers[p2], tiers[p3])
                                             else:
                                                 rp["近三周期变化"] = ""
 
@@ -8909,11 +9448,11 @@ if uploaded_file:
                                                     rp[c_avg] = pd.to_numeric(rp[c_avg], errors="coerce").fillna(0.0).round(1)
 
                                             pv_s["省区"] = pv_s["省区"].fillna("").astype(str).str.strip()
-                                            pv_s["经销商"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            pv_s["门店"] = pv_s["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["经销商"] = _norm_key(pv_s["经销商"])
+                                            pv_s["门店"] = _norm_key(pv_s["门店"])
                                             rp["省区"] = rp["省区"].fillna("").astype(str).str.strip()
-                                            rp["经销商"] = rp["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            rp["门店"] = rp["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            rp["经销商"] = _norm_key(rp["经销商"])
+                                            rp["门店"] = _norm_key(rp["门店"])
 
                                             keep_cols = ["省区", "经销商", "门店"]
                                             for p_label, _yms in roll_periods:
@@ -8938,16 +9477,16 @@ if uploaded_file:
                                         if not dm.empty:
                                             dm["数量(箱)"] = pd.to_numeric(dm.get("数量(箱)", 0), errors="coerce").fillna(0.0)
                                             dm["省区"] = dm["省区"].fillna("").astype(str).str.strip()
-                                            dm["经销商名称"] = dm["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            dm[store_col] = dm[store_col].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            dm["经销商名称"] = _norm_key(dm["经销商名称"])
+                                            dm[store_col] = _norm_key(dm[store_col])
                                             gm = (
                                                 dm.groupby(["省区", "经销商名称", store_col], as_index=False)["数量(箱)"]
                                                 .sum()
                                                 .rename(columns={"经销商名称": "经销商", store_col: "门店", "数量(箱)": march_col})
                                             )
                                             pv_s["省区"] = pv_s["省区"].fillna("").astype(str).str.strip()
-                                            pv_s["经销商"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            pv_s["门店"] = pv_s["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["经销商"] = _norm_key(pv_s["经销商"])
+                                            pv_s["门店"] = _norm_key(pv_s["门店"])
                                             pv_s = pv_s.merge(gm, on=["省区", "经销商", "门店"], how="left", suffixes=("", "_y"))
                                             if f"{march_col}_y" in pv_s.columns:
                                                 pv_s.drop(columns=[march_col], inplace=True, errors="ignore")
@@ -8968,8 +9507,8 @@ if uploaded_file:
                                             if not ddm.empty:
                                                 ddm["数量(箱)"] = pd.to_numeric(ddm.get("数量(箱)", 0), errors="coerce").fillna(0.0)
                                                 ddm["省区"] = ddm["省区"].fillna("").astype(str).str.strip()
-                                                ddm["经销商名称"] = ddm["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                ddm[store_col] = ddm[store_col].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                ddm["经销商名称"] = _norm_key(ddm["经销商名称"])
+                                                ddm[store_col] = _norm_key(ddm[store_col])
                                                 gd = (
                                                     ddm.groupby(["省区", "经销商名称", store_col], as_index=False)["数量(箱)"]
                                                     .sum()
@@ -8990,7 +9529,7 @@ if uploaded_file:
                                         if "省区" in nc.columns:
                                             nc["省区"] = nc["省区"].fillna("").astype(str).str.strip()
                                         if "经销商名称" in nc.columns:
-                                            nc["经销商名称"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            nc["经销商名称"] = _norm_key(nc["经销商名称"])
                                         if "门店名称" in nc.columns:
                                             nc["门店名称"] = nc["门店名称"].fillna("").astype(str).str.strip()
                                         if "新客数" in nc.columns:
@@ -9000,7 +9539,7 @@ if uploaded_file:
                                         if not all_provinces and prov_sel and "省区" in nc.columns:
                                             nc = nc[nc["省区"].astype(str).str.strip() == prov_sel].copy()
                                         if drill_level == 3 and dist_sel and "经销商名称" in nc.columns:
-                                            nc = nc[nc["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == dist_sel.replace(" ", "")].copy()
+                                            nc = nc[_norm_key(nc["经销商名称"]) == dist_sel.replace(" ", "")].copy()
                                         if not nc.empty:
                                             _yms = sorted([int(x) for x in nc["_ym"].dropna().astype(int).tolist() if 200001 <= int(x) <= 209912])
                                             _yy = int(max(_yms) // 100)
@@ -9011,10 +9550,10 @@ if uploaded_file:
                                             cum = nc.groupby(["省区", "经销商名称", "门店名称"], as_index=False)["新客数"].sum().rename(columns={"经销商名称": "经销商", "门店名称": "门店", "新客数": "整体新客"})
                                             for _df in (cur, p3, cum):
                                                 _df["省区"] = _df["省区"].fillna("").astype(str).str.strip()
-                                                _df["经销商"] = _df["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                _df["经销商"] = _norm_key(_df["经销商"])
                                                 _df["门店"] = _df["门店"].fillna("").astype(str).str.strip()
                                             pv_s["省区"] = pv_s["省区"].fillna("").astype(str).str.strip()
-                                            pv_s["经销商"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["经销商"] = _norm_key(pv_s["经销商"])
                                             pv_s["门店"] = pv_s["门店"].fillna("").astype(str).str.strip()
                                             pv_s = pv_s.merge(cur, on=["省区", "经销商", "门店"], how="left")
                                             pv_s = pv_s.merge(p3, on=["省区", "经销商", "门店"], how="left")
@@ -9028,14 +9567,14 @@ if uploaded_file:
 
                                     pv_s[scan_avg_col] = 0.0
                                     pv_s[scan_rate_col] = 0.0
-                                    if df_scan_raw is not None and not getattr(df_scan_raw, "empty", True):
-                                        s = df_scan_raw.copy()
+                                    if df_scan_daily is not None and not getattr(df_scan_daily, "empty", True):
+                                        s = df_scan_daily.copy()
                                         for _c in ["省区", "经销商名称", "门店名称", "产品大类", "产品小类"]:
                                             if _c in s.columns:
                                                 if _c == "经销商名称":
-                                                    s[_c] = s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    s[_c] = _norm_key(s[_c])
                                                 elif _c == "门店名称":
-                                                    s[_c] = s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    s[_c] = _norm_key(s[_c])
                                                 else:
                                                     s[_c] = s[_c].fillna("").astype(str).str.strip()
                                         s["年份"] = pd.to_numeric(s.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -9069,24 +9608,24 @@ if uploaded_file:
                                                         df_stock_raw[["经销商全称", "经销商名称"]]
                                                         .dropna()
                                                         .astype(str)
-                                                        .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                        .apply(_norm_key)
                                                         .drop_duplicates()
                                                     )
                                                     dist_map2 = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
-                                            pv_s["_经销商_key_scan"] = pv_s["经销商"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_经销商_key_scan"] = _norm_key(pv_s["经销商"])
                                             if dist_map2:
                                                 pv_s["_经销商_key_scan"] = pv_s["_经销商_key_scan"].map(dist_map2).fillna(pv_s["_经销商_key_scan"])
-                                            pv_s["_门店_key_scan"] = pv_s["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                            s["_经销商_key_scan"] = s["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_门店_key_scan"] = _norm_key(pv_s["门店"])
+                                            s["_经销商_key_scan"] = _norm_key(s["经销商名称"])
                                             if dist_map2:
                                                 s["_经销商_key_scan"] = s["_经销商_key_scan"].map(dist_map2).fillna(s["_经销商_key_scan"])
-                                            s["_门店_key_scan"] = s["门店名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            s["_门店_key_scan"] = _norm_key(s["门店名称"])
                                             for _ym in scan_yms:
                                                 _ym_i = int(_ym)
                                                 sf = s[pd.to_numeric(s["_ym"], errors="coerce").fillna(0).astype(int) == _ym_i].copy()
                                                 c_scan = f"_scan_{_ym_i}"
                                                 if not sf.empty:
-                                                    agg_f = sf.groupby(["省区", "_经销商_key_scan", "_门店_key_scan"], as_index=False).size().rename(columns={"size": "_扫码听数"})
+                                                    agg_f = sf.groupby(["省区", "_经销商_key_scan", "_门店_key_scan"], as_index=False)["听数"].sum().rename(columns={"听数": "_扫码听数"})
                                                     agg_f[c_scan] = pd.to_numeric(agg_f["_扫码听数"], errors="coerce").fillna(0.0) / 6.0
                                                     agg_f.drop(columns=["_扫码听数"], inplace=True, errors="ignore")
                                                     pv_s = pv_s.merge(agg_f[["省区", "_经销商_key_scan", "_门店_key_scan", c_scan]], on=["省区", "_经销商_key_scan", "_门店_key_scan"], how="left")
@@ -9107,7 +9646,7 @@ if uploaded_file:
 
                                     if store_geo_df is not None and not getattr(store_geo_df, "empty", True) and "门店" in pv_s.columns:
                                         try:
-                                            pv_s["_k_store_geo"] = pv_s["门店"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv_s["_k_store_geo"] = _norm_key(pv_s["门店"])
                                             pv_s = pv_s.merge(store_geo_df, on="_k_store_geo", how="left")
                                             pv_s.drop(columns=["_k_store_geo"], inplace=True, errors="ignore")
                                             pv_s["市"] = pv_s.get("市", "").fillna("").astype(str).str.strip()
@@ -9171,10 +9710,6 @@ if uploaded_file:
                                 if scan_rate_col in pv.columns:
                                     percent_headers_current.add(scan_rate_col)
 
-                                if "out_m_excel_cache" not in st.session_state:
-                                    st.session_state.out_m_excel_cache = {}
-                                _excel_cache = st.session_state.out_m_excel_cache
-
                                 _prov_sel = str(st.session_state.get("out_m_selected_prov") or "").strip()
                                 _dist_sel = str(st.session_state.get("out_m_selected_dist") or "").strip()
                                 _prod_norm_key = tuple(sorted([str(x).strip() for x in (sel_prod or []) if str(x).strip()]))
@@ -9222,7 +9757,7 @@ if uploaded_file:
                                     k_cur = _excel_key("cur")
                                     c_e1, c_e2, _ = st.columns([1.1, 1.6, 6.3])
                                     with c_e1:
-                                        if st.button("生成Excel（当前表）", key=f"{export_id}_gen_cur"):
+                                        if st.button("生成Excel（当前表）", key=f"{export_id}_gen_cur") and _export_needed(k_cur):
                                             with st.spinner("正在生成Excel（当前表）…"):
                                                 df_x = _build_current_excel_df()
                                                 ren = {}
@@ -9258,34 +9793,29 @@ if uploaded_file:
                                                 percent_headers_out = set()
                                                 for c in percent_headers_current:
                                                     percent_headers_out.add(ren.get(c, c))
-                                                xlsx_bytes = _df_to_excel_bytes(
-                                                    df_x,
-                                                    sheet_name="趋势分析",
-                                                    title_lines=export_title_lines,
-                                                    number_headers=number_headers_out,
-                                                    number_formats={
-                                                        ren.get("可销月", "可销月"): "0.0",
-                                                        ren.get(march_col, march_col): "0.0",
-                                                        ren.get(today_col, today_col): "0.0",
-                                                        ren.get(scan_avg_col, scan_avg_col): "0.0",
-                                                    },
-                                                    percent_headers=percent_headers_out,
-                                                    percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
-                                                    group_headers=True,
+                                                _export_submit(
+                                                    k_cur,
+                                                    sanitize_filename(f"出库趋势分析_分省区_{now_tag}.xlsx"),
+                                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                                    df_to_excel_bytes,
+                                                    (df_x,),
+                                                    dict(
+                                                        sheet_name="趋势分析",
+                                                        title_lines=export_title_lines,
+                                                        number_headers=number_headers_out,
+                                                        number_formats={
+                                                            ren.get("可销月", "可销月"): "0.0",
+                                                            ren.get(march_col, march_col): "0.0",
+                                                            ren.get(today_col, today_col): "0.0",
+                                                            ren.get(scan_avg_col, scan_avg_col): "0.0",
+                                                        },
+                                                        percent_headers=percent_headers_out,
+                                                        percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
+                                                        group_headers=True,
+                                                    ),
                                                 )
-                                                _excel_cache[k_cur] = {
-                                                    "bytes": xlsx_bytes,
-                                                    "name": sanitize_filename(f"出库趋势分析_分省区_{now_tag}.xlsx"),
-                                                }
                                     with c_e2:
-                                        if k_cur in _excel_cache:
-                                            st.download_button(
-                                                "下载Excel（当前表）",
-                                                data=_excel_cache[k_cur]["bytes"],
-                                                file_name=_excel_cache[k_cur]["name"],
-                                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                                key=f"{export_id}_dl_cur",
-                                            )
+                                        _export_download(k_cur, "下载Excel（当前表）", f"{export_id}_dl_cur", "正在生成Excel（当前表）")
 
                                     k_all = _excel_key("all_store")
                                     k_all_dist = _excel_key("all_dist")
@@ -9295,7 +9825,7 @@ if uploaded_file:
                                     k_bundle_3s = _excel_key("bundle_3sheets")
                                     c_a1, c_a2, c_a3, c_a4, c_a5, c_a6, c_a7, c_a8, _ = st.columns([1.2, 1.5, 1.2, 1.5, 1.3, 1.7, 2.0, 2.2, 0.9])
                                     with c_a1:
-                                        if st.button("生成导出全部（经销商）", key=f"{export_id}_gen_all_dist"):
+                                        if st.button("生成导出全部（经销商）", key=f"{export_id}_gen_all_dist") and _export_needed(k_all_dist):
                                             with st.spinner("正在生成导出全部（经销商），数据量较大请稍候…"):
                                                 df_all_dist = _build_dist_detail_df(all_provinces=True)
                                                 title_all_dist = [
@@ -9337,36 +9867,31 @@ if uploaded_file:
                                                 if ren.get(scan_avg_col, scan_avg_col) in df_all_dist.columns:
                                                     number_headers_all_dist.add(scan_avg_col)
                                                 number_headers_all_dist = set([ren.get(c, c) for c in number_headers_all_dist])
-                                                xlsx_all_dist = _df_to_excel_bytes(
-                                                    df_all_dist,
-                                                    sheet_name="趋势分析",
-                                                    title_lines=title_all_dist,
-                                                    number_headers=number_headers_all_dist,
-                                                    number_formats={
-                                                        ren.get("可销月", "可销月"): "0.0",
-                                                        ren.get(march_col, march_col): "0.0",
-                                                        ren.get(today_col, today_col): "0.0",
-                                                        ren.get(scan_avg_col, scan_avg_col): "0.0",
-                                                    },
-                                                    percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all_dist.columns else []),
-                                                    percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
-                                                    group_headers=True,
+                                                _export_submit(
+                                                    k_all_dist,
+                                                    sanitize_filename(f"出库趋势分析_经销商_全部省区_{now_tag}.xlsx"),
+                                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                                    df_to_excel_bytes,
+                                                    (df_all_dist,),
+                                                    dict(
+                                                        sheet_name="趋势分析",
+                                                        title_lines=title_all_dist,
+                                                        number_headers=number_headers_all_dist,
+                                                        number_formats={
+                                                            ren.get("可销月", "可销月"): "0.0",
+                                                            ren.get(march_col, march_col): "0.0",
+                                                            ren.get(today_col, today_col): "0.0",
+                                                            ren.get(scan_avg_col, scan_avg_col): "0.0",
+                                                        },
+                                                        percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all_dist.columns else []),
+                                                        percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
+                                                        group_headers=True,
+                                                    ),
                                                 )
-                                                _excel_cache[k_all_dist] = {
-                                                    "bytes": xlsx_all_dist,
-                                                    "name": sanitize_filename(f"出库趋势分析_经销商_全部省区_{now_tag}.xlsx"),
-                                                }
                                     with c_a2:
-                                        if k_all_dist in _excel_cache:
-                                            st.download_button(
-                                                "下载导出全部（经销商）",
-                                                data=_excel_cache[k_all_dist]["bytes"],
-                                                file_name=_excel_cache[k_all_dist]["name"],
-                                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                                key=f"{export_id}_dl_all_dist",
-                                            )
+                                        _export_download(k_all_dist, "下载导出全部（经销商）", f"{export_id}_dl_all_dist", "正在生成导出全部（经销商）")
                                     with c_a3:
-                                        if st.button("生成导出全部（门店）", key=f"{export_id}_gen_all_store"):
+                                        if st.button("生成导出全部（门店）", key=f"{export_id}_gen_all_store") and _export_needed(k_all_store):
                                             with st.spinner("正在生成导出全部（门店明细），数据量较大请稍候…"):
                                                 df_all = _build_store_detail_df(all_provinces=True)
                                                 title_all = [
@@ -9431,31 +9956,26 @@ if uploaded_file:
                                                 if ren.get(scan_avg_col, scan_avg_col) in df_all.columns:
                                                     number_headers_all.add(scan_avg_col)
                                                 number_headers_all = set([ren.get(c, c) for c in number_headers_all])
-                                                xlsx_all = _df_to_excel_bytes(
-                                                    df_all,
-                                                    sheet_name="趋势分析",
-                                                    title_lines=title_all,
-                                                    number_headers=number_headers_all,
-                                                    number_formats=number_formats_all,
-                                                    percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all.columns else []),
-                                                    percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
-                                                    group_headers=True,
+                                                _export_submit(
+                                                    k_all_store,
+                                                    sanitize_filename(f"出库趋势分析_门店明细_全部省区_{now_tag}.xlsx"),
+                                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                                    df_to_excel_bytes,
+                                                    (df_all,),
+                                                    dict(
+                                                        sheet_name="趋势分析",
+                                                        title_lines=title_all,
+                                                        number_headers=number_headers_all,
+                                                        number_formats=number_formats_all,
+                                                        percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all.columns else []),
+                                                        percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
+                                                        group_headers=True,
+                                                    ),
                                                 )
-                                                _excel_cache[k_all_store] = {
-                                                    "bytes": xlsx_all,
-                                                    "name": sanitize_filename(f"出库趋势分析_门店明细_全部省区_{now_tag}.xlsx"),
-                                                }
                                     with c_a4:
-                                        if k_all_store in _excel_cache:
-                                            st.download_button(
-                                                "下载导出全部（门店）",
-                                                data=_excel_cache[k_all_store]["bytes"],
-                                                file_name=_excel_cache[k_all_store]["name"],
-                                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                                key=f"{export_id}_dl_all_store",
-                                            )
+                                        _export_download(k_all_store, "下载导出全部（门店）", f"{export_id}_dl_all_store", "正在生成导出全部（门店）")
                                     with c_a5:
-                                        if st.button("生成各省门店ZIP", key=f"{export_id}_gen_all_zip"):
+                                        if st.button("生成各省门店ZIP", key=f"{export_id}_gen_all_zip") and _export_needed(k_all_zip):
                                             with st.spinner("正在生成各省门店ZIP，请稍候…"):
                                                 df_all_raw = _build_store_detail_df(all_provinces=True)
                                                 
@@ -9517,25 +10037,26 @@ if uploaded_file:
                                                 percent_headers_all = set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all_raw.columns else [])
                                                 percent_formats_all = {ren.get(scan_rate_col, scan_rate_col): "0.0%"}
 
-                                                buf = io.BytesIO()
-                                                with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                                    provs = []
-                                                    if "省区" in df_all_raw.columns:
-                                                        provs = sorted([p for p in df_all_raw["省区"].dropna().unique() if p])
-                                                    for p in provs:
-                                                        df_p = df_all_raw[df_all_raw["省区"] == p].copy()
-                                                        if df_p.empty: continue
-                                                        sort_cols = [c for c in ["经销商", "门店"] if c in df_p.columns]
-                                                        if sort_cols:
-                                                            df_p = df_p.sort_values(sort_cols, kind="stable").reset_index(drop=True)
-                                                        title_p = [
-                                                            f"月度出库趋势表 - {p}（门店明细）",
-                                                            filter_line,
-                                                            f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                        ]
-                                                        df_p_ren = df_p.rename(columns=ren)
-                                                        xlsx_p = _df_to_excel_bytes(
-                                                            df_p_ren,
+                                                zip_members = []
+                                                provs = []
+                                                if "省区" in df_all_raw.columns:
+                                                    provs = sorted([p for p in df_all_raw["省区"].dropna().unique() if p])
+                                                for p in provs:
+                                                    df_p = df_all_raw[df_all_raw["省区"] == p].copy()
+                                                    if df_p.empty: continue
+                                                    sort_cols = [c for c in ["经销商", "门店"] if c in df_p.columns]
+                                                    if sort_cols:
+                                                        df_p = df_p.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+                                                    title_p = [
+                                                        f"月度出库趋势表 - {p}（门店明细）",
+                                                        filter_line,
+                                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                    ]
+                                                    df_p_ren = df_p.rename(columns=ren)
+                                                    zip_members.append((
+                                                        f"{p}.xlsx",
+                                                        df_p_ren,
+                                                        dict(
                                                             sheet_name="趋势分析",
                                                             title_lines=title_p,
                                                             number_headers=number_headers_all,
@@ -9543,14 +10064,17 @@ if uploaded_file:
                                                             percent_headers=percent_headers_all,
                                                             percent_formats=percent_formats_all,
                                                             group_headers=True,
-                                                        )
-                                                        zf.writestr(f"{p}.xlsx", xlsx_p)
-                                                buf.seek(0)
-                                                _excel_cache[k_all_zip] = {
-                                                    "bytes": buf.getvalue(),
-                                                    "name": f"出库趋势分析_各省门店.zip",
-                                                }
-                                        if st.button("生成经销商Excel ZIP", key=f"{export_id}_gen_dist_folder_zip"):
+                                                        ),
+                                                    ))
+                                                _export_submit(
+                                                    k_all_zip,
+                                                    f"出库趋势分析_各省门店.zip",
+                                                    "application/zip",
+                                                    build_xlsx_zip,
+                                                    (zip_members,),
+                                                    progress=True,
+                                                )
+                                        if st.button("生成经销商Excel ZIP", key=f"{export_id}_gen_dist_folder_zip") and _export_needed(k_dist_folder_zip):
                                             with st.spinner("正在生成经销商Excel ZIP（每个经销商一个Excel），请稍候…"):
                                                 df_all_raw = _build_store_detail_df(all_provinces=True)
 
@@ -9558,7 +10082,7 @@ if uploaded_file:
                                                 try:
                                                     if df_trend_universe is not None and not getattr(df_trend_universe, "empty", True) and "经销商名称" in df_trend_universe.columns:
                                                         tmp = df_trend_universe.copy()
-                                                        tmp["经销商名称"] = tmp["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                        tmp["经销商名称"] = _norm_key(tmp["经销商名称"])
                                                         if "客户简称" in tmp.columns:
                                                             tmp["客户简称"] = tmp["客户简称"].fillna("").astype(str).str.strip()
                                                             tmp = tmp[tmp["经销商名称"] != ""].copy()
@@ -9624,41 +10148,42 @@ if uploaded_file:
                                                     ren.get(scan_avg_col, scan_avg_col): "0.0",
                                                 }
 
-                                                buf = io.BytesIO()
-                                                with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                                    dists = []
-                                                    if "经销商" in df_all_raw.columns:
-                                                        dists = sorted([d for d in df_all_raw["经销商"].dropna().unique() if d])
-                                                    used_files = set()
-                                                    for dname in dists:
-                                                        df_d = df_all_raw[df_all_raw["经销商"] == dname].copy()
-                                                        if df_d.empty:
-                                                            continue
-                                                        sort_cols = [c for c in ["省区", "门店"] if c in df_d.columns]
-                                                        if sort_cols:
-                                                            df_d = df_d.sort_values(sort_cols, kind="stable").reset_index(drop=True)
-
-                                                        key_norm = re.sub(r"\s+", "", str(dname))
-                                                        abbr = (abbr_map.get(key_norm) or "").strip()
-                                                        if not abbr:
-                                                            abbr = str(dname)
-                                                        base_fname = sanitize_filename(abbr, default=str(dname)) or sanitize_filename(str(dname), default="经销商")
-                                                        fname = base_fname + ".xlsx"
-                                                        if fname in used_files:
-                                                            _p0 = ""
-                                                            if "省区" in df_d.columns:
-                                                                _p0 = str(df_d["省区"].iloc[0] or "").strip()
-                                                            fname = sanitize_filename(f"{base_fname}_{_p0}" if _p0 else f"{base_fname}_{sanitize_filename(str(dname), default='经销商')}", default=base_fname) + ".xlsx"
-                                                        used_files.add(fname)
-
-                                                        title_d = [
-                                                            f"月度出库趋势表 - {dname}（门店明细）",
-                                                            filter_line,
-                                                            f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                        ]
-                                                        df_d_ren = df_d.rename(columns=ren)
-                                                        xlsx_d = _df_to_excel_bytes(
-                                                            df_d_ren,
+                                                zip_members = []
+                                                dists = []
+                                                if "经销商" in df_all_raw.columns:
+                                                    dists = sorted([d for d in df_all_raw["经销商"].dropna().unique() if d])
+                                                used_files = set()
+                                                for dname in dists:
+                                                    df_d = df_all_raw[df_all_raw["经销商"] == dname].copy()
+                                                    if df_d.empty:
+                                                        continue
+                                                    sort_cols = [c for c in ["省区", "门店"] if c in df_d.columns]
+                                                    if sort_cols:
+                                                        df_d = df_d.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+                                                    key_norm = re.sub(r"\s+", "", str(dname))
+                                                    abbr = (abbr_map.get(key_norm) or "").strip()
+                                                    if not abbr:
+                                                        abbr = str(dname)
+                                                    base_fname = sanitize_filename(abbr, default=str(dname)) or sanitize_filename(str(dname), default="经销商")
+                                                    fname = base_fname + ".xlsx"
+                                                    if fname in used_files:
+                                                        _p0 = ""
+                                                        if "省区" in df_d.columns:
+                                                            _p0 = str(df_d["省区"].iloc[0] or "").strip()
+                                                        fname = sanitize_filename(f"{base_fname}_{_p0}" if _p0 else f"{base_fname}_{sanitize_filename(str(dname), default='经销商')}", default=base_fname) + ".xlsx"
+                                                    used_files.add(fname)
+
+                                                    title_d = [
+                                                        f"月度出库趋势表 - {dname}（门店明细）",
+                                                        filter_line,
+                                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                    ]
+                                                    df_d_ren = df_d.rename(columns=ren)
+                                                    zip_members.append((
+                                                        fname,
+                                                        df_d_ren,
+                                                        dict(
                                                             sheet_name="趋势分析",
                                                             title_lines=title_d,
                                                             number_headers=number_headers_all,
@@ -9666,72 +10191,63 @@ if uploaded_file:
                                                             percent_headers=percent_headers_all,
                                                             percent_formats=percent_formats_all,
                                                             group_headers=True,
-                                                        )
-                                                        zf.writestr(fname, xlsx_d)
-                                                buf.seek(0)
-                                                _excel_cache[k_dist_folder_zip] = {
-                                                    "bytes": buf.getvalue(),
-                                                    "name": sanitize_filename(f"出库趋势分析_经销商ExcelZIP_{now_tag}.zip"),
-                                                }
+                                                        ),
+                                                    ))
+                                                _export_submit(
+                                                    k_dist_folder_zip,
+                                                    sanitize_filename(f"出库趋势分析_经销商ExcelZIP_{now_tag}.zip"),
+                                                    "application/zip",
+                                                    build_xlsx_zip,
+                                                    (zip_members,),
+                                                    progress=True,
+                                                )
                                     with c_a6:
-                                        if k_all_zip in _excel_cache:
-                                            st.download_button(
-                                                "下载各省门店ZIP",
-                                                data=_excel_cache[k_all_zip]["bytes"],
-                                                file_name=_excel_cache[k_all_zip]["name"],
-                                                mime="application/zip",
-                                                key=f"{export_id}_dl_all_zip",
-                                            )
-                                        if k_dist_folder_zip in _excel_cache:
-                                            st.download_button(
-                                                "下载经销商Excel ZIP",
-                                                data=_excel_cache[k_dist_folder_zip]["bytes"],
-                                                file_name=_excel_cache[k_dist_folder_zip]["name"],
-                                                mime="application/zip",
-                                                key=f"{export_id}_dl_dist_folder_zip",
-                                            )
+                                        _export_download(k_all_zip, "下载各省门店ZIP", f"{export_id}_dl_all_zip", "正在生成各省门店ZIP")
+                                        _export_download(k_dist_folder_zip, "下载经销商Excel ZIP", f"{export_id}_dl_dist_folder_zip", "正在生成经销商Excel ZIP")
                                     with c_a7:
-                                        if st.button("生成分省区、客户、门店表格", key=f"{export_id}_gen_bundle_3s"):
+                                        if st.button("生成分省区、客户、门店表格", key=f"{export_id}_gen_bundle_3s") and _export_needed(k_bundle_3s):
                                             with st.spinner("正在生成分省区、客户、门店表格，数据量较大请稍候…"):
-                                                if k_cur not in _excel_cache:
-                                                    df_x = _build_current_excel_df()
-                                                    ren = {}
-                                                    for c in df_x.columns:
-                                                        if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
-                                                            ren[c] = f"发货分析-{c}"
-                                                    for c in sel_month_cols:
-                                                        if c in df_x.columns:
-                                                            ren[c] = f"出库分析-{c}"
-                                                    if avg_header in df_x.columns:
-                                                        ren[avg_header] = f"出库分析-{avg_header}"
-                                                    if march_col in df_x.columns:
-                                                        ren[march_col] = f"出库分析-{march_col}"
-                                                    if today_col in df_x.columns:
-                                                        ren[today_col] = f"出库分析-{today_col}"
-                                                    if "趋势" in df_x.columns:
-                                                        ren["趋势"] = "出库分析-趋势图"
-                                                    if "趋势类型" in df_x.columns:
-                                                        ren["趋势类型"] = "出库分析-趋势类型"
-                                                    if "库存" in df_x.columns:
-                                                        ren["库存"] = "库存分析-库存"
-                                                    if "可销月" in df_x.columns:
-                                                        ren["可销月"] = "库存分析-可销月"
-                                                    for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                        if _c in df_x.columns:
-                                                            ren[_c] = f"新客分析-{_c}"
-                                                    if scan_avg_col in df_x.columns:
-                                                        ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
-                                                    if scan_rate_col in df_x.columns:
-                                                        ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
-                                                    df_x = df_x.rename(columns=ren)
-                                                    number_headers_out = set()
-                                                    for c in number_headers_current:
-                                                        number_headers_out.add(ren.get(c, c))
-                                                    percent_headers_out = set()
-                                                    for c in percent_headers_current:
-                                                        percent_headers_out.add(ren.get(c, c))
-                                                    xlsx_bytes = _df_to_excel_bytes(
-                                                        df_x,
+                                                bundle_parts = []
+                                                df_x = _build_current_excel_df()
+                                                ren = {}
+                                                for c in df_x.columns:
+                                                    if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
+                                                        ren[c] = f"发货分析-{c}"
+                                                for c in sel_month_cols:
+                                                    if c in df_x.columns:
+                                                        ren[c] = f"出库分析-{c}"
+                                                if avg_header in df_x.columns:
+                                                    ren[avg_header] = f"出库分析-{avg_header}"
+                                                if march_col in df_x.columns:
+                                                    ren[march_col] = f"出库分析-{march_col}"
+                                                if today_col in df_x.columns:
+                                                    ren[today_col] = f"出库分析-{today_col}"
+                                                if "趋势" in df_x.columns:
+                                                    ren["趋势"] = "出库分析-趋势图"
+                                                if "趋势类型" in df_x.columns:
+                                                    ren["趋势类型"] = "出库分析-趋势类型"
+                                                if "库存" in df_x.columns:
+                                                    ren["库存"] = "库存分析-库存"
+                                                if "可销月" in df_x.columns:
+                                                    ren["可销月"] = "库存分析-可销月"
+                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                    if _c in df_x.columns:
+                                                        ren[_c] = f"新客分析-{_c}"
+                                                if scan_avg_col in df_x.columns:
+                                                    ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
+                                                if scan_rate_col in df_x.columns:
+                                                    ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
+                                                df_x = df_x.rename(columns=ren)
+                                                number_headers_out = set()
+                                                for c in number_headers_current:
+                                                    number_headers_out.add(ren.get(c, c))
+                                                percent_headers_out = set()
+                                                for c in percent_headers_current:
+                                                    percent_headers_out.add(ren.get(c, c))
+                                                bundle_parts.append((
+                                                    "分省区",
+                                                    df_x,
+                                                    dict(
                                                         sheet_name="趋势分析",
                                                         title_lines=export_title_lines,
                                                         number_headers=number_headers_out,
@@ -9748,57 +10264,55 @@ if uploaded_file:
                                                         percent_headers=percent_headers_out,
                                                         percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
                                                         group_headers=True,
-                                                    )
-                                                    _excel_cache[k_cur] = {
-                                                        "bytes": xlsx_bytes,
-                                                        "name": sanitize_filename(f"出库趋势分析_分省区_{now_tag}.xlsx"),
-                                                    }
-
-                                                if k_all_dist not in _excel_cache:
-                                                    df_all_dist = _build_dist_detail_df(all_provinces=True)
-                                                    title_all_dist = [
-                                                        "月度出库趋势表 - 导出全部经销商",
-                                                        filter_line,
-                                                        "区域：全部省区（省区→经销商）",
-                                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                    ]
-                                                    ren = {}
-                                                    for c in df_all_dist.columns:
-                                                        if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
-                                                            ren[c] = f"发货分析-{c}"
-                                                    for c in sel_month_cols:
-                                                        if c in df_all_dist.columns:
-                                                            ren[c] = f"出库分析-{c}"
-                                                    if avg_header in df_all_dist.columns:
-                                                        ren[avg_header] = f"出库分析-{avg_header}"
-                                                    if march_col in df_all_dist.columns:
-                                                        ren[march_col] = f"出库分析-{march_col}"
-                                                    if today_col in df_all_dist.columns:
-                                                        ren[today_col] = f"出库分析-{today_col}"
-                                                    if "趋势类型" in df_all_dist.columns:
-                                                        ren["趋势类型"] = "出库分析-趋势类型"
-                                                    if "库存" in df_all_dist.columns:
-                                                        ren["库存"] = "库存分析-库存"
-                                                    if "可销月" in df_all_dist.columns:
-                                                        ren["可销月"] = "库存分析-可销月"
-                                                    for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                        if _c in df_all_dist.columns:
-                                                            ren[_c] = f"新客分析-{_c}"
-                                                    if scan_avg_col in df_all_dist.columns:
-                                                        ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
-                                                    if scan_rate_col in df_all_dist.columns:
-                                                        ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
-                                                    df_all_dist = df_all_dist.rename(columns=ren)
-
-                                                    number_headers_all_dist = set(sel_month_cols + [avg_header, march_col, today_col, "库存", "可销月", "1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"])
-                                                    for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                        if ren.get(_c, _c) in df_all_dist.columns:
-                                                            number_headers_all_dist.add(_c)
-                                                    if ren.get(scan_avg_col, scan_avg_col) in df_all_dist.columns:
-                                                        number_headers_all_dist.add(scan_avg_col)
-                                                    number_headers_all_dist = set([ren.get(c, c) for c in number_headers_all_dist])
-                                                    xlsx_all_dist = _df_to_excel_bytes(
-                                                        df_all_dist,
+                                                    ),
+                                                ))
+
+                                                df_all_dist = _build_dist_detail_df(all_provinces=True)
+                                                title_all_dist = [
+                                                    "月度出库趋势表 - 导出全部经销商",
+                                                    filter_line,
+                                                    "区域：全部省区（省区→经销商）",
+                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                ]
+                                                ren = {}
+                                                for c in df_all_dist.columns:
+                                                    if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
+                                                        ren[c] = f"发货分析-{c}"
+                                                for c in sel_month_cols:
+                                                    if c in df_all_dist.columns:
+                                                        ren[c] = f"出库分析-{c}"
+                                                if avg_header in df_all_dist.columns:
+                                                    ren[avg_header] = f"出库分析-{avg_header}"
+                                                if march_col in df_all_dist.columns:
+                                                    ren[march_col] = f"出库分析-{march_col}"
+                                                if today_col in df_all_dist.columns:
+                                                    ren[today_col] = f"出库分析-{today_col}"
+                                                if "趋势类型" in df_all_dist.columns:
+                                                    ren["趋势类型"] = "出库分析-趋势类型"
+                                                if "库存" in df_all_dist.columns:
+                                                    ren["库存"] = "库存分析-库存"
+                                                if "可销月" in df_all_dist.columns:
+                                                    ren["可销月"] = "库存分析-可销月"
+                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                    if _c in df_all_dist.columns:
+                                                        ren[_c] = f"新客分析-{_c}"
+                                                if scan_avg_col in df_all_dist.columns:
+                                                    ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
+                                                if scan_rate_col in df_all_dist.columns:
+                                                    ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
+                                                df_all_dist = df_all_dist.rename(columns=ren)
+
+                                                number_headers_all_dist = set(sel_month_cols + [avg_header, march_col, today_col, "库存", "可销月", "1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"])
+                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                    if ren.get(_c, _c) in df_all_dist.columns:
+                                                        number_headers_all_dist.add(_c)
+                                                if ren.get(scan_avg_col, scan_avg_col) in df_all_dist.columns:
+                                                    number_headers_all_dist.add(scan_avg_col)
+                                                number_headers_all_dist = set([ren.get(c, c) for c in number_headers_all_dist])
+                                                bundle_parts.append((
+                                                    "分经销商",
+                                                    df_all_dist,
+                                                    dict(
                                                         sheet_name="趋势分析",
                                                         title_lines=title_all_dist,
                                                         number_headers=number_headers_all_dist,
@@ -9815,77 +10329,75 @@ if uploaded_file:
                                                         percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all_dist.columns else []),
                                                         percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
                                                         group_headers=True,
-                                                    )
-                                                    _excel_cache[k_all_dist] = {
-                                                        "bytes": xlsx_all_dist,
-                                                        "name": sanitize_filename(f"出库趋势分析_经销商_全部省区_{now_tag}.xlsx"),
-                                                    }
-
-                                                if k_all_store not in _excel_cache:
-                                                    df_all = _build_store_detail_df(all_provinces=True)
-                                                    title_all = [
-                                                        "月度出库趋势表 - 导出全部门店明细",
-                                                        filter_line,
-                                                        "区域：全部省区（省区→经销商→门店）",
-                                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                    ]
-                                                    ren = {}
-                                                    for c in df_all.columns:
-                                                        if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
-                                                            ren[c] = f"发货分析-{c}"
-                                                    for c in sel_month_cols:
-                                                        if c in df_all.columns:
-                                                            ren[c] = f"出库分析-{c}"
-                                                    if avg_header in df_all.columns:
-                                                        ren[avg_header] = f"出库分析-{avg_header}"
-                                                    if march_col in df_all.columns:
-                                                        ren[march_col] = f"出库分析-{march_col}"
-                                                    if today_col in df_all.columns:
-                                                        ren[today_col] = f"出库分析-{today_col}"
-                                                    if "趋势类型" in df_all.columns:
-                                                        ren["趋势类型"] = "出库分析-趋势类型"
-                                                    for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                        if _c in df_all.columns:
-                                                            ren[_c] = f"新客分析-{_c}"
-                                                    if scan_avg_col in df_all.columns:
-                                                        ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
-                                                    if scan_rate_col in df_all.columns:
-                                                        ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
-                                                    for p_label, _yms in roll_periods:
-                                                        for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
-                                                            if c in df_all.columns:
-                                                                ren[c] = f"门店类型分析-{c}"
-                                                    for i in range(1, len(roll_periods)):
-                                                        c = f"{roll_periods[i][0]}变动"
+                                                    ),
+                                                ))
+
+                                                df_all = _build_store_detail_df(all_provinces=True)
+                                                title_all = [
+                                                    "月度出库趋势表 - 导出全部门店明细",
+                                                    filter_line,
+                                                    "区域：全部省区（省区→经销商→门店）",
+                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                ]
+                                                ren = {}
+                                                for c in df_all.columns:
+                                                    if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
+                                                        ren[c] = f"发货分析-{c}"
+                                                for c in sel_month_cols:
+                                                    if c in df_all.columns:
+                                                        ren[c] = f"出库分析-{c}"
+                                                if avg_header in df_all.columns:
+                                                    ren[avg_header] = f"出库分析-{avg_header}"
+                                                if march_col in df_all.columns:
+                                                    ren[march_col] = f"出库分析-{march_col}"
+                                                if today_col in df_all.columns:
+                                                    ren[today_col] = f"出库分析-{today_col}"
+                                                if "趋势类型" in df_all.columns:
+                                                    ren["趋势类型"] = "出库分析-趋势类型"
+                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                    if _c in df_all.columns:
+                                                        ren[_c] = f"新客分析-{_c}"
+                                                if scan_avg_col in df_all.columns:
+                                                    ren[scan_avg_col] = f"扫码分析-{scan_avg_header}"
+                                                if scan_rate_col in df_all.columns:
+                                                    ren[scan_rate_col] = f"扫码分析-{scan_rate_col}"
+                                                for p_label, _yms in roll_periods:
+                                                    for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
                                                         if c in df_all.columns:
                                                             ren[c] = f"门店类型分析-{c}"
-                                                    if "近三周期变化" in df_all.columns:
-                                                        ren["近三周期变化"] = "门店类型分析-近三周期变化"
-                                                    df_all = df_all.rename(columns=ren)
-
-                                                    number_headers_all = set(sel_month_cols + [avg_header, march_col, today_col, "1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"])
-                                                    number_formats_all = {
-                                                        ren.get(avg_header, avg_header): "0.0",
-                                                        ren.get("1月发货额-万元", "1月发货额-万元"): "0.0",
-                                                        ren.get("2月发货额-万元", "2月发货额-万元"): "0.0",
-                                                        ren.get("3月发货额-万元", "3月发货额-万元"): "0.0",
-                                                        ren.get(march_col, march_col): "0.0",
-                                                        "3月出库": "0.0",
-                                                        ren.get(scan_avg_col, scan_avg_col): "0.0",
-                                                    }
-                                                    for p_label, _yms in roll_periods:
-                                                        c = f"{p_label}月均出库"
-                                                        if ren.get(c, c) in df_all.columns:
-                                                            number_headers_all.add(c)
-                                                            number_formats_all[ren.get(c, c)] = "0.0"
-                                                    for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                        if ren.get(_c, _c) in df_all.columns:
-                                                            number_headers_all.add(_c)
-                                                    if ren.get(scan_avg_col, scan_avg_col) in df_all.columns:
-                                                        number_headers_all.add(scan_avg_col)
-                                                    number_headers_all = set([ren.get(c, c) for c in number_headers_all])
-                                                    xlsx_all = _df_to_excel_bytes(
-                                                        df_all,
+                                                for i in range(1, len(roll_periods)):
+                                                    c = f"{roll_periods[i][0]}变动"
+                                                    if c in df_all.columns:
+                                                        ren[c] = f"门店类型分析-{c}"
+                                                if "近三周期变化" in df_all.columns:
+                                                    ren["近三周期变化"] = "门店类型分析-近三周期变化"
+                                                df_all = df_all.rename(columns=ren)
+
+                                                number_headers_all = set(sel_month_cols + [avg_header, march_col, today_col, "1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"])
+                                                number_formats_all = {
+                                                    ren.get(avg_header, avg_header): "0.0",
+                                                    ren.get("1月发货额-万元", "1月发货额-万元"): "0.0",
+                                                    ren.get("2月发货额-万元", "2月发货额-万元"): "0.0",
+                                                    ren.get("3月发货额-万元", "3月发货额-万元"): "0.0",
+                                                    ren.get(march_col, march_col): "0.0",
+                                                    "3月出库": "0.0",
+                                                    ren.get(scan_avg_col, scan_avg_col): "0.0",
+                                                }
+                                                for p_label, _yms in roll_periods:
+                                                    c = f"{p_label}月均出库"
+                                                    if ren.get(c, c) in df_all.columns:
+                                                        number_headers_all.add(c)
+                                                        number_formats_all[ren.get(c, c)] = "0.0"
+                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                    if ren.get(_c, _c) in df_all.columns:
+                                                        number_headers_all.add(_c)
+                                                if ren.get(scan_avg_col, scan_avg_col) in df_all.columns:
+                                                    number_headers_all.add(scan_avg_col)
+                                                number_headers_all = set([ren.get(c, c) for c in number_headers_all])
+                                                bundle_parts.append((
+                                                    "分门店",
+                                                    df_all,
+                                                    dict(
                                                         sheet_name="趋势分析",
                                                         title_lines=title_all,
                                                         number_headers=number_headers_all,
@@ -9893,37 +10405,24 @@ if uploaded_file:
                                                         percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_all.columns else []),
                                                         percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
                                                         group_headers=True,
-                                                    )
-                                                    _excel_cache[k_all_store] = {
-                                                        "bytes": xlsx_all,
-                                                        "name": sanitize_filename(f"出库趋势分析_门店明细_全部省区_{now_tag}.xlsx"),
-                                                    }
-
-                                                xlsx_bundle = _merge_single_sheet_workbooks(
-                                                    [
-                                                        (_excel_cache[k_cur]["bytes"], "分省区"),
-                                                        (_excel_cache[k_all_dist]["bytes"], "分经销商"),
-                                                        (_excel_cache[k_all_store]["bytes"], "分门店"),
-                                                    ]
+                                                    ),
+                                                ))
+
+                                                _export_submit(
+                                                    k_bundle_3s,
+                                                    sanitize_filename(f"出库趋势分析_分省区_分经销商_分门店_{now_tag}.xlsx"),
+                                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                                    sheets_to_excel_bytes,
+                                                    (bundle_parts,),
+                                                    progress=True,
                                                 )
-                                                _excel_cache[k_bundle_3s] = {
-                                                    "bytes": xlsx_bundle,
-                                                    "name": sanitize_filename(f"出库趋势分析_分省区_分经销商_分门店_{now_tag}.xlsx"),
-                                                }
                                     with c_a8:
-                                        if k_bundle_3s in _excel_cache:
-                                            st.download_button(
-                                                "导出分省区、客户、门店表格",
-                                                data=_excel_cache[k_bundle_3s]["bytes"],
-                                                file_name=_excel_cache[k_bundle_3s]["name"],
-                                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                                key=f"{export_id}_dl_bundle_3s",
-                                            )
+                                        _export_download(k_bundle_3s, "导出分省区、客户、门店表格", f"{export_id}_dl_bundle_3s", "正在生成分省区、客户、门店表格")
                                 else:
                                     k_detail = _excel_key("detail_store")
                                     c_d1, c_d2, _ = st.columns([1.3, 2.0, 5.7])
                                     with c_d1:
-                                        if st.button("生成门店明细Excel", key=f"{export_id}_gen_detail"):
+                                        if st.button("生成门店明细Excel", key=f"{export_id}_gen_detail") and _export_needed(k_detail):
                                             with st.spinner("正在生成门店明细Excel…"):
                                                 df_detail = _build_store_detail_df(all_provinces=False)
                                                 title_detail = [
@@ -9988,32 +10487,24 @@ if uploaded_file:
                                                 if ren.get(scan_avg_col, scan_avg_col) in df_detail.columns:
                                                     number_headers_detail.add(scan_avg_col)
                                                 number_headers_detail = set([ren.get(c, c) for c in number_headers_detail])
-                                                xlsx_detail = _df_to_excel_bytes(
-                                                    df_detail,
-                                                    sheet_name="趋势分析",
-                                                    title_lines=title_detail,
-                                                    number_headers=number_headers_detail,
-                                                    number_formats=number_formats_detail,
-                                                    percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_detail.columns else []),
-                                                    percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
-                                                    group_headers=True,
+                                                _export_submit(
+                                                    k_detail,
+                                                    sanitize_filename(f"出库趋势分析_门店明细_{region_label}_{now_tag}.xlsx"),
+                                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                                    df_to_excel_bytes,
+                                                    (df_detail,),
+                                                    dict(
+                                                        sheet_name="趋势分析",
+                                                        title_lines=title_detail,
+                                                        number_headers=number_headers_detail,
+                                                        number_formats=number_formats_detail,
+                                                        percent_headers=set([ren.get(scan_rate_col, scan_rate_col)] if ren.get(scan_rate_col, scan_rate_col) in df_detail.columns else []),
+                                                        percent_formats={ren.get(scan_rate_col, scan_rate_col): "0.0%"},
+                                                        group_headers=True,
+                                                    ),
                                                 )
-                                                _excel_cache[k_detail] = {
-                                                    "bytes": xlsx_detail,
-                                                    "name": sanitize_filename(f"出库趋势分析_门店明细_{region_label}_{now_tag}.xlsx"),
-                                                }
                                     with c_d2:
-                                        if k_detail in _excel_cache:
-                                            st.download_button(
-                                                "下载门店明细Excel",
-                                                data=_excel_cache[k_detail]["bytes"],
-                                                file_name=_excel_cache[k_detail]["name"],
-                                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                                key=f"{export_id}_dl_detail",
-                                            )
-                                _png_state_key = f"{export_id}_png"
-                                _png_name_key = f"{export_id}_name"
-                                _png_sig_key = f"{export_id}_png_sig"
+                                        _export_download(k_detail, "下载门店明细Excel", f"{export_id}_dl_detail", "正在生成门店明细Excel")
                                 _png_sig_march_sum = 0.0
                                 if march_col in df_export.columns:
                                     _png_sig_march_sum = float(pd.to_numeric(df_export[march_col], errors="coerce").fillna(0.0).sum())
@@ -10029,10 +10520,7 @@ if uploaded_file:
                                     _dist_sel,
                                     _png_sig_march_sum,
                                 )
-                                if st.session_state.get(_png_sig_key) != _png_sig:
-                                    st.session_state.pop(_png_state_key, None)
-                                    st.session_state.pop(_png_name_key, None)
-                                    st.session_state[_png_sig_key] = _png_sig
+                                k_png = ("png_cur", export_id, sig) + _png_sig
 
                                 df_png = df_export.copy()
                                 col_types_png = dict(col_types or {})
@@ -10093,17 +10581,16 @@ if uploaded_file:
                                         df_png.insert(int(inv_idx), "库存分析\n客户名", base_name)
                                         col_types_png["库存分析\n客户名"] = "text"
 
-                                if st.button("生成表格图片（含趋势/颜色）", key=f"{export_id}_btn"):
-                                    st.session_state[_png_state_key] = _pil_table_png(df_png, export_title_lines, font_size=16, col_types=col_types_png)
-                                    st.session_state[_png_name_key] = f"月度出库趋势_{region_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                                if st.session_state.get(_png_state_key):
-                                    st.download_button(
-                                        "下载PNG",
-                                        data=st.session_state[_png_state_key],
-                                        file_name=st.session_state.get(_png_name_key, "月度出库趋势.png"),
-                                        mime="image/png",
-                                        key=f"{export_id}_dl",
+                                if st.button("生成表格图片（含趋势/颜色）", key=f"{export_id}_btn") and _export_needed(k_png):
+                                    _export_submit(
+                                        k_png,
+                                        f"月度出库趋势_{region_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png",
+                                        "image/png",
+                                        _pil_table_png,
+                                        (df_png, export_title_lines),
+                                        dict(font_size=16, col_types=col_types_png),
                                     )
+                                _export_download(k_png, "下载PNG", f"{export_id}_dl", "正在生成表格图片")
 
                                 def _compute_pv(level: int, prov: str | None = None, dist: str | None = None):
                                     scan_yms = [202601, 202602, 202603]
@@ -10113,66 +10600,44 @@ if uploaded_file:
 
                                     view = "省区"
                                     grp = "省区"
-                                    d_base = df_trend_base.copy()
-                                    d = df_trend_base.copy()
+                                    d = df_trend_base
                                     if level == 2:
                                         view = "经销商"
                                         grp = "经销商名称"
                                     elif level == 3:
                                         view = "门店"
                                         grp = "_门店名" if "_门店名" in d.columns else None
+                                    store_mask = np.ones(len(trend_stores), dtype=bool)
                                     if prov:
-                                        d_base = d_base[d_base["省区"].astype(str).str.strip() == str(prov).strip()].copy()
-                                        d = d[d["省区"].astype(str).str.strip() == str(prov).strip()].copy()
+                                        d = d[d["省区"].astype(str).str.strip() == str(prov).strip()]
+                                        store_mask &= (trend_stores["省区"].astype(str).str.strip() == str(prov).strip()).to_numpy()
                                     if dist:
-                                        d_base = d_base[d_base["经销商名称"].astype(str).str.strip() == str(dist).strip()].copy()
-                                        d = d[d["经销商名称"].astype(str).str.strip() == str(dist).strip()].copy()
+                                        d = d[d["经销商名称"].astype(str).str.strip() == str(dist).strip()]
+                                        store_mask &= (trend_stores["经销商名称"].astype(str).str.strip() == str(dist).strip()).to_numpy()
                                     if grp is None:
                                         return None, view, grp
-                                    d_base = d_base[d_base[grp].notna()].copy()
-                                    d = d[d[grp].notna()].copy()
+                                    grp_mask = store_mask & trend_stores[grp].notna().to_numpy()
+                                    mod_mask = _cube_module_mask(out_cube, sel_big, sel_small, sel_prod)
+                                    # Row-level slice, only for the day-level 当日 / 当月 columns below.
+                                    d = d[d[grp].notna()]
                                     if sel_big != '全部' and '_模块大类' in d.columns:
-                                        d = d[d['_模块大类'].astype(str).str.strip() == str(sel_big).strip()].copy()
+                                        d = d[d['_模块大类'].astype(str).str.strip() == str(sel_big).strip()]
                                     if sel_small != '全部' and '_模块小类' in d.columns:
-                                        d = d[d['_模块小类'].astype(str).str.strip() == str(sel_small).strip()].copy()
+                                        d = d[d['_模块小类'].astype(str).str.strip() == str(sel_small).strip()]
                                     if sel_prod and '_模块出库产品' in d.columns:
                                         sel_prod_norm = [str(x).strip() for x in sel_prod if str(x).strip()]
                                         if sel_prod_norm:
-                                            d = d[d['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)].copy()
-                                    d_all = d.copy()
-                                    if d.empty:
-                                        d = pd.DataFrame(columns=[grp, "_ym", "数量(箱)"])
-                                    else:
-                                        d = d[d["_ym"].isin(sel_yms)].copy()
-                                        d["数量(箱)"] = pd.to_numeric(d.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                    agg2 = (
-                                        d.groupby([grp, "_ym"], as_index=False)["数量(箱)"]
-                                        .sum()
-                                        .rename(columns={grp: view})
-                                    )
-                                    pv2 = agg2.pivot(index=view, columns="_ym", values="数量(箱)").fillna(0.0)
-
-                                    df_names2 = df_trend_universe.copy()
-                                    if prov and '省区' in df_names2.columns:
-                                        df_names2 = df_names2[df_names2['省区'].astype(str).str.strip() == str(prov).strip()].copy()
-                                    if dist and '经销商名称' in df_names2.columns:
-                                        df_names2 = df_names2[df_names2['经销商名称'].astype(str).str.strip() == str(dist).strip()].copy()
-                                    if sel_big != '全部' and '_模块大类' in df_names2.columns:
-                                        df_names2 = df_names2[df_names2['_模块大类'].astype(str).str.strip() == str(sel_big).strip()].copy()
-                                    if sel_small != '全部' and '_模块小类' in df_names2.columns:
-                                        df_names2 = df_names2[df_names2['_模块小类'].astype(str).str.strip() == str(sel_small).strip()].copy()
-                                    if sel_prod and '_模块出库产品' in df_names2.columns:
-                                        sel_prod_norm = [str(x).strip() for x in sel_prod if str(x).strip()]
-                                        if sel_prod_norm:
-                                            df_names2 = df_names2[df_names2['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)].copy()
+                                            d = d[d['_模块出库产品'].astype(str).str.strip().isin(sel_prod_norm)]
+                                    d_all = d
+
+                                    sel_yms_u = list(dict.fromkeys(int(x) for x in sel_yms))
+                                    s2, _ = _cube_store_months(out_cube, sel_yms_u, grp_mask, mod_mask, stores=trend_stores)
+                                    pv2 = s2.groupby(grp)[sel_yms_u].sum().rename_axis(view)
+
+                                    df_names2, _ = _cube_store_months(out_cube, [], store_mask, mod_mask, any_month=True, stores=trend_stores)
 
                                     invalid_names = {'', 'nan', 'none', 'null'}
-                                    if grp == "省区" and '省区' in df_names2.columns:
-                                        base2 = df_names2['省区'].dropna().astype(str).str.strip().unique().tolist()
-                                    elif grp == "经销商名称" and '经销商名称' in df_names2.columns:
-                                        base2 = df_names2['经销商名称'].dropna().astype(str).str.strip().unique().tolist()
-                                    else:
-                                        base2 = df_names2[grp].dropna().astype(str).str.strip().unique().tolist() if grp in df_names2.columns else []
+                                    base2 = df_names2[grp].dropna().astype(str).str.strip().unique().tolist() if grp in df_names2.columns else []
                                     base2 = sorted([x for x in base2 if x and x.lower() not in invalid_names])
                                     if base2:
                                         df_skel = pd.DataFrame({view: base2})
@@ -10207,7 +10672,7 @@ if uploaded_file:
                                             for c in ["省区", "经销商名称", "大类", "小类", "小类码", "中类", "重量"]:
                                                 if c in sp.columns:
                                                     if c == "经销商名称":
-                                                        sp[c] = sp[c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                        sp[c] = _norm_key(sp[c])
                                                     else:
                                                         sp[c] = sp[c].fillna("").astype(str).str.strip()
                                             sp["年份"] = pd.to_numeric(sp.get("年份", 0), errors="coerce").fillna(0).astype(int)
@@ -10248,15 +10713,15 @@ if uploaded_file:
                                                         df_stock_raw[["经销商全称", "经销商名称"]]
                                                         .dropna()
                                                         .astype(str)
-                                                        .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                        .apply(_norm_key)
                                                         .drop_duplicates()
                                                     )
                                                     dist_map2 = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
-                                            sp["_k_dist"] = sp["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            sp["_k_dist"] = _norm_key(sp["经销商名称"])
                                             if dist_map2:
                                                 sp["_k_dist"] = sp["_k_dist"].map(dist_map2).fillna(sp["_k_dist"])
                                             gsp = sp.groupby(["_k_dist", "_ym"], as_index=False).agg({"发货箱数": "sum"})
-                                            pv2["_k_dist"] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv2["_k_dist"] = _norm_key(pv2[view])
                                             if dist_map2:
                                                 pv2["_k_dist"] = pv2["_k_dist"].map(dist_map2).fillna(pv2["_k_dist"])
                                             ship_cols_qty = ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]
@@ -10278,7 +10743,7 @@ if uploaded_file:
                                         for _c in ["省区", "经销商名称", "产品大类", "产品小类", "重量"]:
                                             if _c in _s.columns:
                                                 if _c == "经销商名称":
-                                                    _s[_c] = _s[_c].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                    _s[_c] = _norm_key(_s[_c])
                                                 else:
                                                     _s[_c] = _s[_c].fillna("").astype(str).str.strip()
                                         if "箱数" in _s.columns:
@@ -10312,7 +10777,7 @@ if uploaded_file:
                                         if "省区" in nc.columns:
                                             nc["省区"] = nc["省区"].fillna("").astype(str).str.strip()
                                         if "经销商名称" in nc.columns:
-                                            nc["经销商名称"] = nc["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            nc["经销商名称"] = _norm_key(nc["经销商名称"])
                                         if "门店名称" in nc.columns:
                                             nc["门店名称"] = nc["门店名称"].fillna("").astype(str).str.strip()
                                         if "新客数" in nc.columns:
@@ -10322,7 +10787,7 @@ if uploaded_file:
                                         if prov and "省区" in nc.columns:
                                             nc = nc[nc["省区"].astype(str).str.strip() == str(prov).strip()].copy()
                                         if level == 3 and dist and "经销商名称" in nc.columns:
-                                            nc = nc[nc["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == str(dist).strip().replace(" ", "")].copy()
+                                            nc = nc[_norm_key(nc["经销商名称"]) == str(dist).strip().replace(" ", "")].copy()
                                         if not nc.empty:
                                             _yms = sorted([int(x) for x in nc["_ym"].dropna().astype(int).tolist() if 200001 <= int(x) <= 209912])
                                             _yy = int(max(_yms) // 100)
@@ -10360,10 +10825,10 @@ if uploaded_file:
                                                     else:
                                                         pv2[_c] = 0.0
                                                 pv2["累计新客"] = pd.to_numeric(pv2.get("整体新客", 0), errors="coerce").fillna(0.0)
-                                    if df_scan_raw is not None and not getattr(df_scan_raw, "empty", True):
-                                        s = df_scan_raw.copy()
+                                    if df_scan_daily is not None and not getattr(df_scan_daily, "empty", True):
+                                        s = df_scan_daily.copy()
                                         if "经销商名称" in s.columns:
-                                            s["经销商名称"] = s["经销商名称"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            s["经销商名称"] = _norm_key(s["经销商名称"])
                                         if "省区" in s.columns:
                                             s["省区"] = s["省区"].fillna("").astype(str).str.strip()
                                         if "门店名称" in s.columns:
@@ -10379,7 +10844,7 @@ if uploaded_file:
                                             s = s[s["省区"].astype(str).str.strip() == str(prov).strip()].copy()
                                         if level == 3 and dist and "经销商名称" in s.columns:
                                             _dist_norm = re.sub(r"\s+", "", str(dist).strip())
-                                            s = s[s["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == _dist_norm].copy()
+                                            s = s[_norm_key(s["经销商名称"]) == _dist_norm].copy()
                                         if sel_big != "全部":
                                             _sb = str(sel_big).strip()
                                             if _sb == "雅系列":
@@ -10403,20 +10868,20 @@ if uploaded_file:
                                             pv2[scan_avg_col] = 0.0
                                             pv2[scan_rate_col] = 0.0
                                             if key_col in s.columns:
-                                                pv2[view] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                pv2[view] = _norm_key(pv2[view])
                                                 for _ym in scan_yms:
                                                     _ym_i = int(_ym)
                                                     c_scan = f"_scan_{_ym_i}"
                                                     s_m = s[pd.to_numeric(s["_ym"], errors="coerce").fillna(0).astype(int) == _ym_i].copy()
                                                     if not s_m.empty:
                                                         scan_agg = (
-                                                            s_m.groupby(key_col, as_index=False)
-                                                            .size()
-                                                            .rename(columns={key_col: view, "size": "_扫码听数"})
+                                                            s_m.groupby(key_col, as_index=False)["听数"]
+                                                            .sum()
+                                                            .rename(columns={key_col: view, "听数": "_扫码听数"})
                                                         )
                                                         scan_agg[c_scan] = pd.to_numeric(scan_agg["_扫码听数"], errors="coerce").fillna(0.0) / 6.0
                                                         scan_agg = scan_agg[[view, c_scan]].copy()
-                                                        scan_agg[view] = scan_agg[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                        scan_agg[view] = _norm_key(scan_agg[view])
                                                         pv2 = pv2.merge(scan_agg, on=view, how="left")
                                                     else:
                                                         pv2[c_scan] = 0.0
@@ -10433,7 +10898,7 @@ if uploaded_file:
 
                                     if level == 3 and store_geo_df is not None and not getattr(store_geo_df, "empty", True) and (view in pv2.columns):
                                         try:
-                                            pv2["_k_store_geo"] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv2["_k_store_geo"] = _norm_key(pv2[view])
                                             pv2 = pv2.merge(store_geo_df, on="_k_store_geo", how="left")
                                             pv2.drop(columns=["_k_store_geo"], inplace=True, errors="ignore")
                                             pv2["市"] = pv2.get("市", "").fillna("").astype(str).str.strip()
@@ -10455,16 +10920,16 @@ if uploaded_file:
                                                         df_stock_raw[["经销商全称", "经销商名称"]]
                                                         .dropna()
                                                         .astype(str)
-                                                        .apply(lambda col: col.str.replace(r"\s+", "", regex=True))
+                                                        .apply(_norm_key)
                                                         .drop_duplicates()
                                                     )
                                                     dist_map_march = dict(zip(_m2["经销商全称"].tolist(), _m2["经销商名称"].tolist()))
 
-                                            dm["_k_march"] = dm[grp].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            dm["_k_march"] = _norm_key(dm[grp])
                                             if dist_map_march:
                                                 dm["_k_march"] = dm["_k_march"].map(dist_map_march).fillna(dm["_k_march"])
                                             gm = dm.groupby(["_k_march"], as_index=False)["数量(箱)"].sum().rename(columns={"数量(箱)": march_col})
-                                            pv2["_k_march"] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                            pv2["_k_march"] = _norm_key(pv2[view])
                                             if dist_map_march and grp == "经销商名称":
                                                 pv2["_k_march"] = pv2["_k_march"].map(dist_map_march).fillna(pv2["_k_march"])
                                             pv2 = pv2.merge(gm[["_k_march", march_col]], on="_k_march", how="left", suffixes=("", "_y"))
@@ -10496,11 +10961,11 @@ if uploaded_file:
                                                 ddm = ddm[ddm["_日"] == int(today_day)].copy()
                                             if not ddm.empty:
                                                 ddm["数量(箱)"] = pd.to_numeric(ddm.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                                ddm["_k_today"] = ddm[grp].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                ddm["_k_today"] = _norm_key(ddm[grp])
                                                 if dist_map_march:
                                                     ddm["_k_today"] = ddm["_k_today"].map(dist_map_march).fillna(ddm["_k_today"])
                                                 gd = ddm.groupby(["_k_today"], as_index=False)["数量(箱)"].sum().rename(columns={"数量(箱)": today_col})
-                                                pv2["_k_today"] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                pv2["_k_today"] = _norm_key(pv2[view])
                                                 if dist_map_march and grp == "经销商名称":
                                                     pv2["_k_today"] = pv2["_k_today"].map(dist_map_march).fillna(pv2["_k_today"])
                                                 pv2 = pv2.merge(gd[["_k_today", today_col]], on="_k_today", how="left", suffixes=("", "_y"))
@@ -10523,40 +10988,24 @@ if uploaded_file:
                                             for _, yms in roll_periods:
                                                 need_yms += list(yms)
                                             need_yms = sorted(set([int(x) for x in need_yms]))
-                                            d_roll = d_all.copy()
-                                            d_roll = d_roll[d_roll["_ym"].isin(need_yms)].copy()
+                                            d_roll, _ = _cube_store_months(out_cube, need_yms, grp_mask, mod_mask, stores=trend_stores)
                                             if not d_roll.empty:
-                                                d_roll["数量(箱)"] = pd.to_numeric(d_roll.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                                d_roll[grp] = d_roll[grp].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                d_roll = d_roll[d_roll[grp] != ""].copy()
-                                                r_agg = (
-                                                    d_roll.groupby([grp, "_ym"], as_index=False)["数量(箱)"]
-                                                    .sum()
-                                                    .rename(columns={grp: view})
-                                                )
-                                                r_pv = r_agg.pivot(index=view, columns="_ym", values="数量(箱)").fillna(0.0)
-                                                for ym in need_yms:
-                                                    if ym not in r_pv.columns:
-                                                        r_pv[ym] = 0.0
-                                                r_pv = r_pv[need_yms].reset_index()
+                                                d_roll[grp] = _norm_key(d_roll[grp])
+                                                d_roll = d_roll[d_roll[grp] != ""]
+                                                r_pv = d_roll.groupby(grp, as_index=False)[need_yms].sum().rename(columns={grp: view})
+                                                tiers = {}
                                                 for p_label, yms in roll_periods:
                                                     cols = [int(x) for x in yms]
                                                     r_pv[f"{p_label}月均出库"] = r_pv[cols].sum(axis=1) / 3.0
-                                                    r_pv[f"{p_label}门店类型"] = r_pv[f"{p_label}月均出库"].apply(_classify_store_abcd)
+                                                    tiers[p_label] = _store_tier_codes(r_pv[f"{p_label}月均出库"])
+                                                    r_pv[f"{p_label}门店类型"] = _store_tier_labels(tiers[p_label])
                                                 for i in range(1, len(roll_periods)):
                                                     prev_label = roll_periods[i - 1][0]
                                                     cur_label = roll_periods[i][0]
-                                                    r_pv[f"{cur_label}变动"] = r_pv.apply(lambda r: _store_change(r.get(f"{prev_label}门店类型"), r.get(f"{cur_label}门店类型")), axis=1)
+                                                    r_pv[f"{cur_label}变动"] = _store_tier_change(tiers[prev_label], tiers[cur_label])
                                                 if len(roll_periods) >= 3:
                                                     p1, p2, p3 = roll_periods[-3][0], roll_periods[-2][0], roll_periods[-1][0]
-                                                    r_pv["近三周期变化"] = r_pv.apply(
-                                                        lambda r: _trend3_label(
-                                                            r.get(f"{p1}门店类型"),
-                                                            r.get(f"{p2}门店类型"),
-                                                            r.get(f"{p3}门店类型"),
-                                                        ),
-                                                        axis=1,
-                                                    )
+                                                    r_pv["近三周期变化"] = _store_tier_trend3(tiers[p1], tiers[p2], tiers[p3])
                                                 else:
                                                     r_pv["近三周期变化"] = ""
                                                 for p_label, _yms in roll_periods:
@@ -10564,8 +11013,8 @@ if uploaded_file:
                                                     if c_avg in r_pv.columns:
                                                         r_pv[c_avg] = pd.to_numeric(r_pv[c_avg], errors="coerce").fillna(0.0).round(1)
 
-                                                pv2[view] = pv2[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
-                                                r_pv[view] = r_pv[view].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+                                                pv2[view] = _norm_key(pv2[view])
+                                                r_pv[view] = _norm_key(r_pv[view])
                                                 keep_cols = [view]
                                                 for p_label, _yms in roll_periods:
                                                     keep_cols += [f"{p_label}月均出库", f"{p_label}门店类型"]
@@ -10581,15 +11030,12 @@ if uploaded_file:
 
                                 batch_id = f"out_m_batch_{drill_level}"
                                 batch_export_ver = 3
-                                if "out_m_zip_cache" not in st.session_state:
-                                    st.session_state.out_m_zip_cache = {}
-                                _zip_cache = st.session_state.out_m_zip_cache
 
-                                batch_sig_key = f"{batch_id}_sig"
                                 _prod_norm_key_zip = tuple(sorted([str(x).strip() for x in (sel_prod or []) if str(x).strip()]))
                                 batch_sig = (
                                     batch_export_ver,
                                     int(drill_level),
+                                    sig,
                                     tuple(sel_yms),
                                     tuple(first3_cols),
                                     str(march_col or ""),
@@ -10600,12 +11046,9 @@ if uploaded_file:
                                     str(st.session_state.get("out_m_selected_prov") or ""),
                                 )
                                 k_zip = ("zip",) + (batch_id,) + batch_sig
-                                if st.session_state.get(batch_sig_key) != batch_sig:
-                                    _zip_cache.pop(k_zip, None)
-                                    st.session_state[batch_sig_key] = batch_sig
                                 if drill_level in (1, 2):
                                     label = "全部导出省区图片ZIP" if drill_level == 1 else "全部导出经销商图片ZIP"
-                                    if st.button(label, key=f"{batch_id}_btn"):
+                                    if st.button(label, key=f"{batch_id}_btn") and _export_needed(k_zip):
                                         scan_yms = [202601, 202602, 202603]
                                         scan_avg_col = "近三月均扫码"
                                         scan_rate_col = "近三月扫码率"
@@ -10616,231 +11059,222 @@ if uploaded_file:
                                             targets = base_names
                                         else:
                                             targets = base_names
-                                        zip_buf = io.BytesIO()
-                                        with zipfile.ZipFile(zip_buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                            prog = st.progress(0)
-                                            total = max(1, len(targets))
-                                            for idx, name in enumerate(targets):
-                                                if drill_level == 1:
-                                                    pv_t, v_t, _ = _compute_pv(2, prov=name, dist=None)
-                                                    region_t = str(name)
-                                                else:
-                                                    pv_t, v_t, _ = _compute_pv(3, prov=st.session_state.get("out_m_selected_prov"), dist=name)
-                                                    region_t = str(name)
-                                                if pv_t is None or pv_t.empty:
-                                                    prog.progress(int((idx + 1) * 100 / total))
-                                                    continue
-                                                export_cols_t = [v_t]
-                                                for _c in ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]:
-                                                    if _c in pv_t.columns:
-                                                        export_cols_t.append(_c)
-                                                export_cols_t += [c for c in first3_cols if c in pv_t.columns]
-                                                if avg_col in pv_t.columns:
-                                                    export_cols_t.append(avg_col)
-                                                if "趋势" in pv_t.columns:
-                                                    export_cols_t.append("趋势")
-                                                if march_col in pv_t.columns:
-                                                    export_cols_t.append(march_col)
-                                                if today_col in pv_t.columns:
-                                                    export_cols_t.append(today_col)
-                                                if "库存" in pv_t.columns:
-                                                    export_cols_t.append("库存")
-                                                if "可销月" in pv_t.columns:
-                                                    export_cols_t.append("可销月")
-                                                for _c in ["4月新客", "近三月新客", "累计新客"]:
-                                                    if _c in pv_t.columns:
-                                                        export_cols_t.append(_c)
-                                                if last_col and (last_col in pv_t.columns) and (last_col not in export_cols_t):
-                                                    export_cols_t.append(last_col)
-                                                if "完成率" in pv_t.columns:
-                                                    export_cols_t.append("完成率")
-                                                if scan_avg_col in pv_t.columns:
-                                                    export_cols_t.append(scan_avg_col)
-                                                if scan_rate_col in pv_t.columns:
-                                                    export_cols_t.append(scan_rate_col)
-                                                if v_t == "门店":
-                                                    for p_label, _yms in roll_periods:
-                                                        for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
-                                                            if c in pv_t.columns:
-                                                                export_cols_t.append(c)
-                                                    for i in range(1, len(roll_periods)):
-                                                        c = f"{roll_periods[i][0]}变动"
+                                        zip_members = []
+                                        for name in targets:
+                                            if drill_level == 1:
+                                                pv_t, v_t, _ = _compute_pv(2, prov=name, dist=None)
+                                                region_t = str(name)
+                                            else:
+                                                pv_t, v_t, _ = _compute_pv(3, prov=st.session_state.get("out_m_selected_prov"), dist=name)
+                                                region_t = str(name)
+                                            if pv_t is None or pv_t.empty:
+                                                continue
+                                            export_cols_t = [v_t]
+                                            for _c in ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]:
+                                                if _c in pv_t.columns:
+                                                    export_cols_t.append(_c)
+                                            export_cols_t += [c for c in first3_cols if c in pv_t.columns]
+                                            if avg_col in pv_t.columns:
+                                                export_cols_t.append(avg_col)
+                                            if "趋势" in pv_t.columns:
+                                                export_cols_t.append("趋势")
+                                            if march_col in pv_t.columns:
+                                                export_cols_t.append(march_col)
+                                            if today_col in pv_t.columns:
+                                                export_cols_t.append(today_col)
+                                            if "库存" in pv_t.columns:
+                                                export_cols_t.append("库存")
+                                            if "可销月" in pv_t.columns:
+                                                export_cols_t.append("可销月")
+                                            for _c in ["4月新客", "近三月新客", "累计新客"]:
+                                                if _c in pv_t.columns:
+                                                    export_cols_t.append(_c)
+                                            if last_col and (last_col in pv_t.columns) and (last_col not in export_cols_t):
+                                                export_cols_t.append(last_col)
+                                            if "完成率" in pv_t.columns:
+                                                export_cols_t.append("完成率")
+                                            if scan_avg_col in pv_t.columns:
+                                                export_cols_t.append(scan_avg_col)
+                                            if scan_rate_col in pv_t.columns:
+                                                export_cols_t.append(scan_rate_col)
+                                            if v_t == "门店":
+                                                for p_label, _yms in roll_periods:
+                                                    for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
                                                         if c in pv_t.columns:
                                                             export_cols_t.append(c)
-                                                    if "近三周期变化" in pv_t.columns:
-                                                        export_cols_t.append("近三周期变化")
-                                                for _c in ["市", "区/县"]:
-                                                    if _c in pv_t.columns:
-                                                        export_cols_t.append(_c)
-                                                df_t = pv_t[export_cols_t].copy()
+                                                for i in range(1, len(roll_periods)):
+                                                    c = f"{roll_periods[i][0]}变动"
+                                                    if c in pv_t.columns:
+                                                        export_cols_t.append(c)
+                                                if "近三周期变化" in pv_t.columns:
+                                                    export_cols_t.append("近三周期变化")
+                                            for _c in ["市", "区/县"]:
+                                                if _c in pv_t.columns:
+                                                    export_cols_t.append(_c)
+                                            df_t = pv_t[export_cols_t].copy()
 
-                                                try:
-                                                    total_row = {v_t: "合计"}
-                                                    for _c in export_cols_t:
-                                                        if _c in (v_t, "趋势", "趋势类型", "_趋势数据", "可销月", "完成率", scan_rate_col, "市", "区/县"):
-                                                            continue
-                                                        if str(_c).startswith("_"):
-                                                            continue
-                                                        total_row[_c] = float(pd.to_numeric(pv_t[_c], errors="coerce").fillna(0.0).sum()) if _c in pv_t.columns else 0.0
-                                                    if avg_col in export_cols_t and len(first3_cols) >= 1:
-                                                        _t3 = [float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()) for c in first3_cols if c in pv_t.columns]
-                                                        total_row[avg_col] = float(np.mean(_t3)) if _t3 else 0.0
-                                                    if "可销月" in export_cols_t:
-                                                        _a = float(total_row.get(avg_col, 0.0) or 0.0)
-                                                        _k = float(total_row.get("库存", 0.0) or 0.0)
-                                                        total_row["可销月"] = round((_k / _a), 1) if _a > 0 else 0.0
-                                                    if "完成率" in export_cols_t:
-                                                        _feb = ym_to_label.get(202602)
-                                                        _a = float(total_row.get(avg_col, 0.0) or 0.0)
-                                                        _f = float(total_row.get(_feb, 0.0) or 0.0) if _feb else 0.0
-                                                        total_row["完成率"] = (_f / _a) if _a > 0 else 0.0
-                                                    if scan_avg_col in export_cols_t:
-                                                        _t_scan = []
-                                                        for _ym in scan_yms:
-                                                            c = f"_scan_{int(_ym)}"
-                                                            if c in pv_t.columns:
-                                                                _t_scan.append(float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()))
-                                                        total_row[scan_avg_col] = float(np.mean(_t_scan)) if _t_scan else 0.0
-                                                    if scan_rate_col in export_cols_t and scan_avg_col in total_row and avg_col in total_row:
-                                                        denom = float(total_row.get(avg_col, 0.0) or 0.0)
-                                                        total_row[scan_rate_col] = (float(total_row.get(scan_avg_col, 0.0) or 0.0) / denom) if denom > 0 else 0.0
-                                                    if "趋势" in export_cols_t:
-                                                        _spark_vals = [float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()) for c in trend_base_cols if c in pv_t.columns]
-                                                        total_row["趋势"] = json.dumps([float(x) for x in _spark_vals]) if _spark_vals else json.dumps([])
-                                                    df_t = pd.concat([df_t, pd.DataFrame([total_row])], ignore_index=True)
-                                                except Exception:
-                                                    pass
+                                            try:
+                                                total_row = {v_t: "合计"}
+                                                for _c in export_cols_t:
+                                                    if _c in (v_t, "趋势", "趋势类型", "_趋势数据", "可销月", "完成率", scan_rate_col, "市", "区/县"):
+                                                        continue
+                                                    if str(_c).startswith("_"):
+                                                        continue
+                                                    total_row[_c] = float(pd.to_numeric(pv_t[_c], errors="coerce").fillna(0.0).sum()) if _c in pv_t.columns else 0.0
+                                                if avg_col in export_cols_t and len(first3_cols) >= 1:
+                                                    _t3 = [float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()) for c in first3_cols if c in pv_t.columns]
+                                                    total_row[avg_col] = float(np.mean(_t3)) if _t3 else 0.0
+                                                if "可销月" in export_cols_t:
+                                                    _a = float(total_row.get(avg_col, 0.0) or 0.0)
+                                                    _k = float(total_row.get("库存", 0.0) or 0.0)
+                                                    total_row["可销月"] = round((_k / _a), 1) if _a > 0 else 0.0
+                                                if "完成率" in export_cols_t:
+                                                    _feb = ym_to_label.get(202602)
+                                                    _a = float(total_row.get(avg_col, 0.0) or 0.0)
+                                                    _f = float(total_row.get(_feb, 0.0) or 0.0) if _feb else 0.0
+                                                    total_row["完成率"] = (_f / _a) if _a > 0 else 0.0
+                                                if scan_avg_col in export_cols_t:
+                                                    _t_scan = []
+                                                    for _ym in scan_yms:
+                                                        c = f"_scan_{int(_ym)}"
+                                                        if c in pv_t.columns:
+                                                            _t_scan.append(float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()))
+                                                    total_row[scan_avg_col] = float(np.mean(_t_scan)) if _t_scan else 0.0
+                                                if scan_rate_col in export_cols_t and scan_avg_col in total_row and avg_col in total_row:
+                                                    denom = float(total_row.get(avg_col, 0.0) or 0.0)
+                                                    total_row[scan_rate_col] = (float(total_row.get(scan_avg_col, 0.0) or 0.0) / denom) if denom > 0 else 0.0
+                                                if "趋势" in export_cols_t:
+                                                    _spark_vals = [float(pd.to_numeric(pv_t[c], errors="coerce").fillna(0.0).sum()) for c in trend_base_cols if c in pv_t.columns]
+                                                    total_row["趋势"] = json.dumps([float(x) for x in _spark_vals]) if _spark_vals else json.dumps([])
+                                                df_t = pd.concat([df_t, pd.DataFrame([total_row])], ignore_index=True)
+                                            except Exception:
+                                                pass
 
-                                                col_types_t = {v_t: "text"}
-                                                for c in sel_month_cols:
-                                                    if c in df_t.columns:
-                                                        col_types_t[c] = "num"
-                                                if avg_col in df_t.columns:
-                                                    col_types_t[avg_col] = "num"
-                                                if march_col in df_t.columns:
-                                                    col_types_t[march_col] = "num"
-                                                if today_col in df_t.columns:
-                                                    col_types_t[today_col] = "num"
-                                                if "库存" in df_t.columns:
-                                                    col_types_t["库存"] = "num"
-                                                if "可销月" in df_t.columns:
-                                                    col_types_t["可销月"] = "num"
-                                                for _c in ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]:
-                                                    if _c in df_t.columns:
-                                                        col_types_t[_c] = "num"
-                                                for _c in ["4月新客", "近三月新客", "累计新客"]:
-                                                    if _c in df_t.columns:
-                                                        col_types_t[_c] = "num"
-                                                if scan_avg_col in df_t.columns:
-                                                    col_types_t[scan_avg_col] = "num"
-                                                if last_col and last_col in df_t.columns:
-                                                    col_types_t[last_col] = "num"
-                                                if "完成率" in df_t.columns:
-                                                    col_types_t["完成率"] = "pct"
-                                                if scan_rate_col in df_t.columns:
-                                                    col_types_t[scan_rate_col] = "pct"
-                                                for _c in ["市", "区/县"]:
-                                                    if _c in df_t.columns:
-                                                        col_types_t[_c] = "text"
-                                                if "趋势" in df_t.columns:
-                                                    col_types_t["趋势"] = "spark"
-
-                                                ren_t = {}
-                                                if avg_col in df_t.columns:
-                                                    ren_t[avg_col] = avg_header
-                                                if scan_avg_col in df_t.columns:
-                                                    ren_t[scan_avg_col] = scan_avg_header
-                                                if ren_t:
-                                                    df_t = df_t.rename(columns=ren_t)
-                                                    col_types_t = {ren_t.get(k, k): v for k, v in col_types_t.items()}
-                                                if v_t == "门店":
-                                                    for p_label, _yms in roll_periods:
-                                                        c_avg = f"{p_label}月均出库"
-                                                        c_type = f"{p_label}门店类型"
-                                                        if c_avg in df_t.columns:
-                                                            col_types_t[c_avg] = "num"
-                                                        if c_type in df_t.columns:
-                                                            col_types_t[c_type] = "tag"
-                                                    if "近三周期变化" in df_t.columns:
-                                                        col_types_t["近三周期变化"] = "tag"
-
-                                                ren_png_t = {}
-                                                for c in df_t.columns:
-                                                    if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
-                                                        ren_png_t[c] = f"发货分析\n{c}"
-                                                for c in sel_month_cols:
-                                                    if c in df_t.columns:
-                                                        ren_png_t[c] = f"出库分析\n{c}"
-                                                if march_col in df_t.columns:
-                                                    ren_png_t[march_col] = f"出库分析\n{march_col}"
-                                                if today_col in df_t.columns:
-                                                    ren_png_t[today_col] = f"出库分析\n{today_col}"
-                                                if avg_header in df_t.columns:
-                                                    ren_png_t[avg_header] = f"出库分析\n{avg_header}"
-                                                if "趋势" in df_t.columns:
-                                                    ren_png_t["趋势"] = "出库分析\n趋势图"
-                                                if "趋势类型" in df_t.columns:
-                                                    ren_png_t["趋势类型"] = "出库分析\n趋势类型"
-                                                if "库存" in df_t.columns:
-                                                    ren_png_t["库存"] = "库存分析\n库存"
-                                                if "可销月" in df_t.columns:
-                                                    ren_png_t["可销月"] = "库存分析\n可销月"
-                                                for _c in ["3月新客", "近三月新客", "累计新客"]:
-                                                    if _c in df_t.columns:
-                                                        ren_png_t[_c] = f"新客分析\n{_c}"
-                                                if scan_avg_header in df_t.columns:
-                                                    ren_png_t[scan_avg_header] = f"扫码分析\n{scan_avg_header}"
-                                                if scan_rate_col in df_t.columns:
-                                                    ren_png_t[scan_rate_col] = f"扫码分析\n{scan_rate_col}"
+                                            col_types_t = {v_t: "text"}
+                                            for c in sel_month_cols:
+                                                if c in df_t.columns:
+                                                    col_types_t[c] = "num"
+                                            if avg_col in df_t.columns:
+                                                col_types_t[avg_col] = "num"
+                                            if march_col in df_t.columns:
+                                                col_types_t[march_col] = "num"
+                                            if today_col in df_t.columns:
+                                                col_types_t[today_col] = "num"
+                                            if "库存" in df_t.columns:
+                                                col_types_t["库存"] = "num"
+                                            if "可销月" in df_t.columns:
+                                                col_types_t["可销月"] = "num"
+                                            for _c in ["1月发货件数", "2月发货件数", "3月发货件数", "4月发货件数"]:
+                                                if _c in df_t.columns:
+                                                    col_types_t[_c] = "num"
+                                            for _c in ["4月新客", "近三月新客", "累计新客"]:
+                                                if _c in df_t.columns:
+                                                    col_types_t[_c] = "num"
+                                            if scan_avg_col in df_t.columns:
+                                                col_types_t[scan_avg_col] = "num"
+                                            if last_col and last_col in df_t.columns:
+                                                col_types_t[last_col] = "num"
+                                            if "完成率" in df_t.columns:
+                                                col_types_t["完成率"] = "pct"
+                                            if scan_rate_col in df_t.columns:
+                                                col_types_t[scan_rate_col] = "pct"
+                                            for _c in ["市", "区/县"]:
+                                                if _c in df_t.columns:
+                                                    col_types_t[_c] = "text"
+                                            if "趋势" in df_t.columns:
+                                                col_types_t["趋势"] = "spark"
+
+                                            ren_t = {}
+                                            if avg_col in df_t.columns:
+                                                ren_t[avg_col] = avg_header
+                                            if scan_avg_col in df_t.columns:
+                                                ren_t[scan_avg_col] = scan_avg_header
+                                            if ren_t:
+                                                df_t = df_t.rename(columns=ren_t)
+                                                col_types_t = {ren_t.get(k, k): v for k, v in col_types_t.items()}
+                                            if v_t == "门店":
                                                 for p_label, _yms in roll_periods:
-                                                    for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
-                                                        if c in df_t.columns:
-                                                            ren_png_t[c] = f"门店类型分析\n{c}"
-                                                for i in range(1, len(roll_periods)):
-                                                    c = f"{roll_periods[i][0]}变动"
+                                                    c_avg = f"{p_label}月均出库"
+                                                    c_type = f"{p_label}门店类型"
+                                                    if c_avg in df_t.columns:
+                                                        col_types_t[c_avg] = "num"
+                                                    if c_type in df_t.columns:
+                                                        col_types_t[c_type] = "tag"
+                                                if "近三周期变化" in df_t.columns:
+                                                    col_types_t["近三周期变化"] = "tag"
+
+                                            ren_png_t = {}
+                                            for c in df_t.columns:
+                                                if c in ("1月发货件数", "1月发货额-万元", "2月发货件数", "2月发货额-万元", "3月发货件数", "3月发货额-万元"):
+                                                    ren_png_t[c] = f"发货分析\n{c}"
+                                            for c in sel_month_cols:
+                                                if c in df_t.columns:
+                                                    ren_png_t[c] = f"出库分析\n{c}"
+                                            if march_col in df_t.columns:
+                                                ren_png_t[march_col] = f"出库分析\n{march_col}"
+                                            if today_col in df_t.columns:
+                                                ren_png_t[today_col] = f"出库分析\n{today_col}"
+                                            if avg_header in df_t.columns:
+                                                ren_png_t[avg_header] = f"出库分析\n{avg_header}"
+                                            if "趋势" in df_t.columns:
+                                                ren_png_t["趋势"] = "出库分析\n趋势图"
+                                            if "趋势类型" in df_t.columns:
+                                                ren_png_t["趋势类型"] = "出库分析\n趋势类型"
+                                            if "库存" in df_t.columns:
+                                                ren_png_t["库存"] = "库存分析\n库存"
+                                            if "可销月" in df_t.columns:
+                                                ren_png_t["可销月"] = "库存分析\n可销月"
+                                            for _c in ["3月新客", "近三月新客", "累计新客"]:
+                                                if _c in df_t.columns:
+                                                    ren_png_t[_c] = f"新客分析\n{_c}"
+                                            if scan_avg_header in df_t.columns:
+                                                ren_png_t[scan_avg_header] = f"扫码分析\n{scan_avg_header}"
+                                            if scan_rate_col in df_t.columns:
+                                                ren_png_t[scan_rate_col] = f"扫码分析\n{scan_rate_col}"
+                                            for p_label, _yms in roll_periods:
+                                                for c in [f"{p_label}月均出库", f"{p_label}门店类型"]:
                                                     if c in df_t.columns:
                                                         ren_png_t[c] = f"门店类型分析\n{c}"
-                                                if "近三周期变化" in df_t.columns:
-                                                    ren_png_t["近三周期变化"] = "门店类型分析\n近三周期变化"
-                                                if ren_png_t:
-                                                    df_t = df_t.rename(columns=ren_png_t)
-                                                    col_types_t = {ren_png_t.get(k, k): v for k, v in col_types_t.items()}
-
-                                                if v_t == "经销商" and "经销商" in df_t.columns:
-                                                    base_name = df_t["经销商"].fillna("").astype(str)
-                                                    cols_now = [str(c) for c in df_t.columns.tolist()]
-                                                    out_idx = next((i for i, c in enumerate(cols_now) if c.startswith("出库分析\n")), None)
-                                                    if out_idx is not None:
-                                                        df_t.insert(int(out_idx), "出库分析\n客户名", base_name)
-                                                        col_types_t["出库分析\n客户名"] = "text"
-                                                    cols_now = [str(c) for c in df_t.columns.tolist()]
-                                                    inv_idx = next((i for i, c in enumerate(cols_now) if c.startswith("库存分析\n")), None)
-                                                    if inv_idx is not None:
-                                                        df_t.insert(int(inv_idx), "库存分析\n客户名", base_name)
-                                                        col_types_t["库存分析\n客户名"] = "text"
-
-                                                title_lines_t = [
-                                                    f"月度出库趋势表 - {region_t}",
-                                                    filter_line,
-                                                    f"区域：{region_t}",
-                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                ]
-                                                png = _pil_table_png(df_t, title_lines_t, font_size=16, col_types=col_types_t)
-                                                fname = sanitize_filename(region_t, default="export") + ".png"
-                                                zf.writestr(fname, png)
-                                                prog.progress(int((idx + 1) * 100 / total))
-                                        _zip_cache[k_zip] = {
-                                            "bytes": zip_buf.getvalue(),
-                                            "name": f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                                        }
-                                    if k_zip in _zip_cache:
-                                        st.download_button(
-                                            "下载ZIP",
-                                            data=_zip_cache[k_zip]["bytes"],
-                                            file_name=_zip_cache[k_zip]["name"],
-                                            mime="application/zip",
-                                            key=f"{batch_id}_dl_{batch_export_ver}",
+                                            for i in range(1, len(roll_periods)):
+                                                c = f"{roll_periods[i][0]}变动"
+                                                if c in df_t.columns:
+                                                    ren_png_t[c] = f"门店类型分析\n{c}"
+                                            if "近三周期变化" in df_t.columns:
+                                                ren_png_t["近三周期变化"] = "门店类型分析\n近三周期变化"
+                                            if ren_png_t:
+                                                df_t = df_t.rename(columns=ren_png_t)
+                                                col_types_t = {ren_png_t.get(k, k): v for k, v in col_types_t.items()}
+
+                                            if v_t == "经销商" and "经销商" in df_t.columns:
+                                                base_name = df_t["经销商"].fillna("").astype(str)
+                                                cols_now = [str(c) for c in df_t.columns.tolist()]
+                                                out_idx = next((i for i, c in enumerate(cols_now) if c.startswith("出库分析\n")), None)
+                                                if out_idx is not None:
+                                                    df_t.insert(int(out_idx), "出库分析\n客户名", base_name)
+                                                    col_types_t["出库分析\n客户名"] = "text"
+                                                cols_now = [str(c) for c in df_t.columns.tolist()]
+                                                inv_idx = next((i for i, c in enumerate(cols_now) if c.startswith("库存分析\n")), None)
+                                                if inv_idx is not None:
+                                                    df_t.insert(int(inv_idx), "库存分析\n客户名", base_name)
+                                                    col_types_t["库存分析\n客户名"] = "text"
+
+                                            title_lines_t = [
+                                                f"月度出库趋势表 - {region_t}",
+                                                filter_line,
+                                                f"区域：{region_t}",
+                                                f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                            ]
+                                            fname = sanitize_filename(region_t, default="export") + ".png"
+                                            zip_members.append((fname, _pil_table_png, (df_t, title_lines_t), dict(font_size=16, col_types=col_types_t)))
+                                        _export_submit(
+                                            k_zip,
+                                            f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                                            "application/zip",
+                                            _png_zip_bytes,
+                                            (zip_members,),
+                                            progress=True,
                                         )
+                                    _export_download(k_zip, "下载ZIP", f"{batch_id}_dl_{batch_export_ver}", f"正在生成{label}")
 
                                 _ship_drop = [c for c in pv.columns if ("发货件数" in str(c)) or ("发货额" in str(c))]
                                 if _ship_drop:
@@ -11264,7 +11698,7 @@ if uploaded_file:
                                     p = str(st.session_state.proj_selected_prov or "").strip()
                                     df_s = store_df.copy()
                                     if d:
-                                        df_s = df_s[df_s["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == d].copy()
+                                        df_s = df_s[_norm_key(df_s["经销商名称"]) == d].copy()
                                     if p:
                                         df_s = df_s[df_s["省区"].astype(str).str.strip() == p].copy()
                                     view_df = df_s.sort_values(["段粉-完成率", "雅系列-完成率", "中老年-完成率"], ascending=False).reset_index(drop=True)
@@ -11285,7 +11719,7 @@ if uploaded_file:
                                     if p:
                                         df_s = df_s[df_s["省区"].astype(str).str.strip() == p].copy()
                                     if d:
-                                        df_s = df_s[df_s["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == d].copy()
+                                        df_s = df_s[_norm_key(df_s["经销商名称"]) == d].copy()
                                     view_df = df_s.sort_values(["段粉-完成率", "雅系列-完成率", "中老年-完成率"], ascending=False).reset_index(drop=True)
                                     view_dim = "门店名称"
 
@@ -11486,10 +11920,6 @@ if uploaded_file:
                             export_df = export_df.replace({np.nan: None})
                             export_df = pd.concat([export_df, pd.DataFrame([total_row])], ignore_index=True)
 
-                            if "proj_export_cache" not in st.session_state:
-                                st.session_state.proj_export_cache = {}
-                            _excel_cache = st.session_state.proj_export_cache
-
                             sel_prov = st.session_state.get("proj_selected_prov")
                             sel_dist = st.session_state.get("proj_selected_dist")
                             month_label = f"{o_month}月" if str(o_month) != "全部" else "全年"
@@ -11505,8 +11935,9 @@ if uploaded_file:
 
                             export_id = f"proj_{mode}_{drill_level}"
 
+                            # The view is a function of the upload (in the job id) and these selections.
                             def _excel_key(kind: str):
-                                return (kind, int(proj_year), str(o_month), str(mode), int(drill_level), str(sel_prov or ""), str(sel_dist or ""))
+                                return ("proj", kind, int(proj_year), str(o_month), str(mode), int(drill_level), str(sel_prov or ""), str(sel_dist or ""))
 
                             number_headers = {
                                 "段粉-目标值",
@@ -11543,30 +11974,25 @@ if uploaded_file:
                             c_e1, c_e2, c_e3, c_e4 = st.columns([1.4, 1.9, 1.6, 3.1])
                             k_cur = _excel_key("current")
                             with c_e1:
-                                if st.button("生成当前视图Excel", key=f"{export_id}_gen_cur"):
+                                if st.button("生成当前视图Excel", key=f"{export_id}_gen_cur") and _export_needed(k_cur):
                                     with st.spinner("正在生成Excel…"):
-                                        xlsx_bytes = _df_to_excel_bytes(
-                                            export_df,
-                                            sheet_name="专案追踪",
-                                            title_lines=title_lines,
-                                            number_headers=number_headers,
-                                            percent_headers=percent_headers,
-                                            store_type_header="门店类型",
-                                            group_headers=True,
+                                        _export_submit(
+                                            k_cur,
+                                            sanitize_filename(f"专案追踪_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
+                                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                            df_to_excel_bytes,
+                                            (export_df,),
+                                            dict(
+                                                sheet_name="专案追踪",
+                                                title_lines=title_lines,
+                                                number_headers=number_headers,
+                                                percent_headers=percent_headers,
+                                                store_type_header="门店类型",
+                                                group_headers=True,
+                                            ),
                                         )
-                                        _excel_cache[k_cur] = {
-                                            "bytes": xlsx_bytes,
-                                            "name": sanitize_filename(f"专案追踪_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
-                                        }
                             with c_e2:
-                                if k_cur in _excel_cache:
-                                    st.download_button(
-                                        "下载当前视图Excel",
-                                        data=_excel_cache[k_cur]["bytes"],
-                                        file_name=_excel_cache[k_cur]["name"],
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                        key=f"{export_id}_dl_cur",
-                                    )
+                                _export_download(k_cur, "下载当前视图Excel", f"{export_id}_dl_cur", "正在生成当前视图Excel")
 
                             def _detail_store_df(all_scope: bool):
                                 d = store_df.copy()
@@ -11574,7 +12000,7 @@ if uploaded_file:
                                     if mode == "省区汇总" and drill_level >= 2 and sel_prov:
                                         d = d[d["省区"].astype(str).str.strip() == str(sel_prov).strip()].copy()
                                     if drill_level == 3 and sel_dist:
-                                        d = d[d["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == str(sel_dist).strip().replace(" ", "")].copy()
+                                        d = d[_norm_key(d["经销商名称"]) == str(sel_dist).strip().replace(" ", "")].copy()
                                 cols = [
                                     "省区",
                                     "经销商名称",
@@ -11600,126 +12026,111 @@ if uploaded_file:
 
                             k_detail = _excel_key("detail_store")
                             with c_e3:
-                                if st.button("生成门店明细Excel", key=f"{export_id}_gen_detail"):
+                                if st.button("生成门店明细Excel", key=f"{export_id}_gen_detail") and _export_needed(k_detail):
                                     with st.spinner("正在生成门店明细Excel…"):
                                         df_detail = _detail_store_df(all_scope=False)
                                         total_detail = _total_row_from_df(df_detail, "合计")
                                         df_detail = pd.concat([df_detail, pd.DataFrame([total_detail])], ignore_index=True)
-                                        xlsx_detail = _df_to_excel_bytes(
-                                            df_detail,
-                                            sheet_name="专案追踪",
-                                            title_lines=[
-                                                f"专案追踪 - {proj_year}年{month_label}（门店明细）",
-                                                f"区域：{region_label}",
-                                                f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                            ],
-                                            number_headers=number_headers,
-                                            percent_headers=percent_headers,
-                                            store_type_header="门店类型",
-                                            group_headers=True,
+                                        _export_submit(
+                                            k_detail,
+                                            sanitize_filename(f"专案追踪_门店明细_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
+                                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                            df_to_excel_bytes,
+                                            (df_detail,),
+                                            dict(
+                                                sheet_name="专案追踪",
+                                                title_lines=[
+                                                    f"专案追踪 - {proj_year}年{month_label}（门店明细）",
+                                                    f"区域：{region_label}",
+                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                ],
+                                                number_headers=number_headers,
+                                                percent_headers=percent_headers,
+                                                store_type_header="门店类型",
+                                                group_headers=True,
+                                            ),
                                         )
-                                        _excel_cache[k_detail] = {
-                                            "bytes": xlsx_detail,
-                                            "name": sanitize_filename(f"专案追踪_门店明细_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
-                                        }
                             with c_e4:
-                                if k_detail in _excel_cache:
-                                    st.download_button(
-                                        "下载门店明细Excel",
-                                        data=_excel_cache[k_detail]["bytes"],
-                                        file_name=_excel_cache[k_detail]["name"],
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                        key=f"{export_id}_dl_detail",
-                                    )
+                                _export_download(k_detail, "下载门店明细Excel", f"{export_id}_dl_detail", "正在生成门店明细Excel")
 
                             k_all = _excel_key("all_store")
                             c_all_1, c_all_2, _ = st.columns([1.6, 2.0, 6.4])
                             with c_all_1:
-                                if st.button("生成导出全部Excel（门店明细）", key=f"{export_id}_gen_all"):
+                                if st.button("生成导出全部Excel（门店明细）", key=f"{export_id}_gen_all") and _export_needed(k_all):
                                     with st.spinner("正在生成导出全部Excel…"):
                                         df_all = _detail_store_df(all_scope=True)
                                         df_all = df_all.loc[:, [c for c in df_all.columns if not str(c).startswith("::")]]
                                         total_all = _total_row_from_df(df_all, "合计")
                                         df_all = pd.concat([df_all, pd.DataFrame([total_all])], ignore_index=True)
-                                        xlsx_all = _df_to_excel_bytes(
-                                            df_all,
-                                            sheet_name="专案追踪",
-                                            title_lines=[
-                                                f"专案追踪 - {proj_year}年{month_label}（导出全部门店明细）",
-                                                "范围：所有省区｜所有经销商｜所有门店",
-                                                f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                            ],
-                                            number_headers=number_headers,
-                                            percent_headers=percent_headers,
-                                            store_type_header="门店类型",
-                                            group_headers=True,
+                                        _export_submit(
+                                            k_all,
+                                            sanitize_filename(f"专案追踪_导出全部_门店明细_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
+                                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                            df_to_excel_bytes,
+                                            (df_all,),
+                                            dict(
+                                                sheet_name="专案追踪",
+                                                title_lines=[
+                                                    f"专案追踪 - {proj_year}年{month_label}（导出全部门店明细）",
+                                                    "范围：所有省区｜所有经销商｜所有门店",
+                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                                ],
+                                                number_headers=number_headers,
+                                                percent_headers=percent_headers,
+                                                store_type_header="门店类型",
+                                                group_headers=True,
+                                            ),
                                         )
-                                        _excel_cache[k_all] = {
-                                            "bytes": xlsx_all,
-                                            "name": sanitize_filename(f"专案追踪_导出全部_门店明细_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
-                                        }
                             with c_all_2:
-                                if k_all in _excel_cache:
-                                    st.download_button(
-                                        "下载导出全部Excel（门店明细）",
-                                        data=_excel_cache[k_all]["bytes"],
-                                        file_name=_excel_cache[k_all]["name"],
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                        key=f"{export_id}_dl_all",
-                                    )
-
-                            if st.button("生成表格图片（含颜色）", key=f"{export_id}_gen_png"):
-                                st.session_state[f"{export_id}_png"] = _pil_table_png(export_df, title_lines, font_size=16, col_types=col_types)
-                                st.session_state[f"{export_id}_png_name"] = sanitize_filename(f"专案追踪_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
-                            if st.session_state.get(f"{export_id}_png"):
-                                st.download_button(
-                                    "下载PNG",
-                                    data=st.session_state[f"{export_id}_png"],
-                                    file_name=st.session_state.get(f"{export_id}_png_name", "专案追踪.png"),
-                                    mime="image/png",
-                                    key=f"{export_id}_dl_png",
+                                _export_download(k_all, "下载导出全部Excel（门店明细）", f"{export_id}_dl_all", "正在生成导出全部Excel（门店明细）")
+
+                            k_png = _excel_key("png")
+                            if st.button("生成表格图片（含颜色）", key=f"{export_id}_gen_png") and _export_needed(k_png):
+                                _export_submit(
+                                    k_png,
+                                    sanitize_filename(f"专案追踪_{region_label}_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"),
+                                    "image/png",
+                                    _pil_table_png,
+                                    (export_df, title_lines),
+                                    dict(font_size=16, col_types=col_types),
                                 )
+                            _export_download(k_png, "下载PNG", f"{export_id}_dl_png", "正在生成表格图片")
 
                             if mode == "经销商列表" and drill_level == 2:
                                 zip_id = f"{export_id}_zip_{proj_year}_{month_label}"
-                                if st.button("批量生成门店明细PNG（ZIP）", key=f"{zip_id}_btn"):
+                                k_png_zip = _excel_key("store_png_zip")
+                                if st.button("批量生成门店明细PNG（ZIP）", key=f"{zip_id}_btn") and _export_needed(k_png_zip):
                                     dists = sorted([x for x in store_df["经销商名称"].dropna().astype(str).unique().tolist() if x and x.lower() not in ("nan", "none", "null")])
-                                    zip_buf = io.BytesIO()
-                                    with zipfile.ZipFile(zip_buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                        prog = st.progress(0)
-                                        total = max(1, len(dists))
-                                        for i, dist_name in enumerate(dists):
-                                            df_d = store_df[store_df["经销商名称"].astype(str).str.replace(r"\s+", "", regex=True) == str(dist_name).strip().replace(" ", "")].copy()
-                                            if df_d.empty:
-                                                prog.progress(int((i + 1) * 100 / total))
-                                                continue
-                                            df_d = df_d.loc[:, [c for c in df_d.columns if not str(c).startswith("::")]]
-                                            df_d = df_d.replace({np.nan: None})
-                                            total_d = _total_row_from_df(df_d, "合计")
-                                            df_d = pd.concat([df_d, pd.DataFrame([total_d])], ignore_index=True)
-                                            col_types_d = {c: ("pct" if "完成率" in c else ("tag" if c == "门店类型" else ("num" if c in number_headers else "text"))) for c in df_d.columns}
-                                            png = _pil_table_png(
-                                                df_d,
-                                                [
-                                                    f"专案追踪 - {proj_year}年{month_label}（门店明细）",
-                                                    f"经销商：{dist_name}",
-                                                    f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                                ],
-                                                font_size=16,
-                                                col_types=col_types_d,
-                                            )
-                                            zf.writestr(sanitize_filename(dist_name, default="export") + ".png", png)
-                                            prog.progress(int((i + 1) * 100 / total))
-                                    st.session_state[f"{zip_id}_bytes"] = zip_buf.getvalue()
-                                    st.session_state[f"{zip_id}_name"] = sanitize_filename(f"专案追踪_门店明细PNG_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
-                                if st.session_state.get(f"{zip_id}_bytes"):
-                                    st.download_button(
-                                        "下载ZIP",
-                                        data=st.session_state[f"{zip_id}_bytes"],
-                                        file_name=st.session_state.get(f"{zip_id}_name", "专案追踪.zip"),
-                                        mime="application/zip",
-                                        key=f"{zip_id}_dl",
+                                    zip_members = []
+                                    for dist_name in dists:
+                                        df_d = store_df[_norm_key(store_df["经销商名称"]) == str(dist_name).strip().replace(" ", "")].copy()
+                                        if df_d.empty:
+                                            continue
+                                        df_d = df_d.loc[:, [c for c in df_d.columns if not str(c).startswith("::")]]
+                                        df_d = df_d.replace({np.nan: None})
+                                        total_d = _total_row_from_df(df_d, "合计")
+                                        df_d = pd.concat([df_d, pd.DataFrame([total_d])], ignore_index=True)
+                                        col_types_d = {c: ("pct" if "完成率" in c else ("tag" if c == "门店类型" else ("num" if c in number_headers else "text"))) for c in df_d.columns}
+                                        title_d = [
+                                            f"专案追踪 - {proj_year}年{month_label}（门店明细）",
+                                            f"经销商：{dist_name}",
+                                            f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                        ]
+                                        zip_members.append((
+                                            sanitize_filename(dist_name, default="export") + ".png",
+                                            _pil_table_png,
+                                            (df_d, title_d),
+                                            dict(font_size=16, col_types=col_types_d),
+                                        ))
+                                    _export_submit(
+                                        k_png_zip,
+                                        sanitize_filename(f"专案追踪_门店明细PNG_{proj_year}_{month_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"),
+                                        "application/zip",
+                                        _png_zip_bytes,
+                                        (zip_members,),
+                                        progress=True,
                                     )
+                                _export_download(k_png_zip, "下载ZIP", f"{zip_id}_dl", "正在生成门店明细PNG")
 
                     if out_subtab == "门店类型滚动分析":
                         st.markdown("### 门店类型滚动分析")
@@ -11737,42 +12148,15 @@ if uploaded_file:
                             st.session_state.roll_cat_small = "全部"
 
                         c_f1, c_f2, c_f3 = st.columns([1.25, 1.25, 2.5])
-                        df_roll_universe = o_raw.copy()
+                        roll_cube = _outbound_cube(o_raw, st.session_state.get("_active_file_sig"))
                         with c_f1:
-                            _s_big = df_roll_universe.get("_模块大类", pd.Series(dtype=str)).dropna().astype(str).str.strip()
-                            roll_cat_big_opts = ["全部"] + sorted([x for x in _s_big.unique().tolist() if x and x.lower() not in ("nan", "none", "null")])
+                            roll_cat_big_opts = ["全部"] + _cube_module_opts(roll_cube, "_模块大类")
                             roll_sel_big = st.selectbox("产品大类（T列透视）", roll_cat_big_opts, key="roll_cat_big")
                         with c_f2:
-                            if "_模块小类" in df_roll_universe.columns:
-                                if roll_sel_big != "全部" and "_模块大类" in df_roll_universe.columns:
-                                    subs = (
-                                        df_roll_universe[df_roll_universe["_模块大类"].astype(str).str.strip() == str(roll_sel_big).strip()][
-                                            "_模块小类"
-                                        ]
-                                        .dropna()
-                                        .astype(str)
-                                        .str.strip()
-                                        .unique()
-                                        .tolist()
-                                    )
-                                    roll_cat_small_opts = ["全部"] + sorted([x for x in subs if x and str(x).strip().lower() not in ("nan", "none", "null")])
-                                else:
-                                    _s_small = df_roll_universe["_模块小类"].dropna().astype(str).str.strip()
-                                    roll_cat_small_opts = ["全部"] + sorted([x for x in _s_small.unique().tolist() if x and x.lower() not in ("nan", "none", "null")])
-                            else:
-                                roll_cat_small_opts = ["全部"]
+                            roll_cat_small_opts = ["全部"] + _cube_module_opts(roll_cube, "_模块小类", roll_sel_big)
                             roll_sel_small = st.selectbox("产品小类（U列重量）", roll_cat_small_opts, key="roll_cat_small")
                         with c_f3:
-                            if "_模块出库产品" in df_roll_universe.columns:
-                                df_prod = df_roll_universe.copy()
-                                if roll_sel_big != "全部" and "_模块大类" in df_prod.columns:
-                                    df_prod = df_prod[df_prod["_模块大类"].astype(str).str.strip() == str(roll_sel_big).strip()]
-                                if roll_sel_small != "全部" and "_模块小类" in df_prod.columns:
-                                    df_prod = df_prod[df_prod["_模块小类"].astype(str).str.strip() == str(roll_sel_small).strip()]
-                                _s_prod = df_prod["_模块出库产品"].dropna().astype(str).str.strip()
-                                roll_prod_opts = sorted([x for x in _s_prod.unique().tolist() if x and x.lower() not in ("nan", "none", "null")])
-                            else:
-                                roll_prod_opts = []
+                            roll_prod_opts = _cube_module_opts(roll_cube, "_模块出库产品", roll_sel_big, roll_sel_small)
                             roll_sel_prod = st.multiselect("出库产品（I列，可多选）", roll_prod_opts, key="roll_out_prod")
 
                         def _parse_ym_from_col(col_name: str):
@@ -11796,72 +12180,12 @@ if uploaded_file:
                                 return y, mm
                             return None
 
-                        def _classify_abcd(x):
-                            try:
-                                v = float(x)
-                            except Exception:
-                                v = 0.0
-                            if v >= 4:
-                                return "A"
-                            if 2 <= v < 4:
-                                return "B"
-                            if 1 <= v < 2:
-                                return "C"
-                            return "D"
-
-                        _order = {"A": 4, "B": 3, "C": 2, "D": 1}
-
-                        def _change(prev_c: str | None, cur_c: str | None):
-                            if not prev_c or not cur_c:
-                                return ""
-                            pv = _order.get(str(prev_c).strip(), 0)
-                            cv = _order.get(str(cur_c).strip(), 0)
-                            if pv == cv:
-                                return "持平"
-                            if cv > pv:
-                                return "升级 ⬆️"
-                            return "降级 ⬇️"
-
                         periods = [
                             ("25年10-12月", [(2025, 10), (2025, 11), (2025, 12)]),
                             ("25年11-26年1月", [(2025, 11), (2025, 12), (2026, 1)]),
                             ("25年12-26年2月", [(2025, 12), (2026, 1), (2026, 2)]),
                         ]
 
-                        def _cmp_sign(prev_c: str | None, cur_c: str | None):
-                            if not prev_c or not cur_c:
-                                return None
-                            pv = _order.get(str(prev_c).strip(), 0)
-                            cv = _order.get(str(cur_c).strip(), 0)
-                            if pv == cv:
-                                return 0
-                            return 1 if cv > pv else -1
-
-                        def _trend3_label(c1: str | None, c2: str | None, c3: str | None):
-                            s1 = _cmp_sign(c1, c2)
-                            s2 = _cmp_sign(c2, c3)
-                            if s1 is None or s2 is None:
-                                return ""
-                            if s1 > 0 and s2 > 0:
-                                return "持续升级"
-                            if s1 < 0 and s2 < 0:
-                                return "持续降级"
-                            if s1 > 0 and s2 < 0:
-                                return "先升级后降级"
-                            if s1 < 0 and s2 > 0:
-                                return "先降级后升级"
-                            if s1 == 0 and s2 == 0:
-                                return "持续持平"
-                            if s1 == 0 and s2 > 0:
-                                return "持平升级"
-                            if s1 > 0 and s2 == 0:
-                                return "升级持平"
-                            if s1 == 0 and s2 < 0:
-                                return "持平降级"
-                            if s1 < 0 and s2 == 0:
-                                return "降级持平"
-                            return "其他"
-
                         _prod_norm_key_roll = tuple(sorted([str(x).strip() for x in (roll_sel_prod or []) if str(x).strip()]))
                         ck = (
                             "roll_store_df_v3",
@@ -11883,27 +12207,16 @@ if uploaded_file:
                                 store_roll_df, roll_missing = _cached
                                 roll_missing_note = None
                         else:
-                            d = df_roll_universe.copy()
-                            if sel_prov != "全部" and "省区" in d.columns:
-                                d = d[d["省区"].astype(str).str.strip() == str(sel_prov).strip()].copy()
-                            if sel_dist != "全部" and "经销商名称" in d.columns:
-                                d = d[d["经销商名称"].astype(str).str.strip() == str(sel_dist).strip()].copy()
-                            if roll_sel_big != "全部" and "_模块大类" in d.columns:
-                                d = d[d["_模块大类"].astype(str).str.strip() == str(roll_sel_big).strip()].copy()
-                            if roll_sel_small != "全部" and "_模块小类" in d.columns:
-                                d = d[d["_模块小类"].astype(str).str.strip() == str(roll_sel_small).strip()].copy()
-                            if roll_sel_prod and "_模块出库产品" in d.columns:
-                                _p = [str(x).strip() for x in roll_sel_prod if str(x).strip()]
-                                if _p:
-                                    d = d[d["_模块出库产品"].astype(str).str.strip().isin(_p)].copy()
-
-                            d = d[d.get("_年").notna() & d.get("_月").notna()].copy()
-                            d["_年"] = pd.to_numeric(d.get("_年", 0), errors="coerce").fillna(0).astype(int)
-                            d["_月"] = pd.to_numeric(d.get("_月", 0), errors="coerce").fillna(0).astype(int)
-                            d = d[(d["_年"] > 0) & (d["_月"].between(1, 12))].copy()
-                            d["_ym"] = (d["_年"] * 100 + d["_月"]).astype(int)
-
-                            store_col = "_门店名" if "_门店名" in d.columns else ("门店名称" if "门店名称" in d.columns else None)
+                            cube = roll_cube
+                            c_stores = cube["stores"]
+                            prov_mask = np.ones(len(c_stores), dtype=bool)
+                            if sel_prov != "全部" and "省区" in c_stores.columns:
+                                prov_mask &= (c_stores["省区"].astype(str).str.strip() == str(sel_prov).strip()).to_numpy()
+                            if sel_dist != "全部" and "经销商名称" in c_stores.columns:
+                                prov_mask &= (c_stores["经销商名称"].astype(str).str.strip() == str(sel_dist).strip()).to_numpy()
+                            mod_mask = _cube_module_mask(cube, roll_sel_big, roll_sel_small, roll_sel_prod)
+
+                            store_col = "_门店名" if "_门店名" in c_stores.columns else None
                             if store_col is None:
                                 store_roll_df = pd.DataFrame(columns=["省区", "经销商名称", "门店名称"])
                                 roll_missing = []
@@ -11914,21 +12227,11 @@ if uploaded_file:
                                     for (y, m) in yms:
                                         required_yms.append(int(y * 100 + m))
                                 required_yms = list(dict.fromkeys(required_yms))
-                                avail_yms = set(pd.to_numeric(d.get("_ym", pd.Series(dtype=int)), errors="coerce").fillna(0).astype(int).unique().tolist())
+                                d, avail_yms = _cube_store_months(cube, required_yms, prov_mask, mod_mask, any_month=True)
                                 roll_missing = [f"{int(ym)//100}-{str(int(ym)%100).zfill(2)}" for ym in required_yms if int(ym) not in avail_yms]
                                 roll_missing_note = None
                                 if roll_missing:
-                                    d0 = df_roll_universe.copy()
-                                    if sel_prov != "全部" and "省区" in d0.columns:
-                                        d0 = d0[d0["省区"].astype(str).str.strip() == str(sel_prov).strip()].copy()
-                                    if sel_dist != "全部" and "经销商名称" in d0.columns:
-                                        d0 = d0[d0["经销商名称"].astype(str).str.strip() == str(sel_dist).strip()].copy()
-                                    d0 = d0[d0.get("_年").notna() & d0.get("_月").notna()].copy()
-                                    d0["_年"] = pd.to_numeric(d0.get("_年", 0), errors="coerce").fillna(0).astype(int)
-                                    d0["_月"] = pd.to_numeric(d0.get("_月", 0), errors="coerce").fillna(0).astype(int)
-                                    d0 = d0[(d0["_年"] > 0) & (d0["_月"].between(1, 12))].copy()
-                                    d0["_ym"] = (d0["_年"] * 100 + d0["_月"]).astype(int)
-                                    avail_yms0 = set(pd.to_numeric(d0.get("_ym", pd.Series(dtype=int)), errors="coerce").fillna(0).astype(int).unique().tolist())
+                                    _, avail_yms0 = _cube_store_months(cube, [], prov_mask)
                                     notes = []
                                     for ym in required_yms:
                                         if int(ym) in avail_yms:
@@ -11940,45 +12243,35 @@ if uploaded_file:
                                             notes.append(f"{label}：该月未找到出库记录（按0处理）")
                                     roll_missing_note = "；".join(notes) if notes else None
 
-                                d["数量(箱)"] = pd.to_numeric(d.get("数量(箱)", 0), errors="coerce").fillna(0.0)
-                                d["省区"] = d.get("省区", "").fillna("").astype(str).str.strip()
-                                d["经销商名称"] = d.get("经销商名称", "").fillna("").astype(str).str.strip()
+                                d["省区"] = d["省区"].fillna("").astype(str).str.strip()
+                                d["经销商名称"] = d["经销商名称"].fillna("").astype(str).str.strip()
                                 d[store_col] = d[store_col].fillna("").astype(str).str.strip()
-                                d = d[(d["省区"] != "") & (d["经销商名称"] != "") & (d[store_col] != "")].copy()
+                                d = d[(d["省区"] != "") & (d["经销商名称"] != "") & (d[store_col] != "")]
 
-                                g = d.groupby(["省区", "经销商名称", store_col, "_ym"], as_index=False)["数量(箱)"].sum()
-                                pv_m = g.pivot(index=["省区", "经销商名称", store_col], columns="_ym", values="数量(箱)").fillna(0.0)
-                                for ym in required_yms:
-                                    if ym not in pv_m.columns:
-                                        pv_m[int(ym)] = 0.0
-                                pv_m = pv_m.reset_index().rename(columns={store_col: "门店名称"})
+                                pv_m = (
+                                    d.groupby(["省区", "经销商名称", store_col], as_index=False)[required_yms]
+                                    .sum()
+                                    .rename(columns={store_col: "门店名称"})
+                                )
 
                                 work = pv_m[["省区", "经销商名称", "门店名称"]].copy()
+                                tiers = {}
                                 for p_label, yms in periods:
                                     cols = [int(y * 100 + m) for (y, m) in yms]
                                     avg_col = f"{p_label}月均出库"
                                     cls_col = f"{p_label}门店类型"
                                     work[avg_col] = pv_m[cols].sum(axis=1) / 3.0
-                                    work[cls_col] = work[avg_col].apply(_classify_abcd)
+                                    tiers[p_label] = _store_tier_codes(work[avg_col])
+                                    work[cls_col] = _store_tier_labels(tiers[p_label])
 
                                 for i in range(2, len(periods) + 1):
                                     prev_label = periods[i - 2][0]
                                     cur_label = periods[i - 1][0]
-                                    work[f"{cur_label}变动"] = work.apply(
-                                        lambda r: _change(r.get(f"{prev_label}门店类型"), r.get(f"{cur_label}门店类型")),
-                                        axis=1,
-                                    )
+                                    work[f"{cur_label}变动"] = _store_tier_change(tiers[prev_label], tiers[cur_label])
 
                                 if len(periods) >= 3:
                                     p1, p2, p3 = periods[-3][0], periods[-2][0], periods[-1][0]
-                                    work["近三周期变化"] = work.apply(
-                                        lambda r: _trend3_label(
-                                            r.get(f"{p1}门店类型"),
-                                            r.get(f"{p2}门店类型"),
-                                            r.get(f"{p3}门店类型"),
-                                        ),
-                                        axis=1,
-                                    )
+                                    work["近三周期变化"] = _store_tier_trend3(tiers[p1], tiers[p2], tiers[p3])
                                 else:
                                     work["近三周期变化"] = ""
 
@@ -12087,7 +12380,9 @@ if uploaded_file:
                         export_scope = "省区汇总" if drill_level == 1 else ("经销商汇总" if drill_level == 2 else "门店明细")
                         export_id = f"roll_export_{drill_level}_{sanitize_filename(st.session_state.get('roll_selected_prov') or 'all')}_{sanitize_filename(st.session_state.get('roll_selected_dist') or 'all')}"
                         cexp = st.columns([1, 3, 6])
-                        if cexp[0].button("生成Excel", key=f"{export_id}_btn"):
+                        # store_roll_df is determined by ck, the views by the drill state in the ids.
+                        k_roll_cur = ("roll_cur", export_id, ck)
+                        if cexp[0].button("生成Excel", key=f"{export_id}_btn") and _export_needed(k_roll_cur):
                             title_lines = [
                                 f"门店类型滚动分析 - {export_scope}",
                                 f"范围：{sel_prov}/{sel_dist}",
@@ -12122,27 +12417,26 @@ if uploaded_file:
                                 for c in exp_df.columns:
                                     if str(c).endswith("-月均出库"):
                                         number_formats[str(c)] = "0.0"
-                            xls = _df_to_excel_bytes(
-                                exp_df,
-                                sheet_name="门店类型滚动分析",
-                                title_lines=title_lines,
-                                number_formats=number_formats,
-                                group_headers=True,
-                            )
-                            st.session_state[f"{export_id}_bytes"] = xls
-                            st.session_state[f"{export_id}_name"] = sanitize_filename(f"门店类型滚动分析_{export_scope}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-                        if st.session_state.get(f"{export_id}_bytes"):
-                            cexp[1].download_button(
-                                "下载Excel",
-                                data=st.session_state[f"{export_id}_bytes"],
-                                file_name=st.session_state.get(f"{export_id}_name", "门店类型滚动分析.xlsx"),
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key=f"{export_id}_dl",
+                            _export_submit(
+                                k_roll_cur,
+                                sanitize_filename(f"门店类型滚动分析_{export_scope}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
+                                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                df_to_excel_bytes,
+                                (exp_df,),
+                                dict(
+                                    sheet_name="门店类型滚动分析",
+                                    title_lines=title_lines,
+                                    number_formats=number_formats,
+                                    group_headers=True,
+                                ),
                             )
+                        with cexp[1]:
+                            _export_download(k_roll_cur, "下载Excel", f"{export_id}_dl", "正在生成Excel")
 
                         export_all_id = f"roll_export_all_{sanitize_filename(sel_prov)}_{sanitize_filename(sel_dist)}"
                         export_all_btn_label = "导出各省门店ZIP" if drill_level == 1 else "导出全部门店"
-                        if cexp[0].button(export_all_btn_label, key=f"{export_all_id}_btn"):
+                        k_roll_all = ("roll_all", export_all_id, int(drill_level), ck)
+                        if cexp[0].button(export_all_btn_label, key=f"{export_all_id}_btn") and _export_needed(k_roll_all):
                             cols_all = ["省区", "经销商名称", "门店名称"]
                             for p_label, _yms in periods:
                                 cols_all += [f"{p_label}月均出库", f"{p_label}门店类型"]
@@ -12162,46 +12456,51 @@ if uploaded_file:
                             ren_all["近三周期变化"] = "近三周期变化-变化类型"
 
                             if drill_level == 1:
-                                buf = io.BytesIO()
-                                with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                                    provs = []
-                                    if "省区" in store_roll_df.columns:
-                                        provs = (
-                                            store_roll_df["省区"]
-                                            .dropna()
-                                            .astype(str)
-                                            .str.strip()
-                                            .tolist()
-                                        )
-                                    provs = sorted([p for p in set(provs) if p and p.lower() not in ("nan", "none", "null")])
-                                    for p in provs:
-                                        df_p = store_roll_df[store_roll_df["省区"].astype(str).str.strip() == str(p).strip()][cols_all].copy()
-                                        if df_p.empty:
-                                            continue
-                                        df_p = df_p.sort_values(["经销商名称", "门店名称"], kind="stable").reset_index(drop=True)
-                                        for p_label, _yms in periods:
-                                            avg_col = f"{p_label}月均出库"
-                                            if avg_col in df_p.columns:
-                                                df_p[avg_col] = pd.to_numeric(df_p[avg_col], errors="coerce").fillna(0.0).round(1)
-                                        df_p = df_p.rename(columns=ren_all)
-                                        number_formats_p = {str(c): "0.0" for c in df_p.columns if str(c).endswith("-月均出库")}
-                                        title_lines_p = [
-                                            "门店类型滚动分析 - 门店明细",
-                                            f"省区：{p}",
-                                            f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                        ]
-                                        xls_p = _df_to_excel_bytes(
-                                            df_p,
+                                zip_members = []
+                                provs = []
+                                if "省区" in store_roll_df.columns:
+                                    provs = (
+                                        store_roll_df["省区"]
+                                        .dropna()
+                                        .astype(str)
+                                        .str.strip()
+                                        .tolist()
+                                    )
+                                provs = sorted([p for p in set(provs) if p and p.lower() not in ("nan", "none", "null")])
+                                for p in provs:
+                                    df_p = store_roll_df[store_roll_df["省区"].astype(str).str.strip() == str(p).strip()][cols_all].copy()
+                                    if df_p.empty:
+                                        continue
+                                    df_p = df_p.sort_values(["经销商名称", "门店名称"], kind="stable").reset_index(drop=True)
+                                    for p_label, _yms in periods:
+                                        avg_col = f"{p_label}月均出库"
+                                        if avg_col in df_p.columns:
+                                            df_p[avg_col] = pd.to_numeric(df_p[avg_col], errors="coerce").fillna(0.0).round(1)
+                                    df_p = df_p.rename(columns=ren_all)
+                                    number_formats_p = {str(c): "0.0" for c in df_p.columns if str(c).endswith("-月均出库")}
+                                    title_lines_p = [
+                                        "门店类型滚动分析 - 门店明细",
+                                        f"省区：{p}",
+                                        f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                    ]
+                                    zip_members.append((
+                                        sanitize_filename(f"{p}.xlsx"),
+                                        df_p,
+                                        dict(
                                             sheet_name="门店明细",
                                             title_lines=title_lines_p,
                                             number_formats=number_formats_p,
                                             group_headers=True,
-                                        )
-                                        zf.writestr(sanitize_filename(f"{p}.xlsx"), xls_p)
-                                buf.seek(0)
-                                st.session_state[f"{export_all_id}_bytes"] = buf.getvalue()
-                                st.session_state[f"{export_all_id}_name"] = sanitize_filename(f"门店类型滚动分析_各省门店_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
-                                st.session_state[f"{export_all_id}_mime"] = "application/zip"
+                                        ),
+                                    ))
+                                _export_submit(
+                                    k_roll_all,
+                                    sanitize_filename(f"门店类型滚动分析_各省门店_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"),
+                                    "application/zip",
+                                    build_xlsx_zip,
+                                    (zip_members,),
+                                    progress=True,
+                                )
                             else:
                                 df_all = store_roll_df[cols_all].copy()
                                 for p_label, _yms in periods:
@@ -12215,25 +12514,22 @@ if uploaded_file:
                                     f"范围：{sel_prov}/{sel_dist}",
                                     f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
                                 ]
-                                xls_all = _df_to_excel_bytes(
-                                    df_all,
-                                    sheet_name="全部门店",
-                                    title_lines=title_lines,
-                                    number_formats=number_formats_all,
-                                    group_headers=True,
+                                _export_submit(
+                                    k_roll_all,
+                                    sanitize_filename(f"门店类型滚动分析_全部门店_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"),
+                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                    df_to_excel_bytes,
+                                    (df_all,),
+                                    dict(
+                                        sheet_name="全部门店",
+                                        title_lines=title_lines,
+                                        number_formats=number_formats_all,
+                                        group_headers=True,
+                                    ),
                                 )
-                                st.session_state[f"{export_all_id}_bytes"] = xls_all
-                                st.session_state[f"{export_all_id}_name"] = sanitize_filename(f"门店类型滚动分析_全部门店_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-                                st.session_state[f"{export_all_id}_mime"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        if st.session_state.get(f"{export_all_id}_bytes"):
+                        with cexp[2]:
                             dl_label = "下载各省门店ZIP" if drill_level == 1 else "下载全部门店Excel"
-                            cexp[2].download_button(
-                                dl_label,
-                                data=st.session_state[f"{export_all_id}_bytes"],
-                                file_name=st.session_state.get(f"{export_all_id}_name", "门店类型滚动分析_全部门店.xlsx"),
-                                mime=st.session_state.get(f"{export_all_id}_mime", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
-                                key=f"{export_all_id}_dl",
-                            )
+                            _export_download(k_roll_all, dl_label, f"{export_all_id}_dl", "正在生成各省门店Excel" if drill_level == 1 else "正在生成全部门店Excel")
 
                         ag_key = "roll_prov_ag" if drill_level == 1 else ("roll_dist_ag" if drill_level == 2 else "roll_store_ag")
                         col_defs = None
@@ -12360,6 +12656,7 @@ if uploaded_file:
 
                     # === TAB 7: PERFORMANCE ===
             if main_tab == "🚀 业绩分析":
+                df_target_raw = _lazy_sheet("target")
                 st.markdown("""
                 <style>
                   .perf-wrap {display:flex; flex-direction:column; gap:16px;}
@@ -12432,14 +12729,16 @@ if uploaded_file:
                             sel_prov = st.selectbox("省区", prov_opts, key="t26_prov")
                         
                         # Filter Step 1
-                        df_f = df_track if sel_prov == '全部' else df_track[df_track['省区'] == sel_prov]
+                        _t26_preds = [] if sel_prov == '全部' else [('省区', 'eq', sel_prov)]
+                        df_f = filter_rows(df_track, _filter_sig, "t26", _t26_preds)
                         
                         # Distributor
-                        dist_opts = ['全部'] + sorted([x for x in df_f['经销商名称'].unique() if x])
+                        dist_opts = ['全部'] + sorted([x for x in filter_values(df_track, _filter_sig, "t26", '经销商名称', _t26_preds) if x])
                         with f2:
                             sel_dist = st.selectbox("经销商", dist_opts, key="t26_dist")
                         if sel_dist != '全部':
-                            df_f = df_f[df_f['经销商名称'] == sel_dist]
+                            _t26_preds.append(('经销商名称', 'eq', sel_dist))
+                            df_f = filter_rows(df_track, _filter_sig, "t26", _t26_preds)
                             
                         if '大分类' in df_track.columns:
                             cat_col_S = '大分类'
@@ -12481,22 +12780,24 @@ if uploaded_file:
                                 top_counts.columns = ["类目", "行数"]
                                 show_aggrid_table(top_counts, height=300, key="verify_table")
 
-                        wh_opts = ['全部'] + sorted([x for x in df_f.get(cat_col_S, pd.Series(dtype=str)).unique() if x])
+                        wh_opts = ['全部'] + (sorted([x for x in filter_values(df_track, _filter_sig, "t26", cat_col_S, _t26_preds) if x]) if cat_col_S in df_track.columns else [])
                         with f3:
                             sel_wh = st.selectbox(f"大类 ({cat_col_S})", wh_opts, key="t26_wh")
                         
-                        if sel_wh != '全部':
-                            df_f = df_f[df_f.get(cat_col_S, pd.Series(dtype=str)) == sel_wh]
+                        if sel_wh != '全部' and cat_col_S in df_track.columns:
+                            _t26_preds.append((cat_col_S, 'eq', sel_wh))
+                            df_f = filter_rows(df_track, _filter_sig, "t26", _t26_preds)
                             
                         # Small Category (Group) - Multi Select
-                        grp_opts = sorted([x for x in df_f['归类'].unique() if x])
+                        grp_opts = sorted([x for x in filter_values(df_track, _filter_sig, "t26", '归类', _t26_preds) if x])
                         with f4:
                             sel_grp = st.multiselect("小类 (归类)", grp_opts, default=[], key="t26_grp")
                         if sel_grp:
-                            df_f = df_f[df_f['归类'].isin(sel_grp)]
+                            _t26_preds.append(('归类', 'isin', sel_grp))
+                            df_f = filter_rows(df_track, _filter_sig, "t26", _t26_preds)
                             
                         # Month Selection (Single)
-                        avail_months = sorted(df_f[df_f['年份'] == cur_year]['月份'].unique())
+                        avail_months = sorted(filter_values(df_track, _filter_sig, "t26", '月份', _t26_preds + [('年份', 'eq', cur_year)]))
                         def_month = int(avail_months[-1]) if avail_months else 1
                         with f5:
                             sel_month = st.selectbox("统计月份", list(range(1, 13)), index=def_month-1, key="t26_month")
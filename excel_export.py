@@ -0,0 +1,412 @@
+"""Styled Excel writers for the dashboard exports.
+
+These live outside dashboard.py so process-pool workers can import them
+without re-running the Streamlit script.
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from builtin_parts import detached_main
+
+# Styled sheet writer. The sheet is streamed row by row into a write-only
+# workbook; every distinct cell look is built once as a style array and shared,
+# so large exports never hold a full worksheet of cell objects.
+_XL_THIN = Side(style="thin", color="D1D5DB")
+_XL_BORDER = Border(left=_XL_THIN, right=_XL_THIN, top=_XL_THIN, bottom=_XL_THIN)
+_XL_HEADER = ("111827", "FFFFFF")
+_XL_GREEN = ("DCFCE7", "166534")
+_XL_BLUE = ("DBEAFE", "1D4ED8")
+_XL_YELLOW = ("FEF9C3", "A16207")
+_XL_RED = ("FEE2E2", "991B1B")
+_XL_GREY = ("E5E7EB", "374151")
+_XL_SEG_SPECS = [
+    ("段粉", "段粉-", _XL_GREEN),
+    ("雅系列", "雅系列-", _XL_BLUE),
+    ("中老年（提）", "中老年-", _XL_YELLOW),
+]
+_XL_SUB_COLORS = {
+    "A": _XL_GREEN, "A数量": _XL_GREEN,
+    "B": _XL_BLUE, "B数量": _XL_BLUE,
+    "C": _XL_YELLOW, "C数量": _XL_YELLOW,
+    "D": _XL_RED, "D数量": _XL_RED,
+    "持续升级": _XL_GREEN, "持续降级": _XL_RED,
+    "先降级后升级": _XL_BLUE, "先升级后降级": _XL_YELLOW,
+    "持续持平": _XL_GREY,
+    "持平升级": _XL_GREEN, "升级持平": _XL_GREEN,
+    "持平降级": _XL_RED, "降级持平": _XL_RED,
+}
+_XL_TREND_COLORS = {
+    "持续增长": _XL_GREEN, "持续下滑": _XL_RED,
+    "先下滑后增长": _XL_BLUE, "先增长后下滑": _XL_YELLOW,
+    "持续升级": _XL_GREEN, "持续降级": _XL_RED,
+    "先降级后升级": _XL_BLUE, "先升级后降级": _XL_YELLOW,
+    "持续持平": _XL_GREY,
+    "持平升级": _XL_GREEN, "升级持平": _XL_GREEN,
+    "持平降级": _XL_RED, "降级持平": _XL_RED,
+}
+_XL_CHUNK_ROWS = 5000
+_XL_FULL_STYLE_MAX_ROWS = 12000
+_XL_WIDTH_SCAN_ROWS = 2000
+
+def _xl_store_type_colors(v: str):
+    v = v.upper()
+    for k, colors in (("A", _XL_GREEN), ("B", _XL_BLUE), ("C", _XL_YELLOW), ("D", _XL_RED)):
+        if k in v:
+            return colors
+    return None
+
+def _xl_column_values(s: pd.Series) -> list:
+    # Cell values the way DataFrame.to_excel writes them: missing -> empty,
+    # +/-inf -> "inf"/"-inf", numpy scalars -> Python numbers.
+    if pd.api.types.is_bool_dtype(s.dtype) and not s.hasnans:
+        return s.astype(bool).tolist()
+    if pd.api.types.is_integer_dtype(s.dtype) and not s.hasnans:
+        return s.astype(np.int64).tolist()
+    if pd.api.types.is_float_dtype(s.dtype):
+        a = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        out = a.astype(object)
+        out[np.isnan(a)] = None
+        out[np.isposinf(a)] = "inf"
+        out[np.isneginf(a)] = "-inf"
+        return out.tolist()
+    out = []
+    for v in s.astype(object).tolist():
+        if v is None or v is pd.NaT or v is pd.NA:
+            v = None
+        elif isinstance(v, (float, np.floating)):
+            v = None if v != v else ("inf" if v == np.inf else ("-inf" if v == -np.inf else float(v)))
+        elif isinstance(v, (bool, np.bool_)):
+            v = bool(v)
+        elif isinstance(v, np.integer):
+            v = int(v)
+        out.append(v)
+    return out
+
+def _xl_text_len(v) -> int:
+    # Length of the value as it reads back from the saved file: numbers are
+    # stored with 16 significant digits and dates come back as datetimes.
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        s = "%.16g" % v
+        return len(str(float(s) if any(ch in s for ch in ".Ee") else int(s)))
+    if isinstance(v, date) and not isinstance(v, datetime):
+        return len(str(datetime(v.year, v.month, v.day)))
+    return len(str(v))
+
+def _xl_header_blocks(idxs: list[int]) -> list[tuple[int, int]]:
+    # Runs of consecutive 1-based column numbers.
+    blocks = []
+    for x in sorted(set(idxs)):
+        if blocks and x == blocks[-1][1] + 1:
+            blocks[-1] = (blocks[-1][0], x)
+        else:
+            blocks.append((x, x))
+    return blocks
+
+def write_styled_sheet(
+    wb: Workbook,
+    df: pd.DataFrame,
+    sheet_name: str,
+    title_lines: list[str] | None = None,
+    number_headers: set[str] | None = None,
+    number_formats: dict[str, str] | None = None,
+    trend_type_header: str | None = None,
+    percent_headers: set[str] | None = None,
+    percent_formats: dict[str, str] | None = None,
+    store_type_header: str | None = None,
+    group_headers: bool = False,
+    styles: dict | None = None,
+):
+    # `styles` may be shared by the sheets of one workbook: style arrays index
+    # the workbook's style tables, so every look is registered once.
+    ws = wb.create_sheet(title=sheet_name)
+    styles = {} if styles is None else styles
+
+    def _style(fill=None, font=None, align=None, border=False, num_fmt=None):
+        key = (fill, font, align, border, num_fmt)
+        st_arr = styles.get(key)
+        if st_arr is None:
+            c = WriteOnlyCell(ws)
+            if fill:
+                c.fill = PatternFill("solid", fgColor=fill)
+            if font:
+                bold, color, size = font
+                c.font = Font(bold=bold, color=color, size=size) if size else Font(bold=bold, color=color)
+            if align == "title":
+                c.alignment = Alignment(horizontal="left", vertical="center")
+            elif align == "header":
+                c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+            elif align == "body":
+                c.alignment = Alignment(horizontal="center", vertical="center")
+            if border is True:
+                c.border = _XL_BORDER
+            elif border:
+                c.border = Border(**{side: _XL_THIN for side in border})
+            if num_fmt:
+                c.number_format = num_fmt
+            st_arr = styles[key] = c._style
+        return st_arr
+
+    def _cell(value, st_arr):
+        c = WriteOnlyCell(ws, value=value)
+        c._style = st_arr
+        return c
+
+    def _header_style(colors):
+        bg, fg = colors
+        return _style(fill=bg, font=(True, fg, None), align="header", border=True)
+
+    title_lines = title_lines or []
+    number_headers = number_headers or set()
+    percent_headers = percent_headers or set()
+    number_formats = number_formats or {}
+    percent_formats = percent_formats or {}
+
+    labels = list(df.columns)
+    headers = [str(h) if h is not None else "" for h in labels]
+    ncol = len(headers)
+    nrow = len(df)
+    header_row = (len(title_lines) + 2) if title_lines else 1
+    subheader_row = header_row + 1 if group_headers else header_row
+    end_col = get_column_letter(max(ncol, 1))
+
+    # Header rows: group_row[i] / sub_row[i] are (value, style) per column;
+    # vertical and horizontal merges are written as styled empty cells.
+    group_row: list | None = None
+    sub_row: list = [(labels[i], _header_style(_XL_HEADER)) for i in range(ncol)]
+    merges = [f"A{i}:{end_col}{i}" for i in range(1, len(title_lines) + 1)]
+    if group_headers:
+        group_row = [None] * ncol
+        grouped: set[int] = set()
+
+        def _group(c1: int, c2: int, label, top_colors, sub_of):
+            grouped.update(range(c1, c2 + 1))
+            top = _header_style(top_colors)
+            group_row[c1 - 1] = (label, top)
+            for col in range(c1 + 1, c2 + 1):
+                sides = ("top", "bottom", "right") if col == c2 else ("top", "bottom")
+                group_row[col - 1] = (None, _style(border=sides))
+            if c2 > c1:
+                merges.append(f"{get_column_letter(c1)}{header_row}:{get_column_letter(c2)}{header_row}")
+            for col in range(c1, c2 + 1):
+                sub, colors = sub_of(headers[col - 1])
+                sub_row[col - 1] = (sub, _header_style(colors))
+
+        for label, prefix, colors in _XL_SEG_SPECS:
+            idxs = [i + 1 for i, h in enumerate(headers) if h.startswith(prefix)]
+            for c1, c2 in _xl_header_blocks(idxs):
+                _group(c1, c2, label, colors, lambda full, _c=colors: (
+                    (full.split("-", 1)[1] if "-" in full else full).replace("(提)", "").strip(), _c))
+
+        if not grouped:
+            def _generic_sub(full: str):
+                sub = (full.split("-", 1)[1] if "-" in full else full).strip()
+                if sub in ("A", "B", "C", "D"):
+                    sub = f"{sub}数量"
+                return sub, _XL_SUB_COLORS.get(sub, _XL_HEADER)
+
+            group_map: dict[str, list[int]] = {}
+            for i, h in enumerate(headers, start=1):
+                if "-" not in h:
+                    continue
+                prefix = h.split("-", 1)[0].strip()
+                if prefix:
+                    group_map.setdefault(prefix, []).append(i)
+            for label, idxs in group_map.items():
+                for c1, c2 in _xl_header_blocks(idxs):
+                    _group(c1, c2, label, _XL_HEADER, _generic_sub)
+
+        for col in range(1, ncol + 1):
+            if col in grouped:
+                continue
+            group_row[col - 1] = (labels[col - 1], _header_style(_XL_HEADER))
+            sub_row[col - 1] = (None, _style(border=("left", "right", "bottom")))
+            letter = get_column_letter(col)
+            merges.append(f"{letter}{header_row}:{letter}{subheader_row}")
+
+    trend_cols = set()
+    if trend_type_header and trend_type_header in headers:
+        trend_cols.add(headers.index(trend_type_header))
+    store_cols = set()
+    if store_type_header and store_type_header in headers:
+        store_cols.add(headers.index(store_type_header))
+    for i, h in enumerate(headers):
+        hs = h.strip()
+        if hs in ("趋势类型", "近三周期变化") or hs.endswith("趋势类型") or hs.endswith("变化类型"):
+            trend_cols.add(i)
+        if "门店类型" in hs or hs in ("等级",):
+            store_cols.add(i)
+
+    col_fmts = []
+    for h in headers:
+        fmt = number_formats.get(h) or ("0.#" if h in number_headers else None)
+        fmt = percent_formats.get(h) or ("0.#%" if h in percent_headers else fmt)
+        col_fmts.append(fmt)
+
+    last_row = subheader_row + nrow
+    apply_full = last_row <= _XL_FULL_STYLE_MAX_ROWS
+
+    # Column widths come from the first rows of the finished sheet, so they
+    # are known before the first row is streamed.
+    width_rows = max(0, header_row + _XL_WIDTH_SCAN_ROWS - subheader_row)
+    widths = [0] * ncol
+    head_vals = [[v for v, _ in sub_row]] + ([[v for v, _ in group_row]] if group_row else [])
+    for line in title_lines:
+        if ncol:
+            widths[0] = max(widths[0], len(str(line)))
+    if width_rows and nrow:
+        head_df = df.iloc[:width_rows]
+        for i in range(ncol):
+            for v in _xl_column_values(head_df.iloc[:, i]):
+                if v is not None:
+                    widths[i] = max(widths[i], _xl_text_len(v))
+    for vals in head_vals:
+        for i, v in enumerate(vals):
+            if v is not None:
+                widths[i] = max(widths[i], _xl_text_len(v))
+    for i, w in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = max(10, min(36, w + 2))
+    ws.freeze_panes = f"A{subheader_row + 1}"
+
+    title_style = _style(font=(True, "111827", 12), align="title")
+    for line in title_lines:
+        ws.append([_cell(str(line), title_style)])
+    if title_lines:
+        ws.append([])
+    if group_row is not None:
+        ws.append([_cell(v, s) for v, s in group_row])
+    ws.append([_cell(v, s) for v, s in sub_row])
+
+    total_cols = range(min(4, ncol))
+    r = 0
+    for start in range(0, nrow, _XL_CHUNK_ROWS):
+        part = df.iloc[start:start + _XL_CHUNK_ROWS]
+        cols = [_xl_column_values(part.iloc[:, i]) for i in range(ncol)]
+        for vals in zip(*cols):
+            r += 1
+            even = apply_full and r % 2 == 0
+            total = apply_full and any(str(vals[i] or "").strip() == "合计" for i in total_cols)
+            row = []
+            for i, v in enumerate(vals):
+                fill = "F8FAFC" if even else None
+                font = (True, "A16207", None) if total else None
+                colors = None
+                if i in trend_cols:
+                    colors = _XL_TREND_COLORS.get(str(v or "").strip()) or colors
+                if i in store_cols:
+                    colors = _xl_store_type_colors(str(v or "").strip()) or colors
+                if colors:
+                    fill, font = colors[0], (True, colors[1], None)
+                fmt = col_fmts[i]
+                if fmt is None and isinstance(v, date):
+                    fmt = "YYYY-MM-DD HH:MM:SS" if isinstance(v, datetime) else "YYYY-MM-DD"
+                row.append(_cell(v, _style(fill=fill, font=font, align="body", border=apply_full, num_fmt=fmt)))
+            ws.append(row)
+
+    for ref in merges:
+        ws.merged_cells.add(ref)
+    return ws
+
+def df_to_excel_bytes(
+    df: pd.DataFrame,
+    sheet_name: str,
+    title_lines: list[str] | None = None,
+    number_headers: set[str] | None = None,
+    number_formats: dict[str, str] | None = None,
+    trend_type_header: str | None = None,
+    percent_headers: set[str] | None = None,
+    percent_formats: dict[str, str] | None = None,
+    store_type_header: str | None = None,
+    group_headers: bool = False,
+):
+    wb = Workbook(write_only=True)
+    write_styled_sheet(
+        wb,
+        df,
+        sheet_name,
+        title_lines=title_lines,
+        number_headers=number_headers,
+        number_formats=number_formats,
+        trend_type_header=trend_type_header,
+        percent_headers=percent_headers,
+        percent_formats=percent_formats,
+        store_type_header=store_type_header,
+        group_headers=group_headers,
+    )
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+def sheets_to_excel_bytes(sheets, progress=None) -> bytes:
+    """One workbook with a styled sheet per (title, frame, df_to_excel_bytes kwargs).
+
+    The sheets are streamed into the same write-only workbook and share its
+    styles, so a bundle costs what its parts cost. progress(done, total) is
+    called after every sheet.
+    """
+    sheets = list(sheets)
+    wb = Workbook(write_only=True)
+    styles: dict[tuple, object] = {}
+    for i, (title, df, kwargs) in enumerate(sheets, start=1):
+        kwargs = {k: v for k, v in kwargs.items() if k != "sheet_name"}
+        write_styled_sheet(wb, df, str(title), styles=styles, **kwargs)
+        if progress is not None:
+            progress(i, len(sheets))
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+# Batch ZIPs with fewer members than this are built inline: a spawn pool costs
+# more to start than it saves on a handful of small workbooks.
+_ZIP_POOL_MIN_MEMBERS = 8
+
+def _member_bytes(job) -> bytes:
+    df, kwargs = job
+    return df_to_excel_bytes(df, **kwargs)
+
+def _iter_member_bytes(jobs: list, max_workers: int | None = None):
+    # Workbook bytes in member order, built in a process pool when it pays off.
+    workers = min(len(jobs), int(max_workers or os.cpu_count() or 1))
+    done = 0
+    if workers > 1 and len(jobs) >= _ZIP_POOL_MIN_MEMBERS:
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+                with detached_main():
+                    futures = [ex.submit(_member_bytes, j) for j in jobs]
+                for f in futures:
+                    data = f.result()
+                    done += 1
+                    yield data
+            return
+        except Exception:
+            pass
+    for j in jobs[done:]:
+        yield _member_bytes(j)
+
+def build_xlsx_zip(members, progress=None, max_workers: int | None = None) -> bytes:
+    """ZIP of one styled workbook per (file name, frame, df_to_excel_bytes kwargs).
+
+    Members are written in the given order as soon as each is ready;
+    progress(done, total) is called after every member.
+    """
+    members = list(members)
+    total = len(members)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        jobs = [(df, kwargs) for _, df, kwargs in members]
+        for i, data in enumerate(_iter_member_bytes(jobs, max_workers), start=1):
+            zf.writestr(members[i - 1][0], data)
+            if progress is not None:
+                progress(i, total)
+    return buf.getvalue()
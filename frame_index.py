@@ -0,0 +1,191 @@
+"""Inverted indexes and cached row filters behind the dashboard's filter bars.
+
+These live outside dashboard.py so they can be imported and tested without
+running the Streamlit script.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+def _dim_eq_mask(s: pd.Series, value) -> pd.Series:
+    # Same as s.fillna("").astype(str).str.strip() == value, but on codes for categoricals.
+    value = str(value).strip()
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        return s.fillna("").astype(str).str.strip() == value
+    codes = s.cat.codes.to_numpy()
+    hit = np.flatnonzero(s.cat.categories.astype(str).str.strip() == value)
+    m = np.isin(codes, hit)
+    if value == "":
+        m |= codes == -1
+    return pd.Series(m, index=s.index)
+
+# Filter results as row positions, keyed by (upload sig, dataset, rows, predicate
+# prefix). Predicates are (column, kind, value) applied in order, so changing the
+# last selector only re-tests the rows that survived the earlier ones.
+#   "dim":   _dim_eq_mask(s, value)
+#   "strip": s.fillna("").astype(str).str.strip() == value
+#   "eq":    s == value
+#   "str":   s.astype(str) == str(value)
+#   "isin":  s.isin(value)
+# Both caches are process-wide, so they are bounded by bytes as well as entries.
+_FILTER_CACHE = {"items": OrderedDict(), "bytes": 0}
+_FILTER_CACHE_MAX = 256
+_FILTER_CACHE_MAX_BYTES = 128 * 1024 * 1024
+_FILTER_LOCK = threading.Lock()
+
+# Inverted index per (upload sig, dataset, rows, column): int32 label codes per
+# row plus the row positions grouped by code, so a predicate is evaluated on the
+# distinct labels and turned into a posting list (or a code lookup on rows that
+# an earlier predicate already narrowed to).
+_DIM_INDEX_CACHE = {"items": OrderedDict(), "bytes": 0}
+_DIM_INDEX_MAX = 64
+_DIM_INDEX_MAX_BYTES = 256 * 1024 * 1024
+_DIM_INDEX_LOCK = threading.Lock()
+
+def _cache_get(cache: dict, key):
+    # Caller holds the cache's lock.
+    entry = cache["items"].get(key)
+    if entry is None:
+        return None
+    cache["items"].move_to_end(key)
+    return entry
+
+def _cache_put(cache: dict, key, value, nbytes: int, max_items: int, max_bytes: int):
+    # Caller holds the cache's lock. Least recently used entries go first, but
+    # the newest one is always kept.
+    items = cache["items"]
+    old = items.pop(key, None)
+    if old is not None:
+        cache["bytes"] -= old[0]
+    items[key] = (nbytes, value)
+    cache["bytes"] += nbytes
+    while len(items) > 1 and (len(items) > max_items or cache["bytes"] > max_bytes):
+        _, (n_old, _) = items.popitem(last=False)
+        cache["bytes"] -= n_old
+
+def _filter_pred_mask(s: pd.Series, kind: str, value) -> np.ndarray:
+    if kind == "dim":
+        return _dim_eq_mask(s, value).to_numpy()
+    if kind == "strip":
+        # A stripped label can never equal a non-string or a value with outer whitespace.
+        if not isinstance(value, str) or value != value.strip():
+            return np.zeros(len(s), dtype=bool)
+        return _dim_eq_mask(s, value).to_numpy()
+    if kind == "eq":
+        return (s == value).to_numpy(dtype=bool, na_value=False)
+    if kind == "str":
+        return (s.astype(str) == str(value)).to_numpy(dtype=bool, na_value=False)
+    if kind == "isin":
+        return s.isin(list(value)).to_numpy(dtype=bool, na_value=False)
+    raise ValueError(f"unknown filter kind: {kind}")
+
+def _frame_col(df: pd.DataFrame, col: str) -> pd.Series:
+    s = df[col]
+    return s.iloc[:, 0] if isinstance(s, pd.DataFrame) else s
+
+def _build_dim_index(s: pd.Series) -> dict | None:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes = s.cat.codes.to_numpy()
+        labels = pd.Series(s.cat.categories)
+    elif pd.api.types.infer_dtype(s, skipna=True) in ("string", "integer", "floating", "empty"):
+        codes, uniq = pd.factorize(s, use_na_sentinel=True)
+        labels = pd.Series(uniq)
+    else:
+        # Mixed objects: factorize would fold 1 / 1.0 / True into one label.
+        return None
+    codes = codes.astype(np.int32)
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    # Rows with code c are order[bounds[c + 1]:bounds[c + 2]]; c = -1 is missing.
+    bounds = np.searchsorted(codes[order], np.arange(-1, len(labels) + 1))
+    return {"labels": labels, "codes": codes, "order": order, "bounds": bounds}
+
+def _dim_index_nbytes(idx: dict | None) -> int:
+    if idx is None:
+        return 0
+    n = int(idx["labels"].memory_usage(index=False, deep=True))
+    return n + sum(int(idx[k].nbytes) for k in ("codes", "order", "bounds"))
+
+def _dim_index(df: pd.DataFrame, sig: str | None, name: str, col: str) -> dict | None:
+    if not sig:
+        return _build_dim_index(_frame_col(df, col))
+    key = (sig, name, len(df), col)
+    with _DIM_INDEX_LOCK:
+        hit = _cache_get(_DIM_INDEX_CACHE, key)
+    if hit is not None:
+        return hit[1]
+    idx = _build_dim_index(_frame_col(df, col))
+    with _DIM_INDEX_LOCK:
+        _cache_put(_DIM_INDEX_CACHE, key, idx, _dim_index_nbytes(idx), _DIM_INDEX_MAX, _DIM_INDEX_MAX_BYTES)
+    return idx
+
+def _dim_index_select(idx: dict, s: pd.Series, kind: str, value, pos: np.ndarray | None) -> np.ndarray:
+    order, bounds = idx["order"], idx["bounds"]
+    hit = _filter_pred_mask(idx["labels"], kind, value)
+    # Missing values may still match (e.g. "dim" with ""), so test those rows as-is.
+    na = order[bounds[0]:bounds[1]]
+    na_hit = na[_filter_pred_mask(s.iloc[na], kind, value)] if len(na) else na
+    if pos is None:
+        parts = [order[bounds[c + 1]:bounds[c + 2]] for c in np.flatnonzero(hit)] + [na_hit]
+        out = np.concatenate(parts)
+        return np.sort(out) if len(parts) > 2 or len(na_hit) else out
+    keep = np.append(hit, False)[idx["codes"][pos]]
+    if len(na_hit):
+        keep |= np.isin(pos, na_hit)
+    return pos[keep]
+
+def _filter_value_key(kind: str, value):
+    # 1, 1.0 and True hash and compare equal, but "str" / "dim" / "strip" tell
+    # them apart, so cache keys carry each value's type.
+    if kind == "isin":
+        return tuple((type(v).__name__, v) for v in value)
+    return (type(value).__name__, value)
+
+def filter_positions(df: pd.DataFrame, sig: str | None, name: str, preds) -> np.ndarray | None:
+    # Row positions matching every predicate, or None for "all rows".
+    preds = tuple((c, k, tuple(v) if k == "isin" else v) for c, k, v in preds)
+    if df is None or not preds:
+        return None
+    base = (sig, name, len(df))
+    keys = tuple((c, k, _filter_value_key(k, v)) for c, k, v in preds)
+    pos, start = None, 0
+    if sig:
+        with _FILTER_LOCK:
+            for i in range(len(preds), 0, -1):
+                hit = _cache_get(_FILTER_CACHE, base + (keys[:i],))
+                if hit is not None:
+                    pos, start = hit[1], i
+                    break
+    for i in range(start, len(preds)):
+        col, kind, value = preds[i]
+        s = _frame_col(df, col)
+        idx = _dim_index(df, sig, name, col) if sig else None
+        if idx is not None:
+            pos = _dim_index_select(idx, s, kind, value, pos)
+        else:
+            m = _filter_pred_mask(s if pos is None else s.iloc[pos], kind, value)
+            pos = np.flatnonzero(m) if pos is None else pos[m]
+        if sig:
+            with _FILTER_LOCK:
+                _cache_put(_FILTER_CACHE, base + (keys[: i + 1],), pos, int(pos.nbytes), _FILTER_CACHE_MAX, _FILTER_CACHE_MAX_BYTES)
+    return pos
+
+def filter_rows(df: pd.DataFrame, sig: str | None, name: str, preds) -> pd.DataFrame:
+    pos = filter_positions(df, sig, name, preds)
+    return df if pos is None else df.iloc[pos]
+
+def filter_values(df: pd.DataFrame, sig: str | None, name: str, col: str, preds=()) -> pd.Series:
+    # Same values as filter_rows(...)[col].unique() (missing included once), read off the index.
+    pos = filter_positions(df, sig, name, preds)
+    idx = _dim_index(df, sig, name, col) if sig else None
+    if idx is None:
+        s = _frame_col(df, col)
+        return pd.Series((s if pos is None else s.iloc[pos]).unique())
+    codes = idx["codes"] if pos is None else idx["codes"][pos]
+    present = np.flatnonzero(np.bincount(codes + 1, minlength=len(idx["labels"]) + 1))
+    vals = idx["labels"].iloc[present[present > 0] - 1].reset_index(drop=True)
+    if len(present) and present[0] == 0:
+        na_row = idx["order"][0]
+        vals = pd.concat([vals, _frame_col(df, col).iloc[[na_row]].reset_index(drop=True)], ignore_index=True)
+    return vals
@@ -0,0 +1,178 @@
+"""Scan-data helpers behind the 扫码 heat map and anomaly views.
+
+These live outside dashboard.py so they can be imported and tested without
+running the Streamlit script.
+"""
+import numpy as np
+import pandas as pd
+
+from builtin_parts import scan_code_text
+
+# Heat-map cells at every selectable precision (0-3 decimals).
+_SCAN_GRID_PRECISIONS = range(4)
+
+def build_scan_grids(pts: pd.DataFrame) -> dict:
+    grids = {}
+    for p in _SCAN_GRID_PRECISIONS:
+        cells = pd.DataFrame({"经度": pts["经度"].round(p), "纬度": pts["纬度"].round(p)})
+        g = cells.groupby(["经度", "纬度"]).size().reset_index(name="扫码听数")
+        g["扫码箱数"] = g["扫码听数"] / 6.0
+        grids[p] = g
+    return {
+        "n": len(pts),
+        "center": (float(pts["纬度"].mean()), float(pts["经度"].mean())) if len(pts) else (0.0, 0.0),
+        "by_prov": pts.groupby("省区", observed=True).size().reset_index(name="扫码听数"),
+        "grids": grids,
+    }
+
+# Level of detail for the point map: markers sent per view start at
+# _SCAN_LOD_BASE around national zoom and double with each zoom level, up to
+# _SCAN_LOD_MAX.
+_SCAN_LOD_BASE = 2500
+_SCAN_LOD_MAX = 20000
+
+def _scan_lod_budget(zoom: float) -> int:
+    return int(min(_SCAN_LOD_MAX, _SCAN_LOD_BASE * 2 ** max(0.0, float(zoom) - 3.0)))
+
+def _merge_cells(g: pd.DataFrame, precision: int) -> pd.DataFrame:
+    return (
+        g.assign(经度=g["经度"].round(precision), 纬度=g["纬度"].round(precision))
+        .groupby(["经度", "纬度"], as_index=False)[["扫码听数", "扫码箱数"]].sum()
+    )
+
+def scan_lod_grid(layers: dict, precision: int, zoom: float, weight: str) -> pd.DataFrame:
+    # Heaviest cells at `precision` up to the zoom budget; the remaining cells are
+    # merged into the finest coarser grid that fits half the budget, so totals
+    # are kept and detail grows as the map zooms in. When even whole-degree
+    # cells do not fit, those are rounded further (tens of degrees, ...) until
+    # they do.
+    grids = layers["grids"]
+    g = grids[int(precision)]
+    budget = _scan_lod_budget(zoom)
+    if len(g) <= budget:
+        return g
+    coarse = next((p for p in range(int(precision) - 1, -1, -1) if len(grids[p]) <= budget // 2), None)
+    if coarse is None:
+        coarse = -1
+        while len(_merge_cells(grids[0], coarse)) > budget // 2:
+            coarse -= 1
+        n_coarse = len(_merge_cells(grids[0], coarse))
+    else:
+        n_coarse = len(grids[coarse])
+    # The merged remainder has at most n_coarse cells, so the result fits.
+    keep = budget - n_coarse
+    order = g[weight].to_numpy().argsort(kind="stable")[::-1]
+    top = g.iloc[order[:keep]]
+    rest = _merge_cells(g.iloc[order[keep:]], coarse)
+    return pd.concat([top, rest], ignore_index=True)
+
+# Scan-code index: uint64 keys for 听码 / 箱码 / IP地址 (0 when missing) plus
+# the rows that look duplicated or suspicious. Codes are hashed
+# _SCAN_CODE_CHUNK rows at a time, and the counting passes sort one key
+# partition of about that many rows at a time, so the working set beyond the
+# per-row key and count arrays stays bounded by the chunk size.
+_SCAN_CODE_CHUNK = 1_000_000
+SCAN_IP_BURST = 30
+
+def _hash_codes(df: pd.DataFrame, col: str) -> np.ndarray:
+    out = np.zeros(len(df), dtype=np.uint64)
+    if col not in df.columns:
+        return out
+    s = df[col]
+    for i in range(0, len(s), _SCAN_CODE_CHUNK):
+        vals = s.iloc[i:i + _SCAN_CODE_CHUNK].fillna("").astype(str).to_numpy(dtype=object)
+        h = pd.util.hash_array(vals, categorize=True)
+        h[vals == ""] = 0
+        out[i:i + len(h)] = h
+    return out
+
+def _key_parts(keys: np.ndarray):
+    # Row positions of the non-missing keys, split by the keys' top bits into
+    # about len(keys) / _SCAN_CODE_CHUNK parts; equal keys share a part.
+    bits = int(np.ceil(np.log2(max(1.0, len(keys) / _SCAN_CODE_CHUNK))))
+    if bits == 0:
+        yield np.flatnonzero(keys)
+        return
+    bits = min(bits, 16)
+    top = (keys >> np.uint64(64 - bits)).astype(np.uint32)
+    top[keys == 0] = 1 << bits
+    for p in range(1 << bits):
+        rows = np.flatnonzero(top == p)
+        if rows.size:
+            yield rows
+
+def _key_counts(keys: np.ndarray) -> np.ndarray:
+    # Rows sharing each row's key (0 for missing keys).
+    out = np.zeros(len(keys), dtype=np.int64)
+    for rows in _key_parts(keys):
+        _, inv, cnt = np.unique(keys[rows], return_inverse=True, return_counts=True)
+        out[rows] = cnt[inv]
+    return out
+
+def _key_spread(keys: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # Distinct `groups` values seen with each row's key (0 for missing keys).
+    out = np.zeros(len(keys), dtype=np.int64)
+    for rows in _key_parts(keys):
+        order = np.lexsort((groups[rows], keys[rows]))
+        rows = rows[order]
+        k = keys[rows]
+        g = groups[rows]
+        first = np.r_[True, k[1:] != k[:-1]]
+        new = first | np.r_[True, g[1:] != g[:-1]]
+        starts = np.flatnonzero(first)
+        spread = np.add.reduceat(new.astype(np.int64), starts)
+        out[rows] = spread[np.cumsum(first) - 1]
+    return out
+
+def _distinct_keys(keys: np.ndarray, mask: np.ndarray) -> int:
+    # Distinct non-missing keys among the rows in `mask`.
+    keys = np.where(mask, keys, np.uint64(0))
+    return sum(int(np.unique(keys[rows]).size) for rows in _key_parts(keys))
+
+def _ip_day_keys(df: pd.DataFrame, ip: np.ndarray) -> np.ndarray:
+    # IP key mixed with the scan date, built a chunk of rows at a time.
+    out = np.zeros(len(df), dtype=np.uint64)
+    for i in range(0, len(df), _SCAN_CODE_CHUNK):
+        ymd = df[["年份", "月份", "日"]].iloc[i:i + _SCAN_CODE_CHUNK].fillna(0).to_numpy(dtype=np.int64)
+        h = ip[i:i + len(ymd)]
+        out[i:i + len(ymd)] = np.where(h != 0, h ^ pd.util.hash_array(ymd @ np.array([10000, 100, 1])), 0)
+    return out
+
+def build_scan_code_index(df: pd.DataFrame) -> dict:
+    tin = _hash_codes(df, "听码")
+    box = _hash_codes(df, "箱码")
+    ip = _hash_codes(df, "IP地址")
+    prov = df["省区"]
+    prov = prov.cat.codes.to_numpy() if isinstance(prov.dtype, pd.CategoricalDtype) else pd.factorize(prov)[0]
+
+    tin_n = _key_counts(tin)
+    tin_prov = _key_spread(tin, prov)
+    box_prov = _key_spread(box, prov)
+    ip_key = _ip_day_keys(df, ip)
+    ip_day = _key_counts(ip_key)
+
+    m = (tin_n > 1) | (tin_prov > 1) | (box_prov > 1) | (ip_day >= SCAN_IP_BURST)
+    flags = pd.DataFrame(
+        {"听码次数": tin_n[m], "听码省区数": tin_prov[m], "箱码省区数": box_prov[m], "IP当日扫码": ip_day[m]},
+        index=df.index[m],
+    )
+    return {
+        "tin": tin,
+        "box": box,
+        "ip": ip,
+        "flags": flags,
+        "summary": {
+            "重复听码": _distinct_keys(tin, tin_n > 1),
+            "跨省听码": _distinct_keys(tin, tin_prov > 1),
+            "跨省箱码": _distinct_keys(box, box_prov > 1),
+            "IP突增": _distinct_keys(ip_key, ip_day >= SCAN_IP_BURST),
+        },
+    }
+
+def scan_code_rows(idx: dict, kind: str, code: str) -> np.ndarray:
+    # Row positions whose 听码 ("tin") / 箱码 ("box") equals `code`.
+    code = scan_code_text(pd.Series([code])).iloc[0]
+    if not code:
+        return np.array([], dtype=np.int64)
+    h = pd.util.hash_array(np.array([code], dtype=object), categorize=True)[0]
+    return np.flatnonzero(idx[kind] == h)
@@ -0,0 +1,146 @@
+import random
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from builtin_parts import SCAN_PART_SCHEMA, normalize_scan_frame, parse_lon_lat_series
+
+# The row-wise parser parse_lon_lat_series replaced, kept as the reference.
+_COORD_NUM_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+def _parse_lon_lat(v):
+    if v is None:
+        return None, None
+    s = str(v).strip()
+    if not s or s.lower() in {"nan", "none"}:
+        return None, None
+    nums = _COORD_NUM_RE.findall(s)
+    if len(nums) < 2:
+        return None, None
+    a = float(nums[0])
+    b = float(nums[1])
+
+    def _is_lon(x): return 70 <= x <= 140
+    def _is_lat(x): return 0 <= x <= 60
+
+    if _is_lon(a) and _is_lat(b):
+        lon, lat = a, b
+    elif _is_lon(b) and _is_lat(a):
+        lon, lat = b, a
+    else:
+        lon, lat = (a, b) if abs(a) >= abs(b) else (b, a)
+    if not _is_lon(lon) or not _is_lat(lat):
+        return None, None
+    return lon, lat
+
+_CASES = [
+    "116.3,39.9", "39.9,116.3", "116.3 39.9", "GPS: 39.9 / 116.3", "116.3+39.9", "116.3.60",
+    "60.5+39.9,116.3", "123", "1.2.3", "+-39.9,116.3", "116..39", "",
+    "nan", "None", "None 116.3 39.9", "-116.3,-39.9", "200,300", "116.3\n39.9", None, np.nan,
+]
+
+def _fuzz_cases(alphabet="0123456789" * 3 + "..++--,, /:a\n", n=20000, seed=7):
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 16))) for _ in range(n)]
+
+def _expected(values):
+    pairs = [_parse_lon_lat(v) for v in values]
+    return (
+        np.array([np.nan if lon is None else lon for lon, _ in pairs]),
+        np.array([np.nan if lat is None else lat for _, lat in pairs]),
+    )
+
+def _check(values):
+    # Duplicate labels must survive the vectorized path.
+    s = pd.Series(values, index=[i // 2 for i in range(len(values))], dtype=object)
+    lon, lat = parse_lon_lat_series(s)
+    exp_lon, exp_lat = _expected(values)
+    assert lon.index.equals(s.index) and lat.index.equals(s.index)
+    np.testing.assert_array_equal(lon.to_numpy(dtype=float), exp_lon)
+    np.testing.assert_array_equal(lat.to_numpy(dtype=float), exp_lat)
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_parse_lon_lat_series_matches_row_parser(monkeypatch, use_pyarrow):
+    if not use_pyarrow:
+        monkeypatch.setitem(sys.modules, "pyarrow.compute", None)
+    _check(_CASES + _fuzz_cases())
+
+def test_parse_lon_lat_series_non_ascii_digits():
+    _check(["１１６.３，３９.９", "３９.９ 116.3", "116.3,39.９"] + _fuzz_cases("0123456789３９.+-, ", n=5000))
+
+@pytest.mark.parametrize("as_category", [False, True])
+def test_normalize_scan_frame_keeps_schema_int_dtypes(as_category):
+    n = 5
+    df = pd.DataFrame(
+        {
+            "门店名称": "店",
+            "经销商名称": "商",
+            "省区": "华东",
+            "产品大类": "段粉",
+            "产品小类": "雅赋",
+            "经纬度": "116.4,39.9",
+            "年份": ["2025", "25年", "2025", "99999", "2025"],
+            "月份": ["3月", "12", None, "1", "300"],
+            "日": ["01", "31日", "7", "2", "40000"],
+            "听码": "1",
+            "箱码": "2",
+            "IP地址": "10.0.0.1",
+        },
+        index=range(n),
+    )
+    if as_category:
+        df[["年份", "月份", "日"]] = df[["年份", "月份", "日"]].astype("category")
+    out = normalize_scan_frame(df)
+    want = {name: t for name, t in SCAN_PART_SCHEMA.values() if name in ("年份", "月份", "日")}
+    assert {c: str(out[c].dtype) for c in want} == want
+    assert out.index.tolist() == [0, 1, 2, 4]
+    assert out["月份"].tolist() == [3, 12, 0, 0]
+    assert out["日"].tolist() == [1, 31, 7, 0]
+
+def test_detached_main_concurrent_swaps_restore_main():
+    import threading
+    import time
+
+    from builtin_parts import detached_main
+
+    main_mod = sys.modules["__main__"]
+    seen, errors = [], []
+    start = threading.Barrier(8)
+
+    def _swap():
+        start.wait()
+        for _ in range(200):
+            with detached_main():
+                stub = sys.modules["__main__"]
+                if stub is main_mod or getattr(stub, "__file__", None) is not None:
+                    errors.append(stub)
+                seen.append(stub)
+                time.sleep(0)
+                # Another thread must not swap in its own stub meanwhile.
+                if sys.modules["__main__"] is not stub:
+                    errors.append(stub)
+
+    threads = [threading.Thread(target=_swap) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and len(seen) == 1600
+    assert sys.modules["__main__"] is main_mod
+
+def test_detached_main_keeps_main_installed_meanwhile():
+    import types
+
+    from builtin_parts import detached_main
+
+    main_mod = sys.modules["__main__"]
+    rerun = types.ModuleType("__main__")
+    try:
+        with detached_main():
+            sys.modules["__main__"] = rerun
+        assert sys.modules["__main__"] is rerun
+    finally:
+        sys.modules["__main__"] = main_mod
@@ -0,0 +1,159 @@
+import io
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+import excel_export
+from excel_export import build_xlsx_zip, df_to_excel_bytes, sheets_to_excel_bytes
+
+def _load(data):
+    return load_workbook(io.BytesIO(data))
+
+def _fill(cell):
+    return cell.fill.fgColor.rgb[-6:] if cell.fill.fill_type == "solid" else None
+
+def _frame():
+    return pd.DataFrame(
+        {
+            "省区": ["华东", "华南", "合计", "西南"],
+            "段粉-A": [1, 2, 3, 4],
+            "段粉-B": [5, 6, 7, 8],
+            "雅系列-A": [1.25, np.nan, np.inf, -np.inf],
+            "中老年-C(提)": [0, 1, 2, 3],
+            "门店类型": ["A类", "C类", "", "D类"],
+            "趋势类型": ["持续增长", "持续下滑", "", "未知"],
+            "金额": [1234.5, 0.0, 2.25, None],
+            "占比": [0.125, 0.5, 1.0, 0.0],
+            "日期": [date(2025, 1, 2)] * 4,
+        }
+    )
+
+def _grouped_sheet():
+    data = df_to_excel_bytes(
+        _frame(),
+        "明细",
+        title_lines=["月度出库趋势表", "筛选：全部"],
+        number_headers={"金额"},
+        number_formats={"段粉-A": "#,##0"},
+        percent_headers={"占比"},
+        group_headers=True,
+    )
+    return _load(data)["明细"]
+
+def test_grouped_headers_titles_and_merges():
+    ws = _grouped_sheet()
+    assert ws.freeze_panes == "A6"
+    assert [ws.cell(r, 1).value for r in (1, 2, 3)] == ["月度出库趋势表", "筛选：全部", None]
+    assert ws.cell(1, 1).font.b and ws.cell(1, 1).font.sz == 12
+    assert {str(r) for r in ws.merged_cells.ranges} == {
+        "A1:J1", "A2:J2",
+        "B4:C4",
+        "A4:A5", "F4:F5", "G4:G5", "H4:H5", "I4:I5", "J4:J5",
+    }
+    assert [ws.cell(4, c).value for c in range(1, 6)] == ["省区", "段粉", None, "雅系列", "中老年（提）"]
+    assert [ws.cell(5, c).value for c in range(1, 6)] == [None, "A", "B", "A", "C"]
+    assert _fill(ws["B4"]) == "DCFCE7" and _fill(ws["B5"]) == "DCFCE7"
+    assert _fill(ws["D4"]) == "DBEAFE" and _fill(ws["E5"]) == "FEF9C3"
+    assert _fill(ws["A4"]) == "111827" and ws["A4"].font.color.rgb[-6:] == "FFFFFF"
+
+def test_body_values_formats_and_fills():
+    ws = _grouped_sheet()
+    rows = [[c.value for c in r] for r in ws.iter_rows(min_row=6)]
+    assert len(rows) == 4
+    assert [r[3] for r in rows] == [1.25, None, "inf", "-inf"]
+    assert [r[7] for r in rows] == [1234.5, 0, 2.25, None]
+    assert ws["H6"].number_format == "0.#"
+    assert ws["I6"].number_format == "0.#%"
+    assert ws["B6"].number_format == "#,##0"
+    assert ws["J6"].number_format == "YYYY-MM-DD" and ws["J6"].value.date() == date(2025, 1, 2)
+    assert ws["C6"].number_format == "General"
+    # Trend and store-type cells take their category colours, even rows are
+    # striped and the 合计 row is bold amber.
+    assert _fill(ws["G6"]) == "DCFCE7" and _fill(ws["G7"]) == "FEE2E2"
+    assert _fill(ws["F6"]) == "DCFCE7" and _fill(ws["F9"]) == "FEE2E2"
+    assert _fill(ws["G9"]) == "F8FAFC" and _fill(ws["A7"]) == "F8FAFC" and _fill(ws["A6"]) is None
+    assert ws["A8"].font.b and ws["A8"].font.color.rgb[-6:] == "A16207"
+    assert ws["A6"].border.left.style == "thin"
+
+def test_plain_sheet_without_titles():
+    df = pd.DataFrame({"省区": ["华东"], "数值-A": [1]})
+    ws = _load(df_to_excel_bytes(df, "表"))["表"]
+    assert ws.freeze_panes == "A2"
+    assert not ws.merged_cells.ranges
+    assert [c.value for c in ws[1]] == ["省区", "数值-A"]
+    assert [c.value for c in ws[2]] == ["华东", 1]
+    assert ws.column_dimensions["A"].width == 10
+
+def _xlsx_parts(data):
+    # Workbook XML parts, without the creation / modified timestamps.
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {n: zf.read(n) for n in zf.namelist() if n != "docProps/core.xml"}
+
+def _members(n):
+    out = []
+    for i in range(n):
+        df = pd.DataFrame({"门店": [f"店{j}" for j in range(i + 2)], "段粉-A": range(i + 2), "占比": 0.5})
+        kwargs = {"sheet_name": f"省区{i}", "title_lines": [f"省区{i}"], "percent_headers": {"占比"}, "group_headers": i % 2 == 0}
+        out.append((f"{i:02d}_省区{i}.xlsx", df, kwargs))
+    return out
+
+def test_zip_members_keep_names_and_order():
+    members = _members(3)
+    seen = []
+    data = build_xlsx_zip(members, progress=lambda done, total: seen.append((done, total)), max_workers=1)
+    assert seen == [(1, 3), (2, 3), (3, 3)]
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == [name for name, _, _ in members]
+        for name, df, kwargs in members:
+            assert _xlsx_parts(zf.read(name)) == _xlsx_parts(df_to_excel_bytes(df, **kwargs))
+
+def test_zip_pool_matches_inline(monkeypatch):
+    futures = []
+
+    class _Pool(ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            f = super().submit(*args, **kwargs)
+            futures.append(f)
+            return f
+
+    monkeypatch.setattr(excel_export, "ProcessPoolExecutor", _Pool)
+    members = _members(excel_export._ZIP_POOL_MIN_MEMBERS + 1)
+    inline = build_xlsx_zip(members, max_workers=1)
+    assert not futures
+    seen = []
+    pooled = build_xlsx_zip(members, progress=lambda done, total: seen.append(done), max_workers=2)
+    assert len(futures) == len(members) and all(f.exception() is None for f in futures)
+    assert seen == list(range(1, len(members) + 1))
+    with zipfile.ZipFile(io.BytesIO(inline)) as a, zipfile.ZipFile(io.BytesIO(pooled)) as b:
+        assert a.namelist() == b.namelist()
+        for name in a.namelist():
+            assert _xlsx_parts(a.read(name)) == _xlsx_parts(b.read(name))
+
+def _sheet_dump(ws):
+    cells = [
+        (c.coordinate, c.value, c.number_format, _fill(c), c.font.b, c.font.color.rgb if c.font.color else None, c.border.left.style)
+        for row in ws.iter_rows()
+        for c in row
+    ]
+    widths = {k: d.width for k, d in ws.column_dimensions.items()}
+    return cells, sorted(str(r) for r in ws.merged_cells.ranges), ws.freeze_panes, widths
+
+def test_bundle_sheets_match_their_standalone_workbooks():
+    store = _frame()
+    sheets = [
+        ("分省区", store.head(2), {"sheet_name": "x", "title_lines": ["分省区"], "group_headers": True, "percent_headers": {"占比"}}),
+        ("分经销商", store, {"title_lines": ["分经销商", "筛选"], "number_headers": {"金额"}}),
+        ("分门店", store.tail(3), {"group_headers": True, "store_type_header": "门店类型"}),
+    ]
+    seen = []
+    wb = _load(sheets_to_excel_bytes(sheets, progress=lambda done, total: seen.append((done, total))))
+    assert wb.sheetnames == ["分省区", "分经销商", "分门店"]
+    assert seen == [(1, 3), (2, 3), (3, 3)]
+    for title, df, kwargs in sheets:
+        kwargs = {k: v for k, v in kwargs.items() if k != "sheet_name"}
+        alone = _load(df_to_excel_bytes(df, title, **kwargs))[title]
+        assert _sheet_dump(wb[title]) == _sheet_dump(alone)
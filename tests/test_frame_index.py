@@ -0,0 +1,120 @@
+import random
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import frame_index
+from frame_index import filter_positions, filter_rows, filter_values
+
+# The plain full-frame masks the indexed / cached path must reproduce.
+def _ref_mask(s, kind, value):
+    if kind == "dim":
+        return (s.fillna("").astype(str).str.strip() == str(value).strip()).to_numpy(dtype=bool)
+    if kind == "strip":
+        return (s.fillna("").astype(str).str.strip() == value).to_numpy(dtype=bool)
+    if kind == "eq":
+        return (s == value).to_numpy(dtype=bool, na_value=False)
+    if kind == "str":
+        return (s.astype(str) == str(value)).to_numpy(dtype=bool)
+    return s.isin(list(value)).to_numpy(dtype=bool)
+
+def _ref_positions(df, preds):
+    m = np.ones(len(df), dtype=bool)
+    for col, kind, value in preds:
+        m &= _ref_mask(df[col], kind, value)
+    return np.flatnonzero(m)
+
+_LABELS = ["a", " a", "a ", "b", "", " ", "1", "1.0", "True"]
+_VALUES = ["a", " a", "b", "", "1", "1.0", "True", "nan", "None", 1, 1.0, True, 0]
+
+def _frame(rnd, n=400):
+    pick = lambda xs: [rnd.choice(xs) for _ in range(n)]
+    text = pick(_LABELS + [None, np.nan])
+    return pd.DataFrame(
+        {
+            "cat": pd.Categorical(pick(_LABELS + [None]), categories=_LABELS + ["unused"]),
+            "obj": pd.Series(text, dtype=object),
+            "int": pick([0, 1, 2]),
+            "flt": pick([1.0, 2.5, np.nan]),
+            # Mixed objects have no index and take the plain mask path.
+            "mix": pd.Series(pick([1, 1.0, True, "1", None, "a"]), dtype=object),
+        }
+    )
+
+def _rand_preds(rnd, cols):
+    preds = []
+    for col in rnd.sample(cols, rnd.randint(1, 3)):
+        kind = rnd.choice(["dim", "strip", "eq", "str", "isin"])
+        if kind == "isin":
+            value = rnd.sample(_VALUES, rnd.randint(0, 3))
+        else:
+            value = rnd.choice(_VALUES)
+        preds.append((col, kind, value))
+    return preds
+
+@pytest.fixture(autouse=True)
+def _clear_caches(monkeypatch):
+    monkeypatch.setattr(frame_index, "_FILTER_CACHE", {"items": OrderedDict(), "bytes": 0})
+    monkeypatch.setattr(frame_index, "_DIM_INDEX_CACHE", {"items": OrderedDict(), "bytes": 0})
+
+@pytest.mark.parametrize("seed", range(4))
+def test_filter_positions_match_plain_masks(seed):
+    rnd = random.Random(seed)
+    df = _frame(rnd)
+    cols = list(df.columns)
+    for _ in range(120):
+        preds = _rand_preds(rnd, cols)
+        exp = _ref_positions(df, preds)
+        # Cached and uncached, and again after every prefix is cached.
+        for sig in ("sig", None, "sig"):
+            got = filter_positions(df, sig, "t", preds)
+            got = np.arange(len(df)) if got is None else got
+            np.testing.assert_array_equal(got, exp, err_msg=repr(preds))
+
+def test_filter_cache_keeps_equal_hashing_values_apart():
+    df = pd.DataFrame({"m": ["1", "1.0", "1", "x"]})
+    np.testing.assert_array_equal(filter_positions(df, "sig", "t", [("m", "str", 1.0)]), [1])
+    np.testing.assert_array_equal(filter_positions(df, "sig", "t", [("m", "str", 1)]), [0, 2])
+    np.testing.assert_array_equal(filter_positions(df, "sig", "t", [("m", "str", True)]), [])
+    np.testing.assert_array_equal(filter_positions(df, "sig", "t", [("m", "isin", ["1"])]), [0, 2])
+    np.testing.assert_array_equal(filter_positions(df, "sig", "t", [("m", "isin", [1])]), [])
+
+def _value_set(vals):
+    vals = pd.Series(vals, dtype=object)
+    na = vals.isna()
+    return sorted(repr(v) for v in vals[~na].tolist()), int(na.sum())
+
+@pytest.mark.parametrize("seed", range(4))
+def test_filter_values_match_unique(seed):
+    rnd = random.Random(seed)
+    df = _frame(rnd)
+    cols = list(df.columns)
+    for _ in range(80):
+        preds = _rand_preds(rnd, cols)
+        col = rnd.choice(cols)
+        rows = df.iloc[_ref_positions(df, preds)][col]
+        exp_vals, exp_na = _value_set(rows.unique())
+        got_vals, got_na = _value_set(filter_values(df, "sig", "t", col, preds))
+        # Missing values are reported once, whatever mix of None / NaN they are.
+        assert got_vals == exp_vals and got_na == min(exp_na, 1), (col, preds)
+        pd.testing.assert_frame_equal(filter_rows(df, "sig", "t", preds), df.iloc[_ref_positions(df, preds)])
+
+def test_caches_stay_within_byte_budget(monkeypatch):
+    monkeypatch.setattr(frame_index, "_FILTER_CACHE_MAX_BYTES", 4096)
+    monkeypatch.setattr(frame_index, "_DIM_INDEX_MAX_BYTES", 8192)
+    rnd = random.Random(11)
+    df = _frame(rnd, n=1000)
+    cols = list(df.columns)
+    for _ in range(200):
+        preds = _rand_preds(rnd, cols)
+        got = filter_positions(df, "sig", "t", preds)
+        np.testing.assert_array_equal(got, _ref_positions(df, preds))
+        for cache, budget in (
+            (frame_index._FILTER_CACHE, 4096),
+            (frame_index._DIM_INDEX_CACHE, 8192),
+        ):
+            items = cache["items"]
+            assert cache["bytes"] == sum(n for n, _ in items.values())
+            assert cache["bytes"] <= budget or len(items) == 1
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import scan_views
+from scan_views import SCAN_IP_BURST, _scan_lod_budget, build_scan_code_index, build_scan_grids, scan_code_rows, scan_lod_grid
+
+def _points(rng, n, spread):
+    # Clustered points around a few city centres plus a uniform scatter.
+    centres = rng.uniform([100.0, 22.0], [122.0, 42.0], size=(8, 2))
+    pick = centres[rng.integers(0, len(centres), n)]
+    pts = pick + rng.normal(0.0, spread, size=(n, 2))
+    return pd.DataFrame(
+        {
+            "经度": pts[:, 0],
+            "纬度": pts[:, 1],
+            "省区": pd.Categorical(rng.choice(["华东", "华南", "西南"], n)),
+        }
+    )
+
+def _check(layers, precision, zoom):
+    for weight in ("扫码听数", "扫码箱数"):
+        out = scan_lod_grid(layers, precision, zoom, weight)
+        assert len(out) <= _scan_lod_budget(zoom)
+        assert out["扫码听数"].sum() == layers["n"]
+        assert out["扫码箱数"].sum() == pytest.approx(layers["n"] / 6.0)
+
+@pytest.mark.parametrize("seed,n,spread", [(0, 3000, 0.05), (1, 40000, 0.5), (2, 60000, 3.0)])
+def test_lod_grid_keeps_totals_within_budget(seed, n, spread):
+    layers = build_scan_grids(_points(np.random.default_rng(seed), n, spread))
+    for precision in range(4):
+        for zoom in (0, 3, 4.5, 6, 9, 14):
+            _check(layers, precision, zoom)
+
+def test_lod_grid_returns_the_grid_when_it_fits():
+    layers = build_scan_grids(_points(np.random.default_rng(3), 500, 0.2))
+    for precision in range(4):
+        assert scan_lod_grid(layers, precision, 3, "扫码听数") is layers["grids"][precision]
+
+def test_lod_grid_coarsens_past_whole_degrees():
+    # One point per whole-degree cell over the globe: even precision 0 holds
+    # far more cells than the national-zoom budget.
+    lon, lat = np.meshgrid(np.arange(-179.0, 180.0), np.arange(-60.0, 60.0))
+    pts = pd.DataFrame({"经度": lon.ravel(), "纬度": lat.ravel(), "省区": "华东"})
+    layers = build_scan_grids(pts)
+    assert len(layers["grids"][0]) > _scan_lod_budget(3)
+    for precision in range(4):
+        _check(layers, precision, 3)
+
+# Plain per-code groupbys on the raw strings the hashed, chunked index must
+# reproduce.
+def _ref_code_index(df):
+    prov = pd.Series(df["省区"].cat.codes.to_numpy(), index=df.index)
+
+    def counts(keys):
+        k = keys.where(keys != "")
+        return k.map(k.value_counts()).fillna(0).astype(np.int64).to_numpy()
+
+    def spread(col):
+        k = df[col].fillna("").astype(str)
+        k = k.where(k != "")
+        return k.map(prov.groupby(k).nunique()).fillna(0).astype(np.int64).to_numpy()
+
+    tin = df["听码"].fillna("").astype(str)
+    ip = df["IP地址"].fillna("").astype(str)
+    ip_day = ip.where(ip == "", ip + "|" + df["年份"].astype(str) + "-" + df["月份"].astype(str) + "-" + df["日"].astype(str))
+    cols = {
+        "听码次数": counts(tin),
+        "听码省区数": spread("听码"),
+        "箱码省区数": spread("箱码"),
+        "IP当日扫码": counts(ip_day),
+    }
+    m = (cols["听码次数"] > 1) | (cols["听码省区数"] > 1) | (cols["箱码省区数"] > 1) | (cols["IP当日扫码"] >= SCAN_IP_BURST)
+    box = df["箱码"].fillna("").astype(str)
+    summary = {
+        "重复听码": tin[cols["听码次数"] > 1].nunique(),
+        "跨省听码": tin[cols["听码省区数"] > 1].nunique(),
+        "跨省箱码": box[cols["箱码省区数"] > 1].nunique(),
+        "IP突增": ip_day[cols["IP当日扫码"] >= SCAN_IP_BURST].nunique(),
+    }
+    return pd.DataFrame({c: v[m] for c, v in cols.items()}, index=df.index[m]), summary
+
+def _scan_frame(rng, n):
+    pick = lambda xs: rng.choice(np.array(xs, dtype=object), n)
+    tins = [f"1{i:05d}" for i in range(n // 2)] + [None, ""]
+    boxes = [f"9{i:04d}" for i in range(n // 12)] + [None]
+    return pd.DataFrame(
+        {
+            "听码": pick(tins),
+            "箱码": pick(boxes),
+            "IP地址": pick([f"10.0.0.{i}" for i in range(6)] + [None]),
+            "省区": pd.Categorical(pick(["华东", "华南", "西南", None])),
+            "年份": 2025,
+            "月份": rng.integers(1, 3, n),
+            "日": rng.integers(1, 4, n),
+        },
+        index=rng.permutation(n) + 100,
+    )
+
+@pytest.mark.parametrize("chunk", [7, 1000, 1_000_000])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_scan_code_index_matches_groupbys(monkeypatch, chunk, seed):
+    monkeypatch.setattr(scan_views, "_SCAN_CODE_CHUNK", chunk)
+    df = _scan_frame(np.random.default_rng(seed), 3000)
+    flags, summary = _ref_code_index(df)
+    idx = build_scan_code_index(df)
+    pd.testing.assert_frame_equal(idx["flags"], flags)
+    assert idx["summary"] == summary
+    assert summary["IP突增"] > 0 and summary["跨省箱码"] > 0
+
+def test_scan_code_rows_find_every_row_of_a_code():
+    df = _scan_frame(np.random.default_rng(2), 1000)
+    idx = build_scan_code_index(df)
+    for kind, col in (("tin", "听码"), ("box", "箱码")):
+        for code in df[col].dropna().unique()[:20]:
+            assert np.array_equal(scan_code_rows(idx, kind, code + ".0"), np.flatnonzero(df[col] == code))
+    assert scan_code_rows(idx, "tin", "").size == 0